@@ -1,16 +1,329 @@
 import logging
 import re
-from typing import Optional, Tuple, Dict, Union
+import time
+from typing import Optional, Tuple, Dict, Union, List, Any
 import google.generativeai as genai
 import numpy as np
 from utils.image_utils import cv2_to_pil, image_to_base64 # cv2_to_pil is used
 from tools.token_usage_tool import _get_token_usage # Assuming this is in tools
+from tools.llm_gateway import llm_gateway
 from vision.xga import UIElementCollection # Assuming this is in vision.xga
+from agents.candidate_ranking import rank_ui_elements, build_candidate_crop, DEFAULT_CANDIDATE_TOP_K
+from agents.selection_rendering import render_composite, render_tiles, SELECTION_RENDER_MODES, DEFAULT_SELECTION_RENDER_MODE
+from agents.selection_cache import SelectionCache, SelectionCacheKey
 
 class UIAgent:
-    def __init__(self, llm_model: genai.GenerativeModel):
+    def __init__(
+            self,
+            llm_model: genai.GenerativeModel,
+            candidate_top_k: Optional[int] = DEFAULT_CANDIDATE_TOP_K,
+            render_mode: str = DEFAULT_SELECTION_RENDER_MODE,
+            selection_cache: Optional[SelectionCache] = None
+        ):
         self.model = llm_model
+        # None or 0 disables the candidate pass and always sends the full element set.
+        self.candidate_top_k = candidate_top_k
+        if render_mode not in SELECTION_RENDER_MODES:
+            logging.warning(f"Unknown selection render mode '{render_mode}', using '{DEFAULT_SELECTION_RENDER_MODE}'.")
+            render_mode = DEFAULT_SELECTION_RENDER_MODE
+        self.render_mode = render_mode
+        # Full-set selection calls per render mode (the candidate pass is not included).
+        self.render_mode_stats = {m: {"calls": 0, "prompt_tokens": 0, "latency_ms": 0.0, "payload_bytes": 0, "fallbacks": 0} for m in SELECTION_RENDER_MODES}
         self.last_reasoning: str = "Selection process not started."
+        self.last_selection_stats: Dict[str, Any] = {}
+        self.selection_stats = {"selections": 0, "cache_hits": 0, "candidate_only": 0, "widened": 0, "full_only": 0, "prompt_tokens": 0, "latency_ms": 0.0}
+        self.selection_cache = selection_cache if selection_cache is not None else SelectionCache()
+        self.last_selection_cache_key: Optional[SelectionCacheKey] = None
+
+    @staticmethod
+    def _describe_element(i: int, elem: Any) -> str:
+        label = elem.label.strip() if elem.label else "[No Label]"
+        return f"Element {i}: Type='{elem.element_type}', Label='{label[:50]}{'...' if len(label)>50 else ''}', Center=({int(elem.center[0])},{int(elem.center[1])})"
+
+    def _query_model(self, content_for_llm: List[Dict[str, Any]]) -> Tuple[Optional[str], Dict[str, int]]:
+        """Send a selection prompt. Returns (response text or None on error/block, token usage)."""
+        llm_call_token_usage = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+        try:
+            safety_settings = {} # Define safety settings if needed
+            response, llm_call_token_usage, _ = llm_gateway.generate("ui_selection", content_for_llm, model=self.model, safety_settings=safety_settings)
+            txt = ""
+            if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
+                txt = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text')).strip()
+
+            if not txt:
+                block_reason = "Unknown"
+                if hasattr(response, 'prompt_feedback') and response.prompt_feedback and hasattr(response.prompt_feedback, 'block_reason') and response.prompt_feedback.block_reason:
+                    block_reason = str(response.prompt_feedback.block_reason)
+                logging.error(f"LLM response blocked: {block_reason}")
+                self.last_reasoning = f"LLM response blocked ({block_reason})."
+                return None, llm_call_token_usage
+
+            logging.info(f"[UI Agent Raw Response]\n{txt}")
+            return txt, llm_call_token_usage
+        except ValueError as ve:
+            logging.error(f"ValueError accessing LLM response: {ve}")
+            self.last_reasoning = f"LLM response likely blocked. ValueError: {ve}"
+            return None, llm_call_token_usage
+        except Exception as e:
+            logging.error(f"Error getting response from Gemini: {e}")
+            self.last_reasoning = f"Error communicating with LLM: {e}"
+            return None, llm_call_token_usage
+
+    @staticmethod
+    def _parse_selection(txt: str, valid_indices: set) -> Tuple[Optional[int], str]:
+        """Extract (selected index or None, reasoning) from a REASONING/SELECTED response."""
+        reasoning = "No reasoning extracted."
+        selection = None
+
+        reasoning_match = re.search(r'REASONING:\s*(.*?)(?=\nSELECTED:|$)', txt, re.DOTALL | re.IGNORECASE)
+        selection_match = re.search(r'SELECTED:\s*(\d+|NOT FOUND)', txt, re.IGNORECASE)
+
+        if reasoning_match:
+            reasoning = reasoning_match.group(1).strip()
+        else:
+            logging.warning("Could not extract reasoning.")
+            sel_keyword_pos = txt.upper().find("SELECTED:")
+            reasoning = txt[:sel_keyword_pos].strip() if sel_keyword_pos != -1 and sel_keyword_pos > 0 else txt
+
+        if selection_match:
+            selection_text = selection_match.group(1).strip()
+            if selection_text.isdigit():
+                try:
+                    selected_idx = int(selection_text)
+                    if selected_idx in valid_indices:
+                        selection = selected_idx
+                    else:
+                        logging.warning(f"LLM selected invalid index: {selected_idx} (not among {len(valid_indices)} listed elements).")
+                        reasoning += f"\n(Agent Note: LLM selected invalid index {selected_idx}.)"
+                        selection = None # Explicitly set to None
+                except ValueError:
+                    logging.warning(f"Could not convert selected text '{selection_text}' to int.")
+                    selection = None
+            elif "NOT FOUND" in selection_text.upper():
+                logging.info("LLM indicated element not found.")
+                selection = None
+            else:
+                logging.warning(f"Could not parse selection: '{selection_text}'")
+                selection = None
+        else:
+            logging.warning("Could not extract selection.")
+            if "NOT FOUND" not in txt.upper():
+                lines = txt.strip().split('\n')
+                last_line = lines[-1] if lines else ""
+                numbers_in_last_line = re.findall(r'\b(\d+)\b$', last_line)
+                if not numbers_in_last_line:
+                    numbers_in_text = re.findall(r'\b(\d+)\b', txt)
+                    if numbers_in_text:
+                        numbers_in_last_line = [numbers_in_text[-1]]
+
+                if numbers_in_last_line:
+                    try:
+                        potential_idx = int(numbers_in_last_line[-1])
+                        if potential_idx in valid_indices:
+                            logging.warning(f"Used fallback extraction, selected index: {potential_idx}")
+                            selection = potential_idx
+                            reasoning += f"\n(Agent Note: Used fallback extraction, selected index {potential_idx}.)"
+                        else:
+                            logging.warning(f"Fallback number {potential_idx} out of bounds.")
+                    except ValueError:
+                        pass
+        return selection, reasoning
+
+    def _build_full_prompt(self, element_desc: str, elements_text: str, orig_base64: str, vis_base64: Optional[str]) -> List[Dict[str, Any]]:
+        prompt_parts = [
+            "You are an advanced UI Navigation Agent. Your task is to identify the exact element a user wants to click based on a description, using visual analysis and a list of detected elements.",
+            "\nI'm providing image(s) and a list of detected UI elements:",
+            "\n1. FIRST IMAGE: The original screenshot.",
+        ]
+        content_for_llm = [{"inline_data": {"mime_type": "image/png", "data": orig_base64}}]
+
+        if vis_base64:
+            prompt_parts.append("\n2. SECOND IMAGE: Visualization with numbered boxes highlighting detected elements (numbers match indices below).")
+            content_for_llm.append({"inline_data": {"mime_type": "image/png", "data": vis_base64}})
+        else:
+            prompt_parts.append("\n(Note: Visualization image is not available.)")
+
+        prompt_parts.extend([
+            f"\n\nUser's request: Find and click on '{element_desc}'",
+            f"\n\nDetected UI elements with their indices:\n{elements_text}\n",
+            "\nINSTRUCTIONS FOR ANALYSIS:",
+            "- Analyze the FIRST IMAGE (original screenshot) to visually locate what the user is asking for based on the description.",
+        ])
+        if vis_base64:
+            prompt_parts.append("- Use the SECOND IMAGE (visualization) to map your visual finding to an element index from the list.")
+        else:
+            prompt_parts.append("- Rely heavily on element labels, types, and positions in the list compared to the original screenshot.")
+
+        prompt_parts.extend([
+            "\n\n**Specific Guidance for Common Elements:**",
+            "- **Video Thumbnails/Links:** Often appear as rectangular images with titles. The clickable area is usually the image or the title text. Look for elements with labels matching video titles or generic descriptions like 'video thumbnail'. If multiple similar items exist (e.g., search results), use relative position (e.g., 'first', 'top-most') if specified in the user's request.",
+            "\nIMPORTANT: Provide step-by-step reasoning.",
+            "1. Describe what you visually identify in the original screenshot matching the request.",
+            "2. Examine the element list for candidates based on label, type, and location.",
+            "3. If visualization is available, confirm the index using the numbered boxes.",
+            "4. Explain your choice for the best match or state if no clear match exists.",
+            "\nFormat your response ONLY with these two lines:",
+            "REASONING: [Your detailed step-by-step reasoning here]",
+            "SELECTED: [The index number of the best match, or 'NOT FOUND']"
+        ])
+
+        content_for_llm.insert(0, {"text": "\n".join(prompt_parts)})
+        return content_for_llm
+
+    def _build_rendered_prompt(self, element_desc: str, elements_text: str, image_parts: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Prompt for the single-view modes: each image already carries the numbered element boxes."""
+        prompt_parts = [
+            "You are an advanced UI Navigation Agent. Your task is to identify the exact element a user wants to click based on a description, using visual analysis and a list of detected elements.",
+            "\nI'm providing image(s) of the screen where every detected element is shaded and tagged with its index (numbers match indices below):",
+        ]
+        content_for_llm: List[Dict[str, Any]] = []
+        for number, (caption, image_base64) in enumerate(image_parts, start=1):
+            prompt_parts.append(f"\n{number}. {caption}")
+            content_for_llm.append({"inline_data": {"mime_type": "image/png", "data": image_base64}})
+        prompt_parts.extend([
+            f"\n\nUser's request: Find and click on '{element_desc}'",
+            f"\n\nDetected UI elements with their indices (Center is in screen coordinates):\n{elements_text}\n",
+            "\nINSTRUCTIONS FOR ANALYSIS:",
+            "- Visually locate what the user is asking for and read the index tag on its box.",
+            "- Confirm the index against the element list using label, type, and location.",
+            "- If multiple similar items exist (e.g., search results), use relative position (e.g., 'first', 'top-most') if specified in the user's request.",
+            "\nFormat your response ONLY with these two lines:",
+            "REASONING: [Your detailed step-by-step reasoning here]",
+            "SELECTED: [The index number of the best match, or 'NOT FOUND']"
+        ])
+        content_for_llm.insert(0, {"text": "\n".join(prompt_parts)})
+        return content_for_llm
+
+    def _build_full_content(
+            self,
+            element_desc: str,
+            elements_text: str,
+            elements: UIElementCollection,
+            cv2_screenshot: np.ndarray,
+            vis_img: Optional[np.ndarray]
+        ) -> Tuple[Optional[List[Dict[str, Any]]], int, str]:
+        """
+        Build the full-set selection request for the current render mode.
+        Returns (content or None, image payload bytes, mode actually rendered).
+        """
+        if self.render_mode == "composite":
+            composite, scale = render_composite(cv2_screenshot, elements)
+            composite_base64 = image_to_base64(cv2_to_pil(composite)) if composite is not None else None
+            if composite_base64:
+                caption = f"The screenshot downscaled by {scale:.2f} with the element overlay." if scale < 1.0 else "The screenshot with the element overlay."
+                return self._build_rendered_prompt(element_desc, elements_text, [(caption, composite_base64)]), len(composite_base64), "composite"
+            logging.warning("Composite rendering failed; falling back to two-image mode.")
+            self.render_mode_stats["composite"]["fallbacks"] += 1
+        elif self.render_mode == "tiled":
+            image_parts = []
+            for tile in render_tiles(cv2_screenshot, elements):
+                tile_base64 = image_to_base64(cv2_to_pil(tile["image"]))
+                if tile_base64:
+                    image_parts.append((f"Screen region {tile['screen_box']} (elements {tile['indices'][0]}..{tile['indices'][-1]}).", tile_base64))
+            if image_parts:
+                return self._build_rendered_prompt(element_desc, elements_text, image_parts), sum(len(b) for _, b in image_parts), "tiled"
+            logging.warning("Tiled rendering failed; falling back to two-image mode.")
+            self.render_mode_stats["tiled"]["fallbacks"] += 1
+
+        # Convert cv2_screenshot (NumPy array) to PIL Image
+        try:
+            orig_pil = cv2_to_pil(cv2_screenshot)
+            if orig_pil is None:
+                logging.error("cv2_to_pil returned None for original screenshot.")
+                self.last_reasoning = "Error processing original screenshot (conversion to PIL failed)."
+                return None, 0, "two_image"
+        except Exception as e:
+            logging.error(f"Failed to convert cv2_screenshot (NumPy array) to PIL: {e}")
+            self.last_reasoning = "Error processing original screenshot (conversion exception)."
+            return None, 0, "two_image"
+
+        orig_base64 = image_to_base64(orig_pil)
+
+        # Convert vis_img (NumPy array) to PIL Image
+        vis_pil = None
+        if vis_img is not None: # vis_img is np.ndarray or None
+            try:
+                vis_pil = cv2_to_pil(vis_img)
+            except Exception as e:
+                logging.warning(f"Failed to convert vis_img (NumPy array) to PIL: {e}")
+        vis_base64 = image_to_base64(vis_pil) if vis_pil else None
+
+        if not orig_base64:
+            logging.error("Failed to convert original screenshot to base64.")
+            self.last_reasoning = "Error processing original screenshot for LLM."
+            return None, 0, "two_image"
+
+        return self._build_full_prompt(element_desc, elements_text, orig_base64, vis_base64), len(orig_base64) + len(vis_base64 or ""), "two_image"
+
+    def _build_candidate_prompt(self, element_desc: str, elements_text: str, crop_base64: str, crop_offset: Tuple[int, int], total_elements: int) -> List[Dict[str, Any]]:
+        prompt_parts = [
+            "You are an advanced UI Navigation Agent. Your task is to identify the exact element a user wants to click based on a description, using visual analysis and a list of candidate elements.",
+            f"\nThe {total_elements} detected elements were pre-filtered to the most likely candidates below.",
+            f"\nIMAGE: A crop of the screenshot around the candidates (its top-left corner is screen position {crop_offset}). Each candidate is outlined in red and tagged with its element index.",
+            f"\n\nUser's request: Find and click on '{element_desc}'",
+            f"\n\nCandidate UI elements with their indices (Center is in screen coordinates):\n{elements_text}\n",
+            "\nINSTRUCTIONS FOR ANALYSIS:",
+            "- Locate what the user is asking for in the image and map it to a tagged candidate index.",
+            "- If multiple similar items exist, use relative position (e.g., 'first', 'top-most') if specified in the user's request.",
+            "- If none of the candidates is the requested element, answer NOT FOUND; the full element list will then be provided.",
+            "\nFormat your response ONLY with these two lines:",
+            "REASONING: [Your brief step-by-step reasoning here]",
+            "SELECTED: [The index number of the best match, or 'NOT FOUND']"
+        ]
+        return [{"text": "\n".join(prompt_parts)}, {"inline_data": {"mime_type": "image/png", "data": crop_base64}}]
+
+    def _select_from_candidates(
+            self,
+            elements: UIElementCollection,
+            element_desc: str,
+            cv2_screenshot: np.ndarray,
+            top_k: int
+        ) -> Tuple[Optional[int], Dict[str, int], int, bool]:
+        """
+        Candidate pass: rank locally and send the top-K with a cropped annotated image.
+        Returns (selection, tokens, candidates sent, whether the model answered).
+        """
+        height, width = cv2_screenshot.shape[:2]
+        ranked = rank_ui_elements(elements, element_desc, (width, height), top_k)
+        candidate_indices = [idx for idx, _ in ranked]
+        crop, crop_offset = build_candidate_crop(cv2_screenshot, elements, candidate_indices)
+        crop_base64 = image_to_base64(cv2_to_pil(crop)) if crop is not None else None
+        if not crop_base64:
+            logging.warning("Could not build candidate crop; using the full element set.")
+            return None, {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}, 0, False
+
+        elements_text = "\n".join(self._describe_element(i, elements[i]) for i in candidate_indices)
+        content_for_llm = self._build_candidate_prompt(element_desc, elements_text, crop_base64, crop_offset, len(elements))
+        txt, token_usage = self._query_model(content_for_llm)
+        if txt is None:
+            return None, token_usage, len(candidate_indices), False
+        selection, reasoning = self._parse_selection(txt, set(candidate_indices))
+        self.last_reasoning = reasoning
+        return selection, token_usage, len(candidate_indices), True
+
+    def _record_selection_stats(self, mode: str, elements_count: int, candidates: int, token_usage: Dict[str, int], llm_calls: int, start: float) -> None:
+        latency_ms = (time.perf_counter() - start) * 1000.0
+        self.last_selection_stats = {
+            "mode": mode,
+            "elements": elements_count,
+            "candidates": candidates,
+            "llm_calls": llm_calls,
+            "prompt_tokens": token_usage.get("prompt_tokens", 0),
+            "total_tokens": token_usage.get("total_tokens", 0),
+            "latency_ms": round(latency_ms, 1),
+            "token_usage": dict(token_usage),
+            "cache_hit": mode == "cache",
+        }
+        self.selection_stats["selections"] += 1
+        self.selection_stats[{"cache": "cache_hits", "candidates": "candidate_only", "candidates+full": "widened"}.get(mode, "full_only")] += 1
+        self.selection_stats["prompt_tokens"] += token_usage.get("prompt_tokens", 0)
+        self.selection_stats["latency_ms"] += latency_ms
+        logging.info(f"UI selection stats: {self.last_selection_stats}")
+
+    def invalidate_last_selection(self) -> bool:
+        """Forget the most recent selection, e.g. after its click was assessed as a failure."""
+        key, self.last_selection_cache_key = self.last_selection_cache_key, None
+        return self.selection_cache.invalidate(key)
 
     def select_ui_element_for_click(
             self,
@@ -22,6 +335,8 @@ class UIAgent:
 
             llm_call_token_usage = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
             self.last_reasoning = "Selection process not started."
+            self.last_selection_stats = {}
+            start = time.perf_counter()
 
             if not elements:
                 logging.warning("No UI elements provided to select_ui_element_for_click.")
@@ -33,175 +348,68 @@ class UIAgent:
                 self.last_reasoning = "Missing screenshot for visual analysis (cv2_screenshot was None)."
                 return None, llm_call_token_usage
 
-            elements_description = []
-            for i, elem in enumerate(elements):
-                label = elem.label.strip() if elem.label else "[No Label]"
-                desc_str = f"Element {i}: Type='{elem.element_type}', Label='{label[:50]}{'...' if len(label)>50 else ''}', Center=({int(elem.center[0])},{int(elem.center[1])})"
-                elements_description.append(desc_str)
+            cache_key = self.selection_cache.make_key(cv2_screenshot, element_desc, elements)
+            self.last_selection_cache_key = cache_key
+            cached = self.selection_cache.get(cache_key)
+            if cached and 0 <= cached[0] < len(elements):
+                selection, cached_reasoning = cached
+                self.last_reasoning = f"{cached_reasoning}\n(Agent Note: Reused cached selection for an unchanged screen.)"
+                self._record_selection_stats("cache", len(elements), 0, llm_call_token_usage, 0, start)
+                logging.info(f"Selection cache hit for '{element_desc}': element index {selection}")
+                return selection, llm_call_token_usage
+
+            mode = "full"
+            candidates_sent = 0
+            llm_calls = 0
+            if self.candidate_top_k and len(elements) > self.candidate_top_k:
+                selection, candidate_tokens, candidates_sent, answered = self._select_from_candidates(elements, element_desc, cv2_screenshot, self.candidate_top_k)
+                for k in llm_call_token_usage: llm_call_token_usage[k] += candidate_tokens.get(k, 0)
+                if candidates_sent:
+                    llm_calls += 1
+                    mode = "candidates"
+                if selection is not None:
+                    self.selection_cache.put(cache_key, selection, self.last_reasoning)
+                    self._record_selection_stats(mode, len(elements), candidates_sent, llm_call_token_usage, llm_calls, start)
+                    logging.info(f"LLM selected element index: {selection} (from {candidates_sent} candidates)")
+                    return selection, llm_call_token_usage
+                if candidates_sent and not answered:
+                    # Blocked or failed call; a larger prompt would not fare better.
+                    self._record_selection_stats(mode, len(elements), candidates_sent, llm_call_token_usage, llm_calls, start)
+                    return None, llm_call_token_usage
+                if candidates_sent:
+                    logging.info(f"No match among {candidates_sent} candidates; widening to all {len(elements)} elements.")
+                    mode = "candidates+full"
+
+            elements_description = [self._describe_element(i, elem) for i, elem in enumerate(elements)]
 
             if not elements_description:
                 logging.warning("UI elements list was empty after formatting descriptions.")
                 self.last_reasoning = "Detected UI elements list was empty or could not be processed."
                 return None, llm_call_token_usage
 
-            elements_text = "\n".join(elements_description)            
-            # Convert cv2_screenshot (NumPy array) to PIL Image
-            orig_pil = None
-            if cv2_screenshot is not None: # cv2_screenshot is np.ndarray
-                try:
-                    orig_pil = cv2_to_pil(cv2_screenshot) 
-                    if orig_pil is None:
-                        logging.error("cv2_to_pil returned None for original screenshot.")
-                        self.last_reasoning = "Error processing original screenshot (conversion to PIL failed)."
-                        return None, llm_call_token_usage
-                except Exception as e:
-                    logging.error(f"Failed to convert cv2_screenshot (NumPy array) to PIL: {e}")
-                    self.last_reasoning = "Error processing original screenshot (conversion exception)."
-                    return None, llm_call_token_usage
-            else: # This case should have been caught earlier, but as a safeguard
-                logging.error("cv2_screenshot became None unexpectedly before PIL conversion.")
-                self.last_reasoning = "Internal error: screenshot became unavailable."
+            elements_text = "\n".join(elements_description)
+            content_for_llm, payload_bytes, rendered_mode = self._build_full_content(element_desc, elements_text, elements, cv2_screenshot, vis_img)
+            if content_for_llm is None:
                 return None, llm_call_token_usage
-            
-            orig_base64 = image_to_base64(orig_pil)
-
-            # Convert vis_img (NumPy array) to PIL Image
-            vis_pil = None
-            if vis_img is not None: # vis_img is np.ndarray or None
-                try:
-                    vis_pil = cv2_to_pil(vis_img) 
-                except Exception as e:
-                    logging.warning(f"Failed to convert vis_img (NumPy array) to PIL: {e}")
-            vis_base64 = image_to_base64(vis_pil) if vis_pil else None
-
 
-            if not orig_base64:
-                logging.error("Failed to convert original screenshot to base64.")
-                self.last_reasoning = "Error processing original screenshot for LLM."
+            call_start = time.perf_counter()
+            txt, full_tokens = self._query_model(content_for_llm)
+            llm_calls += 1
+            for k in llm_call_token_usage: llm_call_token_usage[k] += full_tokens.get(k, 0)
+            render_stats = self.render_mode_stats[rendered_mode] # The fallback mode when rendering the configured one failed
+            render_stats["calls"] += 1
+            render_stats["prompt_tokens"] += full_tokens.get("prompt_tokens", 0)
+            render_stats["latency_ms"] += (time.perf_counter() - call_start) * 1000.0
+            render_stats["payload_bytes"] += payload_bytes
+            if txt is None:
+                self._record_selection_stats(mode, len(elements), candidates_sent, llm_call_token_usage, llm_calls, start)
                 return None, llm_call_token_usage
 
-            prompt_parts = [
-                "You are an advanced UI Navigation Agent. Your task is to identify the exact element a user wants to click based on a description, using visual analysis and a list of detected elements.",
-                "\nI'm providing image(s) and a list of detected UI elements:",
-                "\n1. FIRST IMAGE: The original screenshot.",
-            ]
-            content_for_llm = [{"inline_data": {"mime_type": "image/png", "data": orig_base64}}]
-
-            if vis_base64:
-                prompt_parts.append("\n2. SECOND IMAGE: Visualization with numbered boxes highlighting detected elements (numbers match indices below).")
-                content_for_llm.append({"inline_data": {"mime_type": "image/png", "data": vis_base64}})
-            else:
-                prompt_parts.append("\n(Note: Visualization image is not available.)")
-
-            prompt_parts.extend([
-                f"\n\nUser's request: Find and click on '{element_desc}'",
-                f"\n\nDetected UI elements with their indices:\n{elements_text}\n",
-                "\nINSTRUCTIONS FOR ANALYSIS:",
-                "- Analyze the FIRST IMAGE (original screenshot) to visually locate what the user is asking for based on the description.",
-            ])
-            if vis_base64:
-                prompt_parts.append("- Use the SECOND IMAGE (visualization) to map your visual finding to an element index from the list.")
-            else:
-                prompt_parts.append("- Rely heavily on element labels, types, and positions in the list compared to the original screenshot.")
-
-            prompt_parts.extend([
-                "\n\n**Specific Guidance for Common Elements:**",
-                "- **Video Thumbnails/Links:** Often appear as rectangular images with titles. The clickable area is usually the image or the title text. Look for elements with labels matching video titles or generic descriptions like 'video thumbnail'. If multiple similar items exist (e.g., search results), use relative position (e.g., 'first', 'top-most') if specified in the user's request.",
-                "\nIMPORTANT: Provide step-by-step reasoning.",
-                "1. Describe what you visually identify in the original screenshot matching the request.",
-                "2. Examine the element list for candidates based on label, type, and location.",
-                "3. If visualization is available, confirm the index using the numbered boxes.",
-                "4. Explain your choice for the best match or state if no clear match exists.",
-                "\nFormat your response ONLY with these two lines:",
-                "REASONING: [Your detailed step-by-step reasoning here]",
-                "SELECTED: [The index number of the best match, or 'NOT FOUND']"
-            ])
-
-            prompt_text = "\n".join(prompt_parts)
-            content_for_llm.insert(0, {"text": prompt_text})
-
-            try:
-                safety_settings = {} # Define safety settings if needed
-                response = self.model.generate_content(content_for_llm, safety_settings=safety_settings)
-                llm_call_token_usage = _get_token_usage(response)
-                txt = ""
-                if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-                    txt = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text')).strip()
-
-                if not txt:
-                    block_reason = "Unknown"
-                    if hasattr(response, 'prompt_feedback') and response.prompt_feedback and hasattr(response.prompt_feedback, 'block_reason') and response.prompt_feedback.block_reason:
-                        block_reason = str(response.prompt_feedback.block_reason)
-                    logging.error(f"LLM response blocked: {block_reason}")
-                    self.last_reasoning = f"LLM response blocked ({block_reason})."
-                    return None, llm_call_token_usage
-
-                logging.info(f"[UI Agent Raw Response]\n{txt}")
-            except ValueError as ve:
-                logging.error(f"ValueError accessing LLM response: {ve}")
-                self.last_reasoning = f"LLM response likely blocked. ValueError: {ve}"
-                return None, llm_call_token_usage
-            except Exception as e:
-                logging.error(f"Error getting response from Gemini: {e}")
-                self.last_reasoning = f"Error communicating with LLM: {e}"
-                return None, llm_call_token_usage
-
-            reasoning = "No reasoning extracted."
-            selection = None
-
-            reasoning_match = re.search(r'REASONING:\s*(.*?)(?=\nSELECTED:|$)', txt, re.DOTALL | re.IGNORECASE)
-            selection_match = re.search(r'SELECTED:\s*(\d+|NOT FOUND)', txt, re.IGNORECASE)
-
-            if reasoning_match:
-                reasoning = reasoning_match.group(1).strip()
-            else:
-                logging.warning("Could not extract reasoning.")
-                sel_keyword_pos = txt.upper().find("SELECTED:")
-                reasoning = txt[:sel_keyword_pos].strip() if sel_keyword_pos != -1 and sel_keyword_pos > 0 else txt
-
-            if selection_match:
-                selection_text = selection_match.group(1).strip()
-                if selection_text.isdigit():
-                    try:
-                        selected_idx = int(selection_text)
-                        if 0 <= selected_idx < len(elements):
-                            selection = selected_idx
-                        else:
-                            logging.warning(f"LLM selected invalid index: {selected_idx} (max: {len(elements)-1}).")
-                            reasoning += f"\n(Agent Note: LLM selected invalid index {selected_idx}.)"
-                            selection = None # Explicitly set to None
-                    except ValueError:
-                        logging.warning(f"Could not convert selected text '{selection_text}' to int.")
-                        selection = None
-                elif "NOT FOUND" in selection_text.upper():
-                    logging.info("LLM indicated element not found.")
-                    selection = None
-                else:
-                    logging.warning(f"Could not parse selection: '{selection_text}'")
-                    selection = None
-            else:
-                logging.warning("Could not extract selection.")
-                if "NOT FOUND" not in txt.upper():
-                    lines = txt.strip().split('\n')
-                    last_line = lines[-1] if lines else ""
-                    numbers_in_last_line = re.findall(r'\b(\d+)\b$', last_line)
-                    if not numbers_in_last_line:
-                        numbers_in_text = re.findall(r'\b(\d+)\b', txt)
-                        if numbers_in_text:
-                            numbers_in_last_line = [numbers_in_text[-1]]
-
-                    if numbers_in_last_line:
-                        try:
-                            potential_idx = int(numbers_in_last_line[-1])
-                            if 0 <= potential_idx < len(elements):
-                                logging.warning(f"Used fallback extraction, selected index: {potential_idx}")
-                                selection = potential_idx
-                                reasoning += f"\n(Agent Note: Used fallback extraction, selected index {potential_idx}.)"
-                            else:
-                                logging.warning(f"Fallback number {potential_idx} out of bounds.")
-                        except ValueError:
-                            pass
-            
+            selection, reasoning = self._parse_selection(txt, set(range(len(elements))))
             self.last_reasoning = reasoning
+            if selection is not None:
+                self.selection_cache.put(cache_key, selection, reasoning)
+            self._record_selection_stats(mode, len(elements), candidates_sent, llm_call_token_usage, llm_calls, start)
+            self.last_selection_stats.update({"render_mode": rendered_mode, "requested_render_mode": self.render_mode, "payload_bytes": payload_bytes})
             logging.info(f"LLM selected element index: {selection}" if selection is not None else "LLM did not select a valid index.")
             return selection, llm_call_token_usage
@@ -0,0 +1,155 @@
+import logging
+import re
+from difflib import SequenceMatcher
+from typing import Optional, Tuple, List, Dict, Any
+import numpy as np
+import cv2
+
+from vision.xga import UIElementCollection
+
+# Number of locally ranked candidates sent to the LLM before widening to the full element set.
+DEFAULT_CANDIDATE_TOP_K = 15
+# Pixels of context kept around the candidates' union bbox in the cropped image.
+CANDIDATE_CROP_MARGIN = 60
+
+# Words in an element description hinting at the detector's element_type (see vision.xga).
+TYPE_HINTS = {
+    "button": ("Button",),
+    "btn": ("Button",),
+    "icon": ("Icon",),
+    "logo": ("Icon",),
+    "field": ("Input Field",),
+    "input": ("Input Field",),
+    "box": ("Input Field",),
+    "bar": ("Input Field",),
+    "textbox": ("Input Field",),
+    "link": ("Clickable Text",),
+    "text": ("Clickable Text",),
+    "menu": ("Clickable Text", "Button"),
+    "tab": ("Clickable Text", "Button"),
+    "cell": ("Grid Cell",),
+}
+
+# Positional words mapped to the (x, y) anchor they favour, in frame fractions; None = no preference on that axis.
+POSITION_HINTS = {
+    "top": (None, 0.0),
+    "upper": (None, 0.0),
+    "bottom": (None, 1.0),
+    "lower": (None, 1.0),
+    "left": (0.0, None),
+    "right": (1.0, None),
+    "center": (0.5, 0.5),
+    "middle": (0.5, 0.5),
+}
+
+# Detector placeholder labels that carry no text ("Icon at (12, 34)", "Grid Cell (1, 2)").
+_PLACEHOLDER_LABEL = re.compile(r'^(icon|grid cell|ui element|rounded button|square button|button|input field)( at)? \(\s*-?\d+,\s*-?\d+\)$', re.IGNORECASE)
+_STOP_WORDS = {"the", "a", "an", "on", "in", "at", "of", "to", "for", "and", "with", "click", "press", "select", "open", "button", "icon", "link"}
+
+LABEL_WEIGHT = 0.6
+TYPE_WEIGHT = 0.2
+POSITION_WEIGHT = 0.2
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+
+def _is_placeholder_label(label: Optional[str]) -> bool:
+    return not label or not label.strip() or bool(_PLACEHOLDER_LABEL.match(label.strip()))
+
+
+def _label_similarity(label: str, desc_text: str, desc_words: List[str]) -> float:
+    """0..1 similarity of an element label to the description (word overlap and fuzzy ratio)."""
+    label_norm = " ".join(_tokens(label))
+    if not label_norm or not desc_text:
+        return 0.0
+    if desc_text in label_norm or label_norm in desc_text:
+        return 1.0
+    label_words = set(label_norm.split())
+    overlap = sum(1 for w in desc_words if w in label_words) / len(desc_words) if desc_words else 0.0
+    ratio = SequenceMatcher(None, label_norm, desc_text).ratio()
+    return max(overlap, ratio)
+
+
+def _position_score(center: Tuple[float, float], frame_size: Tuple[int, int], anchors: List[Tuple[Optional[float], Optional[float]]]) -> float:
+    """0..1 closeness of an element centre to the anchors named in the description."""
+    if not anchors or not frame_size[0] or not frame_size[1]:
+        return 0.0
+    fx, fy = center[0] / float(frame_size[0]), center[1] / float(frame_size[1])
+    distances = []
+    for ax, ay in anchors:
+        if ax is not None:
+            distances.append(abs(fx - ax))
+        if ay is not None:
+            distances.append(abs(fy - ay))
+    return max(0.0, 1.0 - sum(distances) / len(distances)) if distances else 0.0
+
+
+def rank_ui_elements(
+    elements: UIElementCollection,
+    element_desc: str,
+    frame_size: Tuple[int, int],
+    top_k: int = DEFAULT_CANDIDATE_TOP_K
+) -> List[Tuple[int, float]]:
+    """
+    Score every detected element against the description locally and return the best
+    `top_k` as (element_index, score), highest first. Scores combine label similarity,
+    element-type hints ("button", "field", ...) and positional words ("top", "left", ...).
+    """
+    words = _tokens(element_desc)
+    desc_words = [w for w in words if w not in _STOP_WORDS and w not in POSITION_HINTS] or words
+    desc_text = " ".join(desc_words)
+    type_hints = {t for w in words for t in TYPE_HINTS.get(w, ())}
+    anchors = [POSITION_HINTS[w] for w in words if w in POSITION_HINTS]
+
+    scored = []
+    for idx, elem in enumerate(elements):
+        label_score = 0.0 if _is_placeholder_label(elem.label) else _label_similarity(elem.label, desc_text, desc_words)
+        element_type = elem.element_type or ""
+        type_score = 1.0 if type_hints and any(t in element_type for t in type_hints) else 0.0
+        position_score = _position_score(elem.center, frame_size, anchors)
+        scored.append((idx, LABEL_WEIGHT * label_score + TYPE_WEIGHT * type_score + POSITION_WEIGHT * position_score))
+    # Stable sort keeps detector order among ties (e.g. many unlabeled icons).
+    scored.sort(key=lambda item: item[1], reverse=True)
+    return scored[:max(1, top_k)]
+
+
+def build_candidate_crop(
+    cv2_screenshot: np.ndarray,
+    elements: UIElementCollection,
+    candidate_indices: List[int],
+    margin: int = CANDIDATE_CROP_MARGIN
+) -> Tuple[Optional[np.ndarray], Tuple[int, int]]:
+    """
+    Crop the screenshot to the union of the candidates' boxes plus `margin` and draw each
+    candidate's box with its original element index. Returns (crop, (offset_x, offset_y)).
+    """
+    if cv2_screenshot is None or not candidate_indices:
+        return None, (0, 0)
+    try:
+        height, width = cv2_screenshot.shape[:2]
+        boxes = [elements[i].bbox for i in candidate_indices]
+        x1 = max(0, min(b[0] for b in boxes) - margin)
+        y1 = max(0, min(b[1] for b in boxes) - margin)
+        x2 = min(width, max(b[0] + b[2] for b in boxes) + margin)
+        y2 = min(height, max(b[1] + b[3] for b in boxes) + margin)
+        crop = cv2_screenshot[y1:y2, x1:x2].copy()
+        for idx in candidate_indices:
+            bx, by, bw, bh = elements[idx].bbox
+            top_left = (int(bx - x1), int(by - y1))
+            cv2.rectangle(crop, top_left, (top_left[0] + int(bw), top_left[1] + int(bh)), (0, 0, 255), 2)
+            label = str(idx)
+            (tw, th), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+            ty = top_left[1] - 4 if top_left[1] - 4 > th else top_left[1] + int(bh) + th + 4
+            cv2.rectangle(crop, (top_left[0], ty - th - baseline), (top_left[0] + tw + 4, ty + baseline), (0, 0, 255), cv2.FILLED)
+            cv2.putText(crop, label, (top_left[0] + 2, ty), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        return crop, (x1, y1)
+    except Exception as e:
+        logging.error(f"Error building candidate crop: {e}")
+        return None, (0, 0)
+
+
+def candidate_recall(ranked: List[Tuple[int, float]], expected_index: int) -> bool:
+    """True if the expected element is among the ranked candidates."""
+    return any(idx == expected_index for idx, _ in ranked)
@@ -0,0 +1,255 @@
+import base64
+import io
+import json
+import logging
+import math
+import os
+import re
+import sys
+import time
+from types import SimpleNamespace
+from typing import Optional, List, Dict, Any, Sequence
+import cv2
+import numpy as np
+from PIL import Image
+import google.generativeai as genai
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from config import DEBUG_DIR
+from agents.ai_agent import UIAgent
+from agents.candidate_ranking import rank_ui_elements, candidate_recall, DEFAULT_CANDIDATE_TOP_K
+from agents.selection_rendering import SELECTION_RENDER_MODES
+from vision.xga import UIElementCollection, visualize_ui_elements
+
+# Corpus = debug sessions written by locate_and_click_ui_element (DEBUG_DIR/<app>_<timestamp>/).
+# The expected element is read from expected_index.txt when present (hand-verified label),
+# otherwise from the "Matched index:" line of match_successful.txt.
+EXPECTED_INDEX_FILE = "expected_index.txt"
+RECALL_TOP_K_VALUES = (5, 10, 15, 30)
+
+# Gemini image token accounting used by the stub model: images with both sides <= 384px
+# cost 258 tokens, larger ones are tiled into 768x768 crops of 258 tokens each.
+IMAGE_TOKENS_PER_TILE = 258
+IMAGE_SMALL_SIDE = 384
+IMAGE_TILE_SIDE = 768
+STUB_CHARS_PER_TOKEN = 4
+
+
+def _elements_from_debug_json(serialized: List[Dict[str, Any]]) -> UIElementCollection:
+    """Rebuild a UIElementCollection from a debug session's ui_elements.json."""
+    elements = []
+    for elem in serialized:
+        bbox = [int(float(v)) for v in elem.get("bbox", [0, 0, 0, 0])]
+        elements.append({
+            "center": tuple(float(c) for c in elem.get("center", [0, 0])),
+            "label": elem.get("label", ""),
+            "bbox": bbox,
+            "width": int(float(elem.get("width", bbox[2]))),
+            "height": int(float(elem.get("height", bbox[3]))),
+            "position": (bbox[0], bbox[1]),
+            "element_type": elem.get("element_type", "Unknown"),
+        })
+    return UIElementCollection(elements)
+
+
+def load_selection_corpus(corpus_dir: str = DEBUG_DIR, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Load recorded click selections (screenshot, elements, description, expected index)."""
+    corpus = []
+    if not os.path.isdir(corpus_dir):
+        return corpus
+    for session in sorted(os.listdir(corpus_dir)):
+        session_dir = os.path.join(corpus_dir, session)
+        match_path = os.path.join(session_dir, "match_successful.txt")
+        screenshot_path = os.path.join(session_dir, "original_screenshot.png")
+        elements_path = os.path.join(session_dir, "ui_elements.json")
+        if not (os.path.isfile(match_path) and os.path.isfile(screenshot_path) and os.path.isfile(elements_path)):
+            continue
+        try:
+            with open(match_path, "r", encoding="utf-8") as f:
+                match_text = f.read()
+            desc_match = re.search(r'^Search term: (.*)$', match_text, re.MULTILINE)
+            index_match = re.search(r'^Matched index: (\d+)$', match_text, re.MULTILINE)
+            expected_path = os.path.join(session_dir, EXPECTED_INDEX_FILE)
+            if os.path.isfile(expected_path):
+                with open(expected_path, "r", encoding="utf-8") as f:
+                    expected_index = int(f.read().strip())
+            elif index_match:
+                expected_index = int(index_match.group(1))
+            else:
+                continue
+            if not desc_match:
+                continue
+            with open(elements_path, "r", encoding="utf-8") as f:
+                elements = _elements_from_debug_json(json.load(f))
+            screenshot = cv2.imread(screenshot_path)
+            if screenshot is None or not (0 <= expected_index < len(elements)):
+                continue
+            corpus.append({
+                "session": session,
+                "element_desc": desc_match.group(1).strip(),
+                "expected_index": expected_index,
+                "elements": elements,
+                "screenshot": screenshot,
+            })
+        except Exception as e:
+            logging.warning(f"Skipping selection corpus entry '{session}': {e}")
+        if limit and len(corpus) >= limit:
+            break
+    return corpus
+
+
+def evaluate_candidate_recall(corpus: List[Dict[str, Any]], top_k_values: Sequence[int] = RECALL_TOP_K_VALUES) -> List[Dict[str, Any]]:
+    """Offline check of the local ranking: how often the expected element is in the top-K, and ranking time."""
+    results = []
+    for top_k in top_k_values:
+        hits = 0
+        candidates = 0
+        elements_total = 0
+        rank_seconds = 0.0
+        for case in corpus:
+            height, width = case["screenshot"].shape[:2]
+            start = time.perf_counter()
+            ranked = rank_ui_elements(case["elements"], case["element_desc"], (width, height), top_k)
+            rank_seconds += time.perf_counter() - start
+            hits += candidate_recall(ranked, case["expected_index"])
+            candidates += len(ranked)
+            elements_total += len(case["elements"])
+        cases = max(1, len(corpus))
+        results.append({
+            "top_k": top_k,
+            "recall": hits / cases,
+            "mean_candidates": candidates / cases,
+            "mean_elements": elements_total / cases,
+            "rank_ms": rank_seconds * 1000.0 / cases,
+        })
+    return results
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Approximate Gemini prompt tokens for one image."""
+    if width <= IMAGE_SMALL_SIDE and height <= IMAGE_SMALL_SIDE:
+        return IMAGE_TOKENS_PER_TILE
+    return math.ceil(width / IMAGE_TILE_SIDE) * math.ceil(height / IMAGE_TILE_SIDE) * IMAGE_TOKENS_PER_TILE
+
+
+class StubSelectionModel:
+    """
+    Offline stand-in for the Gemini model in selection benchmarks. Estimates prompt tokens
+    from the text length and image sizes and always answers with `answer`.
+    """
+
+    def __init__(self, answer: str = "0"):
+        self.answer = answer
+        self.calls = 0
+
+    def generate_content(self, content: List[Dict[str, Any]], safety_settings: Optional[Dict[str, Any]] = None) -> Any:
+        self.calls += 1
+        prompt_tokens = 0
+        for part in content:
+            if "text" in part:
+                prompt_tokens += len(part["text"]) // STUB_CHARS_PER_TOKEN
+            elif "inline_data" in part:
+                with Image.open(io.BytesIO(base64.b64decode(part["inline_data"]["data"]))) as image:
+                    prompt_tokens += estimate_image_tokens(*image.size)
+        text = f"REASONING: Stub model answer.\nSELECTED: {self.answer}"
+        usage = SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=12, total_token_count=prompt_tokens + 12)
+        part = SimpleNamespace(text=text)
+        return SimpleNamespace(
+            candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))],
+            usage_metadata=usage,
+            prompt_feedback=None
+        )
+
+
+def _synthetic_selection_case(width: int = 1920, height: int = 1080, element_count: int = 150) -> Dict[str, Any]:
+    """A desktop-like frame with a grid of labelled elements, used when no corpus is recorded."""
+    rng = np.random.default_rng(0)
+    screenshot = np.full((height, width, 3), 236, dtype=np.uint8)
+    screenshot[:40, :] = (60, 60, 60)
+    elements = []
+    cols = 15
+    for i in range(element_count):
+        x, y = 20 + (i % cols) * (width // cols), 60 + (i // cols) * ((height - 80) // max(1, element_count // cols))
+        w, h = 90, 28
+        screenshot[y:y + h, x:x + w] = rng.integers(120, 220, size=3, dtype=np.uint8)
+        cv2.putText(screenshot, f"Item {i}", (x + 4, y + 19), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+        elements.append({
+            "center": (x + w / 2.0, y + h / 2.0), "label": f"Item {i}", "bbox": [x, y, w, h],
+            "width": w, "height": h, "position": (x, y), "element_type": "Clickable Text",
+        })
+    return {"session": "synthetic", "element_desc": "Item 42", "expected_index": 42,
+            "elements": UIElementCollection(elements), "screenshot": screenshot}
+
+
+def benchmark_render_modes(corpus: Optional[List[Dict[str, Any]]] = None, modes: Sequence[str] = SELECTION_RENDER_MODES) -> Dict[str, Dict[str, Any]]:
+    """
+    Offline A/B of the full-set selection render modes with StubSelectionModel: image payload
+    size, estimated prompt tokens and local render/encode time per selection.
+    """
+    corpus = corpus or [_synthetic_selection_case()]
+    report = {}
+    for mode in modes:
+        stub = StubSelectionModel()
+        agent = UIAgent(stub, candidate_top_k=None, render_mode=mode) # type: ignore
+        latency_ms = 0.0
+        for case in corpus:
+            vis_img = visualize_ui_elements(case["screenshot"], case["elements"]) if mode == "two_image" else None
+            agent.select_ui_element_for_click(case["elements"], case["element_desc"], case["screenshot"], vis_img)
+            latency_ms += agent.last_selection_stats.get("latency_ms", 0.0)
+        stats = agent.render_mode_stats[mode]
+        cases = max(1, len(corpus))
+        report[mode] = {
+            "payload_kb": stats["payload_bytes"] / 1024.0 / cases,
+            "prompt_tokens": stats["prompt_tokens"] / cases,
+            "local_ms": latency_ms / cases,
+            "fallbacks": stats["fallbacks"],
+        }
+    return report
+
+
+def compare_selection_modes(corpus: List[Dict[str, Any]], llm_model: genai.GenerativeModel, top_k: int = DEFAULT_CANDIDATE_TOP_K) -> Dict[str, Dict[str, Any]]:
+    """
+    Run every corpus case through the full-set selection and the candidate selection
+    (with widening) and report accuracy, prompt tokens and latency per click for each mode.
+    """
+    modes = {"full": UIAgent(llm_model, candidate_top_k=None), "candidates": UIAgent(llm_model, candidate_top_k=top_k)}
+    report = {}
+    for mode, agent in modes.items():
+        correct = 0
+        prompt_tokens = 0
+        latency_ms = 0.0
+        for case in corpus:
+            vis_img = visualize_ui_elements(case["screenshot"], case["elements"])
+            selection, _ = agent.select_ui_element_for_click(case["elements"], case["element_desc"], case["screenshot"], vis_img)
+            correct += selection == case["expected_index"]
+            prompt_tokens += agent.last_selection_stats.get("prompt_tokens", 0)
+            latency_ms += agent.last_selection_stats.get("latency_ms", 0.0)
+        cases = max(1, len(corpus))
+        report[mode] = {
+            "accuracy": correct / cases,
+            "mean_prompt_tokens": prompt_tokens / cases,
+            "mean_latency_ms": latency_ms / cases,
+            "widened": agent.selection_stats["widened"],
+        }
+    return report
+
+
+if __name__ == "__main__":
+    corpus = load_selection_corpus()
+    print(f"Selection corpus: {len(corpus)} recorded clicks from {DEBUG_DIR}")
+    for row in evaluate_candidate_recall(corpus):
+        print(
+            f"top-{row['top_k']:>2}: recall {row['recall']:.1%} | "
+            f"{row['mean_candidates']:.1f} of {row['mean_elements']:.1f} elements sent | rank {row['rank_ms']:.2f}ms"
+        )
+    for mode, row in benchmark_render_modes(corpus[:20] or None).items():
+        print(f"{mode:>10}: {row['payload_kb']:.0f} KB images | ~{row['prompt_tokens']:.0f} prompt tokens | {row['local_ms']:.0f}ms render+encode")
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if corpus and api_key and "--llm" in sys.argv:
+        import config
+        if config.configure_gemini_api(api_key):
+            for mode, row in compare_selection_modes(corpus, config.model).items():
+                print(
+                    f"{mode:>10}: accuracy {row['accuracy']:.1%} | {row['mean_prompt_tokens']:.0f} prompt tokens | "
+                    f"{row['mean_latency_ms']:.0f}ms per click | widened {row['widened']}"
+                )
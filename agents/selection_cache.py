@@ -0,0 +1,95 @@
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple, Dict, Any, Union
+import numpy as np
+from PIL import Image
+
+from utils.frame_hash import perceptual_frame_hash
+from vision.xga import UIElementCollection
+
+DEFAULT_SELECTION_CACHE_SIZE = 128
+
+SelectionCacheKey = Tuple[str, str, str]
+
+
+def normalize_element_description(element_desc: str) -> str:
+    """Lower-case, strip punctuation/quotes and collapse whitespace so rephrased retries still match."""
+    return " ".join(re.findall(r'[a-z0-9]+', (element_desc or "").lower()))
+
+
+def element_set_digest(elements: UIElementCollection) -> str:
+    """Digest of the detected elements (type, label, bbox) in index order."""
+    hasher = hashlib.blake2b(digest_size=8)
+    for elem in elements:
+        bbox = ",".join(str(int(v)) for v in elem.bbox)
+        hasher.update(f"{elem.element_type}|{elem.label}|{bbox}\n".encode("utf-8", "replace"))
+    return hasher.hexdigest()
+
+
+class SelectionCache:
+    """
+    LRU cache of UI element selections keyed by (perceptual frame hash, normalized
+    description, element-set digest). Stores the chosen index and the model's reasoning.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_SELECTION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[SelectionCacheKey, Tuple[int, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def make_key(frame: Optional[Union[Image.Image, np.ndarray]], element_desc: str, elements: UIElementCollection) -> Optional[SelectionCacheKey]:
+        frame_hash = perceptual_frame_hash(frame)
+        if not frame_hash:
+            return None
+        return frame_hash, normalize_element_description(element_desc), element_set_digest(elements)
+
+    def get(self, key: Optional[SelectionCacheKey]) -> Optional[Tuple[int, str]]:
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+
+    def put(self, key: Optional[SelectionCacheKey], index: int, reasoning: str) -> None:
+        if key is None:
+            return
+        with self._lock:
+            self._entries[key] = (index, reasoning)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, key: Optional[SelectionCacheKey]) -> bool:
+        """Drop a selection (e.g. its click was assessed as a failure). Returns True if it was cached."""
+        if key is None:
+            return False
+        with self._lock:
+            removed = self._entries.pop(key, None) is not None
+            if removed:
+                self.stats["invalidations"] += 1
+        if removed:
+            logging.info(f"Selection cache: invalidated entry for '{key[1]}'.")
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries), "hit_rate": round(self.hit_rate(), 3)}
@@ -0,0 +1,108 @@
+import logging
+import math
+from typing import Optional, Tuple, List, Dict, Any
+import numpy as np
+import cv2
+
+from vision.xga import UIElementCollection
+
+# How the full element set is shown to the selection LLM:
+#   two_image - original screenshot + visualize_ui_elements overlay, both at full resolution
+#   composite - one downscaled frame with a semi-transparent overlay and index tickets
+#   tiled     - the composite cut into a grid, keeping only tiles that contain elements
+SELECTION_RENDER_MODES = ("two_image", "composite", "tiled")
+DEFAULT_SELECTION_RENDER_MODE = "two_image"
+
+COMPOSITE_MAX_SIDE = 1600
+COMPOSITE_OVERLAY_ALPHA = 0.3
+TILE_GRID = (2, 2)  # columns, rows
+TILE_MAX_SIDE = 1024
+
+
+def _element_color(element_type: str) -> Tuple[int, int, int]:
+    """BGR colour per element type, matching visualize_ui_elements."""
+    if "Button" in element_type:
+        return (0, 255, 0)
+    if "Text" in element_type:
+        return (0, 165, 255)
+    if "Icon" in element_type:
+        return (255, 0, 0)
+    if "Input" in element_type:
+        return (255, 0, 255)
+    return (0, 255, 255)
+
+
+def _downscale(image: np.ndarray, max_side: int) -> Tuple[np.ndarray, float]:
+    height, width = image.shape[:2]
+    scale = min(1.0, float(max_side) / max(height, width))
+    if scale >= 1.0:
+        return image.copy(), 1.0
+    resized = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+    return resized, scale
+
+
+def render_composite(
+    cv2_screenshot: np.ndarray,
+    elements: UIElementCollection,
+    max_side: int = COMPOSITE_MAX_SIDE,
+    alpha: float = COMPOSITE_OVERLAY_ALPHA
+) -> Tuple[Optional[np.ndarray], float]:
+    """
+    Draw a semi-transparent box per element and an index ticket onto a downscaled copy of
+    the screenshot, so one image carries both the content and the indices.
+    Returns (composite, scale) where scale maps screen pixels to composite pixels.
+    """
+    if cv2_screenshot is None:
+        return None, 1.0
+    try:
+        frame, scale = _downscale(cv2_screenshot, max_side)
+        fills = frame.copy()
+        for elem in elements:
+            x, y, w, h = (int(v * scale) for v in elem.bbox)
+            cv2.rectangle(fills, (x, y), (x + w, y + h), _element_color(elem.element_type or ""), cv2.FILLED)
+        composite = cv2.addWeighted(fills, alpha, frame, 1.0 - alpha, 0)
+        for idx, elem in enumerate(elements):
+            x, y, w, h = (int(v * scale) for v in elem.bbox)
+            color = _element_color(elem.element_type or "")
+            cv2.rectangle(composite, (x, y), (x + w, y + h), color, 1)
+            label = str(idx)
+            (tw, th), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.4, 1)
+            ty = y - 2 if y - 2 > th else y + h + th + 2
+            cv2.rectangle(composite, (x, ty - th - baseline), (x + tw + 2, ty + baseline), color, cv2.FILLED)
+            cv2.putText(composite, label, (x + 1, ty), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1)
+        return composite, scale
+    except Exception as e:
+        logging.error(f"Error rendering selection composite: {e}")
+        return None, 1.0
+
+
+def render_tiles(
+    cv2_screenshot: np.ndarray,
+    elements: UIElementCollection,
+    grid: Tuple[int, int] = TILE_GRID,
+    max_side: int = TILE_MAX_SIDE
+) -> List[Dict[str, Any]]:
+    """
+    Cut an annotated full-resolution composite into a grid and keep the tiles containing
+    element centres. Each tile is downscaled to `max_side`. Returns a list of
+    {"image", "screen_box": (x1, y1, x2, y2), "indices"}.
+    """
+    if cv2_screenshot is None:
+        return []
+    composite, _ = render_composite(cv2_screenshot, elements, max_side=max(cv2_screenshot.shape[:2]))
+    if composite is None:
+        return []
+    height, width = composite.shape[:2]
+    cols, rows = grid
+    tile_w, tile_h = math.ceil(width / cols), math.ceil(height / rows)
+    tiles = []
+    for row in range(rows):
+        for col in range(cols):
+            x1, y1 = col * tile_w, row * tile_h
+            x2, y2 = min(width, x1 + tile_w), min(height, y1 + tile_h)
+            indices = [i for i, elem in enumerate(elements) if x1 <= elem.center[0] < x2 and y1 <= elem.center[1] < y2]
+            if not indices:
+                continue
+            tile, _ = _downscale(composite[y1:y2, x1:x2], max_side)
+            tiles.append({"image": tile, "screen_box": (x1, y1, x2, y2), "indices": indices})
+    return tiles
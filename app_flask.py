@@ -13,8 +13,17 @@ import uuid
 from config import model,LOG_FILE,DEBUG_DIR,chroma_client,default_ef,model
 from tools.shortcuts_tool import load_shortcuts_cache
 from task_exec.tasks_management import save_user_task_structure, load_user_task_structures, update_user_task_structure, delete_user_task_structure, retrieve_user_task_structure
-from utils.reinforcement_util import analyze_feedback_and_generate_reinforcements
+from utils.reinforcement_util import analyze_feedback_and_generate_reinforcements, ReinforcementRetrievalCache
 from task_exec.task_executor import iterative_task_executor
+from task_exec.history_manager import HistoryManager
+from chromaDB_management.session_log import session_log
+from chromaDB_management.blob_store import blob_store
+from chromaDB_management.task_history_index import task_history_index, TASK_HISTORY_PAGE_SIZE
+from chromaDB_management.embedding_cache import task_embedding_stats
+from chromaDB_management.task_context import TaskContext, task_context_retriever, retrieve_task_context, similar_sessions_from_results
+from vision.listener_service import visual_listener_service
+from tools.call_metrics import call_metrics, summarize_by_site, DEFAULT_TASK_TOKEN_BUDGET
+from tools.llm_gateway import llm_gateway
 from agents.ai_agent import UIAgent
 
 ui_agent = UIAgent(model)
@@ -59,6 +68,8 @@ try:
             metadata={"hnsw:space": "cosine"}
         )
         logging.info("ChromaDB collection 'agent_task_sessions_history' initialized for AgentState.")
+        task_history_index.set_loader(lambda: agent_task_sessions_collection.get(include=['metadatas'])['metadatas'] or [])
+        task_context_retriever.set_sessions_collection(agent_task_sessions_collection)
     else:
         raise ImportError("chroma_client or default_ef not available from vision.py")
 except ImportError:
@@ -82,6 +93,18 @@ class TaskSession:
         self.iteration_count: int = 0 # To track iterations for resuming
         self.total_tokens: Dict[str, int] = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0} # New
         self.initial_planning_done: bool = False # To track if initial planning/user interaction is done
+        self.ui_selection_stats: Dict[str, Any] = {"selections": 0, "cache_hits": 0, "llm_calls": 0, "prompt_tokens": 0, "latency_ms": 0.0}
+        self.llm_cache_stats: Dict[str, int] = {"hits": 0, "tokens_saved": 0} # LLM response cache hits (not in total_tokens)
+        self.call_metrics: Dict[str, Any] = {"calls": {}} # Per call site token/latency aggregates, see tools/call_metrics.py
+        self.token_budget: Optional[int] = DEFAULT_TASK_TOKEN_BUDGET # Pause and ask the user once total_tokens reaches this
+        self.budget_paused: bool = False
+        self.critique_stats: Dict[str, Any] = {"skip": 0, "self": 0, "independent": 0, "failed": 0, "critic_s": 0.0, "saved_s_est": 0.0} # See task_exec/critique_policy.py
+        self.history_manager = HistoryManager() # Prompt history segments for the planner/critic; derived, not persisted
+        self.reinforcement_cache = ReinforcementRetrievalCache() # Only its stats are persisted
+        self.shortcut_prompt_stats: Dict[str, int] = {"selections": 0, "full_tokens": 0, "prompt_tokens": 0, "tokens_saved": 0, "records_shown": 0} # See tools/shortcut_index.py
+        self.speculation_stats: Dict[str, Any] = {"started": 0, "hits": 0, "misses": 0, "hit_rate": 0.0, "saved_s": 0.0, "wasted_tokens": 0, "miss_reasons": {}} # See task_exec/speculative_planner.py
+        self.task_context: Optional[TaskContext] = None # Retrieved by the route for the executor's start; not persisted
+        self.task_start_stats: Dict[str, Any] = {"context_source": "", "context_ms": 0.0, "embeddings": 0, "time_to_first_action_s": None} # See chromaDB_management/task_context.py
         logging.info(f"[TaskSession.__init__] Initialized task {task_id} with zero token counts: {self.total_tokens}")
 
     def to_dict(self) -> Dict:
@@ -100,8 +123,62 @@ class TaskSession:
             "total_tokens": self.total_tokens, 
             "iteration_count": self.iteration_count,
             "initial_planning_done": self.initial_planning_done,
+            "ui_selection_stats": self.ui_selection_stats,
+            "llm_cache_stats": self.llm_cache_stats,
+            "call_metrics": self.call_metrics,
+            "token_budget": self.token_budget,
+            "critique_stats": self.critique_stats,
+            "speculation_stats": self.speculation_stats,
+            "shortcut_prompt_stats": self.shortcut_prompt_stats,
+            "task_start_stats": self.task_start_stats,
+            "reinforcement_cache_stats": self.reinforcement_cache.stats,
         }
 
+    def persisted_state(self) -> Dict[str, Any]:
+        """Fields saved to the session event log. Lists are the live ones (the log only serializes what is new)."""
+        return {
+            "task_id": self.task_id,
+            "task_name": self.task_name,
+            "start_time": self.start_time.astimezone(timezone.utc).isoformat(),
+            "end_time": self.end_time.astimezone(timezone.utc).isoformat() if self.end_time else None,
+            "status": self.status,
+            "conversation_history": self.conversation_history,
+            "agent_thoughts": self.agent_thoughts,
+            "youtube_references": self.youtube_references,
+            "execution_log": self.execution_log,
+            "action_failure_counts": self.action_failure_counts,
+            "total_tokens": self.total_tokens,
+            "iteration_count": self.iteration_count,
+            "initial_planning_done": self.initial_planning_done,
+            "ui_selection_stats": self.ui_selection_stats,
+            "llm_cache_stats": self.llm_cache_stats,
+            "call_metrics": self.call_metrics,
+            "token_budget": self.token_budget,
+            "budget_paused": self.budget_paused,
+            "critique_stats": self.critique_stats,
+            "speculation_stats": self.speculation_stats,
+            "shortcut_prompt_stats": self.shortcut_prompt_stats,
+            "task_start_stats": self.task_start_stats,
+            "reinforcement_cache_stats": self.reinforcement_cache.stats,
+        }
+
+    @classmethod
+    def from_persisted_state(cls, state: Dict[str, Any]) -> "TaskSession":
+        """Rebuild a session from persisted_state() as replayed by the session event log."""
+        session = cls(state["task_id"], state["task_name"], datetime.fromisoformat(state["start_time"]))
+        session.end_time = datetime.fromisoformat(state["end_time"]) if state.get("end_time") else None
+        for field in ("status", "conversation_history", "agent_thoughts", "youtube_references", "execution_log",
+                      "action_failure_counts", "iteration_count", "initial_planning_done", "token_budget", "budget_paused"):
+            if field in state:
+                setattr(session, field, state[field])
+        tokens = state.get("total_tokens")
+        if isinstance(tokens, dict) and all(key in tokens for key in ["prompt_tokens", "candidates_tokens", "total_tokens"]):
+            session.total_tokens = tokens
+        for field in ("ui_selection_stats", "llm_cache_stats", "call_metrics", "critique_stats", "speculation_stats", "shortcut_prompt_stats", "task_start_stats"):
+            getattr(session, field).update(state.get(field) or {})
+        session.reinforcement_cache.stats.update(state.get("reinforcement_cache_stats") or {})
+        return session
+
     def _accumulate_tokens(self, new_tokens: Dict[str, int]): # Helper method
         if not isinstance(new_tokens, dict):
             logging.error(f"[Token Accumulation] Invalid token data type: {type(new_tokens)}")
@@ -116,6 +193,10 @@ class TaskSession:
             logging.error(f"[Token Accumulation] Invalid token type or missing required token count keys in: {new_tokens}")
             return # Do not proceed if types are wrong after defaulting
 
+        if new_tokens.get("cached_calls"): # Served from the LLM response cache: counted here, zero tokens below
+            self.llm_cache_stats["hits"] = self.llm_cache_stats.get("hits", 0) + new_tokens["cached_calls"]
+            self.llm_cache_stats["tokens_saved"] = self.llm_cache_stats.get("tokens_saved", 0) + new_tokens.get("tokens_saved", 0)
+
         try:
             logging.debug(f"[Token Accumulation] Current counts for task {self.task_id}: {self.total_tokens}")
             logging.debug(f"[Token Accumulation] Adding new counts: {{'prompt_tokens': {prompt_tokens_new}, 'candidates_tokens': {candidates_tokens_new}, 'total_tokens': {total_tokens_new}}}")
@@ -132,6 +213,83 @@ class TaskSession:
         except Exception as e:
             logging.error(f"[Token Accumulation] Error accumulating tokens for task {self.task_id}: {e}")
 
+    def history_lines(self) -> List[str]:
+        """Capped "role: content" lines for the whole conversation_history, updated incrementally."""
+        return self.history_manager.lines(self.conversation_history)
+
+    def history_segment(self, consumer: str, model: Any = None) -> str:
+        """Token-windowed prompt history for "planner" or "critic" (see task_exec/history_manager.py)."""
+        segment = self.history_manager.segment(self.conversation_history, consumer, model)
+        self._accumulate_tokens(self.history_manager.take_token_usage())
+        return segment
+
+    def token_budget_exceeded(self) -> bool:
+        return bool(self.token_budget) and self.total_tokens.get("total_tokens", 0) >= self.token_budget # type: ignore
+
+    def raise_token_budget(self, reply: Optional[str]) -> int:
+        """Apply the user's reply to a budget pause: a number sets the new budget, anything else adds the old budget again."""
+        used = self.total_tokens.get("total_tokens", 0)
+        match = re.search(r'\d[\d,]*', reply or "")
+        requested = int(match.group(0).replace(",", "")) if match else 0
+        self.token_budget = requested if requested > used else used + (self.token_budget or 0)
+        self.budget_paused = False
+        logging.info(f"[Token Budget] Task {self.task_id}: budget raised to {self.token_budget} ({used} used).")
+        return self.token_budget
+
+    def _accumulate_selection_stats(self, selection_stats: Dict[str, Any]):
+        """Add one UI element selection (see UIAgent.last_selection_stats) to the task's stats."""
+        if not isinstance(selection_stats, dict) or not selection_stats:
+            return
+        stats = self.ui_selection_stats
+        stats["selections"] = stats.get("selections", 0) + 1
+        stats["cache_hits"] = stats.get("cache_hits", 0) + (1 if selection_stats.get("cache_hit") else 0)
+        stats["llm_calls"] = stats.get("llm_calls", 0) + selection_stats.get("llm_calls", 0)
+        stats["prompt_tokens"] = stats.get("prompt_tokens", 0) + selection_stats.get("prompt_tokens", 0)
+        stats["latency_ms"] = round(stats.get("latency_ms", 0.0) + selection_stats.get("latency_ms", 0.0), 1)
+        stats["cache_hit_rate"] = round(stats["cache_hits"] / stats["selections"], 3)
+
+    def _accumulate_critique_stats(self, tier: str, passed: bool, critic_seconds: float = 0.0, saved_seconds: float = 0.0):
+        """Count one pre-execution check by tier ("skip", "self", "independent") with its measured and saved time."""
+        stats = self.critique_stats
+        stats[tier] = stats.get(tier, 0) + 1
+        stats["failed"] = stats.get("failed", 0) + (0 if passed else 1)
+        stats["critic_s"] = round(stats.get("critic_s", 0.0) + critic_seconds, 3)
+        stats["saved_s_est"] = round(stats.get("saved_s_est", 0.0) + saved_seconds, 3)
+
+    def _accumulate_speculation_stats(self, outcome: Optional[Dict[str, Any]] = None, started: bool = False, wasted_tokens: int = 0):
+        """Count a speculative draft being started, resolved (hit or miss with its reason) or its discarded tokens."""
+        stats = self.speculation_stats
+        stats["started"] = stats.get("started", 0) + (1 if started else 0)
+        stats["wasted_tokens"] = stats.get("wasted_tokens", 0) + wasted_tokens
+        if outcome:
+            if outcome.get("hit"):
+                stats["hits"] = stats.get("hits", 0) + 1
+                stats["saved_s"] = round(stats.get("saved_s", 0.0) + outcome.get("saved_s", 0.0), 3)
+            else:
+                stats["misses"] = stats.get("misses", 0) + 1
+                reasons = stats.setdefault("miss_reasons", {})
+                reasons[outcome.get("reason", "unknown")] = reasons.get(outcome.get("reason", "unknown"), 0) + 1
+            resolved = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = round(stats["hits"] / resolved, 3) if resolved else 0.0
+
+    def _accumulate_shortcut_prompt_stats(self, selection: Dict[str, int]):
+        """Count one shortcut selection for the planner prompt and the tokens it saved over the full list."""
+        stats = self.shortcut_prompt_stats
+        stats["selections"] = stats.get("selections", 0) + 1
+        for key in ("full_tokens", "prompt_tokens", "records_shown"):
+            stats[key] = stats.get(key, 0) + selection.get(key, 0)
+        stats["tokens_saved"] = stats["full_tokens"] - stats["prompt_tokens"]
+
+    def _record_task_start_stats(self, context: Optional[TaskContext] = None, source: str = "", first_action_s: Optional[float] = None):
+        """The task-start context retrieval (where, how long, embeddings computed), and the time to the first action, kept once."""
+        stats = self.task_start_stats
+        if context is not None:
+            stats["context_source"] = source
+            stats["context_ms"] = context.timings.get("total_ms", 0.0)
+            stats["embeddings"] = context.embeddings
+        if first_action_s is not None and stats.get("time_to_first_action_s") is None:
+            stats["time_to_first_action_s"] = round(first_action_s, 3)
+
 class AgentState:
     def __init__(self):
         self.current_task: Optional[TaskSession] = None
@@ -143,8 +301,25 @@ class AgentState:
         
         self.pending_new_task_decision: Optional[Dict[str, Any]] = None
         self.status_message: str = 'Ready for new task'  # Add status message attribute
+        self.streaming_reply: str = ""  # Partial final chat reply while it is being streamed
+        self._chroma_summaries: Dict[str, tuple] = {} # task_id -> (name, status, end_time) last upserted to Chroma
 
     def _save_session_to_chromadb(self, session: TaskSession):
+        task_history_index.upsert({
+            "task_id": session.task_id,
+            "task_name": session.task_name,
+            "start_time": session.start_time.astimezone(timezone.utc).isoformat(),
+            "end_time": session.end_time.astimezone(timezone.utc).isoformat() if session.end_time else None,
+            "status": session.status,
+        })
+        # The session event log holds the full state and takes only what changed since the last save.
+        # The Chroma record (task list, similar-session search) is re-upserted only when its summary changes.
+        if session_log.enabled:
+            session_log.record(session.task_id, session.persisted_state())
+            summary = (session.task_name, session.status, session.end_time)
+            if self._chroma_summaries.get(session.task_id) == summary:
+                return
+            self._chroma_summaries[session.task_id] = summary
         if not agent_task_sessions_collection:
             print("ERROR: ChromaDB collection not available. Cannot save session.")
             return
@@ -157,23 +332,8 @@ class AgentState:
                 logging.error(f"[ChromaDB] Invalid token count format for task {session.task_id}: {session.total_tokens}")
                 session.total_tokens = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
             
-            metadata = {
-                "task_id": session.task_id,
-                "task_name": session.task_name,
-                "start_time": session.start_time.astimezone(timezone.utc).isoformat(),
-                "end_time": session.end_time.astimezone(timezone.utc).isoformat() if session.end_time else "",
-                "status": session.status,
-                "execution_log": session.execution_log
-            } 
-            metadata["total_tokens"] = json.dumps(session.total_tokens)
-            metadata["iteration_count"] = session.iteration_count
-            metadata["initial_planning_done"] = session.initial_planning_done
-            
+            metadata = self._chroma_summary_metadata(session)
             print(f"[ChromaDB] Token counts in metadata: {metadata['total_tokens']}")
-            
-            metadata["conversation_history"] = json.dumps(session.conversation_history)
-            metadata["agent_thoughts"] = json.dumps(session.agent_thoughts)
-            metadata["youtube_references"] = json.dumps(session.youtube_references)
 
             agent_task_sessions_collection.upsert(
                 ids=[session.task_id],
@@ -184,52 +344,46 @@ class AgentState:
         except Exception as e:
             print(f"ERROR saving to ChromaDB: {e}")
 
+    def _chroma_summary_metadata(self, session: TaskSession) -> Dict[str, Any]:
+        """
+        The small fields kept in Chroma (task list, similar-session search). Everything else lives in
+        the session event log; with the log disabled it is saved as a blob referenced by "fields_blob".
+        """
+        metadata = {
+            "task_id": session.task_id,
+            "task_name": session.task_name,
+            "start_time": session.start_time.astimezone(timezone.utc).isoformat(),
+            "end_time": session.end_time.astimezone(timezone.utc).isoformat() if session.end_time else "",
+            "status": session.status,
+            "total_tokens": json.dumps(session.total_tokens),
+            "iteration_count": session.iteration_count,
+            "initial_planning_done": session.initial_planning_done,
+            "token_budget": session.token_budget or 0, # Chroma metadata cannot hold None
+            "budget_paused": session.budget_paused,
+        }
+        if not session_log.enabled:
+            fields = {key: value for key, value in session.persisted_state().items() if key not in metadata}
+            metadata["fields_blob"] = blob_store.put_json(blob_store.externalize(fields))
+        return metadata
+
     def _load_session_from_chromadb(self, task_id: str) -> Optional[TaskSession]:
+        state = session_log.load(task_id)
+        if state:
+            try:
+                session = TaskSession.from_persisted_state(state)
+                session_log.track(task_id, session.persisted_state())
+                logging.debug(f"Loaded task session {task_id} from the session event log.")
+                return session
+            except (KeyError, TypeError, ValueError) as e:
+                logging.error(f"[SessionLog] Invalid logged state for task {task_id}, falling back to ChromaDB: {e}")
+        # Sessions saved before the event log existed (their first save afterwards logs a full snapshot)
         if not agent_task_sessions_collection:
             logging.error("ChromaDB collection for task sessions not available. Cannot load session.")
             return None
         try:
             results = agent_task_sessions_collection.get(ids=[task_id], include=['metadatas'])
             if results and results['ids'] and results['metadatas']:
-                session_data = results['metadatas'][0]
-
-                start_time = datetime.fromisoformat(session_data["start_time"].replace("Z", "+00:00"))
-                end_time = datetime.fromisoformat(session_data["end_time"].replace("Z", "+00:00")) if session_data["end_time"] else None
-
-                session = TaskSession(
-                    task_id=session_data["task_id"],
-                    task_name=session_data["task_name"],
-                    start_time=start_time
-                )
-                session.end_time = end_time
-                session.status = session_data["status"]
-                session.execution_log = session_data["execution_log"]
-
-                try:
-                    if "total_tokens" in session_data and session_data["total_tokens"]: # Check if not empty
-                        loaded_tokens = json.loads(session_data["total_tokens"])
-                        if isinstance(loaded_tokens, dict) and all(key in loaded_tokens for key in ["prompt_tokens", "candidates_tokens", "total_tokens"]):
-                            session.total_tokens = loaded_tokens
-                            logging.info(f"[ChromaDB] Loaded token counts for task {task_id}: {session.total_tokens}")
-                        else:
-                            logging.warning(f"[ChromaDB] Invalid token count format in metadata for task {task_id}: {loaded_tokens}, using defaults.")
-                            session.total_tokens = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
-                    else:
-                        logging.warning(f"[ChromaDB] No token counts found or empty in metadata for task {task_id}, using defaults")
-                        session.total_tokens = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
-                except json.JSONDecodeError as e:
-                    logging.error(f"[ChromaDB] Error decoding token counts JSON for task {task_id}: {e}. Metadata value: '{session_data.get('total_tokens', 'MISSING')}'")
-                    session.total_tokens = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
-                except Exception as e: # Catch other potential errors during token loading
-                    logging.error(f"[ChromaDB] Generic error loading token counts for task {task_id}: {e}")
-                    session.total_tokens = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
-
-                session.conversation_history = json.loads(session_data["conversation_history"])
-                session.agent_thoughts = json.loads(session_data["agent_thoughts"])
-                session.youtube_references = json.loads(session_data.get("youtube_references", "[]"))
-                session.iteration_count = session_data.get("iteration_count", 0)
-                session.initial_planning_done = session_data.get("initial_planning_done", False)
-
+                session = self._session_from_chroma_metadata(results['metadatas'][0])
                 logging.debug(f"Loaded task session {task_id} from ChromaDB.")
                 return session
             else:
@@ -239,12 +393,155 @@ class AgentState:
             logging.error(f"Error loading task session {task_id} from ChromaDB: {e}", exc_info=True)
             return None
 
-    def start_new_task(self, task_name: str) -> TaskSession:
+    def _session_from_chroma_metadata(self, session_data: Dict[str, Any]) -> TaskSession:
+        """A session from its Chroma record: summary plus "fields_blob", or the large fields inline (records not migrated yet)."""
+        task_id = session_data["task_id"]
+        if session_data.get("fields_blob"):
+            fields = blob_store.resolve(blob_store.get_json(session_data["fields_blob"]) or {})
+            state = {**session_data, **fields, "total_tokens": json.loads(session_data.get("total_tokens") or "{}"),
+                     "token_budget": session_data.get("token_budget") or None}
+            return TaskSession.from_persisted_state(state)
+        start_time = datetime.fromisoformat(session_data["start_time"].replace("Z", "+00:00"))
+        end_time = datetime.fromisoformat(session_data["end_time"].replace("Z", "+00:00")) if session_data["end_time"] else None
+
+        session = TaskSession(
+            task_id=session_data["task_id"],
+            task_name=session_data["task_name"],
+            start_time=start_time
+        )
+        session.end_time = end_time
+        session.status = session_data["status"]
+        session.execution_log = session_data.get("execution_log", "")
+
+        try:
+            if "total_tokens" in session_data and session_data["total_tokens"]: # Check if not empty
+                loaded_tokens = json.loads(session_data["total_tokens"])
+                if isinstance(loaded_tokens, dict) and all(key in loaded_tokens for key in ["prompt_tokens", "candidates_tokens", "total_tokens"]):
+                    session.total_tokens = loaded_tokens
+                    logging.info(f"[ChromaDB] Loaded token counts for task {task_id}: {session.total_tokens}")
+                else:
+                    logging.warning(f"[ChromaDB] Invalid token count format in metadata for task {task_id}: {loaded_tokens}, using defaults.")
+                    session.total_tokens = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+            else:
+                logging.warning(f"[ChromaDB] No token counts found or empty in metadata for task {task_id}, using defaults")
+                session.total_tokens = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+        except json.JSONDecodeError as e:
+            logging.error(f"[ChromaDB] Error decoding token counts JSON for task {task_id}: {e}. Metadata value: '{session_data.get('total_tokens', 'MISSING')}'")
+            session.total_tokens = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+        except Exception as e: # Catch other potential errors during token loading
+            logging.error(f"[ChromaDB] Generic error loading token counts for task {task_id}: {e}")
+            session.total_tokens = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+
+        session.conversation_history = json.loads(session_data.get("conversation_history", "[]"))
+        session.agent_thoughts = json.loads(session_data.get("agent_thoughts", "[]"))
+        session.youtube_references = json.loads(session_data.get("youtube_references", "[]"))
+        session.iteration_count = session_data.get("iteration_count", 0)
+        session.initial_planning_done = session_data.get("initial_planning_done", False)
+        try:
+            session.ui_selection_stats.update(json.loads(session_data.get("ui_selection_stats") or "{}"))
+        except json.JSONDecodeError:
+            logging.warning(f"[ChromaDB] Invalid ui_selection_stats for task {task_id}, using defaults.")
+        try:
+            session.llm_cache_stats.update(json.loads(session_data.get("llm_cache_stats") or "{}"))
+        except json.JSONDecodeError:
+            logging.warning(f"[ChromaDB] Invalid llm_cache_stats for task {task_id}, using defaults.")
+        try:
+            session.call_metrics.update(json.loads(session_data.get("call_metrics") or "{}"))
+        except json.JSONDecodeError:
+            logging.warning(f"[ChromaDB] Invalid call_metrics for task {task_id}, using defaults.")
+        try:
+            session.critique_stats.update(json.loads(session_data.get("critique_stats") or "{}"))
+        except json.JSONDecodeError:
+            logging.warning(f"[ChromaDB] Invalid critique_stats for task {task_id}, using defaults.")
+        try:
+            session.speculation_stats.update(json.loads(session_data.get("speculation_stats") or "{}"))
+        except json.JSONDecodeError:
+            logging.warning(f"[ChromaDB] Invalid speculation_stats for task {task_id}, using defaults.")
+        try:
+            session.shortcut_prompt_stats.update(json.loads(session_data.get("shortcut_prompt_stats") or "{}"))
+        except json.JSONDecodeError:
+            logging.warning(f"[ChromaDB] Invalid shortcut_prompt_stats for task {task_id}, using defaults.")
+        try:
+            session.reinforcement_cache.stats.update(json.loads(session_data.get("reinforcement_cache_stats") or "{}"))
+        except json.JSONDecodeError:
+            logging.warning(f"[ChromaDB] Invalid reinforcement_cache_stats for task {task_id}, using defaults.")
+        session.token_budget = session_data.get("token_budget") or None
+        session.budget_paused = bool(session_data.get("budget_paused", False))
+
+        return session
+
+    def migrate_legacy_session_records(self, batch_size: int = 50) -> int:
+        """
+        Move the large fields of Chroma session records saved before the summary-only format
+        (conversation_history, agent_thoughts, ... inline in metadata) into the session event log,
+        with inline images in the blob store, and rewrite the records with summary metadata only.
+        Idempotent; returns the number of records migrated.
+        """
+        if not agent_task_sessions_collection:
+            return 0
+        if not session_log.enabled:
+            logging.info("[Migration] Session event log is disabled; leaving task session records in their legacy format.")
+            return 0
+        try:
+            results = agent_task_sessions_collection.get(include=['metadatas'])
+        except Exception as e:
+            logging.error(f"[Migration] Could not read task session records: {e}", exc_info=True)
+            return 0
+        legacy_ids = [task_id for task_id, metadata in zip(results.get('ids') or [], results.get('metadatas') or [])
+                      if metadata and "conversation_history" in metadata]
+        if not legacy_ids:
+            return 0
+        logging.info(f"[Migration] Moving large fields of {len(legacy_ids)} task session records out of ChromaDB metadata.")
+        migrated = 0
+        for offset in range(0, len(legacy_ids), batch_size):
+            batch = agent_task_sessions_collection.get(ids=legacy_ids[offset:offset + batch_size], include=['metadatas', 'documents', 'embeddings'])
+            sessions: Dict[str, TaskSession] = {}
+            for index, task_id in enumerate(batch['ids']):
+                try:
+                    logged = session_log.load(task_id)
+                    session = TaskSession.from_persisted_state(logged) if logged else self._session_from_chroma_metadata(batch['metadatas'][index])
+                    if not logged:
+                        session_log.record(task_id, session.persisted_state())
+                    sessions[task_id] = session
+                except Exception as e:
+                    logging.error(f"[Migration] Failed to migrate task session {task_id}: {e}", exc_info=True)
+            # Only drop the inline fields once the batch is durably in the event log and reads back.
+            if not session_log.flush():
+                logging.error(f"[Migration] Session event log flush timed out; leaving {len(sessions)} records of this batch unmigrated.")
+                continue
+            for index, task_id in enumerate(batch['ids']):
+                session = sessions.get(task_id)
+                if session is None:
+                    continue
+                try:
+                    logged = session_log.load(task_id)
+                    if not logged or len(logged.get("conversation_history") or []) != len(session.conversation_history):
+                        logging.error(f"[Migration] Task session {task_id} did not round-trip through the session event log; keeping its legacy record.")
+                        continue
+                    # delete + add with the stored embedding: upsert would merge the old keys back in
+                    document, embedding = batch['documents'][index] or session.task_name, batch['embeddings'][index]
+                    agent_task_sessions_collection.delete(ids=[task_id])
+                    try:
+                        agent_task_sessions_collection.add(ids=[task_id], documents=[document], embeddings=[embedding],
+                                                           metadatas=[self._chroma_summary_metadata(session)])
+                    except Exception:
+                        agent_task_sessions_collection.add(ids=[task_id], documents=[document], embeddings=[embedding],
+                                                           metadatas=[batch['metadatas'][index]])
+                        raise
+                    task_history_index.upsert(self._chroma_summary_metadata(session))
+                    migrated += 1
+                except Exception as e:
+                    logging.error(f"[Migration] Failed to migrate task session {task_id}: {e}", exc_info=True)
+        logging.info(f"[Migration] Migrated {migrated}/{len(legacy_ids)} task session records.")
+        return migrated
+
+    def start_new_task(self, task_name: str, task_context: Optional[TaskContext] = None) -> TaskSession:
         if self.current_task and self.current_task.status == "active":
             self.pause_current_task() 
 
         task_id = str(uuid.uuid4()) 
         session = TaskSession(task_id, task_name, datetime.now(timezone.utc)) 
+        session.task_context = task_context
         
         self.current_task = session
         self.is_task_running = True 
@@ -328,27 +625,12 @@ class AgentState:
             logging.debug(f"Thought ({type}): {thought}")
 
     def get_task_history_list(self) -> List[Dict]: 
-        if not agent_task_sessions_collection:
-            logging.error("ChromaDB collection for task sessions not available. Cannot get history.")
-            return []
-        try:
-            results = agent_task_sessions_collection.get(include=['metadatas'])
-            history_list = []
-            if results and results['metadatas']:
-                for session_data in results['metadatas']:
-                    # Ensure all expected keys are present or provide defaults
-                    history_item = {
-                        'task_id': session_data.get('task_id', 'N/A'),
-                        'task_name': session_data.get('task_name', 'Unnamed Task'),
-                        'start_time': session_data.get('start_time', ''),
-                        'end_time': session_data.get('end_time', None),
-                        'status': session_data.get('status', 'unknown')
-                    }
-                    history_list.append(history_item)
-            return sorted(history_list, key=lambda x: x.get('start_time', ''), reverse=True)
-        except Exception as e:
-            logging.error(f"Error fetching task history from ChromaDB: {e}", exc_info=True)
-            return []
+        """Every task session summary, newest first (see get_task_history_page for a page)."""
+        return task_history_index.page(limit=None)["items"]
+
+    def get_task_history_page(self, offset: int = 0, limit: Optional[int] = TASK_HISTORY_PAGE_SIZE, **filters) -> Dict[str, Any]:
+        """A page of task session summaries, newest first; filters: status, since, until, name_prefix."""
+        return task_history_index.page(offset=offset, limit=limit, **filters)
 
     def find_similar_task_sessions(self, query_text: str, n_results: int = 3, similarity_threshold: float = 0.70) -> List[Dict]: 
         if not agent_task_sessions_collection:
@@ -368,30 +650,9 @@ class AgentState:
                 include=['metadatas', 'distances']
             )
 
-            similar_sessions = []
-            if query_results and query_results['ids'] and query_results['ids'][0]:
-                for i in range(len(query_results['ids'][0])):
-                    task_id = query_results['ids'][0][i]
-                    metadata = query_results['metadatas'][0][i]
-                    distance = query_results['distances'][0][i]
-
-                    if distance < similarity_threshold: 
-                        # Filter out tasks that are already completed or failed, as they might not be good candidates for "resuming" in the context of a new, similar query.
-                        # However, for "new task" prompt, we might want to show them as examples of past work.
-                        # For now, let's keep the original logic of showing resumable (active/paused) tasks.
-                        if metadata.get('status') not in ['completed', 'failed']:
-                            similar_sessions.append({
-                                "task_id": task_id,
-                                "task_name": metadata.get("task_name", "Unnamed Task"),
-                                "status": metadata.get("status", "unknown"),
-                                "start_time": metadata.get("start_time", ""),
-                                "distance": distance
-                            })
-            
-            # Sort by distance (closer is better), then by start_time (more recent is better)
-            similar_sessions.sort(key=lambda x: (x['distance'], x.get('start_time', '')), reverse=False) # distance ascending, start_time descending if needed
+            similar_sessions = similar_sessions_from_results(query_results, n_results, similarity_threshold)
             logging.info(f"Found {len(similar_sessions)} similar, resumable task sessions for query '{query_text[:50]}...' (threshold: {similarity_threshold}).")
-            return similar_sessions[:n_results]
+            return similar_sessions
         except Exception as e:
             logging.error(f"Error finding similar task sessions in ChromaDB: {e}", exc_info=True)
             return []
@@ -446,6 +707,13 @@ def get_ui_update_state():
     
     # Get current token counts
     current_tokens = agent_state.current_task.total_tokens if agent_state.current_task else {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+
+    # First page of the task history; the current task is always included (the UI looks it up there)
+    task_history_page = agent_state.get_task_history_page()
+    if agent_state.current_task and not any(item["task_id"] == agent_state.current_task.task_id for item in task_history_page["items"]):
+        current_summary = task_history_index.get(agent_state.current_task.task_id)
+        if current_summary:
+            task_history_page["items"].append(current_summary)
     
     # Get the latest reasoning if available
     latest_reasoning = None
@@ -495,12 +763,25 @@ def get_ui_update_state():
         "executionLog": agent_state.current_task.execution_log if agent_state.current_task else "",
         "currentTaskName": agent_state.current_task.task_name if agent_state.current_task else "None",
         "currentTaskId": agent_state.current_task.task_id if agent_state.current_task else None,
-        "taskHistory": agent_state.get_task_history_list(),
+        "taskHistory": task_history_page["items"],
+        "taskHistoryTotal": task_history_page["total"],
         "totalTokens": current_tokens,
+        "uiSelectionStats": agent_state.current_task.ui_selection_stats if agent_state.current_task else {},
+        "llmCacheStats": agent_state.current_task.llm_cache_stats if agent_state.current_task else {},
+        "callMetrics": summarize_by_site(agent_state.current_task.call_metrics) if agent_state.current_task else [],
+        "tokenBudget": agent_state.current_task.token_budget if agent_state.current_task else None,
+        "critiqueStats": agent_state.current_task.critique_stats if agent_state.current_task else {},
+        "speculationStats": agent_state.current_task.speculation_stats if agent_state.current_task else {},
+        "shortcutPromptStats": agent_state.current_task.shortcut_prompt_stats if agent_state.current_task else {},
+        "taskStartStats": agent_state.current_task.task_start_stats if agent_state.current_task else {},
+        "embeddingStats": task_embedding_stats(agent_state.current_task.call_metrics) if agent_state.current_task else {},
+        "reinforcementCacheStats": agent_state.current_task.reinforcement_cache.stats if agent_state.current_task else {},
         "latestReasoning": latest_reasoning,
         "isThinking": agent_state.is_task_running,
+        "streamingReply": agent_state.streaming_reply,
         "showThoughts": True,
-        "agentThoughts": agent_thoughts
+        "agentThoughts": agent_thoughts,
+        "visualListeners": visual_listener_service.get_status(agent_state.current_task.task_id) if agent_state.current_task else []
     }
     
     return ui_state
@@ -510,10 +791,11 @@ def index():
     # Pass initial state to the template
     # Determine initial task to display if any.
     if agent_state.current_task is None and agent_task_sessions_collection:
-        history_summary = agent_state.get_task_history_list() # Gets sorted list
+        history_summary = agent_state.get_task_history_page(limit=1)["items"] # Most recent
         if history_summary:
             # Try to find the first non-completed/failed task from summary
-            active_or_paused_task_info = next((task_info for task_info in history_summary if task_info.get('status') not in ["completed", "failed"]), None)
+            resumable = agent_state.get_task_history_page(limit=1, status=["active", "paused"])["items"]
+            active_or_paused_task_info = resumable[0] if resumable else None
             
             task_to_load_id = None
             if active_or_paused_task_info:
@@ -558,6 +840,7 @@ def send_message():
         if agent_state.pending_new_task_decision and user_input_content:
             original_instruction_for_new = agent_state.pending_new_task_decision["original_instruction"]
             similar_options = agent_state.pending_new_task_decision["similar_sessions"]
+            pending_task_context = agent_state.pending_new_task_decision.get("task_context")
             user_choice_raw = user_input_content.lower().strip()
 
             agent_state.pending_new_task_decision = None # Clear the pending decision
@@ -582,19 +865,19 @@ def send_message():
                     agent_state.is_task_running = True # It's active in the sense that it's the current task
                 else:
                     logging.error(f"Failed to resume task {resumed_task_id}. Starting new for '{original_instruction_for_new}'.")
-                    agent_state.start_new_task(original_instruction_for_new)
+                    agent_state.start_new_task(original_instruction_for_new, pending_task_context)
                     agent_state.current_task.conversation_history.append({"role": "user", "content": user_input_raw}) # The 'resume TASK_ID' or 'new'
                     agent_state.current_task.conversation_history.append({"role": "system", "content": "Failed to resume, created new task."})
                     user_input_content = original_instruction_for_new # This becomes the first input for the new task
             elif "new" in user_choice_raw:
                 logging.info(f"User chose to create a new task for: '{original_instruction_for_new}'")
-                agent_state.start_new_task(original_instruction_for_new)
+                agent_state.start_new_task(original_instruction_for_new, pending_task_context)
                 agent_state.current_task.conversation_history.append({"role": "user", "content": user_input_raw}) # The 'new' command
                 agent_state.current_task.conversation_history.append({"role": "system", "content": "User opted to create a new task."})
                 user_input_content = original_instruction_for_new # This becomes the first input for the new task
             else: # Invalid choice
                 logging.warning(f"Invalid choice '{user_choice_raw}' for similar task prompt. Defaulting to new task for '{original_instruction_for_new}'.")
-                agent_state.start_new_task(original_instruction_for_new)
+                agent_state.start_new_task(original_instruction_for_new, pending_task_context)
                 agent_state.current_task.conversation_history.append({"role": "user", "content": user_input_raw}) # The invalid command
                 agent_state.current_task.conversation_history.append({"role": "system", "content": "Invalid choice for similar task, created new task."})
                 user_input_content = original_instruction_for_new # This becomes the first input for the new task
@@ -609,7 +892,9 @@ def send_message():
             if agent_state.current_task is None or agent_state.current_task.status == "completed":
                 # Context: No active task, or the current one is done.
                 # This is where we consider starting a genuinely new task or resuming a *different* non-active task.
-                similar_sessions = agent_state.find_similar_task_sessions(user_input_content, n_results=3)
+                # One retrieval for the new task: resumable sessions for this choice, the rest for the executor's start
+                task_context = retrieve_task_context(user_input_content)
+                similar_sessions = task_context.similar_sessions
                 current_task_id_if_exists = agent_state.current_task.task_id if agent_state.current_task else None
                 # Filter out the current task if it's 'completed' to avoid offering to resume itself as a "similar" task.
                 resumable_options = [
@@ -627,6 +912,7 @@ def send_message():
                     agent_state.pending_new_task_decision = {
                         "original_instruction": user_input_content,
                         "similar_sessions": resumable_options,
+                        "task_context": task_context,
                         "question_asked_to_user": question_to_ask_user
                     }
                     logging.info(f"Offering user choice for instruction '{user_input_content}'. Similar tasks found.")
@@ -644,7 +930,7 @@ def send_message():
                 else:
                     # No similar resumable tasks, or user implicitly wants new. Start a new task.
                     logging.info(f"No similar resumable tasks found for '{user_input_content}'. Starting new task.")
-                    agent_state.start_new_task(user_input_content)
+                    agent_state.start_new_task(user_input_content, task_context)
                     # The user_input_content is the task name and also the first user message.
                     agent_state.current_task.conversation_history.append({
                         "role": "user",
@@ -676,6 +962,8 @@ def send_message():
                         "role": "user",
                         "content": user_input_content
                     })
+                if agent_state.current_task.budget_paused: # The input answers the token budget question
+                    agent_state.current_task.raise_token_budget(user_input_content)
                 agent_state.current_task.end_time = datetime.now(timezone.utc) # Mark activity
             # agent_state._save_session_to_chromadb(agent_state.current_task) # Save history additions before generator
 
@@ -853,9 +1141,14 @@ def new_task_route():
     global agent_state
     data = request.get_json()
     task_name = data.get('task_name', f'Task_{uuid.uuid4().hex[:6]}') 
-    
+    try:
+        token_budget = _parse_token_budget(data.get('token_budget'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "token_budget must be a non-negative integer"}), 400
     
     session = agent_state.start_new_task(task_name)
+    if token_budget:
+        session.token_budget = token_budget
     
     # Explicitly set the task to paused and ensure is_task_running reflects this
     session.status = "paused"
@@ -1057,7 +1350,23 @@ def retrieve_task_api(task_id_or_name: str):
 
 @app.route('/tasks/history', methods=['GET'])
 def get_all_task_sessions(): # Renamed to be more descriptive
-    return jsonify(agent_state.get_task_history_list())
+    """All sessions as a list, or with any of offset/limit/status/since/until/name_prefix a page {items, total, offset, limit}."""
+    args = request.args
+    if not any(key in args for key in ("offset", "limit", "status", "since", "until", "name_prefix")):
+        return jsonify(agent_state.get_task_history_list())
+    try:
+        offset = int(args.get('offset', 0))
+        limit = int(args.get('limit', TASK_HISTORY_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "offset and limit must be integers"}), 400
+    return jsonify(agent_state.get_task_history_page(
+        offset=offset,
+        limit=max(1, min(limit, 500)),
+        status=args.getlist('status') or None,
+        since=args.get('since') or None,
+        until=args.get('until') or None,
+        name_prefix=args.get('name_prefix') or None
+    ))
 
 @app.route('/tasks/resume/<task_id>', methods=['POST'])
 def resume_specific_task_route(task_id: str): 
@@ -1128,6 +1437,60 @@ def get_ui_state_route():
     """Endpoint for frontend to poll for UI state updates."""
     return jsonify(get_ui_update_state())
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics_route():
+    """Token/latency metrics per call site: for the process and for a task (default: the current one)."""
+    task_id = request.args.get('task_id')
+    session = agent_state.current_task
+    if task_id and (session is None or session.task_id != task_id):
+        session = agent_state._load_session_from_chromadb(task_id)
+        if session is None:
+            return jsonify({"error": "Task not found"}), 404
+    return jsonify({
+        "process": call_metrics.get_process_stats(),
+        "task": {
+            "task_id": session.task_id,
+            "total_tokens": session.total_tokens,
+            "token_budget": session.token_budget,
+            "embeddings": task_embedding_stats(session.call_metrics),
+            "task_start": session.task_start_stats,
+            **call_metrics.get_task_stats(session.call_metrics),
+        } if session else None,
+        "llm_gateway": llm_gateway.get_stats(),
+        "session_log": session_log.get_stats(),
+        "blob_store": blob_store.get_stats(),
+        "embedding_cache": default_ef.get_stats() if hasattr(default_ef, "get_stats") else None,
+        "task_context": task_context_retriever.get_stats(),
+    })
+
+def _parse_token_budget(value: Any) -> Optional[int]:
+    """Token budget from a request body: None for empty/0 (no budget); raises ValueError if not a non-negative integer."""
+    budget = int(value or 0)
+    if budget < 0:
+        raise ValueError(f"negative token budget: {budget}")
+    return budget or None
+
+@app.route('/tasks/<task_id>/token_budget', methods=['POST'])
+def set_token_budget_route(task_id):
+    """Set (or clear with 0/null) the token budget of a task."""
+    data = request.get_json() or {}
+    session = agent_state.current_task if agent_state.current_task and agent_state.current_task.task_id == task_id else agent_state._load_session_from_chromadb(task_id)
+    if session is None:
+        return jsonify({"error": "Task not found"}), 404
+    try:
+        session.token_budget = _parse_token_budget(data.get('token_budget'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "token_budget must be a non-negative integer"}), 400
+    agent_state._save_session_to_chromadb(session)
+    return jsonify({"status": "success", "token_budget": session.token_budget, **get_ui_update_state()})
+
+@app.route('/listeners/<listener_id>/cancel', methods=['POST'])
+def cancel_listener_route(listener_id):
+    """Cancel a running background visual listener."""
+    if visual_listener_service.cancel_listener(listener_id):
+        return jsonify({"status": "success", "message": f"Listener '{listener_id}' cancelled.", **get_ui_update_state()})
+    return jsonify({"status": "error", "message": f"Listener '{listener_id}' is not running.", **get_ui_update_state()}), 404
+
 # Helper functions defined at the end or imported, to be used by routes
 def handle_task_completion(task: TaskSession, final_results: Optional[Dict] = None):
     """Handle task completion and update UI state."""
@@ -1191,12 +1554,17 @@ def generate_final_chat_response(session: TaskSession, final_results: Any):
         elif isinstance(last_result, dict) and 'message' in last_result: 
             final_reasoning = f"Final message: {last_result['message']}"
 
+    def _on_reply_token(text: str) -> None:
+        agent_state.streaming_reply += text
+
+    agent_state.streaming_reply = ""
     try:
         completion_message, chat_tokens = chat_with_user(
             session.conversation_history,
             session.task_name,
             final_results,
-            final_reasoning
+            final_reasoning,
+            on_token=_on_reply_token
         )
         logging.info(f"[generate_final_chat_response] Received chat tokens: {chat_tokens}")
         session._accumulate_tokens(chat_tokens)
@@ -1204,6 +1572,8 @@ def generate_final_chat_response(session: TaskSession, final_results: Any):
     except Exception as e:
         logging.error(f"[generate_final_chat_response] Error in chat_with_user during final response for task {session.task_id}: {e}", exc_info=True)
         session.conversation_history.append({"role": "assistant", "content": f"Task finished. Error generating summary: {str(e)}"})
+    finally:
+        agent_state.streaming_reply = ""
 
 
 def analyze_successful_steps(session: TaskSession, final_results: Any):
@@ -1387,6 +1757,9 @@ if __name__ == '__main__':
         except Exception as e:
             print(f"Warning: Could not write to log file {LOG_FILE}: {e}")
 
+        # Move session records saved before the summary-only format, in the background (not on import: the replay harness imports this module)
+        threading.Thread(target=agent_state.migrate_legacy_session_records, name="session_record_migration", daemon=True).start()
+
         # Start the frontend development server in a separate thread
         logging.info("Preparing to start frontend development server...")
         frontend_thread = threading.Thread(target=start_frontend_dev_server, daemon=True)
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, Optional, Any
+
+from config import CACHE_DIR
+
+# Content-addressed blob store on disk: one file per blob, named by the SHA-256 of its
+# bytes and sharded by the first two hex digits. Writes are atomic (temp file + rename)
+# and identical content is stored once. Used for the large values of task sessions
+# (inline image_data, oversized messages) so they stay out of Chroma metadata and out of
+# the session event log's rows; readers fetch them only when a session is opened.
+SESSION_BLOB_DIR = os.path.join(CACHE_DIR, "session_blobs")
+SESSION_BLOB_MIN_CHARS = 8 * 1024  # string values at least this long are stored as blobs
+
+BLOB_REF_KEY = "$blob"
+
+
+class BlobStore:
+    def __init__(self, root: str = SESSION_BLOB_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"puts": 0, "deduplicated": 0, "gets": 0, "missing": 0, "bytes_written": 0}
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def put(self, data: bytes) -> str:
+        """Store `data` and return its address (hex SHA-256)."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        with self._lock:
+            self.stats["puts"] += 1
+        if os.path.exists(path):
+            with self._lock:
+                self.stats["deduplicated"] += 1
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.stats["bytes_written"] += len(data)
+        return digest
+
+    def get(self, digest: str) -> Optional[bytes]:
+        with self._lock:
+            self.stats["gets"] += 1
+        try:
+            with open(self._path(digest), "rb") as f:
+                return f.read()
+        except OSError:
+            with self._lock:
+                self.stats["missing"] += 1
+            logging.warning(f"[BlobStore] Blob {digest} not found in {self.root}.")
+            return None
+
+    def put_json(self, value: Any) -> str:
+        return self.put(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+
+    def get_json(self, digest: str) -> Any:
+        data = self.get(digest)
+        return json.loads(data.decode("utf-8")) if data is not None else None
+
+    def externalize(self, value: Any, min_chars: int = SESSION_BLOB_MIN_CHARS) -> Any:
+        """Copy of `value` with string values inside dicts of at least min_chars replaced by {"$blob": address}."""
+        if isinstance(value, list):
+            return [self.externalize(item, min_chars) for item in value]
+        if isinstance(value, dict):
+            return {
+                key: {BLOB_REF_KEY: self.put(item.encode("utf-8"))} if isinstance(item, str) and len(item) >= min_chars else self.externalize(item, min_chars)
+                for key, item in value.items()
+            }
+        return value
+
+    def resolve(self, value: Any) -> Any:
+        """Inverse of externalize(); a missing blob becomes an empty string."""
+        if isinstance(value, list):
+            return [self.resolve(item) for item in value]
+        if isinstance(value, dict):
+            if len(value) == 1 and BLOB_REF_KEY in value:
+                data = self.get(value[BLOB_REF_KEY])
+                return data.decode("utf-8") if data is not None else ""
+            return {key: self.resolve(item) for key, item in value.items()}
+        return value
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats)
+
+
+blob_store = BlobStore()
@@ -12,6 +12,7 @@ import hashlib
 import cv2
 import time
 from utils.sanitize_util import sanitize_filename
+from utils.frame_hash import fast_frame_hash
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from config import CACHE_DIR
@@ -280,14 +281,9 @@ class UICache:
 
     def _hash_image(self, image: np.ndarray) -> str:
         """Generate a hash for the image to check if it has changed"""
-        try:
-
-            small_img = cv2.resize(image, (320, 180), interpolation=cv2.INTER_AREA)
-            return hashlib.md5(small_img.tobytes()).hexdigest()
-        except cv2.error as e:
-             logging.error(f"OpenCV error during image hashing: {e}. Returning random hash.")
-             return hashlib.md5(str(time.time()).encode()).hexdigest()
-        except Exception as e:
-             logging.error(f"Unexpected error during image hashing: {e}. Returning random hash.")
-             return hashlib.md5(str(time.time()).encode()).hexdigest()
+        img_hash = fast_frame_hash(image)
+        if img_hash is None:
+            logging.error("Image hashing failed. Returning random hash.")
+            return hashlib.md5(str(time.time()).encode()).hexdigest()
+        return img_hash
 
@@ -0,0 +1,295 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Optional, Any, List, Tuple
+
+from tools.call_metrics import call_metrics
+
+try:
+    from chromadb.api.types import EmbeddingFunction
+    from chromadb.utils.embedding_functions import DefaultEmbeddingFunction, register_embedding_function
+except ImportError:  # older/newer chromadb layouts; the wrapper only needs __call__(input)
+    EmbeddingFunction = object  # type: ignore
+    DefaultEmbeddingFunction = register_embedding_function = None  # type: ignore
+
+# Caching wrapper around the embedding function every Chroma collection shares (config.py).
+# Texts are keyed by (model id, hash of the text): an in-memory LRU first, then an optional
+# SQLite store on disk, and only the remaining texts reach the wrapped function. Concurrent
+# callers are batched: misses go to a shared queue that one caller drains with a single
+# wrapped call per EMBEDDING_MAX_BATCH texts (after waiting EMBEDDING_BATCH_WINDOW_SECONDS
+# for others to join), and a text already being embedded is awaited, not embedded twice.
+# Every requested text is recorded in call_metrics (kind "embedding", cache_hit for the
+# avoided ones), so the calls avoided show up per task. The disk store is capped at
+# EMBEDDING_DISK_CACHE_MAX_ENTRIES rows: when it grows past the cap, the least recently
+# used rows are deleted down to EMBEDDING_DISK_CACHE_EVICT_TO of it.
+EMBEDDING_CACHE_MAX_ENTRIES = 4096
+EMBEDDING_DISK_CACHE_MAX_ENTRIES = 100_000
+EMBEDDING_DISK_CACHE_EVICT_TO = 0.9
+EMBEDDING_BATCH_WINDOW_SECONDS = 0.002
+EMBEDDING_MAX_BATCH = 64
+
+_shared_instance: Optional["CachingEmbeddingFunction"] = None  # see share_with_chroma
+
+
+def text_key(model_id: str, text: str) -> str:
+    return hashlib.blake2b(f"{model_id}\x00{text}".encode("utf-8", "replace"), digest_size=16).hexdigest()
+
+
+class CachingEmbeddingFunction(EmbeddingFunction):  # type: ignore
+    def __init__(self, inner: Any, model_id: str, disk_path: Optional[str] = None, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+                 batch_window: float = EMBEDDING_BATCH_WINDOW_SECONDS, disk_max_entries: int = EMBEDDING_DISK_CACHE_MAX_ENTRIES):
+        self._inner = inner
+        self.model_id = model_id
+        self.disk_path = disk_path
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self.batch_window = batch_window
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[str, Any]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._queue: List[Tuple[str, str, Future]] = []
+        self._draining = False
+        self._as_numpy: Optional[bool] = None  # item type the wrapped function returns
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._disk_rows = 0  # upper bound on the disk store's row count (replacements are counted as inserts)
+        self.stats: Dict[str, Any] = {"texts": 0, "memory_hits": 0, "disk_hits": 0, "joined": 0, "computed": 0, "batches": 0, "embed_ms": 0.0,
+                                      "disk_evictions": 0}
+
+    # Chroma persists the embedding function's name and config with each collection, and on open
+    # embeds with the function it rebuilds from them (build_from_config on the class registered
+    # under that name) rather than the one passed in. The wrapper stands in for the
+    # DefaultEmbeddingFunction config.py wraps, so collections created with either open with the other.
+    @staticmethod
+    def name() -> str:
+        return "default"
+
+    @staticmethod
+    def build_from_config(config: Dict[str, Any]) -> Any:
+        if _shared_instance is not None:
+            return _shared_instance
+        if DefaultEmbeddingFunction is None:
+            raise ValueError("chromadb's DefaultEmbeddingFunction is not available")
+        return DefaultEmbeddingFunction.build_from_config(config)
+
+    def get_config(self) -> Dict[str, Any]:
+        return self._inner.get_config() if hasattr(self._inner, "get_config") else {}
+
+    def default_space(self) -> str:
+        return self._inner.default_space() if hasattr(self._inner, "default_space") else "l2"
+
+    def supported_spaces(self) -> List[str]:
+        return self._inner.supported_spaces() if hasattr(self._inner, "supported_spaces") else ["cosine", "l2", "ip"]
+
+    def embed_query(self, input: List[str]) -> List[Any]:
+        return self(input)
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if not self.disk_path:
+            return None
+        with self._db_lock:
+            if self._conn is None:
+                try:
+                    os.makedirs(os.path.dirname(self.disk_path) or ".", exist_ok=True)
+                    conn = sqlite3.connect(self.disk_path, check_same_thread=False, isolation_level=None)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("CREATE TABLE IF NOT EXISTS embeddings (model_id TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                                 "last_used REAL NOT NULL DEFAULT 0, PRIMARY KEY (model_id, text_hash))")
+                    if "last_used" not in {row[1] for row in conn.execute("PRAGMA table_info(embeddings)")}:
+                        conn.execute("ALTER TABLE embeddings ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+                    conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+                    self._disk_rows = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                    self._conn = conn
+                except Exception as e:
+                    logging.warning(f"[EmbeddingCache] Disk store unavailable, using memory only: {e}")
+                    self.disk_path = None
+                    return None
+            return self._conn
+
+    def _decode(self, blob: bytes) -> Any:
+        vector = array("f")
+        vector.frombytes(blob)
+        if self._as_numpy is not False:
+            try:
+                import numpy as np
+                return np.array(vector, dtype=np.float32)
+            except ImportError:
+                pass
+        return vector.tolist()
+
+    def _disk_get(self, keys: List[str]) -> Dict[str, Any]:
+        conn = self._db()
+        if conn is None or not keys:
+            return {}
+        try:
+            placeholders = ','.join('?' * len(keys))
+            with self._db_lock:
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model_id = ? AND text_hash IN ({placeholders})",
+                    (self.model_id, *keys),
+                ).fetchall()
+                if rows:
+                    conn.execute(f"UPDATE embeddings SET last_used = ? WHERE model_id = ? AND text_hash IN ({','.join('?' * len(rows))})",
+                                 (time.time(), self.model_id, *(key for key, _ in rows)))
+            return {key: self._decode(blob) for key, blob in rows}
+        except Exception as e:
+            logging.warning(f"[EmbeddingCache] Disk read failed: {e}")
+            return {}
+
+    def _disk_put(self, items: List[Tuple[str, Any]]) -> None:
+        conn = self._db()
+        if conn is None or not items:
+            return
+        try:
+            now = time.time()
+            rows = [(self.model_id, key, array("f", [float(x) for x in embedding]).tobytes(), now) for key, embedding in items]
+            with self._db_lock:
+                conn.executemany("INSERT OR REPLACE INTO embeddings (model_id, text_hash, vector, last_used) VALUES (?, ?, ?, ?)", rows)
+                self._disk_rows += len(rows)
+                if self._disk_rows > self.disk_max_entries:
+                    self._evict(conn)
+        except Exception as e:
+            logging.warning(f"[EmbeddingCache] Disk write failed: {e}")
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Delete the least recently used rows down to EMBEDDING_DISK_CACHE_EVICT_TO of the cap (caller holds self._db_lock)."""
+        self._disk_rows = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._disk_rows - int(self.disk_max_entries * EMBEDDING_DISK_CACHE_EVICT_TO)
+        if self._disk_rows <= self.disk_max_entries or excess <= 0:
+            return
+        conn.execute("DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+        self._disk_rows -= excess
+        with self._lock:
+            self.stats["disk_evictions"] += excess
+        logging.info(f"[EmbeddingCache] Evicted {excess} least recently used embeddings from the disk store.")
+
+    def _remember(self, key: str, embedding: Any) -> None:
+        """Add to the LRU (caller holds self._lock)."""
+        self._lru[key] = embedding
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def __call__(self, input: List[str]) -> List[Any]:
+        texts = list(input)
+        keys = [text_key(self.model_id, text) for text in texts]
+        found: Dict[str, Any] = {}
+        hit_kinds: Dict[str, str] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    found[key] = self._lru[key]
+                    hit_kinds[key] = "memory_hits"
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        for key, embedding in self._disk_get(missing).items():
+            found[key] = embedding
+            hit_kinds[key] = "disk_hits"
+        with self._lock:
+            for key, kind in hit_kinds.items():
+                if kind == "disk_hits":
+                    self._remember(key, found[key])
+        pending = [(key, text) for key, text in dict(zip(keys, texts)).items() if key not in found]
+        computed_s = 0.0
+        if pending:
+            start = time.perf_counter()
+            found.update(self._embed(pending, hit_kinds))
+            computed_s = (time.perf_counter() - start) / len(pending)
+        with self._lock:
+            self.stats["texts"] += len(texts)
+            for kind in hit_kinds.values():
+                self.stats[kind] += 1
+        for key in keys:
+            avoided = key in hit_kinds
+            call_metrics.record("embedding", "embedding", self.model_id, latency_s=0.0 if avoided else computed_s, cache_hit=avoided)
+        embeddings = [found[key] for key in keys]
+        if self._as_numpy is False:  # rows decoded before the wrapped function first answered are arrays
+            embeddings = [e.tolist() if hasattr(e, "tolist") else e for e in embeddings]
+        return embeddings
+
+    def _embed(self, pending: List[Tuple[str, str]], hit_kinds: Dict[str, str]) -> Dict[str, Any]:
+        """Embed `pending` (key, text) pairs through the shared batch queue."""
+        futures: Dict[str, Future] = {}
+        with self._lock:
+            for key, text in pending:
+                future = self._inflight.get(key)
+                if future is None:
+                    future = self._inflight[key] = Future()
+                    self._queue.append((key, text, future))
+                else:
+                    hit_kinds[key] = "joined"  # another caller is already embedding this text
+                futures[key] = future
+            lead = not self._draining
+            if lead:
+                self._draining = True
+        if lead:
+            if self.batch_window > 0:
+                time.sleep(self.batch_window)
+            self._drain()
+        return {key: future.result() for key, future in futures.items()}
+
+    def _drain(self) -> None:
+        while True:
+            with self._lock:
+                batch, self._queue = self._queue[:EMBEDDING_MAX_BATCH], self._queue[EMBEDDING_MAX_BATCH:]
+                if not batch:
+                    self._draining = False
+                    return
+            start = time.perf_counter()
+            try:
+                embeddings = list(self._inner([text for _, text, _ in batch]))
+                if len(embeddings) != len(batch):
+                    raise ValueError(f"embedding function returned {len(embeddings)} vectors for {len(batch)} texts")
+            except Exception as e:
+                with self._lock:
+                    for key, _, future in batch:
+                        self._inflight.pop(key, None)
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            with self._lock:
+                if self._as_numpy is None and embeddings:
+                    self._as_numpy = not isinstance(embeddings[0], list)
+                for (key, _, _), embedding in zip(batch, embeddings):
+                    self._remember(key, embedding)
+                    self._inflight.pop(key, None)
+                self.stats["computed"] += len(batch)
+                self.stats["batches"] += 1
+                self.stats["embed_ms"] = round(self.stats["embed_ms"] + (time.perf_counter() - start) * 1000, 2)
+            self._disk_put([(key, embedding) for (key, _, _), embedding in zip(batch, embeddings)])
+            for (_, _, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._lru)
+        avoided = stats["memory_hits"] + stats["disk_hits"] + stats["joined"]
+        stats["avoided"] = avoided
+        stats["saved_ms_est"] = round(avoided * stats["embed_ms"] / stats["computed"], 1) if stats["computed"] else 0.0
+        return stats
+
+
+def share_with_chroma(ef: Optional[CachingEmbeddingFunction]) -> None:
+    """Have Chroma embed collections persisted with the default function through `ef` (None: the plain default)."""
+    global _shared_instance
+    _shared_instance = ef
+    if register_embedding_function is not None:
+        register_embedding_function(CachingEmbeddingFunction)
+
+
+def task_embedding_stats(task_metrics: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Embedding texts requested and avoided (served from cache) for one task, from its call_metrics."""
+    requested, avoided, embed_s = 0, 0, 0.0
+    for entry in ((task_metrics or {}).get("calls") or {}).values():
+        if entry.get("kind") == "embedding":
+            requested += entry.get("calls", 0)
+            avoided += entry.get("cache_hits", 0)
+            embed_s += entry.get("latency_s", 0.0)
+    return {"requested": requested, "avoided": avoided, "computed": requested - avoided, "embed_s": round(embed_s, 3)}
@@ -0,0 +1,354 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Any, List, Tuple
+
+from config import CACHE_DIR
+from chromaDB_management.blob_store import BlobStore, blob_store
+
+# Append-only event log for task session persistence (SQLite in WAL mode).
+# record() compares the session state with what was already logged for that task and
+# queues only the difference: items appended to list fields, text appended to
+# execution_log, and the small value fields (status, stats, ...) that changed. The delta
+# is serialized on the caller's thread (cost grows with the delta, not the session) and
+# written in batches by a background thread. Every SESSION_SNAPSHOT_EVERY_EVENTS events
+# the writer folds a task's log into a snapshot and drops the events it covers; load()
+# replays from the last snapshot. Large strings inside list items (inline image_data,
+# oversized messages) are stored in the blob store and referenced from the events; load()
+# resolves them.
+SESSION_LOG_ENABLED = True
+SESSION_LOG_PATH = os.path.join(CACHE_DIR, "task_sessions.sqlite3")
+SESSION_LOG_FLUSH_SECONDS = 0.5
+SESSION_LOG_BATCH_SIZE = 256
+SESSION_SNAPSHOT_EVERY_EVENTS = 200
+
+LIST_FIELDS = ("conversation_history", "agent_thoughts", "youtube_references")
+TEXT_FIELDS = ("execution_log",)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_session_events_task ON session_events (task_id, id);
+"""
+
+
+class _Cursor:
+    """What has been logged for one task: list lengths/identity, text lengths, value JSON."""
+    __slots__ = ("lists", "texts", "values", "since_snapshot")
+
+    def __init__(self):
+        self.lists: Dict[str, Tuple[int, int]] = {}  # field -> (id of the list, items logged)
+        self.texts: Dict[str, int] = {}
+        self.values: Dict[str, str] = {}
+        self.since_snapshot = 0
+
+
+def apply_event(state: Dict[str, Any], kind: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Fold one logged event into a session state dict."""
+    if kind == "snapshot":
+        return payload
+    if kind == "append":
+        state.setdefault(payload["field"], []).extend(payload["items"])
+    elif kind == "text_append":
+        state[payload["field"]] = state.get(payload["field"], "") + payload["text"]
+    elif kind == "set":
+        state.update(payload)
+    return state
+
+
+class SessionEventLog:
+    def __init__(self, path: str = SESSION_LOG_PATH, enabled: bool = SESSION_LOG_ENABLED,
+                 flush_seconds: float = SESSION_LOG_FLUSH_SECONDS, snapshot_every: int = SESSION_SNAPSHOT_EVERY_EVENTS,
+                 blobs: BlobStore = blob_store):
+        self.path = path
+        self.blobs = blobs
+        self.enabled = enabled
+        self.flush_seconds = flush_seconds
+        self.snapshot_every = snapshot_every
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._cursors: Dict[str, _Cursor] = {}
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self.stats: Dict[str, Any] = {"records": 0, "events": 0, "bytes": 0, "batches": 0, "snapshots": 0, "record_ms": 0.0, "write_ms": 0.0}
+
+    def _connection(self) -> sqlite3.Connection:
+        with self._db_lock:
+            if self._conn is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.executescript(_SCHEMA)
+                self._conn = conn
+            return self._conn
+
+    def _ensure_writer(self) -> None:
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name="session_event_log", daemon=True)
+                self._writer.start()
+
+    def record(self, task_id: str, state: Dict[str, Any]) -> int:
+        """
+        Queue what changed in `state` (a TaskSession.persisted_state()) since the last
+        record/load of `task_id`. Returns the number of events queued.
+        """
+        start = time.perf_counter()
+        events: List[Tuple[str, str, str]] = []
+        with self._lock:
+            cursor = self._cursors.get(task_id)
+            if cursor is None:
+                cursor = self._cursors[task_id] = _Cursor()
+                snapshot = {**state, **{field: self.blobs.externalize(state.get(field) or []) for field in LIST_FIELDS}}
+                events.append((task_id, "snapshot", json.dumps(snapshot, default=str)))
+                self._sync_cursor(cursor, state)
+            else:
+                for field in LIST_FIELDS:
+                    items = state.get(field) or []
+                    list_id, logged = cursor.lists.get(field, (id(items), 0))
+                    if logged and (list_id != id(items) or len(items) < logged):  # replaced or truncated: log it whole
+                        events.append((task_id, "set", json.dumps({field: self.blobs.externalize(items)}, default=str)))
+                    elif len(items) > logged:
+                        events.append((task_id, "append", json.dumps({"field": field, "items": self.blobs.externalize(items[logged:])}, default=str)))
+                    cursor.lists[field] = (id(items), len(items))
+                for field in TEXT_FIELDS:
+                    text = state.get(field) or ""
+                    logged = cursor.texts.get(field, 0)
+                    if len(text) < logged:
+                        events.append((task_id, "set", json.dumps({field: text})))
+                    elif len(text) > logged:
+                        events.append((task_id, "text_append", json.dumps({"field": field, "text": text[logged:]})))
+                    cursor.texts[field] = len(text)
+                changed = {}
+                for field, value in state.items():
+                    if field in LIST_FIELDS or field in TEXT_FIELDS:
+                        continue
+                    encoded = json.dumps(value, sort_keys=True, default=str)
+                    if cursor.values.get(field) != encoded:
+                        changed[field] = value
+                        cursor.values[field] = encoded
+                if changed:
+                    events.append((task_id, "set", json.dumps(changed, default=str)))
+            cursor.since_snapshot += len(events)
+            compact = cursor.since_snapshot >= self.snapshot_every
+            if compact:
+                cursor.since_snapshot = 0
+            self.stats["records"] += 1
+            self.stats["events"] += len(events)
+            self.stats["bytes"] += sum(len(payload) for _, _, payload in events)
+            self.stats["record_ms"] = round(self.stats["record_ms"] + (time.perf_counter() - start) * 1000, 3)
+        if not self.enabled:
+            return 0
+        for event in events:
+            self._queue.put(("event", event))
+        if compact:
+            self._queue.put(("compact", task_id))
+        self._ensure_writer()
+        return len(events)
+
+    def _sync_cursor(self, cursor: _Cursor, state: Dict[str, Any]) -> None:
+        for field in LIST_FIELDS:
+            items = state.get(field) or []
+            cursor.lists[field] = (id(items), len(items))
+        for field in TEXT_FIELDS:
+            cursor.texts[field] = len(state.get(field) or "")
+        cursor.values = {field: json.dumps(value, sort_keys=True, default=str) for field, value in state.items() if field not in LIST_FIELDS and field not in TEXT_FIELDS}
+
+    def _write_loop(self) -> None:
+        """Collect events for up to flush_seconds (or a full batch, or a flush() call) and write them in one transaction."""
+        while True:
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_seconds
+            batch, compactions, waiters = [], [], []
+            while item is not None:
+                kind, value = item
+                if kind == "event":
+                    batch.append(value)
+                elif kind == "compact":
+                    compactions.append(value)
+                else:
+                    waiters.append(value)
+                if waiters or len(batch) >= SESSION_LOG_BATCH_SIZE:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    item = None
+            self._write(batch)
+            for task_id in dict.fromkeys(compactions):
+                self._compact(task_id)
+            for waiter in waiters:
+                waiter.set()
+
+    def _write(self, batch: List[Tuple[str, str, str]]) -> None:
+        if not batch:
+            return
+        start = time.perf_counter()
+        try:
+            conn = self._connection()
+            with self._db_lock:
+                conn.execute("BEGIN")
+                conn.executemany(
+                    "INSERT INTO session_events (task_id, kind, payload, created) VALUES (?, ?, ?, ?)",
+                    [(task_id, kind, payload, time.time()) for task_id, kind, payload in batch],
+                )
+                conn.execute("COMMIT")
+        except Exception as e:
+            logging.error(f"[SessionLog] Failed to write {len(batch)} session events: {e}", exc_info=True)
+            try:
+                with self._db_lock:
+                    conn.execute("ROLLBACK")
+            except Exception:
+                pass
+            return
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["write_ms"] = round(self.stats["write_ms"] + (time.perf_counter() - start) * 1000, 3)
+
+    def _read_state(self, task_id: str) -> Tuple[Optional[Dict[str, Any]], int]:
+        """(state folded from the last snapshot, id of the newest event) for a task."""
+        conn = self._connection()
+        with self._db_lock:
+            row = conn.execute(
+                "SELECT MAX(id) FROM session_events WHERE task_id = ? AND kind = 'snapshot'", (task_id,)
+            ).fetchone()
+            if not row or row[0] is None:
+                return None, 0
+            rows = conn.execute(
+                "SELECT id, kind, payload FROM session_events WHERE task_id = ? AND id >= ? ORDER BY id", (task_id, row[0])
+            ).fetchall()
+        state: Dict[str, Any] = {}
+        last_id = 0
+        for event_id, kind, payload in rows:
+            try:
+                state = apply_event(state, kind, json.loads(payload))
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                logging.warning(f"[SessionLog] Skipping unreadable event {event_id} for task {task_id}: {e}")
+            last_id = event_id
+        return state, last_id
+
+    def _compact(self, task_id: str) -> None:
+        """Write a snapshot of the folded log and delete the events it replaces."""
+        try:
+            state, last_id = self._read_state(task_id)
+            if state is None:
+                return
+            conn = self._connection()
+            with self._db_lock:
+                conn.execute("BEGIN")
+                conn.execute(
+                    "INSERT INTO session_events (task_id, kind, payload, created) VALUES (?, 'snapshot', ?, ?)",
+                    (task_id, json.dumps(state, default=str), time.time()),
+                )
+                conn.execute("DELETE FROM session_events WHERE task_id = ? AND id <= ?", (task_id, last_id))
+                conn.execute("COMMIT")
+            with self._lock:
+                self.stats["snapshots"] += 1
+        except Exception as e:
+            logging.error(f"[SessionLog] Snapshot of task {task_id} failed: {e}", exc_info=True)
+
+    def flush(self, timeout: Optional[float] = 10.0) -> bool:
+        """Wait until everything queued so far is written."""
+        if not self.enabled or self._writer is None:
+            return True
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        self._ensure_writer()
+        return done.wait(timeout)
+
+    def load(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """The task's state replayed from its last snapshot (blobs resolved), or None if it was never logged."""
+        if not self.enabled:
+            return None
+        self.flush()
+        try:
+            state, _ = self._read_state(task_id)
+        except Exception as e:
+            logging.error(f"[SessionLog] Failed to load task {task_id}: {e}", exc_info=True)
+            return None
+        if state is not None:
+            for field in LIST_FIELDS:
+                state[field] = self.blobs.resolve(state.get(field) or [])
+        return state
+
+    def track(self, task_id: str, state: Dict[str, Any]) -> None:
+        """Mark `state` (a live session's persisted_state()) as already logged, e.g. after load()."""
+        with self._lock:
+            cursor = self._cursors.setdefault(task_id, _Cursor())
+            self._sync_cursor(cursor, state)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+
+session_log = SessionEventLog()
+atexit.register(session_log.flush)
+
+
+def benchmark_session_saves(lengths: Tuple[int, ...] = (10, 100, 1000, 5000), saves: int = 20) -> List[Dict[str, Any]]:
+    """
+    Per-save cost on the caller's thread at several session lengths (conversation entries):
+    the full re-serialization _save_session_to_chromadb does for Chroma metadata vs
+    SessionEventLog.record() after one new thought, plus the log's background write time.
+    Chroma's own upsert (and re-embedding of the task name) comes on top of the former.
+    """
+    import tempfile
+    report = []
+    for length in lengths:
+        state: Dict[str, Any] = {
+            "task_id": "bench", "task_name": "benchmark task", "status": "active", "iteration_count": 0,
+            "total_tokens": {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0},
+            "conversation_history": [{"role": "system", "content": f"System Observation: step {i} " + "x" * 300} for i in range(length)],
+            "agent_thoughts": [{"timestamp": "2024-01-01T00:00:00+00:00", "content": f"thought {i} " + "y" * 200, "type": "thinking"} for i in range(length)],
+            "youtube_references": [],
+            "execution_log": "",
+        }
+        start = time.perf_counter()
+        for i in range(saves):
+            state["agent_thoughts"].append({"timestamp": "", "content": f"new thought {i}", "type": "thinking"})
+            metadata = {key: json.dumps(value) for key, value in state.items()}
+            len(metadata)
+        full_ms = (time.perf_counter() - start) * 1000 / saves
+        with tempfile.TemporaryDirectory() as tmp:
+            log = SessionEventLog(path=os.path.join(tmp, "sessions.sqlite3"), flush_seconds=0.05, blobs=BlobStore(os.path.join(tmp, "blobs")))
+            log.record("bench", state)
+            log.flush()
+            write_ms_before = log.stats["write_ms"]
+            start = time.perf_counter()
+            for i in range(saves):
+                state["agent_thoughts"].append({"timestamp": "", "content": f"new thought {i}", "type": "thinking"})
+                state["iteration_count"] += 1
+                log.record("bench", state)
+            record_ms = (time.perf_counter() - start) * 1000 / saves
+            log.flush()
+            write_ms = (log.stats["write_ms"] - write_ms_before) / saves
+            start = time.perf_counter()
+            loaded = log.load("bench")
+            load_ms = (time.perf_counter() - start) * 1000
+            assert loaded is not None and len(loaded["agent_thoughts"]) == len(state["agent_thoughts"])
+            if log._conn is not None:
+                log._conn.close()
+        report.append({"entries": length, "full_serialize_ms": round(full_ms, 3), "log_record_ms": round(record_ms, 3),
+                       "log_write_ms": round(write_ms, 3), "load_ms": round(load_ms, 2)})
+    return report
+
+
+if __name__ == "__main__":
+    print("entries | full re-serialize per save (ms) | event log record (ms) | background write (ms) | load (ms)")
+    for row in benchmark_session_saves():
+        print(f"{row['entries']:>7} | {row['full_serialize_ms']:>31} | {row['log_record_ms']:>21} | {row['log_write_ms']:>20} | {row['load_ms']}")
@@ -0,0 +1,253 @@
+import logging
+import time
+import threading
+from typing import Dict, Optional, Any, List, Tuple
+
+from config import chroma_client, task_executions_collection, user_task_structures_collection, reinforcements_collection, BLUE, GREEN, RESET
+
+# Context retrieval at task start. A new task used to look up similar past executions,
+# the user's saved task structures, reinforcements and resumable sessions with separate
+# calls, each counting its collection, embedding the instruction again and querying on
+# its own. retrieve_task_context() embeds the instruction once (through the shared
+# embedding function, config.default_ef) and queries every collection together on the
+# async core with query_embeddings; collections are no longer counted first (a query asking
+# for more results than a collection holds is retried with its count). The TaskContext it
+# returns is built by the Flask route when a message starts a new task, handed to the task
+# session and consumed by the executor at start; the executor retrieves one itself when
+# none is waiting (resumed or re-opened tasks).
+# With TASK_CONTEXT_SINGLE_PASS = False every collection is counted and embeds the text
+# itself, one query after another: the former cost, for comparisons.
+TASK_CONTEXT_SINGLE_PASS = True
+SIMILAR_EXECUTIONS_N = 1
+USER_TASK_STRUCTURES_N = 1
+REINFORCEMENTS_N = 5
+SIMILAR_SESSIONS_N = 3
+USER_TASK_STRUCTURE_MAX_DISTANCE = 0.6
+SIMILAR_SESSION_MAX_DISTANCE = 0.70
+
+
+class TaskContext:
+    """What the collections hold about one instruction, retrieved at task start."""
+
+    def __init__(self, instruction: str, executions: Optional[List[Dict[str, Any]]] = None, user_task_structure: Optional[Dict[str, Any]] = None,
+                 reinforcements: Optional[List[str]] = None, similar_sessions: Optional[List[Dict[str, Any]]] = None,
+                 timings: Optional[Dict[str, float]] = None, embeddings: int = 0):
+        self.instruction = instruction
+        self.executions: List[Dict[str, Any]] = executions or []  # {"document", "metadata", "distance"}, nearest first
+        self.user_task_structure = user_task_structure  # {"id", "task_name", "plan_text", "timestamp", "distance"} under the threshold
+        self.reinforcements = reinforcements  # None when not retrieved
+        self.similar_sessions: List[Dict[str, Any]] = similar_sessions or []  # resumable (not completed/failed), nearest first
+        self.timings: Dict[str, float] = timings or {}  # embed_ms, per collection ms, total_ms
+        self.embeddings = embeddings  # instruction embeddings computed for this context
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "instruction": self.instruction,
+            "executions": self.executions,
+            "user_task_structure": self.user_task_structure,
+            "reinforcements": self.reinforcements,
+            "similar_sessions": self.similar_sessions,
+            "timings": self.timings,
+            "embeddings": self.embeddings,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TaskContext":
+        return cls(data.get("instruction", ""), data.get("executions"), data.get("user_task_structure"), data.get("reinforcements"),
+                   data.get("similar_sessions"), data.get("timings"), data.get("embeddings", 0))
+
+
+def _first(results: Optional[Dict[str, Any]], key: str) -> List[Any]:
+    values = (results or {}).get(key)
+    return list(values[0]) if values and values[0] is not None else []
+
+
+def executions_from_results(results: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    documents, metadatas, distances = _first(results, "documents"), _first(results, "metadatas"), _first(results, "distances")
+    return [{"document": doc, "metadata": meta or {}, "distance": distances[i] if i < len(distances) else 1.0}
+            for i, (doc, meta) in enumerate(zip(documents, metadatas))]
+
+
+def user_task_structure_from_results(results: Optional[Dict[str, Any]], max_distance: float = USER_TASK_STRUCTURE_MAX_DISTANCE) -> Optional[Dict[str, Any]]:
+    ids, metadatas, distances = _first(results, "ids"), _first(results, "metadatas"), _first(results, "distances")
+    if not ids or not distances or distances[0] >= max_distance:
+        return None
+    metadata = metadatas[0] or {}
+    return {"id": ids[0], "task_name": metadata.get("task_name", "Unnamed Task"), "plan_text": metadata.get("plan_text", ""),
+            "timestamp": metadata.get("timestamp", "N/A"), "distance": distances[0]}
+
+
+def similar_sessions_from_results(results: Optional[Dict[str, Any]], n_results: int = SIMILAR_SESSIONS_N,
+                                  max_distance: float = SIMILAR_SESSION_MAX_DISTANCE) -> List[Dict[str, Any]]:
+    """Resumable sessions (not completed or failed) closer than max_distance, nearest first."""
+    sessions = []
+    for task_id, metadata, distance in zip(_first(results, "ids"), _first(results, "metadatas"), _first(results, "distances")):
+        metadata = metadata or {}
+        if distance < max_distance and metadata.get("status") not in ["completed", "failed"]:
+            sessions.append({
+                "task_id": task_id,
+                "task_name": metadata.get("task_name", "Unnamed Task"),
+                "status": metadata.get("status", "unknown"),
+                "start_time": metadata.get("start_time", ""),
+                "distance": distance,
+            })
+    sessions.sort(key=lambda x: (x["distance"], x.get("start_time", "")))
+    return sessions[:n_results]
+
+
+# name -> (n_results, include) of each collection searched at task start.
+CONTEXT_SOURCES: Dict[str, Tuple[int, List[str]]] = {
+    "executions": (SIMILAR_EXECUTIONS_N, ["documents", "metadatas", "distances"]),
+    "user_task_structures": (USER_TASK_STRUCTURES_N, ["metadatas", "distances"]),
+    "reinforcements": (REINFORCEMENTS_N, ["documents"]),
+    "sessions": (SIMILAR_SESSIONS_N * 2, ["metadatas", "distances"]),  # extra to filter by status
+}
+
+
+class TaskContextRetriever:
+    def __init__(self, single_pass: bool = TASK_CONTEXT_SINGLE_PASS, collections: Optional[Dict[str, Any]] = None, embedding_function: Any = None):
+        self.single_pass = single_pass
+        self._collections = collections  # name -> collection; None: config's collections and the registered sessions one
+        self._embedding_function = embedding_function  # None: config.default_ef
+        self._sessions_collection: Any = None
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Any] = {"contexts": 0, "embeddings": 0, "queries": 0, "embed_ms": 0.0, "query_ms": 0.0, "total_ms": 0.0}
+
+    def set_sessions_collection(self, collection: Any) -> None:
+        """The task session collection (created by the Flask app), searched for resumable sessions."""
+        self._sessions_collection = collection
+
+    def _sources(self) -> Dict[str, Tuple[Any, int, List[str]]]:
+        """name -> (collection, n_results, include) for every collection available."""
+        collections = self._collections if self._collections is not None else {
+            "executions": task_executions_collection if chroma_client else None,
+            "user_task_structures": user_task_structures_collection if chroma_client else None,
+            "reinforcements": reinforcements_collection if chroma_client else None,
+            "sessions": self._sessions_collection,
+        }
+        return {name: (collection, *CONTEXT_SOURCES[name]) for name, collection in collections.items() if collection is not None}
+
+    def _embed(self, instruction: str) -> Optional[Any]:
+        try:
+            embedding_function = self._embedding_function
+            if embedding_function is None:
+                from config import default_ef as embedding_function
+            return embedding_function([instruction])[0]
+        except Exception as e:
+            logging.warning(f"[TaskContext] Could not embed the instruction, letting each collection embed it: {e}")
+            return None
+
+    def _query(self, collection: Any, n_results: int, include: List[str], instruction: str, embedding: Optional[Any]) -> Optional[Dict[str, Any]]:
+        query = {"query_embeddings": [embedding]} if embedding is not None else {"query_texts": [instruction]}
+        if not self.single_pass:
+            count = collection.count()
+            return collection.query(n_results=min(n_results, count), include=include, **query) if count else None
+        try:
+            return collection.query(n_results=n_results, include=include, **query)
+        except Exception as first_error:
+            # Some Chroma versions reject n_results above the collection size.
+            count = collection.count()
+            if count == 0:
+                return None
+            if count >= n_results:
+                raise first_error
+            return collection.query(n_results=count, include=include, **query)
+
+    def _timed_query(self, name: str, source: Tuple[Any, int, List[str]], instruction: str, embedding: Optional[Any]) -> Tuple[Optional[Dict[str, Any]], float]:
+        collection, n_results, include = source
+        start = time.perf_counter()
+        try:
+            results = self._query(collection, n_results, include, instruction, embedding)
+        except Exception as e:
+            logging.error(f"[TaskContext] Query of '{name}' failed for '{instruction[:70]}...': {e}", exc_info=True)
+            results = None
+        return results, (time.perf_counter() - start) * 1000
+
+    def retrieve(self, instruction: str) -> TaskContext:
+        sources = self._sources()
+        if not instruction or not sources:
+            return TaskContext(instruction)
+        start = time.perf_counter()
+        embedding, embed_ms = None, 0.0
+        if self.single_pass:
+            embedding = self._embed(instruction)
+            embed_ms = (time.perf_counter() - start) * 1000
+        if self.single_pass and len(sources) > 1:
+            from task_exec.async_core import async_core
+            outcomes = async_core.run_phases({
+                f"context_{name}": (lambda name=name, source=source: self._timed_query(name, source, instruction, embedding))
+                for name, source in sources.items()
+            })
+            outcomes = {name: outcomes[f"context_{name}"] for name in sources}
+        else:
+            outcomes = {name: self._timed_query(name, source, instruction, embedding) for name, source in sources.items()}
+        total_ms = (time.perf_counter() - start) * 1000
+        timings = {"embed_ms": round(embed_ms, 2), **{f"{name}_ms": round(ms, 2) for name, (_, ms) in outcomes.items()}, "total_ms": round(total_ms, 2)}
+        results = {name: value for name, (value, _) in outcomes.items()}
+        context = TaskContext(
+            instruction,
+            executions=executions_from_results(results.get("executions")),
+            user_task_structure=user_task_structure_from_results(results.get("user_task_structures")),
+            reinforcements=_first(results.get("reinforcements"), "documents") if "reinforcements" in sources else None,
+            similar_sessions=similar_sessions_from_results(results.get("sessions")),
+            timings=timings,
+            embeddings=1 if embedding is not None else len(sources),
+        )
+        with self._lock:
+            self.stats["contexts"] += 1
+            self.stats["embeddings"] += context.embeddings
+            self.stats["queries"] += len(sources)
+            self.stats["embed_ms"] = round(self.stats["embed_ms"] + embed_ms, 2)
+            self.stats["query_ms"] = round(self.stats["query_ms"] + sum(ms for _, ms in outcomes.values()), 2)
+            self.stats["total_ms"] = round(self.stats["total_ms"] + total_ms, 2)
+        print(f"{BLUE}[ChromaDB] Task context for '{instruction[:50]}...': {GREEN}{len(context.executions)}{BLUE} execution(s), "
+              f"{GREEN}{len(context.reinforcements or [])}{BLUE} reinforcement(s), {GREEN}{len(context.similar_sessions)}{BLUE} resumable session(s) "
+              f"in {total_ms:.0f} ms.{RESET}")
+        return context
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["single_pass"] = self.single_pass
+        stats["avg_ms"] = round(stats["total_ms"] / stats["contexts"], 2) if stats["contexts"] else 0.0
+        return stats
+
+
+task_context_retriever = TaskContextRetriever()
+
+
+def retrieve_task_context(instruction: str) -> TaskContext:
+    """Similar executions, saved task structure, reinforcements and resumable sessions for `instruction`."""
+    return task_context_retriever.retrieve(instruction)
+
+
+def benchmark_task_context(records: int = 500, runs: int = 20) -> Dict[str, Any]:
+    """
+    Task-start retrieval on in-memory collections of `records` items each: one context
+    per distinct instruction, the former per-collection path (count, embed, query, in turn)
+    vs the single pass. Needs chromadb and its default embedding model.
+    """
+    import chromadb
+    from chromadb.utils import embedding_functions
+    ef = embedding_functions.DefaultEmbeddingFunction()
+    client = chromadb.EphemeralClient()
+    collections = {}
+    for name in ("executions", "user_task_structures", "reinforcements", "sessions"):
+        collection = client.get_or_create_collection(f"bench_{name}", embedding_function=ef, metadata={"hnsw:space": "cosine"})
+        collection.add(ids=[f"{name}-{i}" for i in range(records)],
+                       documents=[f"{('open', 'write', 'search', 'close')[i % 4]} {name} item {i} in app {i % 17}" for i in range(records)],
+                       metadatas=[{"task_name": f"task {i}", "status": ("success", "paused", "active", "failed")[i % 4]} for i in range(records)])
+        collections[name] = collection
+    report = {"records": records, "runs": runs}
+    for label, single_pass in (("before_ms", False), ("after_ms", True)):
+        retriever = TaskContextRetriever(single_pass=single_pass, collections=collections, embedding_function=ef)
+        start = time.perf_counter()
+        for run in range(runs):
+            retriever.retrieve(f"{label} open the report number {run} and email it")
+        report[label] = round((time.perf_counter() - start) * 1000 / runs, 2)
+        report[label.replace("_ms", "_embeddings")] = retriever.stats["embeddings"] // runs
+    return report
+
+
+if __name__ == "__main__":
+    print(benchmark_task_context())
@@ -0,0 +1,180 @@
+import bisect
+import logging
+import threading
+import time
+from typing import Dict, Optional, Any, Callable, List, Tuple, Iterable, Union
+
+# In-memory index of task session summaries (task_id, task_name, start_time, end_time,
+# status) ordered by start time. It is filled once from the Chroma session records and
+# then kept current by AgentState on every save (create, pause, resume, complete, fail),
+# so listing sessions no longer reads the whole collection. page() returns the newest
+# first, with optional status / start-time range / name-prefix filters; an unfiltered page
+# costs O(log n + page size).
+TASK_HISTORY_PAGE_SIZE = 50
+
+SUMMARY_FIELDS = ("task_id", "task_name", "start_time", "end_time", "status")
+
+
+def _summary(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "task_id": metadata.get("task_id", "N/A"),
+        "task_name": metadata.get("task_name", "Unnamed Task"),
+        "start_time": metadata.get("start_time", "") or "",
+        "end_time": metadata.get("end_time", None) or None,
+        "status": metadata.get("status", "unknown"),
+    }
+
+
+class TaskHistoryIndex:
+    def __init__(self, loader: Optional[Callable[[], Iterable[Dict[str, Any]]]] = None):
+        self._loader = loader
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        self._order: List[Tuple[str, str]] = []  # (start_time, task_id), ascending
+
+    def set_loader(self, loader: Callable[[], Iterable[Dict[str, Any]]]) -> None:
+        """Source of the initial summaries (session record metadatas), read on first use."""
+        with self._lock:
+            self._loader = loader
+            self._loaded = False
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded or self._loader is None:
+                return
+            start = time.perf_counter()
+            try:
+                records = list(self._loader())
+            except Exception as e:
+                # Stay unloaded so the next call retries instead of serving an empty history.
+                logging.error(f"[TaskHistoryIndex] Could not load task session summaries: {e}", exc_info=True)
+                return
+            for metadata in records:
+                if metadata:
+                    summary = _summary(metadata)
+                    # Entries upserted before the load are newer than the stored records.
+                    self._by_id.setdefault(summary["task_id"], summary)
+            self._order = sorted((summary["start_time"], task_id) for task_id, summary in self._by_id.items())
+            self._loaded = True
+            logging.info(f"[TaskHistoryIndex] Indexed {len(self._by_id)} task sessions in {(time.perf_counter() - start) * 1000:.1f} ms.")
+
+    def _put(self, summary: Dict[str, Any]) -> None:
+        old = self._by_id.get(summary["task_id"])
+        if old is not None and old["start_time"] != summary["start_time"]:
+            position = bisect.bisect_left(self._order, (old["start_time"], old["task_id"]))
+            if position < len(self._order) and self._order[position] == (old["start_time"], old["task_id"]):
+                del self._order[position]
+            old = None
+        if old is None:
+            bisect.insort(self._order, (summary["start_time"], summary["task_id"]))
+        self._by_id[summary["task_id"]] = summary
+
+    def upsert(self, metadata: Dict[str, Any]) -> None:
+        """Add or update one session's summary (any dict with the SUMMARY_FIELDS)."""
+        self._ensure_loaded()
+        with self._lock:
+            self._put(_summary(metadata))
+
+    def remove(self, task_id: str) -> None:
+        self._ensure_loaded()
+        with self._lock:
+            old = self._by_id.pop(task_id, None)
+            if old is not None:
+                position = bisect.bisect_left(self._order, (old["start_time"], task_id))
+                if position < len(self._order) and self._order[position] == (old["start_time"], task_id):
+                    del self._order[position]
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        self._ensure_loaded()
+        with self._lock:
+            summary = self._by_id.get(task_id)
+            return dict(summary) if summary else None
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._by_id)
+
+    def page(self, offset: int = 0, limit: Optional[int] = TASK_HISTORY_PAGE_SIZE, status: Union[str, Iterable[str], None] = None,
+             since: Optional[str] = None, until: Optional[str] = None, name_prefix: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Summaries newest first. `status` is one status or several; `since`/`until` bound
+        start_time (ISO strings, inclusive); `name_prefix` matches task names case-insensitively.
+        Returns {"items", "total", "offset", "limit"}; limit None returns every match.
+        """
+        self._ensure_loaded()
+        statuses = {status} if isinstance(status, str) else set(status) if status else None
+        prefix = name_prefix.lower() if name_prefix else None
+        offset = max(0, offset)
+        with self._lock:
+            low = bisect.bisect_left(self._order, (since, "")) if since else 0
+            high = bisect.bisect_right(self._order, (until + "\uffff", "")) if until else len(self._order)
+            if statuses is None and prefix is None:
+                total = max(0, high - low)
+                end = high - offset
+                begin = max(low, end - limit) if limit is not None else low
+                items = [dict(self._by_id[task_id]) for _, task_id in reversed(self._order[begin:max(begin, end)])]
+            else:
+                items, total = [], 0
+                for position in range(high - 1, low - 1, -1):
+                    summary = self._by_id[self._order[position][1]]
+                    if statuses is not None and summary["status"] not in statuses:
+                        continue
+                    if prefix is not None and not summary["task_name"].lower().startswith(prefix):
+                        continue
+                    if total >= offset and (limit is None or len(items) < limit):
+                        items.append(dict(summary))
+                    total += 1
+        return {"items": items, "total": total, "offset": offset, "limit": limit}
+
+
+task_history_index = TaskHistoryIndex()
+
+
+def benchmark_task_history(sizes: Tuple[int, ...] = (10, 1000, 50000), polls: int = 50) -> List[Dict[str, Any]]:
+    """
+    Latency of one task-list poll at several session counts: the former full read and sort
+    of every session's metadata (simulated in memory, without Chroma's own read cost) vs
+    the index's first page, a filtered page and an update.
+    """
+    from datetime import datetime, timedelta, timezone
+    report = []
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for size in sizes:
+        metadatas = [{
+            "task_id": f"task-{i}", "task_name": f"{'open' if i % 3 else 'write'} report {i}",
+            "start_time": (base + timedelta(minutes=i)).isoformat(), "end_time": "",
+            "status": ("completed", "paused", "failed", "active")[i % 4],
+        } for i in range(size)]
+        start = time.perf_counter()
+        for _ in range(polls):
+            history = [_summary(m) for m in metadatas]
+            history.sort(key=lambda x: x.get("start_time", ""), reverse=True)
+        full_ms = (time.perf_counter() - start) * 1000 / polls
+        index = TaskHistoryIndex(loader=lambda: metadatas)
+        start = time.perf_counter()
+        len(index)
+        load_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        for _ in range(polls):
+            index.page(limit=TASK_HISTORY_PAGE_SIZE)
+        page_ms = (time.perf_counter() - start) * 1000 / polls
+        start = time.perf_counter()
+        for _ in range(polls):
+            index.page(limit=TASK_HISTORY_PAGE_SIZE, status="paused", name_prefix="write")
+        filtered_ms = (time.perf_counter() - start) * 1000 / polls
+        start = time.perf_counter()
+        for i in range(polls):
+            index.upsert({**metadatas[i % size], "status": "completed"})
+        upsert_ms = (time.perf_counter() - start) * 1000 / polls
+        report.append({"sessions": size, "full_list_ms": round(full_ms, 3), "index_load_ms": round(load_ms, 2), "page_ms": round(page_ms, 4),
+                       "filtered_page_ms": round(filtered_ms, 3), "upsert_ms": round(upsert_ms, 4)})
+    return report
+
+
+if __name__ == "__main__":
+    print("sessions | full read+sort per poll (ms) | index load once (ms) | first page (ms) | filtered page (ms) | update (ms)")
+    for row in benchmark_task_history():
+        print(f"{row['sessions']:>8} | {row['full_list_ms']:>28} | {row['index_load_ms']:>20} | {row['page_ms']:>15} | {row['filtered_page_ms']:>18} | {row['upsert_ms']}")
@@ -42,6 +42,8 @@ DEBUG_DIR = os.path.join(CACHE_DIR, "debug")
 LOG_FILE = os.path.join(DEBUG_DIR, "agent_log.txt")
 CHROMA_DATA_PATH = os.path.join(CACHE_DIR, "chroma_db_store")
 SHORTCUT_CACHE_FILE = os.path.join(CACHE_DIR, "shortcuts_cache.json")
+EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite3") # On-disk embedding cache, see chromaDB_management/embedding_cache.py
+EMBEDDING_MODEL_ID = "chroma-default/all-MiniLM-L6-v2" # Part of the embedding cache key; change it with the embedding function
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 SHORTCUT_DEBUG_DIR = r"\debug"
 
@@ -160,17 +162,36 @@ logging.basicConfig(level=logging.DEBUG,
                         logging.StreamHandler(sys.stdout) 
                     ])
 
+# Embedding function shared by every collection. It is built here, outside the ChromaDB
+# initialization below (whose recovery path deletes CHROMA_DATA_PATH), so a problem with
+# the caching wrapper only falls back to the plain function and never resets the store.
+try:
+    base_ef = embedding_functions.DefaultEmbeddingFunction()
+except Exception as e:
+    logging.error(f"Failed to create the default embedding function: {e}", exc_info=True)
+    base_ef = None
+default_ef = base_ef
+if base_ef is not None:
+    try:
+        from chromaDB_management.embedding_cache import CachingEmbeddingFunction, share_with_chroma
+        default_ef = CachingEmbeddingFunction(base_ef, EMBEDDING_MODEL_ID, disk_path=EMBEDDING_CACHE_PATH)
+        share_with_chroma(default_ef)
+    except Exception as e:
+        logging.warning(f"Embedding cache unavailable, using the uncached embedding function: {e}")
+
 # Initialize ChromaDB
 try:
+    if default_ef is None:
+        raise RuntimeError("No embedding function available")
     # First, ensure the directory exists
     os.makedirs(CHROMA_DATA_PATH, exist_ok=True)
     
     # Try to initialize the client
     chroma_client = chromadb.PersistentClient(path=CHROMA_DATA_PATH)
-    default_ef = embedding_functions.DefaultEmbeddingFunction()
 
     # Function to safely get or create a collection
     def get_or_create_collection(name):
+        global default_ef
         try:
             return chroma_client.get_or_create_collection(
                 name=name,
@@ -179,6 +200,19 @@ try:
             )
         except Exception as e:
             logging.error(f"Error getting/creating collection '{name}': {e}")
+            if default_ef is not base_ef:
+                # Retry with the plain embedding function before recreating (and emptying) the collection
+                try:
+                    collection = chroma_client.get_or_create_collection(
+                        name=name,
+                        embedding_function=base_ef,
+                        metadata={"hnsw:space": "cosine"}
+                    )
+                    logging.warning(f"Collection '{name}' rejected the caching embedding function; using the uncached one.")
+                    default_ef = base_ef
+                    return collection
+                except Exception as plain_e:
+                    logging.error(f"Error getting/creating collection '{name}' with the uncached embedding function: {plain_e}")
             # If there's an error, try to delete and recreate the collection
             try:
                 chroma_client.delete_collection(name)
@@ -197,6 +231,7 @@ try:
         reinforcements_collection = get_or_create_collection("reinforcements")
         user_task_structures_collection = get_or_create_collection("user_task_structures")
         app_shortcuts_collection = get_or_create_collection("app_shortcuts") # New collection for shortcuts
+        shortcut_records_collection = get_or_create_collection("shortcut_records") # One record per parsed shortcut, see tools/shortcut_index.py
         
         # Verify collections are working
         task_executions_collection.count()
@@ -226,6 +261,7 @@ try:
             reinforcements_collection = get_or_create_collection("reinforcements")
             user_task_structures_collection = get_or_create_collection("user_task_structures")
             app_shortcuts_collection = get_or_create_collection("app_shortcuts") # New collection for shortcuts
+            shortcut_records_collection = get_or_create_collection("shortcut_records")
             
             logging.info("ChromaDB reset successful")
             print(f"{GREEN}[OK] ChromaDB reset and reinitialized successfully.{RESET}")
@@ -240,4 +276,5 @@ except Exception as e:
     task_executions_collection = None
     reinforcements_collection = None
     user_task_structures_collection = None
-    app_shortcuts_collection = None
\ No newline at end of file
+    app_shortcuts_collection = None
+    shortcut_records_collection = None
\ No newline at end of file
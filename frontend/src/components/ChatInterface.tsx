@@ -943,6 +943,9 @@ const ChatInterface: React.FC<ChatInterfaceProps> = ({ activeTab, onTabChange })
               {isTyping && (
                 <div className="flex justify-start">
                   <div className="bg-gray-800 rounded-xl px-4 py-3">
+                    {uiState.streamingReply && (
+                      <p className="mb-2 text-sm text-gray-200 whitespace-pre-wrap">{uiState.streamingReply}</p>
+                    )}
                     <button
                       onClick={() => setShowProcessingDetails(!showProcessingDetails)}
                       className="text-sm text-gray-400 hover:text-gray-300 transition-colors duration-200 flex items-center"
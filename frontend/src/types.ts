@@ -52,6 +52,7 @@ export interface UIState {
   isThinking: boolean;
   showThoughts: boolean;
   latestReasoning: string | null;
+  streamingReply?: string;
   agentThoughts: Array<{
     timestamp: string;
     content: string;
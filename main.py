@@ -9,6 +9,7 @@ import google.generativeai as genai
 from typing import List, Dict, Optional, Tuple
 import json
 from tools.token_usage_tool import _get_token_usage
+from tools.llm_gateway import llm_gateway
 import logging 
 import os, sys
 import logging 
@@ -230,8 +231,7 @@ def request_replan_from_failure(
     token_usage = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
     try:
         safety_settings = {}
-        response = llm_model.generate_content(content, safety_settings=safety_settings)
-        token_usage = _get_token_usage(response)
+        response, token_usage, _ = llm_gateway.generate("planner", content, model=llm_model, safety_settings=safety_settings)
         raw_response_text = ""
         if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
             raw_response_text = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text')).strip()
@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Any, Callable, Generator, Tuple
+
+# Asyncio core for the executor's I/O phases. iterative_task_executor stays a generator
+# (its ask_user / inform_user / paused yields and send() replies are the protocol the
+# Flask app and the replay harness drive), and hands each iteration's independent I/O to
+# this core: the active window and shortcut lookup, the planning frame capture with its
+# hash and PNG encoding, and the reinforcement retrieval. Each phase is a blocking call
+# (win32/psutil, PIL, Chroma, shortcut LLM lookups) run on a worker thread; the asyncio loop
+# awaits them together so an iteration costs the slowest phase instead of their sum.
+# With ASYNC_CORE_ENABLED = False the same phases run one after another on the caller's
+# thread, which is the baseline for latency comparisons.
+ASYNC_CORE_ENABLED = True
+ASYNC_CORE_IO_WORKERS = 8
+ASYNC_PHASE_TIMEOUT_SECONDS = 120.0
+
+
+class AsyncExecutorCore:
+    """An asyncio loop on a daemon thread plus a worker pool for blocking libraries."""
+
+    def __init__(self, enabled: bool = ASYNC_CORE_ENABLED, io_workers: int = ASYNC_CORE_IO_WORKERS):
+        self.enabled = enabled
+        self.io_workers = io_workers
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Any] = {"runs": 0, "wall_s": 0.0, "phase_s": 0.0, "phases": {}}
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="executor_io")
+                self._loop = asyncio.new_event_loop()
+                self._loop.set_default_executor(self._pool)
+                self._thread = threading.Thread(target=self._loop.run_forever, name="executor_async_core", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def run(self, coro, timeout: Optional[float] = ASYNC_PHASE_TIMEOUT_SECONDS) -> Any:
+        """Run a coroutine on the core's loop and wait for its result (called from the executor thread)."""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()).result(timeout=timeout)
+
+    async def blocking(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Await a blocking call on the worker pool."""
+        return await asyncio.get_running_loop().run_in_executor(self._pool, lambda: fn(*args, **kwargs))
+
+    async def _timed(self, fn: Callable[[], Any]) -> Tuple[Any, float]:
+        start = time.perf_counter()
+        try:
+            return await self.blocking(fn), time.perf_counter() - start
+        except Exception as e:
+            return e, time.perf_counter() - start
+
+    async def _gather(self, phases: Dict[str, Callable[[], Any]]) -> Dict[str, Tuple[Any, float]]:
+        outcomes = await asyncio.gather(*(self._timed(fn) for fn in phases.values()))
+        return dict(zip(phases.keys(), outcomes))
+
+    def run_phases_settled(self, phases: Dict[str, Optional[Callable[[], Any]]]) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+        """
+        Run independent blocking phases (name -> callable, None to skip) and return
+        (results, errors) by name: a phase that raised is in `errors` and the others
+        keep their results.
+        """
+        phases = {name: fn for name, fn in phases.items() if fn is not None}
+        start = time.perf_counter()
+        if self.enabled and len(phases) > 1:
+            outcomes = self.run(self._gather(phases))
+        else:
+            outcomes = {}
+            for name, fn in phases.items():
+                phase_start = time.perf_counter()
+                try:
+                    outcomes[name] = (fn(), time.perf_counter() - phase_start)
+                except Exception as e:
+                    outcomes[name] = (e, time.perf_counter() - phase_start)
+        self._record(outcomes, time.perf_counter() - start)
+        results, errors = {}, {}
+        for name, (value, _) in outcomes.items():
+            if isinstance(value, Exception):
+                errors[name] = value
+            else:
+                results[name] = value
+        return results, errors
+
+    def run_phases(self, phases: Dict[str, Optional[Callable[[], Any]]]) -> Dict[str, Any]:
+        """
+        Like run_phases_settled(), but returns only the results: the first phase that
+        raised has its exception re-raised here, after all phases have finished.
+        """
+        results, errors = self.run_phases_settled(phases)
+        for error in errors.values():
+            raise error
+        return results
+
+    def _record(self, outcomes: Dict[str, Tuple[Any, float]], wall_s: float) -> None:
+        with self._lock:
+            self.stats["runs"] += 1
+            self.stats["wall_s"] = round(self.stats["wall_s"] + wall_s, 4)
+            for name, (_, seconds) in outcomes.items():
+                phase = self.stats["phases"].setdefault(name, {"calls": 0, "seconds": 0.0})
+                phase["calls"] += 1
+                phase["seconds"] = round(phase["seconds"] + seconds, 4)
+                self.stats["phase_s"] = round(self.stats["phase_s"] + seconds, 4)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Phase time vs wall time; overlap_saved_s is the time concurrency took off the iterations."""
+        with self._lock:
+            stats = {**self.stats, "phases": {name: dict(phase) for name, phase in self.stats["phases"].items()}}
+        stats["enabled"] = self.enabled
+        stats["overlap_saved_s"] = round(max(0.0, stats["phase_s"] - stats["wall_s"]), 4)
+        return stats
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = {"runs": 0, "wall_s": 0.0, "phase_s": 0.0, "phases": {}}
+
+    def shutdown(self) -> None:
+        with self._lock:
+            loop, pool, self._loop = self._loop, self._pool, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+
+async_core = AsyncExecutorCore()
+
+
+class AsyncGeneratorAdapter:
+    """
+    The executor generator's protocol for asyncio callers: `await adapter.asend(reply)`
+    advances it on the worker pool without blocking the caller's loop, and raises
+    StopAsyncIteration with the generator's return value kept in `result`.
+    """
+
+    def __init__(self, generator: Generator[Dict[str, Any], Optional[str], Any]):
+        self.generator = generator
+        self.result: Any = None
+        self._started = False
+
+    def __aiter__(self) -> "AsyncGeneratorAdapter":
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        return await self.asend(None)
+
+    async def asend(self, value: Optional[str]) -> Dict[str, Any]:
+        def _step():
+            # StopIteration cannot be set on a future, so the return value is captured here
+            try:
+                if not self._started:
+                    self._started = True
+                    return True, next(self.generator)
+                return True, self.generator.send(value)
+            except StopIteration as e:
+                self.result = e.value
+                return False, None
+        running, event = await asyncio.get_running_loop().run_in_executor(None, _step)
+        if not running:
+            raise StopAsyncIteration
+        return event
+
+    async def aclose(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.generator.close)
@@ -0,0 +1,74 @@
+import logging
+from typing import Dict, Optional, Tuple, Any
+
+from tools.llm_gateway import llm_gateway
+
+# Which check a proposed action gets before it is executed:
+#   "skip"        - no critique (read-only or purely conversational actions)
+#   "self"        - the planner's own self_critique from the same response (see PLANNER_STATIC_PREFIX)
+#   "independent" - a separate critique_action call with a screenshot
+# Unknown action types get the independent critic. A multi_action gets the strictest tier of its steps.
+CRITIQUE_POLICY_ENABLED = True
+CRITIQUE_TIERS = ("skip", "self", "independent")
+CRITIQUE_POLICY: Dict[str, str] = {
+    "wait": "skip",
+    "read_file": "skip",
+    "INFORM_USER": "skip",
+    "ask_user": "skip",
+    "describe_screen": "skip",
+    "capture_screenshot": "skip",
+    "search_web": "skip",
+    "search_youtube": "skip",
+    "task_complete": "skip",
+    "focus_window": "skip",
+    "move_mouse": "skip",
+    "cancel_visual_listener": "skip",
+    "click": "self",
+    "type": "self",
+    "click_and_type": "self",
+    "press_keys": "self",
+    "navigate_web": "self",
+    "start_visual_listener": "self",
+    "process_local_files": "self",
+    "process_files_from_urls": "self",
+    "run_shell_command": "independent",
+    "run_python_script": "independent",
+    "write_file": "independent",
+    "edit_image_with_file": "independent",  # writes output_path, overwriting output.png by default
+    "generate_large_content_with_gemini": "independent",
+}
+DEFAULT_CRITIQUE_TIER = "independent"
+
+# Used for "seconds saved" until the independent critic has been timed in this process.
+DEFAULT_CRITIC_SECONDS_ESTIMATE = 3.0
+
+
+def critique_tier(action: Dict[str, Any]) -> str:
+    """Critique tier for a proposed action (see CRITIQUE_POLICY)."""
+    if not CRITIQUE_POLICY_ENABLED or not isinstance(action, dict):
+        return DEFAULT_CRITIQUE_TIER
+    action_type = action.get("action_type")
+    if action_type == "multi_action":
+        sequence = (action.get("parameters") or {}).get("sequence") or []
+        tiers = [critique_tier(step) for step in sequence] or [DEFAULT_CRITIQUE_TIER]
+        return max(tiers, key=CRITIQUE_TIERS.index)
+    return CRITIQUE_POLICY.get(action_type, DEFAULT_CRITIQUE_TIER) # type: ignore
+
+
+def parse_self_critique(step_data: Optional[Dict[str, Any]]) -> Optional[Tuple[bool, str]]:
+    """(passed, reasoning) from the planner's "self_critique" field, or None if it is missing or malformed."""
+    self_critique = (step_data or {}).get("self_critique")
+    if not isinstance(self_critique, dict):
+        return None
+    decision = str(self_critique.get("decision", "")).strip().upper()
+    if decision not in ("PASS", "FAIL"):
+        logging.warning(f"Ignoring planner self-critique with invalid decision: {self_critique}")
+        return None
+    return decision == "PASS", str(self_critique.get("critique", "")).strip() or "No self-critique reasoning given."
+
+
+def estimated_critic_seconds() -> float:
+    """Mean latency of independent critic calls in this process (gateway stats), for savings estimates."""
+    stats = llm_gateway.get_stats().get("critic") or {}
+    calls = stats.get("calls", 0) - stats.get("cache_hits", 0)
+    return stats.get("latency_s", 0.0) / calls if calls > 0 else DEFAULT_CRITIC_SECONDS_ESTIMATE
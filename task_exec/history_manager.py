@@ -0,0 +1,216 @@
+import logging
+import time
+from typing import Dict, Optional, Any, List, Tuple
+
+from tools.context_cache import CHARS_PER_TOKEN
+
+# Prompt history for the planner and the critic, maintained incrementally per TaskSession.
+# Each conversation_history entry is formatted, size-capped and token-counted once, when it
+# is first seen. A consumer's segment is the pinned user goal, a rolling summary of the
+# turns that fell out of its token window, and the newest turns that fit the window.
+# Summaries are extractive (one short line per evicted observation, user turn or critique);
+# with HISTORY_SUMMARY_MODE = "llm" evicted turns are folded into an LLM-written summary in
+# batches, and the extractive lines cover the turns not folded yet.
+HISTORY_WINDOW_TOKENS = {"planner": 3000, "critic": 1200}
+HISTORY_ENTRY_MAX_CHARS = 1600  # longer entries keep their head and tail
+HISTORY_SUMMARY_MAX_CHARS = 1800
+HISTORY_SUMMARY_LINE_CHARS = 160
+HISTORY_SUMMARY_MODE = "extractive"  # or "llm"
+HISTORY_SUMMARY_LLM_BATCH = 8  # evicted turns per LLM summary update
+SUMMARY_MARKERS = ("System Observation:", "User responded:", "Critique failed", "critiqued:", "ask_user", "Advancing to sub-task")
+
+# Fixed turn-count truncation used before this module, kept for benchmark comparison.
+LEGACY_HISTORY_TURNS = {"planner": 10, "critic": 6}
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def cap_entry(text: str, max_chars: int = HISTORY_ENTRY_MAX_CHARS) -> str:
+    """Keep the head and tail of an oversized entry."""
+    if len(text) <= max_chars:
+        return text
+    keep = max_chars // 2
+    return f"{text[:keep]} …[{len(text) - 2 * keep} chars omitted]… {text[-keep:]}"
+
+
+def legacy_history_str(history: List[str], max_turns: int) -> str:
+    """The fixed turn-count truncation process_next_step/critique_action used to apply."""
+    if len(history) <= max_turns * 2:
+        return "\n".join(history)
+    cutoff = len(history) - max_turns * 2
+    keep = [0] if "User Goal:" in history[0] else []
+    return "\n".join(history[i] for i in keep + list(range(cutoff, len(history))))
+
+
+class _Entry:
+    __slots__ = ("line", "tokens", "summary_line", "capped")
+
+    def __init__(self, message: Dict[str, Any]):
+        full = f"{message.get('role', 'unknown')}: {message.get('content', '')}"
+        self.line = cap_entry(full)
+        self.capped = len(full) > len(self.line)
+        self.tokens = estimate_tokens(self.line) + 1
+        self.summary_line = None
+        if message.get("role") == "user" or any(marker in full for marker in SUMMARY_MARKERS):
+            short = " ".join(full.split())
+            self.summary_line = short if len(short) <= HISTORY_SUMMARY_LINE_CHARS else short[:HISTORY_SUMMARY_LINE_CHARS - 1] + "…"
+
+
+class HistoryManager:
+    """Incremental prompt history for one task's conversation_history (see module notes)."""
+
+    def __init__(self, summary_mode: str = HISTORY_SUMMARY_MODE, windows: Optional[Dict[str, int]] = None):
+        self.summary_mode = summary_mode
+        self.windows = dict(windows or HISTORY_WINDOW_TOKENS)
+        self._source: Optional[List[Dict[str, Any]]] = None
+        self._entries: List[_Entry] = []
+        self._lines: List[str] = []
+        self._llm_summary: Dict[str, Tuple[int, str]] = {}  # consumer -> (entries folded, summary text)
+        self._segments: Dict[str, Tuple[int, str]] = {}  # consumer -> (entry count, segment)
+        self.pending_token_usage = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+        self.stats: Dict[str, Dict[str, Any]] = {}
+
+    def sync(self, conversation_history: List[Dict[str, Any]]) -> None:
+        """Take in entries appended since the last call (rebuilds if the list was replaced or shrank)."""
+        if conversation_history is not self._source or len(conversation_history) < len(self._entries):
+            self._source = conversation_history
+            self._entries, self._lines, self._llm_summary, self._segments = [], [], {}, {}
+        for message in conversation_history[len(self._entries):]:
+            entry = _Entry(message if isinstance(message, dict) else {"role": "unknown", "content": str(message)})
+            self._entries.append(entry)
+            self._lines.append(entry.line)
+
+    def lines(self, conversation_history: List[Dict[str, Any]]) -> List[str]:
+        """Capped "role: content" lines for the whole history (the list is reused; do not mutate)."""
+        self.sync(conversation_history)
+        return self._lines
+
+    def _pinned(self) -> int:
+        """Number of leading entries always kept: the user's goal."""
+        if self._entries and (self._entries[0].line.startswith("user:") or "User Goal:" in self._entries[0].line):
+            return 1
+        return 0
+
+    def _window_start(self, budget: int, pinned: int) -> int:
+        used = sum(entry.tokens for entry in self._entries[:pinned])
+        start = len(self._entries)
+        while start > pinned and used + self._entries[start - 1].tokens <= budget:
+            start -= 1
+            used += self._entries[start].tokens
+        return min(start, len(self._entries) - 1) if len(self._entries) > pinned else start  # always keep the newest turn
+
+    def _extractive(self, first: int, end: int) -> List[str]:
+        """Summary lines for entries [first, end), newest kept when over HISTORY_SUMMARY_MAX_CHARS."""
+        lines, size = [], 0
+        for index in range(end - 1, first - 1, -1):
+            line = self._entries[index].summary_line
+            if line is None:
+                continue
+            if size + len(line) > HISTORY_SUMMARY_MAX_CHARS:
+                lines.append(f"- ({sum(1 for e in self._entries[first:index + 1] if e.summary_line)} earlier events omitted)")
+                break
+            lines.append(f"- {line}")
+            size += len(line) + 3
+        return list(reversed(lines))
+
+    def _fold_with_llm(self, consumer: str, pinned: int, window_start: int, model: Any) -> Tuple[int, str]:
+        folded, text = self._llm_summary.get(consumer, (pinned, ""))
+        if model is None or window_start - folded < HISTORY_SUMMARY_LLM_BATCH:
+            return folded, text
+        from tools.llm_gateway import llm_gateway
+        new_turns = "\n".join(entry.line for entry in self._entries[folded:window_start])
+        prompt = (
+            "Update the running summary of a PC automation task's history. Keep what was tried, what succeeded or failed "
+            "and why, user decisions and any file paths, URLs or names still needed. At most 12 short bullet points.\n\n"
+            f"Current summary:\n{text or '(none)'}\n\nNew turns to fold in:\n{new_turns}\n\nUpdated summary:"
+        )
+        try:
+            response, token_usage, _ = llm_gateway.generate("history_summary", prompt, model=model)
+            text = (response.text or "").strip()[:HISTORY_SUMMARY_MAX_CHARS] or text
+            for key in self.pending_token_usage:
+                self.pending_token_usage[key] += token_usage.get(key, 0)
+            folded = window_start
+        except Exception as e:
+            logging.warning(f"History summary via LLM failed, keeping extractive summary: {e}")
+        self._llm_summary[consumer] = (folded, text)
+        return folded, text
+
+    def segment(self, conversation_history: List[Dict[str, Any]], consumer: str, model: Any = None) -> str:
+        """Ready-built history text for `consumer` ("planner" or "critic")."""
+        started = time.perf_counter()
+        self.sync(conversation_history)
+        cached = self._segments.get(consumer)
+        if cached and cached[0] == len(self._entries):
+            return cached[1]
+        pinned = self._pinned()
+        window_start = self._window_start(self.windows.get(consumer, HISTORY_WINDOW_TOKENS["planner"]), pinned)
+        parts = [entry.line for entry in self._entries[:pinned]]
+        if window_start > pinned:
+            folded, llm_text = pinned, ""
+            if self.summary_mode == "llm":
+                folded, llm_text = self._fold_with_llm(consumer, pinned, window_start, model)
+            summary = ([llm_text] if llm_text else []) + self._extractive(folded, window_start)
+            if summary:
+                parts.append(f"[Summary of {window_start - pinned} earlier turns]\n" + "\n".join(summary) + "\n[End of summary]")
+        parts.extend(entry.line for entry in self._entries[window_start:])
+        text = "\n".join(parts)
+        self._segments[consumer] = (len(self._entries), text)
+        stat = self.stats.setdefault(consumer, {"builds": 0, "tokens": 0, "last_tokens": 0, "evicted": 0, "capped": 0, "build_ms": 0.0})
+        stat["builds"] += 1
+        stat["last_tokens"] = estimate_tokens(text)
+        stat["tokens"] += stat["last_tokens"]
+        stat["evicted"] = max(0, window_start - pinned)
+        stat["capped"] = sum(1 for entry in self._entries if entry.capped)
+        stat["build_ms"] = round(stat["build_ms"] + (time.perf_counter() - started) * 1000, 3)
+        return text
+
+    def take_token_usage(self) -> Dict[str, int]:
+        """Tokens spent on LLM summaries since the last call, for the task's totals."""
+        usage, self.pending_token_usage = self.pending_token_usage, {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+        return usage
+
+
+def benchmark_history_segments(iterations: int = 25, observation_chars: int = 3000) -> List[Dict[str, Any]]:
+    """
+    Simulate a task of `iterations` plan/act/assess cycles with multi-kilobyte observations and
+    report history and planner-prompt tokens per iteration: legacy truncation vs HistoryManager.
+    """
+    from task_exec.planner_prompts import build_planner_suffix
+    history: List[Dict[str, Any]] = [{"role": "user", "content": "User Goal: collect the release notes of the last 5 versions into notes.md"}]
+    manager = HistoryManager()
+    report = []
+    for iteration in range(1, iterations + 1):
+        history.append({"role": "system", "content": f"System: Proposed action run_shell_command critiqued: ok. Step {iteration}."})
+        history.append({"role": "system", "content": f"System Observation: Command output (step {iteration}): " + ("log line " * (observation_chars // 9))})
+        if iteration % 5 == 0:
+            history.append({"role": "user", "content": f"User responded: continue with version {iteration // 5}"})
+        legacy_lines = [f"{m['role']}: {m['content']}" for m in history]
+        rows = {}
+        for consumer, turns in LEGACY_HISTORY_TURNS.items():
+            legacy = legacy_history_str(legacy_lines, turns)
+            managed = manager.segment(history, consumer)
+            rows[consumer] = (estimate_tokens(legacy), estimate_tokens(managed))
+        planner_legacy = build_planner_suffix("collect release notes", "", legacy_history_str(legacy_lines, 10), "", "", "")
+        planner_managed = build_planner_suffix("collect release notes", "", manager.segment(history, "planner"), "", "", "")
+        report.append({
+            "iteration": iteration,
+            "planner_history_tokens": rows["planner"],
+            "critic_history_tokens": rows["critic"],
+            "planner_suffix_tokens": (estimate_tokens(planner_legacy), estimate_tokens(planner_managed)),
+        })
+    return report
+
+
+if __name__ == "__main__":
+    rows = benchmark_history_segments()
+    print("iteration | planner history tokens legacy -> managed | critic legacy -> managed | planner suffix legacy -> managed")
+    for row in rows:
+        print(
+            f"{row['iteration']:>9} | {row['planner_history_tokens'][0]:>6} -> {row['planner_history_tokens'][1]:<6} | "
+            f"{row['critic_history_tokens'][0]:>6} -> {row['critic_history_tokens'][1]:<6} | "
+            f"{row['planner_suffix_tokens'][0]:>6} -> {row['planner_suffix_tokens'][1]}"
+        )
+    totals = [sum(row["planner_suffix_tokens"][i] for row in rows) for i in (0, 1)]
+    print(f"planner suffix tokens over {len(rows)} iterations: {totals[0]} legacy, {totals[1]} managed")
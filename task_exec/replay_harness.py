@@ -0,0 +1,774 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import types
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, Optional, Any, List, Callable, Iterable, Iterator, Tuple
+from PIL import Image
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Record/replay of iterative_task_executor runs.
+#   record: run a task for real and capture every LLM request/response (via llm_gateway),
+#           every screen capture, the active window titles, action outcomes, DB lookups and
+#           the user's replies into a bundle directory.
+#   replay: drive the executor from a bundle with a replay LLM backend, recorded frames,
+#           recorded action outcomes and a no-op pyautogui, measuring iterations, time per
+#           phase, CPU and memory. Needs no API key, desktop or network. With latency_scale > 0
+#           LLM calls, seams and captures also take their recorded time (scaled), so changes
+#           that overlap I/O (task_exec/async_core.py) show up in the wall time.
+# Both keep session persistence (event log, blobs, history index, Chroma session records)
+# and the shortcut index in a temp dir / memory for the run (_sandboxed_persistence).
+# Bundle layout: <bundle>/manifest.json and <bundle>/frames/NNNN.png.
+BUNDLE_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+FRAMES_DIR = "frames"
+
+# Executor seams captured as JSON values, by name in task_exec.task_executor.
+RECORDED_SEAMS = (
+    "get_active_window_name",
+    "execute_action",
+    "retrieve_task_context",
+    "retrieve_similar_task_executions_from_db",
+    "retrieve_relevant_reinforcements_from_db",
+    "get_application_shortcuts",
+)
+# Seams that only write state; skipped on replay.
+SIDE_EFFECT_SEAMS = ("save_task_execution_to_db", "load_shortcuts_cache")
+# Modules that imported capture_full_screen by name.
+CAPTURE_MODULES = ("task_exec.task_executor", "tools.actions", "vision.vis")
+PYAUTOGUI_MODULES = ("tools.actions", "vision.vis")
+SEAM_PHASES = {
+    "get_active_window_name": "window",
+    "execute_action": "action",
+    "retrieve_task_context": "db",
+    "retrieve_similar_task_executions_from_db": "db",
+    "retrieve_relevant_reinforcements_from_db": "db",
+    "get_application_shortcuts": "shortcuts",
+    "save_task_execution_to_db": "db",
+    "load_shortcuts_cache": "shortcuts",
+}
+
+
+class ReplayExhausted(RuntimeError):
+    """The executor asked for more recorded data than the bundle holds."""
+
+
+class PhaseClock:
+    """Thread-safe wall-clock accumulator per phase ("llm", "capture", "action", ...)."""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+            self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    @contextmanager
+    def timed(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+
+class NoOpPyAutoGUI(types.ModuleType):
+    """Stand-in for pyautogui during replay: every call is counted and does nothing."""
+
+    KEYBOARD_KEYS: List[str] = []
+    FAILSAFE = False
+    PAUSE = 0.0
+
+    def __init__(self):
+        super().__init__("pyautogui")
+        self.calls: Dict[str, int] = {}
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        def _noop(*args, **kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if name == "size":
+                return (1920, 1080)
+            if name == "position":
+                return (0, 0)
+            return None
+        return _noop
+
+
+def install_headless_stubs() -> None:
+    """
+    pyautogui fails to import without a display (a plain Linux CI box); register the no-op
+    in its place so the app modules import. Must run before the first app module is imported,
+    which is why it runs when this module is imported (and from tests/conftest.py).
+    """
+    if "pyautogui" in sys.modules:
+        return
+    try:
+        import pyautogui  # noqa: F401
+    except Exception as e:
+        logging.warning(f"pyautogui unavailable ({e}); using the no-op replacement.")
+        sys.modules["pyautogui"] = NoOpPyAutoGUI()
+
+
+install_headless_stubs()
+
+
+def _to_json(value: Any) -> Any:
+    if hasattr(value, "to_dict"):  # TaskContext
+        value = value.to_dict()
+    return json.loads(json.dumps(value, default=str))
+
+
+def _from_json(name: str, value: Any) -> Any:
+    # Tuples come back as lists; the executor unpacks these two by length.
+    if name in ("execute_action", "get_application_shortcuts") and isinstance(value, list):
+        return tuple(value)
+    if name == "retrieve_task_context" and isinstance(value, dict):
+        from chromaDB_management.task_context import TaskContext
+        return TaskContext.from_dict(value)
+    return value
+
+
+def _recorded_response(text: str, token_usage: Dict[str, int]) -> Any:
+    part = SimpleNamespace(text=text, function_call=None)
+    return SimpleNamespace(
+        text=text,
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]), finish_reason="STOP")],
+        usage_metadata=SimpleNamespace(
+            prompt_token_count=token_usage.get("prompt_tokens", 0),
+            candidates_token_count=token_usage.get("candidates_tokens", 0),
+            total_token_count=token_usage.get("total_tokens", 0),
+        ),
+        prompt_feedback=None,
+    )
+
+
+def _request_key(model_name: str, contents: Any, config: Any = None) -> Optional[str]:
+    from tools.llm_response_cache import make_cache_key
+    return make_cache_key(model_name, contents, config)
+
+
+class RecordingLLMBackend:
+    """Wraps the real gateway backend and logs purpose, request key, reply text, tokens and latency."""
+
+    def __init__(self, inner: Any, clock: PhaseClock):
+        self.inner = inner
+        self.clock = clock
+        self.calls: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def _record(self, purpose: str, key: Optional[str], call: Callable[[], Any]) -> Any:
+        from tools.llm_gateway import response_text
+        from tools.token_usage_tool import _get_token_usage
+        start = time.perf_counter()
+        response = call()
+        latency = time.perf_counter() - start
+        self.clock.add("llm", latency)
+        with self._lock:
+            self.calls.append({
+                "purpose": purpose, "key": key, "text": response_text(response),
+                "token_usage": _get_token_usage(response), "latency_s": round(latency, 4),
+            })
+        return response
+
+    def generate_with_model(self, purpose: str, model: Any, contents: Any, **kwargs) -> Any:
+        key = _request_key(getattr(model, "model_name", "") or "", contents, kwargs or None)
+        return self._record(purpose, key, lambda: self.inner.generate_with_model(purpose, model, contents, **kwargs))
+
+    def generate_with_client(self, purpose: str, model_name: str, contents: Any, config: Any = None) -> Any:
+        key = _request_key(model_name, contents, config)
+        return self._record(purpose, key, lambda: self.inner.generate_with_client(purpose, model_name, contents, config))
+
+    def _record_stream(self, purpose: str, key: Optional[str], chunks: Iterator[Any]) -> Iterator[Any]:
+        from tools.llm_gateway import response_text
+        from tools.token_usage_tool import _get_token_usage
+        start = time.perf_counter()
+        texts: List[str] = []
+        token_usage: Dict[str, int] = {}
+        for chunk in chunks:
+            texts.append(response_text(chunk))
+            usage = _get_token_usage(chunk)
+            if usage.get("total_tokens"):
+                token_usage = usage
+            yield chunk
+        latency = time.perf_counter() - start
+        self.clock.add("llm", latency)
+        with self._lock:
+            self.calls.append({
+                "purpose": purpose, "key": key, "text": "".join(texts),
+                "token_usage": token_usage, "latency_s": round(latency, 4),
+            })
+
+    def stream_with_model(self, purpose: str, model: Any, contents: Any, **kwargs) -> Iterator[Any]:
+        key = _request_key(getattr(model, "model_name", "") or "", contents, kwargs or None)
+        return self._record_stream(purpose, key, self.inner.stream_with_model(purpose, model, contents, **kwargs))
+
+    def stream_with_client(self, purpose: str, model_name: str, contents: Any, config: Any = None) -> Iterator[Any]:
+        key = _request_key(model_name, contents, config)
+        return self._record_stream(purpose, key, self.inner.stream_with_client(purpose, model_name, contents, config))
+
+
+class ReplayLLMBackend:
+    """
+    Answers gateway calls from a bundle. A request is matched to an unused recording with the
+    same request key, otherwise to the next unused recording for its purpose. Recorded latency
+    is slept for, scaled by `latency_scale` (0 = measure local overhead only).
+    """
+
+    def __init__(self, calls: List[Dict[str, Any]], clock: PhaseClock, latency_scale: float = 0.0):
+        self.calls = calls
+        self.clock = clock
+        self.latency_scale = latency_scale
+        self._used = [False] * len(calls)
+        self._lock = threading.Lock()
+        self.stats = {"matched": 0, "in_order": 0, "unmatched": 0}
+
+    def _take(self, purpose: str, key: Optional[str]) -> Dict[str, Any]:
+        with self._lock:
+            candidates = [i for i, call in enumerate(self.calls) if not self._used[i] and call["purpose"] == purpose]
+            exact = [i for i in candidates if key is not None and self.calls[i].get("key") == key]
+            if exact:
+                index = exact[0]
+                self.stats["matched"] += 1
+            elif candidates:
+                index = candidates[0]
+                self.stats["in_order"] += 1
+            else:
+                self.stats["unmatched"] += 1
+                raise ReplayExhausted(f"No recorded '{purpose}' LLM response left to replay.")
+            self._used[index] = True
+            return self.calls[index]
+
+    def _respond(self, purpose: str, key: Optional[str]) -> Any:
+        call = self._take(purpose, key)
+        with self.clock.timed("llm"):
+            if self.latency_scale:
+                time.sleep(call.get("latency_s", 0.0) * self.latency_scale)
+            return _recorded_response(call.get("text", ""), call.get("token_usage") or {})
+
+    def generate_with_model(self, purpose: str, model: Any, contents: Any, **kwargs) -> Any:
+        return self._respond(purpose, _request_key(getattr(model, "model_name", "") or "", contents, kwargs or None))
+
+    def generate_with_client(self, purpose: str, model_name: str, contents: Any, config: Any = None) -> Any:
+        return self._respond(purpose, _request_key(model_name, contents, config))
+
+    # Streams are replayed as a single chunk holding the recorded text.
+    def stream_with_model(self, purpose: str, model: Any, contents: Any, **kwargs) -> Iterator[Any]:
+        return iter([self.generate_with_model(purpose, model, contents, **kwargs)])
+
+    def stream_with_client(self, purpose: str, model_name: str, contents: Any, config: Any = None) -> Iterator[Any]:
+        return iter([self.generate_with_client(purpose, model_name, contents, config)])
+
+
+class _Patches:
+    """Attribute patches on imported modules, restored in reverse order."""
+
+    def __init__(self):
+        self._originals: List[Tuple[Any, str, Any]] = []
+
+    def set(self, module_name: str, attr: str, value: Any) -> Any:
+        module = sys.modules.get(module_name)
+        if module is None or not hasattr(module, attr):
+            return None
+        original = getattr(module, attr)
+        self._originals.append((module, attr, original))
+        setattr(module, attr, value)
+        return original
+
+    def restore(self) -> None:
+        while self._originals:
+            module, attr, original = self._originals.pop()
+            setattr(module, attr, original)
+
+
+class TaskRecorder:
+    """Context manager that records a real executor run into `bundle_dir`."""
+
+    def __init__(self, bundle_dir: str, instruction: str):
+        self.bundle_dir = bundle_dir
+        self.instruction = instruction
+        self.clock = PhaseClock()
+        self.seams: Dict[str, List[Any]] = {name: [] for name in RECORDED_SEAMS}
+        self.seam_latencies: Dict[str, List[float]] = {name: [] for name in RECORDED_SEAMS}
+        self.frames: List[Optional[str]] = []
+        self.frame_latencies: List[float] = []
+        self.user_replies: List[Optional[str]] = []
+        self._patches = _Patches()
+        self._backend: Optional[RecordingLLMBackend] = None
+        self._previous_backend = None
+        self._previous_cache_enabled = True
+        self._lock = threading.Lock()
+
+    def _wrap_seam(self, name: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+        phase = SEAM_PHASES.get(name, name)
+
+        def _recorded(*args, **kwargs):
+            start = time.perf_counter()
+            value = fn(*args, **kwargs)
+            latency = time.perf_counter() - start
+            self.clock.add(phase, latency)
+            if name in self.seams:
+                with self._lock:
+                    self.seams[name].append(_to_json(value))
+                    self.seam_latencies[name].append(round(latency, 4))
+            return value
+        return _recorded
+
+    def _wrap_capture(self, fn: Callable[[], Optional[Image.Image]]) -> Callable[[], Optional[Image.Image]]:
+        def _recorded_capture():
+            start = time.perf_counter()
+            image = fn()
+            latency = time.perf_counter() - start
+            self.clock.add("capture", latency)
+            with self._lock:
+                self.frame_latencies.append(round(latency, 4))
+                index = len(self.frames)
+                if image is None:
+                    self.frames.append(None)
+                else:
+                    rel_path = os.path.join(FRAMES_DIR, f"{index:04d}.png")
+                    image.save(os.path.join(self.bundle_dir, rel_path))
+                    self.frames.append(rel_path)
+            return image
+        return _recorded_capture
+
+    def __enter__(self) -> "TaskRecorder":
+        from tools.llm_gateway import llm_gateway
+        from tools.llm_response_cache import llm_response_cache
+        import task_exec.task_executor as executor
+        os.makedirs(os.path.join(self.bundle_dir, FRAMES_DIR), exist_ok=True)
+        self._backend = RecordingLLMBackend(llm_gateway.backend, self.clock)
+        self._previous_backend = llm_gateway.backend
+        llm_gateway.set_backend(self._backend)
+        # Cache hits would never reach the backend and so be missing from the bundle.
+        self._previous_cache_enabled = llm_response_cache.enabled
+        llm_response_cache.enabled = False
+        capture = self._wrap_capture(executor.capture_full_screen)
+        for module_name in CAPTURE_MODULES:
+            self._patches.set(module_name, "capture_full_screen", capture)
+        for name in RECORDED_SEAMS + SIDE_EFFECT_SEAMS:
+            self._patches.set("task_exec.task_executor", name, self._wrap_seam(name, getattr(executor, name)))
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        from tools.llm_gateway import llm_gateway
+        from tools.llm_response_cache import llm_response_cache
+        self._patches.restore()
+        llm_gateway.set_backend(self._previous_backend)
+        llm_response_cache.enabled = self._previous_cache_enabled
+        self.save()
+
+    def save(self, summary: Optional[Dict[str, Any]] = None) -> str:
+        manifest = {
+            "version": BUNDLE_VERSION,
+            "instruction": self.instruction,
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+            "llm_calls": self._backend.calls if self._backend else [],
+            "seams": self.seams,
+            "seam_latency_s": self.seam_latencies,
+            "frames": self.frames,
+            "frame_latency_s": self.frame_latencies,
+            "user_replies": self.user_replies,
+            "phases": {phase: round(seconds, 3) for phase, seconds in self.clock.seconds.items()},
+            "summary": summary or {},
+        }
+        path = os.path.join(self.bundle_dir, MANIFEST_FILE)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        return path
+
+
+def load_bundle(bundle_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(bundle_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != BUNDLE_VERSION:
+        raise ValueError(f"Unsupported replay bundle version {manifest.get('version')} in {bundle_dir}")
+    return manifest
+
+
+class _FrameSource:
+    """Recorded frames in capture order; the last one repeats once the recording runs out."""
+
+    def __init__(self, bundle_dir: str, frames: List[Optional[str]], clock: PhaseClock, latencies: Optional[List[float]] = None, latency_scale: float = 0.0):
+        self.bundle_dir = bundle_dir
+        self.frames = frames
+        self.clock = clock
+        self.latencies = latencies or []
+        self.latency_scale = latency_scale
+        self._next = 0
+        self._loaded: Dict[str, Image.Image] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self) -> Optional[Image.Image]:
+        with self.clock.timed("capture"):
+            with self._lock:
+                index = self._next
+                self._next += 1
+            if self.latency_scale and index < len(self.latencies):
+                time.sleep(self.latencies[index] * self.latency_scale)
+            with self._lock:
+                if not self.frames:
+                    return None
+                rel_path = self.frames[min(index, len(self.frames) - 1)]
+                if rel_path is None:
+                    return None
+                if rel_path not in self._loaded:
+                    with Image.open(os.path.join(self.bundle_dir, rel_path)) as image:
+                        self._loaded[rel_path] = image.convert("RGB")
+                return self._loaded[rel_path].copy()
+
+
+class TaskReplayer:
+    """
+    Context manager that swaps the executor's environment for a bundle. Action types in
+    `execute_actions` run through the real execute_action (with the no-op pyautogui);
+    all other actions return their recorded outcome.
+    """
+
+    def __init__(self, bundle_dir: str, latency_scale: float = 0.0, execute_actions: Iterable[str] = ()):
+        self.bundle_dir = bundle_dir
+        self.bundle = load_bundle(bundle_dir)
+        self.latency_scale = latency_scale
+        self.execute_actions = set(execute_actions)
+        self.clock = PhaseClock()
+        self.pyautogui = NoOpPyAutoGUI()
+        self.backend = ReplayLLMBackend(self.bundle.get("llm_calls", []), self.clock, latency_scale)
+        self.user_replies = list(self.bundle.get("user_replies", []))
+        self._seam_positions = {name: 0 for name in RECORDED_SEAMS}
+        self._patches = _Patches()
+        self._previous_backend = None
+        self._previous_cache_enabled = True
+        self._lock = threading.Lock()
+
+    def _next_value(self, name: str) -> Any:
+        with self._lock:
+            values = self.bundle.get("seams", {}).get(name, [])
+            position = self._seam_positions[name]
+            if position >= len(values):
+                raise ReplayExhausted(f"No recorded '{name}' result left to replay.")
+            self._seam_positions[name] = position + 1
+        latencies = self.bundle.get("seam_latency_s", {}).get(name, [])
+        if self.latency_scale and position < len(latencies):
+            time.sleep(latencies[position] * self.latency_scale)
+        return _from_json(name, values[position])
+
+    def _replay_seam(self, name: str, real_fn: Callable[..., Any]) -> Callable[..., Any]:
+        phase = SEAM_PHASES.get(name, name)
+
+        def _replayed(*args, **kwargs):
+            with self.clock.timed(phase):
+                if name == "retrieve_task_context" and name not in self.bundle.get("seams", {}):
+                    # Bundles recorded before the task-start context: rebuild it from their executions lookup.
+                    from chromaDB_management.task_context import TaskContext
+                    return TaskContext(args[0] if args else "", executions=self._next_value("retrieve_similar_task_executions_from_db"))
+                value = self._next_value(name)
+                if name == "execute_action" and args and isinstance(args[0], dict) and args[0].get("action_type") in self.execute_actions:
+                    return real_fn(*args, **kwargs)
+                return value
+        return _replayed
+
+    def __enter__(self) -> "TaskReplayer":
+        from tools.llm_gateway import llm_gateway
+        from tools.llm_response_cache import llm_response_cache
+        import task_exec.task_executor as executor
+        self._previous_backend = llm_gateway.backend
+        llm_gateway.set_backend(self.backend)
+        self._previous_cache_enabled = llm_response_cache.enabled
+        llm_response_cache.enabled = False
+        frames = _FrameSource(self.bundle_dir, self.bundle.get("frames", []), self.clock, self.bundle.get("frame_latency_s"), self.latency_scale)
+        for module_name in CAPTURE_MODULES:
+            self._patches.set(module_name, "capture_full_screen", frames)
+        for module_name in PYAUTOGUI_MODULES:
+            self._patches.set(module_name, "pyautogui", self.pyautogui)
+        for name in RECORDED_SEAMS:
+            self._patches.set("task_exec.task_executor", name, self._replay_seam(name, getattr(executor, name)))
+        for name in SIDE_EFFECT_SEAMS:
+            self._patches.set("task_exec.task_executor", name, lambda *args, **kwargs: None)
+        replay_model = SimpleNamespace(model_name="replay")
+        self._patches.set("task_exec.task_executor", "get_model", lambda: replay_model)
+        self._patches.set("task_exec.task_executor", "get_critic_model", lambda: replay_model)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        from tools.llm_gateway import llm_gateway
+        from tools.llm_response_cache import llm_response_cache
+        self._patches.restore()
+        llm_gateway.set_backend(self._previous_backend)
+        llm_response_cache.enabled = self._previous_cache_enabled
+
+
+class _NullCollection:
+    """Stands in for the task session Chroma collection during harness runs."""
+
+    def upsert(self, **kwargs) -> None:
+        pass
+
+    add = delete = upsert
+
+    def get(self, **kwargs) -> Dict[str, Any]:
+        return {"ids": [], "metadatas": [], "documents": []}
+
+    def count(self) -> int:
+        return 0
+
+    def query(self, **kwargs) -> Dict[str, Any]:
+        return {"ids": [[]], "metadatas": [[]], "documents": [[]], "distances": [[]]}
+
+
+@contextmanager
+def _sandboxed_persistence() -> Iterator[str]:
+    """
+    Point session persistence (event log, blobs, task history index, Chroma session records)
+    and the shortcut index at a temp dir / memory for a harness run, so recording or
+    replaying never writes to the user's stores. Yields the temp dir.
+    """
+    import tempfile
+    import app_flask  # noqa: F401  (patched below; importing it starts no background work)
+    from chromaDB_management.blob_store import BlobStore
+    from chromaDB_management.session_log import SessionEventLog
+    from chromaDB_management.task_history_index import TaskHistoryIndex
+    from tools.shortcut_index import ShortcutIndex
+    patches = _Patches()
+    with tempfile.TemporaryDirectory(prefix="replay_harness_") as tmp:
+        blobs = BlobStore(os.path.join(tmp, "session_blobs"))
+        log = SessionEventLog(path=os.path.join(tmp, "task_sessions.sqlite3"), blobs=blobs)
+        patches.set("app_flask", "session_log", log)
+        patches.set("app_flask", "blob_store", blobs)
+        patches.set("app_flask", "task_history_index", TaskHistoryIndex())
+        patches.set("app_flask", "agent_task_sessions_collection", _NullCollection())
+        patches.set("task_exec.task_executor", "shortcut_index", ShortcutIndex(persist=False))
+        try:
+            yield tmp
+        finally:
+            patches.restore()
+            log.flush()
+            if log._conn is not None:
+                log._conn.close()
+
+
+def _new_session(instruction: str) -> Any:
+    from app_flask import AgentState, TaskSession
+    agent_state = AgentState()
+    agent_state.current_task = TaskSession(str(uuid.uuid4()), instruction, datetime.now(timezone.utc))
+    agent_state.is_task_running = True
+    return agent_state
+
+
+def _drive(generator, agent_state: Any, reply_fn: Callable[[str], Optional[str]]) -> Tuple[List[Any], int]:
+    """Run the executor generator to completion, answering ask_user and resuming after pauses."""
+    yields = 0
+    to_send: Optional[str] = None
+    try:
+        next_yield = next(generator)
+        while True:
+            yields += 1
+            kind = next_yield.get("type") if isinstance(next_yield, dict) else None
+            if kind == "error":
+                logging.error(f"Executor error during harness run: {next_yield.get('message')}")
+                generator.close()
+                return [], yields
+            if kind == "ask_user":
+                to_send = reply_fn(next_yield.get("question", ""))
+            else:  # inform_user / paused: continue as the UI's "continue" button does
+                agent_state.task_is_paused = False
+                to_send = None
+            next_yield = generator.send(to_send)
+    except StopIteration as e:
+        return e.value or [], yields
+
+
+def _latency_per_call(before: Dict[str, Dict[str, Any]], after: Dict[str, Dict[str, Any]]) -> Dict[str, float]:
+    """Mean gateway latency per purpose between two get_stats() snapshots."""
+    report = {}
+    for purpose, stats in after.items():
+        calls = stats.get("calls", 0) - before.get(purpose, {}).get("calls", 0)
+        if calls:
+            report[purpose] = round((stats.get("latency_s", 0.0) - before.get(purpose, {}).get("latency_s", 0.0)) / calls, 3)
+    return report
+
+
+def record_task(instruction: str, bundle_dir: str, reply_fn: Optional[Callable[[str], Optional[str]]] = None) -> Dict[str, Any]:
+    """Run `instruction` for real (API key, desktop) and write a replay bundle. Returns the run summary."""
+    from config import get_model
+    from agents.ai_agent import UIAgent
+    from task_exec.task_executor import iterative_task_executor
+    from tools.context_cache import context_prefix_cache
+    from tools.llm_gateway import llm_gateway
+    reply_fn = reply_fn or (lambda question: input(f"{question}\n> "))
+    llm_model = get_model()
+    context_prefix_cache.reset_stats()
+    gateway_before = llm_gateway.get_stats()
+    with _sandboxed_persistence(), TaskRecorder(bundle_dir, instruction) as recorder:
+        agent_state = _new_session(instruction)
+        def _recorded_reply(question: str) -> Optional[str]:
+            reply = reply_fn(question)
+            recorder.user_replies.append(reply)
+            return reply
+        start = time.perf_counter()
+        results, _ = _drive(
+            iterative_task_executor(instruction, agent_state, UIAgent(llm_model), llm_model), agent_state, _recorded_reply
+        )
+        summary = {
+            "iterations": agent_state.current_task.iteration_count,
+            "actions": len(results),
+            "wall_s": round(time.perf_counter() - start, 3),
+            "status": agent_state.current_task.status,
+            "total_tokens": agent_state.current_task.total_tokens,
+            "prompt_prefixes": context_prefix_cache.get_stats(),
+            "llm_latency_s": _latency_per_call(gateway_before, llm_gateway.get_stats()),
+            "critique": agent_state.current_task.critique_stats,
+            "speculation": agent_state.current_task.speculation_stats,
+        }
+    recorder.save(summary)
+    return summary
+
+
+def replay_task(bundle_dir: str, latency_scale: float = 0.0, execute_actions: Iterable[str] = ()) -> Dict[str, Any]:
+    """Replay a bundle once and report iterations, wall/CPU time per phase and peak Python memory."""
+    from agents.ai_agent import UIAgent
+    from task_exec.task_executor import iterative_task_executor
+    from tools.context_cache import context_prefix_cache
+    from task_exec.async_core import async_core
+    from chromaDB_management.embedding_cache import task_embedding_stats
+    context_prefix_cache.reset_stats()
+    async_core.reset_stats()
+    with _sandboxed_persistence(), TaskReplayer(bundle_dir, latency_scale, execute_actions) as replayer:
+        instruction = replayer.bundle["instruction"]
+        agent_state = _new_session(instruction)
+        replies = iter(replayer.user_replies)
+        tracemalloc.start()
+        start, cpu_start = time.perf_counter(), time.process_time()
+        results, yields = _drive(
+            iterative_task_executor(instruction, agent_state, UIAgent(None), SimpleNamespace(model_name="replay")), # type: ignore
+            agent_state, lambda question: next(replies, None)
+        )
+        wall, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    phases = {phase: round(seconds, 4) for phase, seconds in replayer.clock.seconds.items()}
+    phases["executor"] = round(max(0.0, wall - sum(replayer.clock.seconds.values())), 4)
+    return {
+        "bundle": os.path.basename(os.path.normpath(bundle_dir)),
+        "iterations": agent_state.current_task.iteration_count,
+        "actions": len(results),
+        "yields": yields,
+        "status": agent_state.current_task.status,
+        "wall_s": round(wall, 4),
+        "iteration_s": round(wall / max(1, agent_state.current_task.iteration_count), 4),
+        "cpu_s": round(cpu, 4),
+        "peak_mem_mb": round(peak / (1024 * 1024), 2),
+        "phases": phases,
+        "llm": dict(replayer.backend.stats),
+        "prompt_prefixes": context_prefix_cache.get_stats(),
+        "critique": agent_state.current_task.critique_stats,
+        "async_core": async_core.get_stats(),
+        "speculation": agent_state.current_task.speculation_stats,
+        "history_segments": agent_state.current_task.history_manager.stats,
+        "reinforcement_cache": agent_state.current_task.reinforcement_cache.stats,
+        "shortcut_prompt": agent_state.current_task.shortcut_prompt_stats,
+        "task_start": agent_state.current_task.task_start_stats,
+        "embeddings": task_embedding_stats(agent_state.current_task.call_metrics),
+        "pyautogui_calls": dict(replayer.pyautogui.calls),
+        "total_tokens": agent_state.current_task.total_tokens,
+        "recorded_summary": replayer.bundle.get("summary", {}),
+    }
+
+
+def benchmark_bundles(bundle_dirs: Iterable[str], runs: int = 3, latency_scale: float = 0.0) -> List[Dict[str, Any]]:
+    """Replay each bundle `runs` times and keep the median run by wall time."""
+    report = []
+    for bundle_dir in bundle_dirs:
+        samples = sorted((replay_task(bundle_dir, latency_scale) for _ in range(max(1, runs))), key=lambda r: r["wall_s"])
+        report.append(samples[len(samples) // 2])
+    return report
+
+
+def compare_async_core(bundle_dirs: Iterable[str], runs: int = 3, latency_scale: float = 1.0) -> List[Dict[str, Any]]:
+    """Per-iteration latency of each bundle with the executor's I/O phases run sequentially vs on the async core."""
+    from task_exec.async_core import async_core
+    bundle_dirs = list(bundle_dirs)
+    previous = async_core.enabled
+    try:
+        async_core.enabled = False
+        sequential = benchmark_bundles(bundle_dirs, runs, latency_scale)
+        async_core.enabled = True
+        overlapped = benchmark_bundles(bundle_dirs, runs, latency_scale)
+    finally:
+        async_core.enabled = previous
+    return [
+        {
+            "bundle": seq["bundle"],
+            "iterations": seq["iterations"],
+            "sequential_iteration_s": seq["iteration_s"],
+            "async_iteration_s": ovl["iteration_s"],
+            "speedup": round(seq["iteration_s"] / ovl["iteration_s"], 2) if ovl["iteration_s"] else None,
+            "overlap_saved_s": ovl["async_core"]["overlap_saved_s"],
+        }
+        for seq, ovl in zip(sequential, overlapped)
+    ]
+
+
+if __name__ == "__main__":
+    # python -m task_exec.replay_harness record "<instruction>" <bundle_dir> [--no-context-cache] [--no-critique-policy] [--speculative]
+    # python -m task_exec.replay_harness replay <bundle_dir> [<bundle_dir> ...] [--runs N] [--latency-scale X] [--compare-async] [--speculative]
+    args = sys.argv[1:]
+    if "--speculative" in args:  # draft the next step while long-running actions execute
+        from task_exec.speculative_planner import speculative_planner
+        speculative_planner.enabled = True
+    if len(args) >= 3 and args[0] == "record":
+        if "--no-context-cache" in args:  # baseline: static prompt prefixes sent inline on every call
+            from tools.context_cache import context_prefix_cache
+            context_prefix_cache.enabled = False
+        if "--no-critique-policy" in args:  # baseline: independent critic before every action
+            import task_exec.critique_policy as critique_policy
+            critique_policy.CRITIQUE_POLICY_ENABLED = False
+        print(json.dumps(record_task(args[1], args[2]), indent=2))
+    elif len(args) >= 2 and args[0] == "replay":
+        runs = int(args[args.index("--runs") + 1]) if "--runs" in args else 3
+        scale = float(args[args.index("--latency-scale") + 1]) if "--latency-scale" in args else 0.0
+        bundles = [a for i, a in enumerate(args[1:], 1) if not a.startswith("--") and args[i - 1] not in ("--runs", "--latency-scale")]
+        if "--compare-async" in args:  # recorded I/O latencies are needed for the phases to overlap
+            for row in compare_async_core(bundles, runs, scale or 1.0):
+                print(
+                    f"{row['bundle']}: {row['iterations']} iterations | per iteration {row['sequential_iteration_s']:.3f}s sequential, "
+                    f"{row['async_iteration_s']:.3f}s async ({row['speedup']}x, {row['overlap_saved_s']:.3f}s overlapped)"
+                )
+            sys.exit(0)
+        for row in benchmark_bundles(bundles, runs, scale):
+            phases = " | ".join(f"{phase} {seconds:.3f}s" for phase, seconds in sorted(row["phases"].items()))
+            print(
+                f"{row['bundle']}: {row['iterations']} iterations, {row['actions']} actions, {row['status']} | "
+                f"wall {row['wall_s']:.3f}s cpu {row['cpu_s']:.3f}s peak {row['peak_mem_mb']:.1f}MB | {phases} | llm {row['llm']}"
+            )
+            for name, split in row["prompt_prefixes"].items():
+                print(
+                    f"  {name} prompt ({split['version']}): ~{split['prefix_tokens_per_call']} static + ~{split['suffix_tokens_per_call']} dynamic "
+                    f"tokens per call, prefix from context cache on {split['cached_calls']}/{split['calls']} calls"
+                )
+            critique = row["critique"]
+            print(
+                f"  critique: {critique.get('skip', 0)} skipped, {critique.get('self', 0)} self-critiqued, "
+                f"{critique.get('independent', 0)} independent ({critique.get('critic_s', 0.0):.2f}s), {critique.get('failed', 0)} failed, "
+                f"~{critique.get('saved_s_est', 0.0):.2f}s critic time saved"
+            )
+            speculation = row["speculation"]
+            if speculation.get("started"):
+                print(
+                    f"  speculation: {speculation['started']} drafts, {speculation.get('hits', 0)} used (hit rate {speculation.get('hit_rate', 0.0):.0%}), "
+                    f"~{speculation.get('saved_s', 0.0):.2f}s planning overlapped, {speculation.get('wasted_tokens', 0)} tokens discarded, misses {speculation.get('miss_reasons', {})}"
+                )
+    else:
+        print("usage: replay_harness record <instruction> <bundle_dir> [--no-context-cache] [--no-critique-policy] [--speculative] | replay <bundle_dir>... [--runs N] [--latency-scale X] [--compare-async] [--speculative]")
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional, Any, Callable, Tuple, List
+from PIL import Image
+
+from utils.frame_diff import compute_frame_diff, SIGNIFICANT_CHANGE_FRACTION
+
+# Opt-in speculative planning. While a long-running action executes, the planner drafts the
+# following step on a worker thread assuming the action succeeds. The draft is used only if
+# the assessment is SUCCESS, the next planning cycle has the instruction/sub-task the draft
+# assumed, and the post-action frame still matches the frame the draft was planned on
+# (these actions are not expected to change the screen). Otherwise it is discarded and the
+# step is planned normally; the discarded draft's tokens are still charged to the task.
+SPECULATIVE_PLANNING_ENABLED = False
+SPECULATIVE_ACTION_TYPES = frozenset({
+    "run_shell_command", "run_python_script", "process_local_files", "process_files_from_urls",
+    "search_youtube", "wait", "generate_large_content_with_gemini",
+})
+SPECULATION_MAX_FRAME_CHANGE = SIGNIFICANT_CHANGE_FRACTION
+SPECULATION_WORKERS = 2
+
+ZERO_TOKENS = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+
+
+class Speculation:
+    """A draft next step being planned while `action_type` runs."""
+
+    def __init__(self, future: Future, key: Tuple[str, int], base_frame: Optional[Image.Image], action_type: str):
+        self.future = future
+        self.key = key
+        self.base_frame = base_frame
+        self.action_type = action_type
+        self.started_at = time.perf_counter()
+
+
+class SpeculativePlanner:
+    def __init__(self, enabled: bool = SPECULATIVE_PLANNING_ENABLED, workers: int = SPECULATION_WORKERS):
+        self.enabled = enabled
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="speculative_planner")
+        self._lock = threading.Lock()
+        self._discarded: List[Speculation] = []
+
+    def should_speculate(self, action: Optional[Dict[str, Any]]) -> bool:
+        return self.enabled and isinstance(action, dict) and action.get("action_type") in SPECULATIVE_ACTION_TYPES
+
+    def start(self, action_type: str, key: Tuple[str, int], base_frame: Optional[Image.Image], plan_fn: Callable[[], Tuple[Optional[dict], Dict[str, int]]]) -> Speculation:
+        """Draft the step planned under `key` (instruction, sub-task index) on the worker pool."""
+        def _draft():
+            start = time.perf_counter()
+            step_data, tokens = plan_fn()
+            return step_data, tokens, time.perf_counter() - start
+        logging.info(f"Speculative planning: drafting the next step while '{action_type}' runs.")
+        return Speculation(self._pool.submit(_draft), key, base_frame, action_type)
+
+    def resolve(self, speculation: Speculation, key: Tuple[str, int], frame: Optional[Image.Image]) -> Tuple[Optional[Tuple[dict, Dict[str, int]]], Dict[str, Any]]:
+        """
+        The draft as (step_data, token_usage) if it is still valid for `key` and `frame`,
+        else None. Also returns the outcome for the task's speculation stats.
+        """
+        if key != speculation.key:
+            return None, self.discard(speculation, "context_changed")
+        diff = compute_frame_diff(speculation.base_frame, frame)
+        if diff is None or diff["changed_fraction"] > SPECULATION_MAX_FRAME_CHANGE:
+            return None, self.discard(speculation, "frame_changed")
+        wait_start = time.perf_counter()
+        try:
+            step_data, tokens, plan_s = speculation.future.result()
+        except Exception as e:
+            logging.error(f"Speculative planning: draft failed: {e}", exc_info=True)
+            return None, {"hit": False, "reason": "draft_error", "tokens": ZERO_TOKENS}
+        wait_s = time.perf_counter() - wait_start
+        if not step_data or not isinstance(step_data.get("next_action"), dict):
+            return None, {"hit": False, "reason": "draft_invalid", "tokens": tokens}
+        saved_s = max(0.0, plan_s - wait_s)
+        logging.info(f"Speculative planning: using the draft planned during '{speculation.action_type}' (saved ~{saved_s:.2f}s).")
+        return (step_data, tokens), {"hit": True, "reason": "hit", "saved_s": saved_s, "tokens": ZERO_TOKENS}
+
+    def discard(self, speculation: Speculation, reason: str) -> Dict[str, Any]:
+        """Drop a draft; its tokens are reported by collect_discarded_tokens() once it finishes."""
+        logging.info(f"Speculative planning: discarding the draft planned during '{speculation.action_type}' ({reason}).")
+        with self._lock:
+            self._discarded.append(speculation)
+        return {"hit": False, "reason": reason, "tokens": ZERO_TOKENS}
+
+    def collect_discarded_tokens(self) -> Dict[str, int]:
+        """Token usage of discarded drafts that have finished since the last call (on the executor thread)."""
+        totals = dict(ZERO_TOKENS)
+        with self._lock:
+            finished = [s for s in self._discarded if s.future.done()]
+            self._discarded = [s for s in self._discarded if not s.future.done()]
+        for speculation in finished:
+            if speculation.future.exception() is None:
+                tokens = speculation.future.result()[1] or {}
+                for key in totals:
+                    totals[key] += int(tokens.get(key, 0) or 0)
+        return totals
+
+
+speculative_planner = SpeculativePlanner()
@@ -4,8 +4,10 @@ import logging,re
 import google.generativeai as genai
 from PIL import  Image
 from tools.token_usage_tool import _get_token_usage # type: ignore
+from tools.llm_gateway import llm_gateway
 from vision.vis import _hash_pil_image,capture_full_screen # Keep these from vision.vis
 from utils.image_utils import image_to_base64 # Import this from the new utility file
+from utils.frame_diff import compute_frame_diff, changed_near_point, find_new_window_region, extract_click_point, summarize_frame_diff, SIGNIFICANT_CHANGE_FRACTION
 import json
 import demjson3
 from agents.ai_agent import UIAgent
@@ -18,8 +20,18 @@ from utils.app_name import get_base_app_name
 from chromaDB_management.cache import sanitize_filename,get_active_window_name
 from tools.shortcuts_tool import load_shortcuts_cache, get_application_shortcuts # Import shortcuts tool functions
 from task_exec.tasks_management import retrieve_similar_task_executions_from_db # Added for plan adaptation
+from chromaDB_management.task_context import retrieve_task_context, REINFORCEMENTS_N
 from task_exec.task_planner import critique_action # Assuming process_next_step is also in task_planner or imported elsewhere
 from tools.actions import execute_action
+from vision.listener_service import visual_listener_service
+from tools.call_metrics import call_metrics
+from tools.context_cache import context_prefix_cache
+from task_exec.planner_prompts import PLANNER_PROMPT_VERSION, PLANNER_STATIC_PREFIX, build_planner_suffix
+from task_exec.critique_policy import critique_tier, parse_self_critique, estimated_critic_seconds
+from task_exec.async_core import async_core
+from task_exec.speculative_planner import speculative_planner, Speculation
+from task_exec.history_manager import legacy_history_str, LEGACY_HISTORY_TURNS
+from tools.shortcut_index import shortcut_index
 import time # Removed datetime from here
 from chromaDB_management.credential import save_credential
 from utils.reinforcement_util import retrieve_relevant_reinforcements_from_db
@@ -31,9 +43,14 @@ from config import ( # type: ignore
 )
 from tools.files_upload import process_files_from_urls
 
+# Adapting the plan of a similar past successful task at start. Off: the executions lookup
+# carried no distance before, so this path never ran; adapted steps are critiqued like planned ones.
+ADAPT_PLANS_FROM_SIMILAR_TASKS = False
+ADAPTED_PLAN_REASON_PREFIX = "Adapted from similar past task"
+
 # Add this near the top of the file or where VALID_ACTIONS or similar is defined
 VALID_ACTIONS = {
-    "focus_window", "click", "type", "press_keys", "move_mouse", "run_shell_command", "run_python_script", "write_file", "navigate_web", "search_web", "search_youtube", "wait", "ask_user", "describe_screen", "capture_screenshot", "click_and_type", "multi_action", "task_complete", "read_file", "INFORM_USER", "process_local_files", "process_files_from_urls", "start_visual_listener", "edit_image_with_file", "refresh_application_shortcuts"
+    "focus_window", "click", "type", "press_keys", "move_mouse", "run_shell_command", "run_python_script", "write_file", "navigate_web", "search_web", "search_youtube", "wait", "ask_user", "describe_screen", "capture_screenshot", "click_and_type", "multi_action", "task_complete", "read_file", "INFORM_USER", "process_local_files", "process_files_from_urls", "start_visual_listener", "cancel_visual_listener", "edit_image_with_file", "refresh_application_shortcuts"
 }
 
 def _normalize_instruction(instruction: str) -> str:
@@ -50,9 +67,10 @@ def assess_action_outcome(
     exec_message: str,
     screenshot_after: Optional[Image.Image],
     llm_model: genai.GenerativeModel,
-    screenshot_before_hash: Optional[str] = None
+    screenshot_before_hash: Optional[str] = None,
+    screenshot_before: Optional[Image.Image] = None
 ) -> Tuple[str, str, Dict[str, int]]:
-    """Assess the outcome of an action."""
+    """Assess the outcome of an action. With `screenshot_before`, visual actions are judged by a region diff."""
     action_type = action.get("action_type", "unknown")
     logging.info(f"Assessing outcome for action: {action_type}")
     logging.debug(f"Execution Result: Success={exec_success}, Message='{exec_message}'")
@@ -121,7 +139,8 @@ def assess_action_outcome(
     non_visual_actions_or_explicit_success = {
         "wait", "get_clipboard", "set_clipboard", "save_credential", "read_file", "write_file",
         "navigate_web", "search_web", "capture_screenshot", "INFORM_USER", "search_youtube",
-        "generate_large_content_with_gemini", "process_local_files", "process_files_from_urls"  # Added file processing actions
+        "generate_large_content_with_gemini", "process_local_files", "process_files_from_urls",  # Added file processing actions
+        "start_visual_listener", "cancel_visual_listener"
     }
     
     if action_type in non_visual_actions_or_explicit_success:
@@ -132,10 +151,15 @@ def assess_action_outcome(
         logging.warning("Cannot perform visual assessment: Screenshot after action is missing. Assuming success based on execution report.")
         return "SUCCESS", f"Action executed successfully (non-visual assessment as screenshot_after is missing): {exec_message}", token_usage
 
-    current_screenshot_hash = _hash_pil_image(screenshot_after)
+    frame_diff = compute_frame_diff(screenshot_before, screenshot_after) if screenshot_before is not None else None
     screen_changed = False
-    if screenshot_before_hash and current_screenshot_hash:
-        screen_changed = screenshot_before_hash != current_screenshot_hash
+    if frame_diff is not None:
+        screen_changed = bool(frame_diff["regions"])
+        logging.debug(f"Frame diff ({frame_diff['elapsed_ms']:.1f}ms): {summarize_frame_diff(frame_diff)}")
+    else:
+        current_screenshot_hash = _hash_pil_image(screenshot_after)
+        if screenshot_before_hash and current_screenshot_hash:
+            screen_changed = screenshot_before_hash != current_screenshot_hash
 
     # For visual actions, we need to verify the screen changed
     visual_change_expected = action_type in {
@@ -145,13 +169,29 @@ def assess_action_outcome(
 
     if visual_change_expected:
         if not screen_changed:
-            logging.warning(f"Screen content hash did NOT change after action '{action_type}' which usually causes visual changes. Assessing as FAILURE.")
+            logging.warning(f"Screen content did NOT change after action '{action_type}' which usually causes visual changes. Assessing as FAILURE.")
             return "FAILURE", f"Action '{action_type}' reported success, but screen content did not change visually, indicating it likely failed.", token_usage
-        else:
-            logging.info("Screen content hash changed as expected for visual action.")
-            return "SUCCESS", f"Action '{action_type}' executed successfully and screen content changed as expected.", token_usage
+
+        click_point = extract_click_point(exec_message) if action_type in {"click", "click_and_type"} else None
+        if frame_diff is not None and click_point:
+            diff_summary = summarize_frame_diff(frame_diff)
+            if changed_near_point(frame_diff, click_point):
+                logging.info(f"Screen changed around click point {click_point}.")
+                return "SUCCESS", f"Action '{action_type}' executed successfully; screen changed around the clicked point {click_point} ({diff_summary}).", token_usage
+            new_window_bbox = find_new_window_region(frame_diff)
+            if new_window_bbox:
+                logging.info(f"New window/dialog-like region appeared at {new_window_bbox} after click.")
+                return "SUCCESS", f"Action '{action_type}' executed successfully; a new window or dialog appeared at {new_window_bbox} ({diff_summary}).", token_usage
+            if frame_diff["changed_fraction"] >= SIGNIFICANT_CHANGE_FRACTION:
+                logging.info(f"Screen changed significantly away from click point {click_point}.")
+                return "SUCCESS", f"Action '{action_type}' executed successfully; screen changed away from the clicked point {click_point} ({diff_summary}).", token_usage
+            logging.warning(f"Only small changes far from click point {click_point} after '{action_type}'. Assessing as FAILURE.")
+            return "FAILURE", f"Action '{action_type}' reported success, but the screen only changed in small areas away from the clicked point {click_point} ({diff_summary}), e.g. a clock or animation. The click likely had no effect.", token_usage
+
+        logging.info("Screen content changed as expected for visual action.")
+        return "SUCCESS", f"Action '{action_type}' executed successfully and screen content changed as expected.", token_usage
     else:
-        logging.info("Screen content hash did not change (as expected for this action type or no change expected).")
+        logging.info("Screen content did not change (as expected for this action type or no change expected).")
         return "SUCCESS", f"Action '{action_type}' executed successfully.", token_usage
 
 
@@ -368,8 +408,7 @@ def request_replan_from_failure(
     token_usage = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
     try:
         safety_settings = {}
-        response = llm_model.generate_content(content, safety_settings=safety_settings)
-        token_usage = _get_token_usage(response)
+        response, token_usage, _ = llm_gateway.generate("planner", content, model=llm_model, safety_settings=safety_settings)
         raw_response_text = ""
         if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
             raw_response_text = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text')).strip()
@@ -592,6 +631,124 @@ def _adapt_plan_from_past_task(
     return adapted_plan if adapted_plan else None
 
 
+def _collect_listener_directives(
+    listener_directives: List[Dict[str, Any]],
+    agent_state: 'AgentState'
+) -> Tuple[Optional[List[Dict[str, Any]]], Optional[str]]:
+    """
+    Record background listener results in the task and merge their plans.
+    Returns (plan_to_inject, reason) for fired/timed-out listeners with actions, else (None, None).
+    """
+    merged_plan: List[Dict[str, Any]] = []
+    reasons = []
+    for listener_directive in listener_directives:
+        if agent_state.current_task:
+            listener_tokens = listener_directive.get("token_usage")
+            if isinstance(listener_tokens, dict): agent_state.current_task._accumulate_tokens(listener_tokens)
+            agent_state.current_task.conversation_history.append({"role": "system", "content": f"System Observation: Visual listener {listener_directive.get('listener_id')}: {listener_directive.get('message', '')}"})
+        agent_state.add_thought(f"Visual listener {listener_directive.get('listener_id')} result: {listener_directive.get('message', '')}", type="listener_event")
+        if listener_directive.get("type") == "inject_plan" and listener_directive.get("plan"):
+            merged_plan.extend(listener_directive["plan"])
+            reasons.append(listener_directive.get("reason", "visual_listener"))
+    if not merged_plan:
+        return None, None
+    return merged_plan, "; ".join(reasons)
+
+
+def _reinforcement_query(instruction: str, history: List[str]) -> str:
+    """The latest user goal/response in the history, else the instruction."""
+    for item in reversed(history or []):
+        item_lower = item.lower()
+        if item_lower.startswith("user goal:") or item_lower.startswith("user responded:"):
+            return item.split(":", 1)[-1].strip()
+    return instruction
+
+
+def _executed_actions_summary(results: List[Tuple[Dict[str, Any], bool, str, Any]]) -> str:
+    """The last five executed actions and their outcomes, for the planner prompt."""
+    executed_actions_summary_parts = []
+    if results:
+        for i, (action_dict_res, success_res, msg_res, _) in reversed(list(enumerate(results[-5:]))):
+            action_type_res = action_dict_res.get('action_type', 'Unknown')
+            outcome_res = "OK" if success_res else "FAIL"
+            exec_msg_only_res = msg_res.split("| Assessment:")[0].strip()
+            summary_line = f"  Prev. Action {len(results) - i}: {action_type_res}, Outcome: {outcome_res} - Msg: {exec_msg_only_res[:70]}{'...' if len(exec_msg_only_res)>70 else ''}"
+            executed_actions_summary_parts.append(summary_line)
+    return "\n".join(executed_actions_summary_parts) if executed_actions_summary_parts else "No actions executed yet in this task."
+
+
+def _shortcuts_for_prompt(agent_state: Any, app_name: str, shortcuts: Union[str, List[Dict[str, str]]], instruction: str) -> Union[str, List[Dict[str, str]]]:
+    """The shortcut records relevant to `instruction` instead of the app's whole list (see tools/shortcut_index.py)."""
+    if not isinstance(shortcuts, str) or not shortcuts.strip():
+        return shortcuts
+    shortcuts_text, shortcut_stats = shortcut_index.select(app_name, shortcuts, instruction)
+    if agent_state and agent_state.current_task: agent_state.current_task._accumulate_shortcut_prompt_stats(shortcut_stats)
+    return shortcuts_text
+
+
+def _next_planning_cycle(current_sub_tasks: List[str], current_sub_task_index: int, current_task_instruction: str) -> Optional[Tuple[str, int]]:
+    """(instruction, sub-task index) the next planning cycle uses if the current action succeeds; None if the task would complete."""
+    if current_sub_tasks and 0 <= current_sub_task_index < len(current_sub_tasks):
+        next_index = current_sub_task_index + 1
+        return (current_sub_tasks[next_index], next_index) if next_index < len(current_sub_tasks) else None
+    return current_task_instruction, -1
+
+
+def _charge_discarded_drafts(agent_state: Any) -> None:
+    """Charge finished, discarded speculative drafts to the task's tokens."""
+    discarded_tokens = speculative_planner.collect_discarded_tokens()
+    if agent_state.current_task and discarded_tokens["total_tokens"]:
+        agent_state.current_task._accumulate_tokens(discarded_tokens)
+        agent_state.current_task._accumulate_speculation_stats(wasted_tokens=discarded_tokens["total_tokens"])
+
+
+def _detect_app_context(conversation_history: List[Dict[str, Any]], current_app_base_name: Optional[str]) -> Dict[str, Any]:
+    """
+    Active window, the term to look shortcuts up by (the website for browsers, from recent
+    history) and, when the app changed since `current_app_base_name`, its shortcuts.
+    """
+    try:
+        full_app_name = get_active_window_name()
+        app_base_name = get_base_app_name(full_app_name)
+        name_for_shortcuts_lookup = app_base_name
+        is_website_shortcut_lookup = False
+        known_browsers_bases_exec = ["chrome.exe", "firefox.exe", "msedge.exe", "brave.exe"]
+
+        if app_base_name.lower() in known_browsers_bases_exec:
+            if conversation_history:
+                for msg in reversed(conversation_history[-5:]):
+                    if msg["role"] == "system" and "content" in msg and "System Observation: Opened web URL:" in msg["content"]:
+                        url_match = re.search(r"Opened web URL:\s*(https?://[^/\s]+)", msg["content"])
+                        if url_match:
+                            full_url = url_match.group(1)
+                            domain_match = re.search(r"https?://(?:www\.)?([^/]+)", full_url)
+                            if domain_match:
+                                domain = domain_match.group(1)
+                                name_for_shortcuts_lookup = domain
+                                logging.info(f"Browser '{app_base_name}' is active. Identified active website '{domain}' from history. Will fetch shortcuts for '{domain}'.")
+                                is_website_shortcut_lookup = True
+                                break
+                else:
+                    logging.info(f"Browser '{app_base_name}' is active, but no recent 'Opened web URL' found in history. Using browser name for shortcuts.")
+            else:
+                logging.info(f"Browser '{app_base_name}' is active, but no conversation history to check for URLs. Using browser name for shortcuts.")
+
+        shortcuts = get_application_shortcuts(name_for_shortcuts_lookup) if app_base_name != current_app_base_name else None
+        return {
+            "full_app_name": full_app_name, "app_base_name": app_base_name, "lookup_name": name_for_shortcuts_lookup,
+            "is_website": is_website_shortcut_lookup, "shortcuts": shortcuts, "error": None,
+        }
+    except Exception as app_detect_err:
+        logging.error(f"Error during application detection/shortcut handling: {app_detect_err}", exc_info=True)
+        return {"error": str(app_detect_err)}
+
+
+def _capture_planning_frame() -> Tuple[Optional[Image.Image], Optional[str], Optional[str]]:
+    """Planning screenshot with its change-detection hash and base64 PNG for the planner prompt."""
+    screenshot = capture_full_screen()
+    return screenshot, _hash_pil_image(screenshot), image_to_base64(screenshot) if screenshot else None
+
+
 def iterative_task_executor(
     original_instruction: str,
     agent_state: 'AgentState',
@@ -618,6 +775,7 @@ def iterative_task_executor(
     task_completed = False
     current_app_base_name = "unknown"
     current_shortcuts: Union[str, List[Dict[str, str]]] = []
+    shortcuts_app_name = "unknown"
     last_assessment_screenshot_hash: Optional[str] = None
     action_failure_counts: Dict[str, int] = agent_state.current_task.action_failure_counts if agent_state.current_task else {}
 
@@ -644,19 +802,37 @@ def iterative_task_executor(
     instruction_for_current_planning_cycle = original_instruction
     pending_risky_action: Optional[Dict[str, Any]] = None
     user_response_to_ask: Optional[str] = None
+    speculation: Optional[Speculation] = None # Draft of the next step planned while the last action ran
 
     logging.info(f"Starting iterative execution for: {original_instruction}")
+    executor_started = time.perf_counter()
+    if agent_state.current_task:
+        call_metrics.activate_task(agent_state.current_task.task_id, agent_state.current_task.call_metrics)
     load_shortcuts_cache()
 
+    # Task-start context: retrieved by the Flask route for a new task, else here (see chromaDB_management/task_context.py)
+    task_context = agent_state.current_task.task_context if agent_state.current_task else None
+    context_source = "route"
+    if agent_state.current_task: agent_state.current_task.task_context = None # Used once
+    if task_context is None or task_context.instruction != original_instruction:
+        task_context = retrieve_task_context(original_instruction)
+        context_source = "executor"
+    if agent_state.current_task:
+        agent_state.current_task._record_task_start_stats(task_context, context_source)
+        if task_context.reinforcements is not None: # Served from the per-task cache when the first planning query is the instruction
+            agent_state.current_task.reinforcement_cache.put(original_instruction, REINFORCEMENTS_N, task_context.reinforcements, task_context.timings.get("reinforcements_ms", 0.0))
+    if task_context.user_task_structure:
+        logging.info(f"Similar saved task structure: '{task_context.user_task_structure['task_name']}' (Dist: {task_context.user_task_structure['distance']:.4f}).")
+
     if not plan_to_inject:
         logging.info(f"Checking for similar past successful tasks for: {original_instruction}")
-        similar_past_tasks = retrieve_similar_task_executions_from_db(original_instruction, n_results=1) # type: ignore
+        similar_past_tasks = task_context.executions
         if similar_past_tasks:
             for past_task_data in similar_past_tasks:
                 past_metadata = past_task_data.get("metadata", {})
                 past_status = past_metadata.get("status")
                 past_instruction_text = past_metadata.get("original_instruction")
-                similarity_distance = past_task_data.get("distance", 1.0)
+                similarity_distance = past_task_data.get("distance", 1.0) if ADAPT_PLANS_FROM_SIMILAR_TASKS else 1.0
                 SIMILARITY_THRESHOLD_FOR_ADAPTATION = 0.30
 
                 if past_status == "success" and past_instruction_text and similarity_distance < SIMILARITY_THRESHOLD_FOR_ADAPTATION:
@@ -666,7 +842,7 @@ def iterative_task_executor(
                         adapted_plan = _adapt_plan_from_past_task(past_actions_json_str, original_instruction, past_instruction_text, similarity_distance) # type: ignore
                         if adapted_plan:
                             plan_to_inject = adapted_plan
-                            plan_injection_reason = f"Adapted from similar past task (Dist: {similarity_distance:.4f}): '{past_instruction_text}'"
+                            plan_injection_reason = f"{ADAPTED_PLAN_REASON_PREFIX} (Dist: {similarity_distance:.4f}): '{past_instruction_text}'"
                             print(f"\n{BLUE}=== Using Adapted Plan from Past Task ===")
                             print(f"Current Task: '{original_instruction}'")
                             print(f"Adapted from: '{past_instruction_text}' (Similarity Distance: {similarity_distance:.4f})")
@@ -762,6 +938,25 @@ def iterative_task_executor(
             yield {"type": "paused"}
             logging.debug("Generator: Resuming from pause check.")
 
+        if agent_state.current_task and user_response_to_ask is None and agent_state.current_task.token_budget_exceeded():
+            session = agent_state.current_task
+            used_tokens = session.total_tokens.get("total_tokens", 0)
+            agent_state.add_thought(f"Token budget reached: {used_tokens} of {session.token_budget} tokens used. Pausing.", type="token_budget")
+            session.budget_paused = True
+            budget_reply = yield {"type": "ask_user", "question": f"This task has used {used_tokens} tokens, reaching its budget of {session.token_budget}. Reply with a new budget to continue (any other reply adds {session.token_budget} more)."}
+            if session.budget_paused: # Not already applied by the app when it received the reply
+                session.raise_token_budget(budget_reply)
+            continue
+
+        if agent_state.current_task and not action_to_execute and not pending_risky_action:
+            listener_plan, listener_reason = _collect_listener_directives(
+                visual_listener_service.drain_directives(agent_state.current_task.task_id), agent_state
+            )
+            if listener_plan:
+                logging.info(f"Background visual listener fired; injecting {len(listener_plan)} step(s) ahead of the current plan.")
+                plan_to_inject = listener_plan + (plan_to_inject or [])
+                plan_injection_reason = listener_reason
+
         if user_response_to_ask is not None:
             response_processed_this_cycle = False
             if pending_risky_action:
@@ -809,52 +1004,60 @@ def iterative_task_executor(
                     plan_to_inject = None
                     plan_injection_reason = None
         
+        if not action_to_execute and chosen_high_level_plan_description:
+            logging.info(f"Using chosen high-level plan description for detailed planning: {chosen_high_level_plan_description[:200]}...")
+            instruction_for_current_planning_cycle = chosen_high_level_plan_description
+            plan_source = "Detailed planning of chosen high-level path"
+            chosen_high_level_plan_description = None
+
+        # Independent I/O for this iteration runs concurrently on the async core (see task_exec/async_core.py)
+        history_snapshot = list(agent_state.current_task.conversation_history) if agent_state.current_task else []
+        will_plan = not action_to_execute and not plan_to_inject
+        reinforcement_history = agent_state.current_task.history_lines() if agent_state.current_task and will_plan else []
         try:
-            full_app_name = get_active_window_name()
-            app_base_name = get_base_app_name(full_app_name)
-            name_for_shortcuts_lookup = app_base_name
-            is_website_shortcut_lookup = False
-            known_browsers_bases_exec = ["chrome.exe", "firefox.exe", "msedge.exe", "brave.exe"]
-
-            if app_base_name.lower() in known_browsers_bases_exec:
-                if agent_state.current_task and agent_state.current_task.conversation_history:
-                    for msg in reversed(agent_state.current_task.conversation_history[-5:]):
-                        if msg["role"] == "system" and "content" in msg and "System Observation: Opened web URL:" in msg["content"]:
-                            url_match = re.search(r"Opened web URL:\s*(https?://[^/\s]+)", msg["content"])
-                            if url_match:
-                                full_url = url_match.group(1)
-                                domain_match = re.search(r"https?://(?:www\.)?([^/]+)", full_url)
-                                if domain_match:
-                                    domain = domain_match.group(1)
-                                    name_for_shortcuts_lookup = domain
-                                    logging.info(f"Browser '{app_base_name}' is active. Identified active website '{domain}' from history. Will fetch shortcuts for '{domain}'.")
-                                    is_website_shortcut_lookup = True
-                                    break
-                    else:
-                        logging.info(f"Browser '{app_base_name}' is active, but no recent 'Opened web URL' found in history. Using browser name for shortcuts.")
-                else:
-                    logging.info(f"Browser '{app_base_name}' is active, but no conversation history to check for URLs. Using browser name for shortcuts.")
-
-            if app_base_name != current_app_base_name:
+            observed, observe_errors = async_core.run_phases_settled({
+                "app_context": lambda: _detect_app_context(history_snapshot, current_app_base_name),
+                "frame": _capture_planning_frame if not action_to_execute else None,
+                "reinforcements": (lambda: retrieve_relevant_reinforcements_from_db(
+                    _reinforcement_query(instruction_for_current_planning_cycle, reinforcement_history), n_results=5,
+                    cache=agent_state.current_task.reinforcement_cache if agent_state.current_task else None
+                )) if will_plan else None,
+            })
+            for phase_name, phase_err in observe_errors.items(): # Phases that succeeded are still used
+                logging.error(f"Error while gathering iteration context ({phase_name}): {phase_err}", exc_info=phase_err)
+        except Exception as observe_err:
+            logging.error(f"Error while gathering iteration context: {observe_err}", exc_info=True)
+            observed = {}
+        if speculation and not will_plan:
+            if agent_state.current_task: agent_state.current_task._accumulate_speculation_stats(speculative_planner.discard(speculation, "superseded"))
+            speculation = None
+        _charge_discarded_drafts(agent_state)
+
+        app_context = observed.get("app_context")
+        if not app_context or app_context.get("error"): # Logged where it failed
+            current_app_base_name = "unknown"; current_shortcuts = ""; shortcuts_app_name = "unknown"
+        else:
+            full_app_name = app_context["full_app_name"]
+            app_base_name = app_context["app_base_name"]
+            name_for_shortcuts_lookup = app_context["lookup_name"]
+            if app_context["shortcuts"] is not None:
                 logging.info(f"Application context changed. Old: '{current_app_base_name}', New: '{app_base_name}', Full title: '{full_app_name}'. Shortcut lookup term: '{name_for_shortcuts_lookup}'")
                 current_app_base_name = app_base_name
-                current_shortcuts_str, shortcut_tokens = get_application_shortcuts(name_for_shortcuts_lookup) # type: ignore
+                current_shortcuts_str, shortcut_tokens = app_context["shortcuts"] # type: ignore
                 current_shortcuts = current_shortcuts_str # type: ignore
+                shortcuts_app_name = name_for_shortcuts_lookup
                 if current_shortcuts_str and current_shortcuts_str.strip(): # type: ignore
                     from config import GREEN, RESET
                     logging.info(f"{GREEN}Using shortcuts for '{name_for_shortcuts_lookup}':\n{current_shortcuts_str}{RESET}") # type: ignore
                 if agent_state.current_task: agent_state.current_task._accumulate_tokens(shortcut_tokens)
-                if is_website_shortcut_lookup:
+                if app_context["is_website"]:
                     from config import YELLOW, RESET
                     logging.info(f"{YELLOW}Fetching shortcuts for WEBSITE: {name_for_shortcuts_lookup}{RESET}")
                 if agent_state.current_task: agent_state.current_task.conversation_history.append({"role": "system", "content": f"System Observation: Active application changed to '{app_base_name}' (Window: '{full_app_name}')."})
-        except Exception as app_detect_err:
-            logging.error(f"Error during application detection/shortcut handling: {app_detect_err}", exc_info=True)
-            current_app_base_name = "unknown"; current_shortcuts = ""
-        
+
         if not action_to_execute:
-            planning_screenshot = capture_full_screen()
-            screenshot_before_action_hash = _hash_pil_image(planning_screenshot)
+            planning_screenshot, screenshot_before_action_hash, planning_screenshot_base64 = observed.get("frame") or _capture_planning_frame()
+            prefetched_reinforcements = observed.get("reinforcements")
 
             if last_assessment_screenshot_hash and screenshot_before_action_hash and screenshot_before_action_hash != last_assessment_screenshot_hash:
                 logging.info("Detected screen change since last assessment.")
@@ -863,12 +1066,6 @@ def iterative_task_executor(
             planning_reasoning = "Planning skipped due to pending credential request or injected plan."
             next_step_data = None
 
-            if chosen_high_level_plan_description:
-                logging.info(f"Using chosen high-level plan description for detailed planning: {chosen_high_level_plan_description[:200]}...")
-                instruction_for_current_planning_cycle = chosen_high_level_plan_description
-                plan_source = "Detailed planning of chosen high-level path"
-                chosen_high_level_plan_description = None
-
             if plan_to_inject:
                 action_to_execute = plan_to_inject.pop(0)
                 planning_reasoning = f"Executing step from injected plan (original reason: {plan_injection_reason})"
@@ -877,29 +1074,36 @@ def iterative_task_executor(
                     plan_injection_reason = None
                 logging.info(f"Using action from injected plan: {action_to_execute.get('action_type') if isinstance(action_to_execute, dict) else 'Invalid injected action'}")
             else:
-                string_history_for_planning = [f"{msg['role']}: {msg['content']}" for msg in (agent_state.current_task.conversation_history if agent_state.current_task else [])]
-                executed_actions_summary_parts = []
-                if results:
-                    for i, (action_dict_res, success_res, msg_res, _) in reversed(list(enumerate(results[-5:]))):
-                        action_type_res = action_dict_res.get('action_type', 'Unknown')
-                        outcome_res = "OK" if success_res else "FAIL"
-                        exec_msg_only_res = msg_res.split("| Assessment:")[0].strip()
-                        summary_line = f"  Prev. Action {len(results) - i}: {action_type_res}, Outcome: {outcome_res} - Msg: {exec_msg_only_res[:70]}{'...' if len(exec_msg_only_res)>70 else ''}"
-                        executed_actions_summary_parts.append(summary_line)
-                executed_actions_summary_str_for_prompt = "\n".join(executed_actions_summary_parts) if executed_actions_summary_parts else "No actions executed yet in this task."
-
-                next_step_data, planning_tokens = process_next_step(
-                    instruction_for_current_planning_cycle,
-                    string_history_for_planning,
-                    llm_model,
-                    current_shortcuts, # type: ignore
-                    [],
-                    planning_screenshot,
-                    executed_actions_summary=executed_actions_summary_str_for_prompt,
-                    overall_original_instruction=original_instruction,
-                    all_sub_tasks_count=len(current_sub_tasks) if current_sub_tasks else 0,
-                    current_sub_task_idx=current_sub_task_index if current_sub_tasks else -1
-                )
+                string_history_for_planning = agent_state.current_task.history_lines() if agent_state.current_task else []
+                history_str_for_planning = agent_state.current_task.history_segment("planner", llm_model) if agent_state.current_task else None
+                executed_actions_summary_str_for_prompt = _executed_actions_summary(results)
+
+                drafted_step = None
+                if speculation:
+                    drafted_step, speculation_outcome = speculative_planner.resolve(
+                        speculation, (instruction_for_current_planning_cycle, current_sub_task_index if current_sub_tasks else -1), planning_screenshot
+                    )
+                    speculation = None
+                    if agent_state.current_task:
+                        agent_state.current_task._accumulate_speculation_stats(speculation_outcome, wasted_tokens=speculation_outcome["tokens"]["total_tokens"])
+                        agent_state.current_task._accumulate_tokens(speculation_outcome["tokens"])
+                if drafted_step:
+                    next_step_data, planning_tokens = drafted_step
+                else:
+                    next_step_data, planning_tokens = process_next_step(
+                        instruction_for_current_planning_cycle,
+                        string_history_for_planning,
+                        llm_model,
+                        _shortcuts_for_prompt(agent_state, shortcuts_app_name, current_shortcuts, instruction_for_current_planning_cycle),
+                        prefetched_reinforcements,
+                        planning_screenshot,
+                        executed_actions_summary=executed_actions_summary_str_for_prompt,
+                        overall_original_instruction=original_instruction,
+                        all_sub_tasks_count=len(current_sub_tasks) if current_sub_tasks else 0,
+                        current_sub_task_idx=current_sub_task_index if current_sub_tasks else -1,
+                        planning_screenshot_base64=planning_screenshot_base64,
+                        history_str=history_str_for_planning
+                    )
                 if agent_state.current_task: agent_state.current_task._accumulate_tokens(planning_tokens)
                 if next_step_data is None or "next_action" not in next_step_data or not isinstance(next_step_data["next_action"], dict):
                     reason = f"Planning failed: Invalid or no 'next_action' from process_next_step: {next_step_data}"
@@ -922,6 +1126,7 @@ def iterative_task_executor(
             logging.info(f"Executing special action: refresh_application_shortcuts for '{name_for_shortcuts_lookup}'") # type: ignore
             current_shortcuts_str, shortcut_tokens = get_application_shortcuts(name_for_shortcuts_lookup, force_refresh=True) # type: ignore
             current_shortcuts = current_shortcuts_str # type: ignore
+            shortcuts_app_name = name_for_shortcuts_lookup # type: ignore
             if agent_state.current_task: agent_state.current_task._accumulate_tokens(shortcut_tokens)
             refresh_message = f"Application shortcuts for '{name_for_shortcuts_lookup}' have been refreshed." # type: ignore
             if agent_state.current_task: agent_state.current_task.conversation_history.append({"role": "system", "content": f"System Observation: {refresh_message}"})
@@ -940,15 +1145,38 @@ def iterative_task_executor(
 
         critique_passed = True
         critique_feedback = "Critique skipped for credential value request or injected plan."
-        if not (pending_credential_request and credential_consent_choice in ['onetime', 'remember']) and not plan_injection_reason:
-            critique_screenshot = planning_screenshot if 'planning_screenshot' in locals() else capture_full_screen()
-            string_history_for_critique = [f"{msg['role']}: {msg['content']}" for msg in (agent_state.current_task.conversation_history if agent_state.current_task else [])]
+        injected_without_critique = bool(plan_injection_reason) and not plan_injection_reason.startswith(ADAPTED_PLAN_REASON_PREFIX)
+        if not (pending_credential_request and credential_consent_choice in ['onetime', 'remember']) and not injected_without_critique:
             if not action_to_execute.get("_confirmed_"):
-                logging.info(f"About to call critique_action with critic_model: {critic_model}")
-                critique_passed, critique_feedback, critique_tokens = critique_action(
-                    instruction_for_current_planning_cycle, string_history_for_critique, action_to_execute, critic_model, critique_screenshot # type: ignore
-                )
-                if agent_state.current_task: agent_state.current_task._accumulate_tokens(critique_tokens)
+                critique_tier_used = critique_tier(action_to_execute)
+                self_critique = parse_self_critique(next_step_data) if critique_tier_used == "self" else None
+                if critique_tier_used == "self" and self_critique is None:
+                    logging.info(f"Planner gave no self-critique for '{action_type}', using the independent critic.")
+                    critique_tier_used = "independent"
+                critic_seconds = 0.0
+                if critique_tier_used == "skip":
+                    critique_feedback = f"Critique skipped for low-risk action '{action_type}'."
+                elif critique_tier_used == "self":
+                    critique_passed, critique_feedback = self_critique # type: ignore
+                    critique_feedback = f"Self-critique: {critique_feedback}"
+                else:
+                    critique_screenshot = planning_screenshot if 'planning_screenshot' in locals() else capture_full_screen()
+                    string_history_for_critique = agent_state.current_task.history_lines() if agent_state.current_task else []
+                    history_str_for_critique = agent_state.current_task.history_segment("critic", llm_model) if agent_state.current_task else None
+                    logging.info(f"About to call critique_action with critic_model: {critic_model}")
+                    critic_started = time.time()
+                    critique_passed, critique_feedback, critique_tokens = critique_action(
+                        instruction_for_current_planning_cycle, string_history_for_critique, action_to_execute, critic_model, critique_screenshot, # type: ignore
+                        history_str=history_str_for_critique
+                    )
+                    critic_seconds = time.time() - critic_started
+                    if agent_state.current_task: agent_state.current_task._accumulate_tokens(critique_tokens)
+                logging.info(f"Critique tier for '{action_type}': {critique_tier_used} (passed={critique_passed}).")
+                if agent_state.current_task:
+                    agent_state.current_task._accumulate_critique_stats(
+                        critique_tier_used, critique_passed, critic_seconds,
+                        0.0 if critique_tier_used == "independent" else estimated_critic_seconds()
+                    )
                 if not critique_passed:
                     if agent_state.current_task: agent_state.current_task.conversation_history.append({"role": "system", "content": f"System: Proposed action {action_type} critiqued: {critique_feedback}. Reconsidering."})
                     results.append((({'action_type': 'CRITIQUE_FAILED', 'parameters': {'failed_action': action_type}}, False, f"Critique failed: {critique_feedback}", None)))
@@ -957,9 +1185,34 @@ def iterative_task_executor(
                     replan_attempts_current_cycle = 0
                     if pending_credential_request and not credential_consent_choice:
                         pending_credential_request = None
+                    if plan_injection_reason and plan_injection_reason.startswith(ADAPTED_PLAN_REASON_PREFIX):
+                        plan_to_inject = None; plan_injection_reason = None # Drop the rest of the adapted plan and plan normally
                     action_to_execute = None
                     continue
 
+        if action_type == "task_complete" and agent_state.current_task and visual_listener_service.has_active_listeners(agent_state.current_task.task_id):
+            logging.info("Task completion proposed while background visual listeners are running. Waiting for them before completing.")
+            agent_state.add_thought("Waiting for running visual listeners before completing the task.", type="listener_event")
+            # Never block the generator (and the request driving it) on listeners: pause with a notice and
+            # re-check whenever the task is resumed, until a listener injects a plan or none are left running.
+            listener_plan, listener_reason = None, None
+            while True:
+                listener_plan, listener_reason = _collect_listener_directives(
+                    visual_listener_service.drain_directives(agent_state.current_task.task_id), agent_state
+                )
+                if listener_plan or not visual_listener_service.has_active_listeners(agent_state.current_task.task_id):
+                    break
+                running_count = len([s for s in visual_listener_service.get_status(agent_state.current_task.task_id) if s["status"] == "running"])
+                agent_state.task_is_paused = True
+                agent_state.current_task.status = "paused"
+                yield {"type": "inform_user", "message": f"The task is ready to complete but {running_count} visual listener(s) are still running. Continue the task to check on them again, or cancel them to finish now."}
+            if listener_plan:
+                plan_to_inject = listener_plan
+                plan_injection_reason = listener_reason
+                total_consecutive_failures = 0; consecutive_failures_on_current_step = 0; replan_attempts_current_cycle = 0
+                action_to_execute = None
+                continue
+
         is_legitimate_overall_completion_check_for_action = False
         if action_type == "task_complete":
             is_legitimate_overall_completion_check_for_action = not current_sub_tasks or \
@@ -970,13 +1223,40 @@ def iterative_task_executor(
             else:
                 logging.info(f"LLM planned 'task_complete' for sub-task {current_sub_task_index + 1}/{len(current_sub_tasks)} (not the last). Treating as current sub-task success signal.")
         
-        exec_result = execute_action(action_to_execute, agent) # type: ignore
+        next_planning = _next_planning_cycle(current_sub_tasks, current_sub_task_index, current_task_instruction)
+        if next_step_data and next_planning and not task_completed and speculative_planner.should_speculate(action_to_execute):
+            assumed_line = f"system: System Observation: '{action_type}' is still running; plan the next step assuming it succeeds."
+            assumed_history = string_history_for_planning + [assumed_line]
+            assumed_history_str = f"{history_str_for_planning}\n{assumed_line}" if history_str_for_planning is not None else None
+            assumed_summary = _executed_actions_summary(results + [(action_to_execute, True, "Assumed successful (still running)", None)])
+            assumed_shortcuts = _shortcuts_for_prompt(None, shortcuts_app_name, current_shortcuts, next_planning[0])
+            speculation = speculative_planner.start(
+                action_type, next_planning, planning_screenshot, # type: ignore
+                lambda: process_next_step(
+                    next_planning[0], assumed_history, llm_model, assumed_shortcuts, None, planning_screenshot, # type: ignore
+                    executed_actions_summary=assumed_summary,
+                    overall_original_instruction=original_instruction,
+                    all_sub_tasks_count=len(current_sub_tasks) if current_sub_tasks else 0,
+                    current_sub_task_idx=next_planning[1],
+                    planning_screenshot_base64=planning_screenshot_base64,
+                    history_str=assumed_history_str
+                )
+            )
+            if agent_state.current_task: agent_state.current_task._accumulate_speculation_stats(started=True)
+
+        action_started = time.time()
+        if agent_state.current_task and agent_state.current_task.task_start_stats.get("time_to_first_action_s") is None:
+            route_context_s = task_context.timings.get("total_ms", 0.0) / 1000 if context_source == "route" else 0.0
+            agent_state.current_task._record_task_start_stats(first_action_s=time.perf_counter() - executor_started + route_context_s)
+        with call_metrics.action_scope(action_type):
+            exec_result = execute_action({**action_to_execute, "_task_id_": agent_state.current_task.task_id if agent_state.current_task else None}, agent) # type: ignore
         exec_success = False; exec_message = "Execution error"; special_directive = None
         if isinstance(exec_result, tuple) and len(exec_result) == 3 and exec_result[0] == -2: exec_result = (True, exec_result[1], exec_result[2]) # type: ignore
         if isinstance(exec_result, tuple) and len(exec_result) == 3: exec_success, exec_message, special_directive = exec_result # type: ignore
         elif isinstance(exec_result, tuple) and len(exec_result) == 2: 
             exec_success, exec_message = exec_result # type: ignore
             special_directive = None
+        call_metrics.record("tool", action_type or "unknown", latency_s=time.time() - action_started, error=not exec_success)
         
         if special_directive and isinstance(special_directive, dict):
             directive_type = special_directive.get("type")
@@ -998,6 +1278,8 @@ def iterative_task_executor(
             if isinstance(special_directive, dict) and "token_usage" in special_directive:
                 action_tokens = special_directive.get("token_usage")
                 if agent_state.current_task and isinstance(action_tokens, dict): agent_state.current_task._accumulate_tokens(action_tokens)
+            if isinstance(special_directive, dict) and special_directive.get("selection_stats") and agent_state.current_task:
+                agent_state.current_task._accumulate_selection_stats(special_directive["selection_stats"])
 
             if directive_type == "ask_user":
                 question_text = special_directive.get('question', '')
@@ -1025,12 +1307,18 @@ def iterative_task_executor(
                 action_to_execute = None
                 continue
         
-        string_history_for_assessment = [f"{msg['role']}: {msg['content']}" for msg in (agent_state.current_task.conversation_history if agent_state.current_task else [])]
         assessment_status, assessment_reasoning, assessment_tokens = assess_action_outcome( # type: ignore
             instruction_for_current_planning_cycle, action_to_execute, exec_success, exec_message, # type: ignore
-            capture_full_screen(), llm_model, screenshot_before_hash=screenshot_before_action_hash if 'screenshot_before_action_hash' in locals() else None
+            capture_full_screen(), llm_model, screenshot_before_hash=screenshot_before_action_hash if 'screenshot_before_action_hash' in locals() else None,
+            screenshot_before=planning_screenshot if 'planning_screenshot' in locals() else None
         )
         if agent_state.current_task: agent_state.current_task._accumulate_tokens(assessment_tokens)
+        if speculation and assessment_status != "SUCCESS":
+            if agent_state.current_task: agent_state.current_task._accumulate_speculation_stats(speculative_planner.discard(speculation, f"assessment_{str(assessment_status).lower()}"))
+            speculation = None
+        if assessment_status == "FAILURE" and action_type in ("click", "click_and_type") and (params or {}).get("element_description"):
+            # Don't hand the same element back on retry.
+            agent.invalidate_last_selection()
         final_message = f"{exec_message} | Assessment: {assessment_status} - {assessment_reasoning}"
         if agent_state.current_task: agent_state.current_task.conversation_history.append({"role": "system", "content": f"System Observation: {final_message}"})
         final_success = (assessment_status == "SUCCESS")
@@ -1138,6 +1426,10 @@ def iterative_task_executor(
         results.append((({'action_type': 'STOP', 'parameters': {'reason': 'max_iterations'}}, False, f"Max iterations reached.", None)))
         if agent_state.current_task: agent_state.current_task.agent_thoughts.append({"timestamp": datetime.now().isoformat(), "content": f"Execution stopped: Max iterations ({max_iterations}) reached.", "type": "stop"})
 
+    if speculation and agent_state.current_task:
+        agent_state.current_task._accumulate_speculation_stats(speculative_planner.discard(speculation, "task_ended"))
+    _charge_discarded_drafts(agent_state)
+
     final_status = "incomplete"
     execution_summary_for_db = f"Instruction: {original_instruction}\nOutcome: "
     if task_completed and not results:
@@ -1164,6 +1456,11 @@ def iterative_task_executor(
         serializable_results.append([serializable_action, r_success, r_message, serializable_directive])
     full_results_json = json.dumps(serializable_results)
 
+    if agent_state.current_task:
+        if visual_listener_service.cancel_task_listeners(agent_state.current_task.task_id):
+            logging.info("Cancelled background visual listeners still running at task end.")
+        _collect_listener_directives(visual_listener_service.drain_directives(agent_state.current_task.task_id), agent_state)
+
     if agent_state.current_task:
         agent_state.current_task.action_failure_counts = action_failure_counts
         save_task_execution_to_db(original_instruction, execution_summary_for_db, full_results_json, final_status, plan_source, user_feedback=None) # type: ignore
@@ -1181,14 +1478,16 @@ def process_next_step(
     history: List[str],
     llm_model: genai.GenerativeModel,
     current_shortcuts: Optional[str] = None,
-    current_reinforcements: List[str] = None,
+    current_reinforcements: Optional[List[str]] = None, # Already retrieved for this step; None = retrieve here
     planning_screenshot_pil: Optional[Image.Image] = None,
     benchmark_mode: bool = False,
     executed_actions_summary: Optional[str] = None,
     # New parameters for sub-task context
     overall_original_instruction: Optional[str] = None, # The user's very first instruction for the whole task
     all_sub_tasks_count: int = 0, # Total number of sub-tasks if they exist
-    current_sub_task_idx: int = -1 # 0-based index of the current sub-task being planned
+    current_sub_task_idx: int = -1, # 0-based index of the current sub-task being planned
+    planning_screenshot_base64: Optional[str] = None, # Already encoded planning_screenshot_pil
+    history_str: Optional[str] = None # Prompt-ready history (TaskSession.history_segment); None = truncate `history` here
 ) -> Tuple[Optional[dict], Dict[str, int]]:
     # Check if we already have a successful image generation
     for line in reversed(history):
@@ -1207,21 +1506,10 @@ def process_next_step(
     logging.info("Determining next step using standard planning logic.")
     if current_shortcuts is None: current_shortcuts = "" # Should be an empty string if no shortcuts
     
-    max_history_turns_for_prompt = 10
-    string_history = [str(item) for item in history]
-    important_indices = [i for i, item in enumerate(string_history) if "System Observation:" in item or "User responded:" in item or "ask_user" in item or "Critique failed" in item or "User Goal:" in item]
-    if len(string_history) > max_history_turns_for_prompt * 2:
-        cutoff = len(string_history) - (max_history_turns_for_prompt * 2)
-        keep_indices = {0} if len(string_history) > 0 and "User Goal:" in string_history[0] else set()
-        keep_indices.update(range(cutoff, len(string_history)))
-        keep_indices.update(idx for idx in important_indices if idx >= cutoff)
-        keep_indices = {idx for idx in keep_indices if 0 <= idx < len(string_history)}
-        truncated_history = [string_history[i] for i in sorted(list(keep_indices))]
-    else:
-        truncated_history = string_history
-    history_str = "\n".join(truncated_history)
+    if history_str is None:
+        history_str = legacy_history_str([str(item) for item in history], LEGACY_HISTORY_TURNS["planner"])
 
-    screenshot_base64 = image_to_base64(planning_screenshot_pil) if planning_screenshot_pil else None
+    screenshot_base64 = planning_screenshot_base64 or (image_to_base64(planning_screenshot_pil) if planning_screenshot_pil else None)
 
     shortcuts_str = "No specific shortcuts known for the current app."
     if current_shortcuts and isinstance(current_shortcuts, str) and current_shortcuts.strip():
@@ -1229,15 +1517,10 @@ def process_next_step(
     else:
         shortcuts_str = "No specific shortcuts known for the current app or an error occurred fetching them."
 
-    query_for_reinforcements = original_instruction
-    if history:
-        for i in range(len(history) -1, -1, -1):
-            hist_item_lower = history[i].lower()
-            if hist_item_lower.startswith("user goal:") or hist_item_lower.startswith("user responded:"):
-                query_for_reinforcements = history[i].split(":", 1)[-1].strip()
-                break
-
-    retrieved_reinforcements = retrieve_relevant_reinforcements_from_db(query_for_reinforcements, n_results=5)
+    if current_reinforcements is None:
+        retrieved_reinforcements = retrieve_relevant_reinforcements_from_db(_reinforcement_query(original_instruction, history), n_results=5)
+    else:
+        retrieved_reinforcements = current_reinforcements
     reinforcements_str = "No relevant learnings/reinforcements found in DB."
     if retrieved_reinforcements:
         max_reinforcements_to_show = 5
@@ -1246,16 +1529,6 @@ def process_next_step(
         for i, learning in enumerate(relevant_reinforcements):
             reinforcements_str += f"- {learning}\n"
 
-    reinforcements_str += """
-
- **Leveraging Past Successes (from Learnings/Reinforcements):**
- *   If a retrieved Learning/Reinforcement from the DB is highly relevant and describes a specific tool, method, or application that was successful or explicitly liked by the user in a *verifiably similar past task context* (e.g., "User preferred using 'VS Code' for Python editing on task 'Project X' and it was successful"),
- *   THEN, your `next_action` SHOULD BE `{{ "action_type": "ask_user", "parameters": {{ "question": "I recall that for a similar task ('Project X'), you successfully used 'VS Code' for Python editing. Would you like to use that approach again for this task?" }} }}`.
- *   Adapt the question to the specific learning and the past task context if mentioned in the learning.
- *   Only do this if the learning is specific, actionable, and refers to a clear past success. If the learning is general (e.g., "wait after opening apps"), just consider it in your plan without asking.
- *   If the user agrees to reuse the approach, incorporate that into your subsequent plan steps.
- *   If the user declines, proceed with standard planning, potentially avoiding that specific recalled approach if it was the point of contention.
- """
     
     executed_actions_summary_str = executed_actions_summary if executed_actions_summary else "No actions executed yet in this task."
 
@@ -1275,397 +1548,11 @@ Instruction for THIS Current Sub-Task: "{original_instruction}"
 
     task_name_base = sanitize_filename(original_instruction)[:30]
 
-    prompt = rf"""
---- CURRENT SUB-TASK OBJECTIVE / USER GOAL ---
-**Instruction for this step (current sub-task):**
-"{original_instruction}"
-
-{sub_task_info_for_prompt}
---- HISTORY & CONTEXT ---
-**Recent History (Actions, Outcomes, Observations, User Responses, Critiques):**
-{history_str}
-*   **CRITICAL: Focus on the LATEST user message/response.** This defines the current objective. If the user just agreed to create a specialized agent or selected an LLM, plan the next step for *that* process.
-*   **IF A "Critique failed" message is in the LATEST history entries:**
-    *   The `reasoning` for that critique (e.g., "action was unrelated to the LATEST user instruction", "action was redundant") is the MOST IMPORTANT piece of information for your next plan.
-    *   Your `next_action` MUST directly address the LATEST user instruction and AVOID the specific pitfall highlighted by the critique.
-    *   DO NOT repeat the same type of irrelevant or redundant action.
-*   **CRITICAL: Learn from critiques.** Avoid repeating actions that failed critique due to redundancy, speculation, or irrelevance.
-*   Note: "System Observation: Screen content changed..." indicates the visual state changed.
-*   Note: "System Observation: Active application changed to 'app_name.exe'." or "System Observation: Opened web URL: https://example.com" indicates the current application context.
-*   **VERY IMPORTANT CONTEXT CHECK:** Before planning `navigate_web` or `run_shell_command` to open an application, check the LATEST "System Observation" in history. If it indicates you are already on the target URL (e.g., "System Observation: Opened web URL: https://www.youtube.com") or the target application is already active (e.g., "System Observation: Active application changed to 'youtube.com' or 'chrome.exe' showing YouTube"), DO NOT plan to navigate or open it again if the sub-task is to interact *within* that page/app. Instead, plan actions *within* that context (e.g., `click_and_type` in a search bar, `click` on a video).
-*   Note: Check history for user responses to 'ask_user', especially regarding automation, project details, LLM choices, or credentials.
-
-**Actions Already Executed in Current Task Iteration (Most Recent First):**
-{executed_actions_summary_str}
-*   Note: Check history for user responses to 'ask_user', especially regarding automation, project details, LLM choices, or credentials.
-
-**Application Shortcuts:**
-{shortcuts_str}
-
-**Learnings/Reinforcements from DB:**
-{reinforcements_str}
-
-**Current Visual Context:** [See attached screenshot if available - Use ONLY if planning a visual action (Priority 4) or assessing task completion visually.]
-*   **IMPORTANT:** Do not assume you need to see the screen for every step. Only consider the visual context if the next logical step requires interacting with the GUI (e.g., `click`, `type`) or if you need to verify a visual change. Avoid unnecessary `describe_screen` or visual analysis if the task can be done via shell or script.
-
---- TASK PRIORITIZATION & RESPONSE STRATEGY ---
-
---- META-PLANNING FOR COMPLEX PROJECTS (e.g., "create a project", "build an app", "design a system") ---
-IF the LATEST user instruction describes a complex, multi-stage project (especially involving creation or design of software, systems, or substantial files) AND you are at the beginning of this project (no significant project-specific actions taken yet in history for this goal):
-
-1.  **Initial Check & User Response Handling:**
-    *   **IF the PREVIOUS action was `INFORM_USER` presenting multiple paths with "--- START MERMAID CODE ---" markers:**
-        *   Your `next_action` MUST be `{{ "action_type": "ask_user", "parameters": {{ "question": "Which of the above approaches (e.g., 'Path 1' or by title) would you like to proceed with? Or, would you like me to research further or suggest alternatives?" }} }}`.
-        *   `reasoning`: "Asking user to select a development path after presenting options."
-        *   **STOP HERE. Do not proceed to other planning steps below if this condition is met.**
-    *   **IF the LATEST user message in history is a response to the path selection question above:**
-        *   Analyze the user's choice.
-        *   Your `next_action` should be to start implementing the CHOSEN path. This might involve a `multi_action` for the first few steps of that path, or a single action like `write_file` for the main project file.
-        *   Your `reasoning` should state: "Proceeding with user's chosen path: [User's Choice]. Starting with [first action of chosen path]."
-        *   **STOP HERE. Do not proceed to other planning steps below if this condition is met.**
-
-2.  **Research Phase (If no paths presented yet, or if user asked for more research):**
-    *   **Check History:** Have you already performed web searches for "how to [do the project]", "technologies for [project type]", "steps to create [X]" in the very recent history for THIS specific project goal?
-    *   **IF NOT (no recent relevant research for this project):**
-        *   Your `next_action` SHOULD be `search_web` or a `multi_action` of `search_web` and/or `search_youtube` actions.
-        *   **Example Query:** "best ways to create a Python script for web scraping and data storage" or "modern tech stack for a simple blog website".
-        *   `reasoning`: "Researching best practices, technologies, and common steps for creating the requested project/file before proposing implementation paths."
-        *   **STOP HERE. Do not proceed to other planning steps below if this condition is met.**
-
-3.  **Path Proposal Phase (After research results are in history and no paths presented yet):**
-    *   **Check History:** Are there recent `search_web` or `search_youtube` results in history relevant to this project?
-    *   **IF YES (and you haven't presented paths yet):**
-        *   Your `next_action` MUST be `{{ "action_type": "INFORM_USER", "parameters": {{ "message": "..." }} }}`.
-        *   The `message` parameter should be a string containing:
-            *   An introduction, e.g., "Okay, I've researched how to approach '[original_instruction]'. Here are a few potential paths:\n\n"
-            *   **Path 1:**
-                *   "**Path 1: [Concise Title for Approach 1, e.g., Using Flask and SQLite]**\n"
-                *   "[One-paragraph description of this approach, key steps, major technologies, and brief pros/cons. If based on web search, you can briefly mention key findings.]\n"
-                *   "--- START MERMAID CODE ---\n"
-                *   "sequenceDiagram\n"
-                *   "    User->>Agent: Request to build X\n"
-                *   "    Agent->>System: Plan initial setup (e.g., Flask app.py)\n"
-                *   "    System->>Agent: Execute setup\n"
-                *   "    Agent->>System: Plan database models\n"
-                *   "    System->>Agent: Execute DB setup\n"
-                *   "    Agent->>User: Show progress / Ask for next feature\n"
-                *   "--- END MERMAID CODE ---\n\n"
-            *   **Path 2 (and optionally Path 3):** Similar structure as Path 1, presenting a different approach.
-                *   "**Path 2: [Concise Title for Approach 2, e.g., Static Site Generator with Netlify]**\n"
-                *   "[Description...]\n"
-                *   "--- START MERMAID CODE ---\n"
-                *   "sequenceDiagram\n"
-                *   "    ...\n"
-                *   "--- END MERMAID CODE ---"
-            *   (Ensure Mermaid code is valid and uses `sequenceDiagram`. Use `\n` for newlines within the message string.)
-        *   `reasoning`: "Presenting researched high-level strategic paths to the user for selection, including Mermaid diagrams for clarity."
-        *   **STOP HERE. Do not proceed to other planning steps below if this condition is met.**
-
-ELSE (if not a complex project initiation, or if a path has been chosen and implementation is underway):
-    Proceed with the standard planning logic below (Informational Queries, Task Completion, etc.).
---- END META-PLANNING FOR COMPLEX PROJECTS ---
-
---- COMPLEX, CREATIVE, OR ANALYTICAL TASKS ---
-IF the LATEST user instruction is a complex, creative, or analytical task (for example: "analyze a Spotify playlist and create a new one with the same vibe and number of songs", "summarize a YouTube video and generate a blog post from it", "extract structured data from a PDF and visualize it", or any task that could be solved in multiple ways, or that requires reasoning, analysis, or creativity):
-
-1.  **List Possible Approaches:**
-    *   List 2-4 distinct approaches to accomplish the task. For example, for a Spotify playlist analysis:
-        - Using the Spotify API directly (programmatic, requires credentials)
-        - Using UI automation (controlling the web or desktop app)
-        - Using LLM analysis (copying playlist data and analyzing it with the LLM)
-        - Using external tools or web services
-    *   For each approach, briefly explain the method, pros, and cons (e.g., "API: Most robust, but requires user to provide credentials. UI automation: No credentials needed, but more brittle. LLM: Fast, but may be less accurate.").
-
-2.  **Ask for User Preference:**
-    *   After listing the approaches, your `next_action` MUST be `ask_user` with a question like: "Which approach would you like to use? (e.g., API, UI automation, LLM, or other). If you are not sure, I can recommend one."
-    *   Do NOT proceed with any approach until the user has selected or confirmed a method.
-
-3.  **Proceed Only After User Input:**
-    *   Once the user responds, analyze their choice and proceed to plan the next step using the selected approach.
-    *   If the user is unsure, you may recommend the most robust or user-friendly method and ask for confirmation before proceeding.
-
-**STOP HERE for this turn after asking the user. Do not proceed to the standard planning logic until the user has chosen an approach.**
-
---- END COMPLEX, CREATIVE, OR ANALYTICAL TASKS SECTION ---
-
---- STANDARD PLANNING LOGIC ---
-
-**Error Handling and Self-Fixing:**
-If any action (such as a shell command, script, or file operation) fails, you will see the full error message in the recent history (look for 'System Observation:' lines with error details).
-- Analyze the error, reason about the likely cause, and plan a fix or workaround using the available tools and your knowledge.
-- Try to fix the problem up to 2 times. If the error persists after 2 attempts, ask the user whether to ignore the error and continue, or to try fixing it 2 more times (e.g., "The error still persists after 2 fix attempts. Do you want to ignore it and continue, or try fixing it 2 more times? Type 'ignore' to continue, or 'retry' to try again.").
-- Do not give up on the first failure—always attempt to resolve the issue using your knowledge and available actions before asking the user.
-
-1.  **Information Gathering (If Needed):**
-    *   **Consider the project's nature:** Is it a common type of project with well-known architectures (e.g., a standard web app)? Or is it niche, requiring research?
-    *   **Check Learnings/Reinforcements:** Do any past learnings from the DB suggest specific architectures, tools, or user preferences for similar complex tasks?
-    *   **IF information is lacking OR the project is novel/niche OR you want to ensure up-to-date best practices:**
-        *   Your `next_action` SHOULD be to gather information.
-        *   This might involve a single `search_web` or `search_youtube` action, OR, if multiple pieces of information are needed, a `multi_action` containing a sequence of search actions.
-        *   **Example of `multi_action` for diverse research:**
-            `{{ "action_type": "multi_action", "parameters": {{ "sequence": [
-                {{ "action_type": "search_web", "parameters": {{ "query": "best architectures for e-commerce platform with AI chatbot 2024" }} }},
-                {{ "action_type": "search_youtube", "parameters": {{ "query": "tutorial integrating Rasa chatbot with Flask backend" }} }},
-                {{ "action_type": "search_web", "parameters": {{ "query": "comparison of React vs Vue for e-commerce frontend" }} }},
-                {{ "action_type": "read_file", "parameters": {{ "file_path": "C:\\Users\\MyUser\\Documents\\project_notes\\past_ecommerce_learnings.txt" }} }}
-            ] }} }}`
-        *   Your `reasoning` should explain why you are performing this research (e.g., "To comprehensively research architectures, AI tools, and frontend technologies for the e-commerce project before proposing high-level plans.").
-    *   **AFTER information gathering (in a subsequent turn, once search results are in history):** The "META-PLANNING FOR COMPLEX PROJECTS" section (Path Proposal Phase) will handle proposing paths.
-
---- COMPLEX TASK - MULTIPLE PATH PROPOSAL (INFORM & ASK) ---
-IF you are at the stage of proposing multiple paths (either directly or after information gathering),
-THEN, your `next_action` MUST be `INFORM_USER`. The `message` parameter for this `INFORM_USER` action should contain 2-3 distinct high-level strategic approaches (paths) based on your knowledge and any research done.
-
-For each proposed path within the `message`, you MUST include:
-1.  **Title**: A short, descriptive title (e.g., "**Path 1: Serverless Stack**").
-2.  **Description**: A paragraph explaining the key stages, technologies, and pros/cons. If based on web search, briefly mention the source or key findings.
-3.  **Mermaid Sequence Diagram**: Valid Mermaid code for a `sequenceDiagram` visualizing the path. Enclose this code clearly use mermaid version 11.6.0 :
-    `--- START MERMAID CODE ---`
-    `sequenceDiagram`
-    `    participant User`
-    `    participant WebApp`
-    `    User->>WebApp: Action`
-    `    WebApp-->>User: Result`
-    `--- END MERMAID CODE ---`
-    (Ensure newlines `\n` are correctly represented if generating this as part of a JSON string, but for the `INFORM_USER` message, literal newlines are fine).
-Your `reasoning` for this `INFORM_USER` action should state that you are presenting multiple high-level paths for the complex project, possibly informed by prior research.
-**IMPORTANT FOLLOW-UP:** If the PREVIOUS action was `INFORM_USER` and its message contained these multi-path proposals (identifiable by "--- START MERMAID CODE ---" markers), your *current* `next_action` MUST be `{{ "action_type": "ask_user", "parameters": {{ "question": "Which of the above approaches (e.g., 'Path 1' or by title) would you like to proceed with?" }} }}`.
---- END COMPLEX TASK SECTIONS ---
-
-1.  **Informational Queries vs. Actionable Tasks:**
-    *   **IF the LATEST user message is primarily an informational question** (e.g., "What is X?", "How does Y work?", "Tell me about Z", "What are the best ways to do A?", "will X release Y?", "Konami upcoming games?"), consider the following:
-        *   **CRITICAL CHECK FOR PRIOR SEARCH:**
-            *   Examine the **Recent History**.
-*   **Shortcut Prioritization (VERY IMPORTANT):**
-    *   **IF `Application Shortcuts` are available AND contain a relevant shortcut for the current sub-task** (e.g., a shortcut for 'search', 'find', 'open search bar', 'focus search' when the sub-task is to search for something; or 'play/pause', 'next track' for media control):
-        *   Your **FIRST ATTEMPT** to achieve the sub-task **MUST** be to use the relevant shortcut via the `press_keys` action.
-        *   Your `reasoning` for choosing `press_keys` in this case **MUST** state which shortcut you are using and why (e.g., "Using the '/' shortcut to focus the YouTube search bar as per available shortcuts.").
-        *   **Example:** If sub-task is "Search for 'genius by sia'" and shortcuts include "/: Focus search bar", your `next_action` should be `{{ "action_type": "press_keys", "parameters": {{ "keys": ["/"] }} }}`.
-        *   **IF the shortcut only focuses an input field (like a search bar):** Your `next_action` should be a `multi_action` sequence:
-            1.  `press_keys` (to activate/focus the field using the shortcut).
-            2.  `wait` (e.g., 0.1 to 0.3 seconds, ONLY if truly necessary for the field to become active after the shortcut. If the shortcut directly allows typing, this wait can be omitted or very short).
-            3.  `type` (to input the text, e.g., the search query).
-            4.  (Optional) `press_keys` (e.g., ["enter"] to submit the search/form).
-        *   Example (multi_action sequence to search in youtube):
-         ```json
-         {{
-           "action_type": "multi_action",
-           "parameters": {{
-             "sequence": [{{ "action_type": "press_keys", "parameters": {{ "keys": ["/"] }} }}, {{ "action_type": "wait", "parameters": {{ "duration_seconds": 0.5 }} }}, {{ "action_type": "type", "parameters": {{ "text_to_type": "genius by sia" }} }},{{ "action_type": "press_keys", "parameters": {{ "keys": ["enter"] }} }}]
-           }}
-         }}
-         ```
-        *   Your `reasoning` for such a `multi_action` should also explain the shortcut's role.
-        *   Only if no relevant shortcut is found, or if a shortcut attempt has clearly failed (based on history), should you then consider visual actions like `click`, `click_and_type`.
-            *   **IF the IMMEDIATELY PRECEDING successful action in the history** was `search_web` or `search_youtube` AND its output (visible in history as 'System Observation: Web Search Result: ...' or 'System Observation: YouTube Search Result: ...') is relevant to the LATEST user's informational question:
-                *   Your `next_action` **MUST** be `{{ "action_type": "INFORM_USER", "parameters": {{ "message": "Based on my recent search: [Concise summary of the relevant search results FROM HISTORY. If the search result indicates no definitive answer, state that clearly, e.g., 'My search did not find a specific release date, but indicated X...']" }} }}`.
-                *   Your `reasoning` MUST state that you are using information from the immediately preceding search result.
-                *   **DO NOT** plan another `search_web` or `search_youtube` for the same or a very similar query if a relevant search result is already in the immediate history.
-            *   **ELSE (no immediately preceding relevant search result in history, OR the preceding search was clearly insufficient and the user is asking for more/different info, OR if this is the very first step for this informational query):**
-                *   Plan to use `search_web` or `search_youtube`.
-                *   **For "how-to", "tutorial", "best ways to", or visually demonstrable topics, STRONGLY prefer using the `search_youtube` tool.**
-                *   If you use `search_youtube`, the next step will typically be `INFORM_USER` with the findings.
-                *   You can use `search_youtube` in conjunction with `search_web` (e.g., in a `multi_action`) if you want to provide comprehensive information from both sources, or ask the user if they prefer web or video results before searching.
-                *   After the search action(s), the next step will typically be `INFORM_USER` with the findings.
-                *   Your `reasoning` should explain why you are choosing the search tool(s).
-                *   **IMPORTANT SELF-CORRECTION:** If your reasoning for planning a search includes a phrase like "results are not yet available in the history" or "planning the search again ensures it is the intended action", this is likely an error. You should only plan a search if one hasn't *just been performed* or if the user is asking for *new/different* information. If a search was the last action, the next step is to process its results.
-                *   **CRITICAL JSON OUTPUT FOR SEARCH:** If planning a search, your `next_action` (e.g., `search_web`, `search_youtube`, or `multi_action` containing them) and `reasoning` MUST be part of the overall JSON object as specified in the main "Output Format" section.
-    *   **ELSE (if it's an actionable task for PC automation AND NOT a complex project initiation phase as described in "META-PLANNING"):** Proceed with the planning logic below.
-    *   **CRITICAL PLANNING CONSTRAINT:** Review the **Recent History** carefully. If you see a "System Note: [Tool Name] tool disabled..." message, you **MUST NOT** plan to use that specific tool (`action_type`) for the remainder of this task. Choose an alternative tool or strategy, or use `ask_user` if no viable alternative exists.
-
-2.  **Follow-up After `INFORM_USER` (Non-Project Path Proposal):**
-    *   **IF the PREVIOUS action you took was `INFORM_USER` and it was successful, AND the LATEST user message is not a new actionable task or a direct follow-up question to your information, AND the INFORM_USER message did NOT contain '--- START MERMAID CODE ---' markers (meaning it wasn't a multi-path proposal):**
-        *   Your `next_action` MUST be `{{ "action_type": "ask_user", "parameters": {{ "question": "Is there anything else I can help you automate today?" }} }}`.
-        *   Your `reasoning` should be "Following up after providing information."
-    *   **ELSE:** Proceed with other checks.
-
-3.  **Task Completion Flow (Revised):**
-    *   You are currently planning for the instruction: "{original_instruction}".
-    *   This is {(f'sub-task {current_sub_task_idx + 1} of {all_sub_tasks_count} for the overall goal: "{overall_original_instruction}".') if all_sub_tasks_count > 0 and current_sub_task_idx != -1 else "the main/only task."}
-    *   **A. Check for User Response to "Anything else?" question:**
-        *   **IF the LATEST user message in history is a response to a question like "Is there anything else I can help you with?" or "Is there anything more?":**
-            *   **IF the user's response is negative** (e.g., "no", "that's all", "nope", "all good"):
-                *   Your `next_action` MUST be `{{ "action_type": "task_complete", "parameters": {{}} }}`.
-                *   `reasoning`: "User confirmed no further assistance needed. Completing the task."
-                *   **STOP HERE. This is the final action.**
-            *   **ELSE (user's response is affirmative or a new request):**
-                *   Treat the user's new response as the NEW `original_instruction` for this planning cycle.
-                *   `reasoning`: "User provided a new request or follow-up. Planning for that now."
-                *   Proceed to plan for this new instruction (e.g., it might be a simple action, or trigger complex project planning if it's a new project).
-                *   **STOP HERE if this condition was met and a new instruction is being processed. The rest of the completion check below is skipped.**
-    *   **B. Standard Completion Check (if not handling response to "Anything else?"):**
-        *   **IF the current instruction ("{original_instruction}") appears fully addressed by the PREVIOUS successful action(s) in the history:**
-            *   **AND IF this is the LAST sub-task** (this means {(f'current sub-task {current_sub_task_idx + 1} IS THE LAST of {all_sub_tasks_count} sub-tasks') if all_sub_tasks_count > 0 and current_sub_task_idx != -1 and (current_sub_task_idx + 1 == all_sub_tasks_count) else (f'this is NOT the last sub-task (currently {current_sub_task_idx + 1} of {all_sub_tasks_count})' if all_sub_tasks_count > 0 and current_sub_task_idx != -1 else 'this is the only task')}).
-                *   Then, your `next_action` MUST be `{{ "action_type": "ask_user", "parameters": {{ "question": "I believe I've completed [provide a very brief, 2-5 word summary of what was just accomplished, e.g., 'playing the video', 'creating the Python script', 'searching for news']. Is there anything else I can help you with today?" }} }}`.
-                *   `reasoning`: "The current goal appears to be met. Confirming with the user and asking if further assistance is needed before marking the overall task complete."
-                *   **STOP HERE. This `ask_user` is the planned action.**
-            *   **ELSE (if this is NOT the last sub-task, OR if there's no sub-tasking context and the goal isn't fully met by previous actions):**
-                *   DO NOT use `task_complete` or the "anything else" `ask_user` yet.
-                *   If the current sub-task is complete, and more sub-tasks remain, the executor system will handle advancing. Your focus is on the *current* instruction.
-                *   Proceed to plan the next action for the current instruction ("{original_instruction}").
-    *   **ELSE:** Proceed with planning the next sub-step towards the user's goal.
-
-4.  **Handling Multiple Distinct Tasks in One Instruction:**
-    *   **IF the LATEST user instruction appears to contain multiple, clearly distinct, and non-trivial automation tasks** (e.g., "Open Chrome and search for news, then open Notepad and write a summary, then save it to my_summary.txt") AND it's NOT a complex project requiring multiple path proposals:
-        *   Your `next_action` MUST be `{{ "action_type": "ask_user", "parameters": {{ "question": "I see you've asked for several things (e.g., Task A, Task B). Which one should I start with, or would you like me to try them in order?" }} }}` (Adapt the question to the detected tasks).
-        *   DO NOT attempt to create a single giant plan for many distinct complex tasks. Clarify first.
-    *   **EXCEPTION:** If the tasks are very simple and form a natural, tight sequence (e.g., "open notepad and type hello"), you MAY use a `multi_action` for them. Use your judgment. If in doubt, clarify with `ask_user`.
-
---- AVAILABLE TOOLS (Action Types & Parameters) ---
-*   `{{ "action_type": "focus_window", "parameters": {{ "title_substring": "Notepad" }} }}`
-*   `{{ "action_type": "click", "parameters": {{ "element_description": "File menu button" }} }}`
-*   `{{ "action_type": "type", "parameters": {{ "text_to_type": "Hello World!", "interval_seconds": 0.05 }} }}`
-*   `{{ "action_type": "press_keys", "parameters": {{ "keys": ["ctrl", "s"] }} }}`
-*   `{{ "action_type": "move_mouse", "parameters": {{ "x": 100, "y": 200, "duration_seconds": 0.25 }} }}`
-*   `{{ "action_type": "run_shell_command", "parameters": {{ "command": "cd /d C:\\\\Users\\\\User\\\\Desktop ; mkdir my_folder" }} }}`
-*   `{{ "action_type": "run_shell_command", "parameters": {{ "command": "cd /d C:\\\\Users\\\\user\\\\Desktop\\\\Miki_test_AI\\\\Miki-AI-main\\\\Miki-AI-main\\\\uploads && npm install" }} }}`
-    - On Windows, to run a command in a specific directory, you must combine the directory change and the command in a single line using `&&`. For example: `cd /d C:\\path\\to\\dir && npm install`. Do NOT generate a plan that only changes the directory; always include the intended command after `&&`.
-*   `{{ "action_type": "run_python_script", "parameters": {{ "script_path": "scripts/process_data.py", "working_directory": "OPTIONAL_PATH" }} }}`
-*   `{{ "action_type": "write_file", "parameters": {{ "file_path": "output.txt", "content": "Data processed." }} }}`
-*   `{{ "action_type": "navigate_web", "parameters": {{ "url": "https://google.com" }} }}`
-*   `{{ "action_type": "search_web", "parameters": {{ "query": "latest AI news" }} }}`
-*   `{{ "action_type": "search_youtube", "parameters": {{ "query": "how to bake a cake" }} }}`
-*   `{{ "action_type": "wait", "parameters": {{ "duration_seconds": 2.0 }} }}`
-*   `{{ "action_type": "ask_user", "parameters": {{ "question": "What filename should I use?" }} }}`
-*   `{{ "action_type": "describe_screen", "parameters": {{}} }}`
-*   `{{ "action_type": "capture_screenshot", "parameters": {{ "file_path": "debug_screenshot.png" }} }}`
-*   `{{ "action_type": "click_and_type", "parameters": {{ "element_description": "Search input field", "text_to_type": "query text", "press_enter_after": false }} }}` 
-    *   Set `press_enter_after` to `true` if you want to automatically press Enter after typing (e.g., for submitting a search query).
-*   `{{ "action_type": "multi_action", "parameters": {{ "sequence": [ {{...action1...}}, {{...action2...}} ] }} }}`
-*   `{{ "action_type": "task_complete", "parameters": {{}} }}`
-*   `{{ "action_type": "read_file", "parameters": {{ "file_path": "path/to/file.txt" }} }}`
-*   `{{ "action_type": "INFORM_USER", "parameters": {{ "message": "Information for the user." }} }}`
-*   `{{ "action_type": "process_local_files", "parameters": {{ "file_path": "path/to/file.txt", "prompt": "Analyze this file" }} }}`
-*   `{{ "action_type": "process_files_from_urls", "parameters": {{ "url": "https://example.com/file.txt", "prompt": "Analyze this file" }} }}`
-*   `{{ "action_type": "start_visual_listener", "parameters": {{ "description_of_change": "...", "polling_interval_seconds": 10, "timeout_seconds": 300, "actions_on_detection": [{{...plan...}}], "actions_on_timeout": [{{...plan...}}]? }} }}`
-*   `{{ "action_type": "refresh_application_shortcuts", "parameters": {{}} }}`
-*   `{{ "action_type": "edit_image_with_file", "parameters": {{ "image_path": "OPTIONAL_PATH_TO_IMAGE_OR_EMPTY_STRING_FOR_NEW", "prompt": "Description of edits OR image to generate" }} }}`
-
-*   `{{ "action_type": "edit_image_with_file", "parameters": {{ "image_path": "OPTIONAL_PATH_TO_IMAGE_OR_EMPTY_STRING_FOR_NEW", "prompt": "Description of edits OR image to generate" }} }}`
-    - **To generate a NEW image:** Set `image_path` to an empty string (`\"\"`) or `null`. The `prompt` should describe the image to create (e.g., "A photo of a red apple on a wooden table").
-    - **To edit an EXISTING image:** Provide the `image_path` to the image file. The `prompt` should describe the desired edits (e.g., "Make the background blurry", "Convert to grayscale").
-    - Use this action for any requests involving image creation, generation, editing, or modification based on a text prompt.
-
-    Example (Generating a new image):
-    `{{
-      \"action_type\": \"edit_image_with_file\",
-      \"parameters\": {{
-        \"image_path\": \"\", 
-        \"prompt\": \"A cute cat wearing a tiny hat\"
-      }}
-    }}`
-
-    Example (Editing an existing image):
-    `{{
-      \"action_type\": \"edit_image_with_file\",
-      \"parameters\": {{
-        \"image_path\": \"uploads/user_photo.jpg\",
-        \"prompt\": \"Increase brightness and add a vintage filter\"
-      }}
-    }}`
-
-**General Planning & Reasoning Strategy:**
-*   **Context is Key:** Always consider the conversation history and the implied state of the system.
-    *   **Check Current URL/Application:** Before planning `navigate_web` or `run_shell_command` to open an application, check the LATEST "System Observation" in history.
-        *   If the history shows you are already on the target URL (e.g., "System Observation: Opened web URL: https://www.youtube.com" or the active window title in screenshot implies it) AND the current sub-task is to perform an action *on that page* (like searching, clicking a button), **DO NOT plan `navigate_web` to the same URL again.** Instead, plan the interaction (e.g., `click_and_type` for search, `click` for a button).
-        *   Similarly, if the target application is already active (e.g., "System Observation: Active application changed to 'notepad.exe'"), DO NOT plan `run_shell_command` to open it again if the sub-task is to interact with the already open instance.
-    *   **Critique Adherence:** If a previous action was critiqued as "redundant" (especially for navigation), explicitly avoid repeating that navigation.
-    *   **Handling Lost Focus:** If the **Recent History** indicates you were recently in the correct application or on the correct URL for the current sub-task, BUT the **Current Visual Context (Screenshot)** or the LATEST "System Observation: Active application changed to..." shows a *different, incorrect* application is now active (e.g., you were on YouTube, now VS Code is active):
-        *   Your **FIRST `next_action`** MUST be `{{ "action_type": "focus_window", "parameters": {{ "title_substring": "..." }} }}` to attempt to switch back to the correct application window (e.g., browser window containing "YouTube", or "Notepad").
-        *   The `title_substring` should be specific enough to target the correct window (e.g., "YouTube - Brave", "Untitled - Notepad", or a more general "Brave" or "Chrome" if the specific title part is uncertain).
-        *   Only if this `focus_window` action is known to have failed (e.g., from a previous attempt in history for the same situation) OR if there's no known window to focus, should you consider re-opening the application (`run_shell_command`) or re-navigating (`navigate_web`).
-        *   Your `reasoning` should explicitly state that you are attempting to regain focus on the correct application due to a mismatch between recent history and current active window.
-
-*   **Simplicity First:** Prefer simpler, more direct actions (like shell commands or keyboard shortcuts) if they can reliably achieve the sub-goal.
-*   **For simple, direct tasks, you might only need a single action or a short `multi_action` sequence.**
-    *   Examples of simple tasks:
-        *   'open notepad and type hello' (could be a `multi_action` with `run_shell_command`, `wait`, `focus_window`, `type`)
-        *   'what is the weather in London?' (could be a single `search_web` followed by `INFORM_USER` in the next turn)
-        *   'save the current document' (could be a single `press_keys` like `ctrl+s` if shortcuts are known)
-        *   'create a folder named temp on the desktop' (could be a single `run_shell_command` like `cd /d C:\\\\Users\\\\User\\\\Desktop ; mkdir temp`)
-    *   Do not overcomplicate simple requests. If a task can be done in 1-3 steps, plan accordingly.
-
-*   **Visual Actions for GUI:** Use visual interaction tools (`focus_window`, `click`, `type`) when dealing with graphical user interfaces that lack direct command-line or shortcut control.
-    *   **Focus Before Interaction:** Always use `focus_window` before `click` or `type` within a specific application window to ensure the action targets the correct application.
-    *   **Specificity for Clicks:** When using `click`, provide a highly specific `element_description` based on visual cues (text label, icon type, relative position) to ensure the correct element is targeted.
-*   **Shell Commands for Backend/Files:** Use `run_shell_command` for file operations (creating, moving, deleting), running scripts, launching applications, or executing background tasks. Be mindful of quoting and escaping within the command string. Avoid using `echo` for creating files with complex or multi-line content unless absolutely necessary and simple.
-    *   **Idempotency/Pre-checks:** When planning to create a directory (`mkdir`) or a file, consider if its pre-existence is an issue. **Prefer `write_file` for creating/editing file content over shell commands like `echo`.**
-        *   If the goal is to *ensure* it exists (and pre-existence is fine), the plan can proceed after the creation attempt, even if it reports "already exists".
-        *   If pre-existence is a problem (e.g., must be a fresh directory), the plan might need to include steps to delete/rename the existing one first (use `ask_user` if this is destructive and not explicitly requested).
-        *   For `write_file`, if overwriting is not desired, plan to check for the file's existence first (e.g., using `run_shell_command` with `dir` or `ls`, then `ask_user` or `read_file` to decide).
-*   **Keyboard Shortcuts:** Use `press_keys` for common application functions (Save, Copy, Paste, Close Tab/Window, etc.) or OS-level shortcuts.
-*   **Waiting:** Use `wait` judiciously after actions that might take time to complete, such as launching an application, opening a file, or allowing a web page to load, to prevent subsequent steps from failing.
-*   **Clarification:** If the user's instruction is ambiguous, or if a critical piece of information is missing (like which editor to use for a complex file), use `ask_user` to request clarification before proceeding.
-*   **Screen Awareness:** Use `describe_screen` only if the user explicitly asks what is visible or if you need to understand the current visual state before planning complex interactions.
-
-**For Complex Software Development Tasks (Act like a Senior Software Architect/Lead):**
-(This section is CRITICAL for when the agent is doing detailed planning *after* a high-level path has been chosen by the user.)
-IF the current goal is to implement a chosen high-level path for a software project:
-1.  **Holistic Breakdown:** Decompose the project into major components and phases (e.g., Project Setup & Scaffolding, Backend API Development, Frontend UI Development, Database Design & Migrations, DevOps & CI/CD Setup, Unit & Integration Testing, Deployment Strategy).
-2.  **Detailed, Professional Plan:** For each phase, plan specific, actionable steps using the available tools.
-    *   **Project Setup:** Use `run_shell_command` for creating project directories, initializing version control (e.g., `git init`), setting up virtual environments (e.g., `python -m venv .venv`), installing linters/formatters. Use `write_file` for `README.md`, `.gitignore`, initial configuration files (e.g., `config.py`, `settings.json`), `requirements.txt` or `package.json`.
-    *   **Backend (e.g., Python/Flask/Django, Node/Express):** Plan `write_file` actions for creating individual source files (e.g., `app.py`, `models.py`, `views.py`, `routes.js`, `controllers.js`). Generate well-structured, professional-quality code. Plan `run_shell_command` for installing framework dependencies.
-    *   **Frontend (e.g., React/Vue/Angular):** Plan `run_shell_command` to initialize the frontend project (e.g., `npx create-react-app my-app`). Plan `write_file` actions for creating components, services, CSS/SCSS files with professional code.
-    *   **Database:** Plan `write_file` for SQL schema definitions, ORM models, or migration scripts. Plan `run_shell_command` to apply migrations if applicable.
-    *   **DevOps/Deployment:** Plan `write_file` for `Dockerfile`, `docker-compose.yml`, CI/CD pipeline configuration files (e.g., GitHub Actions `.github/workflows/main.yml`, Jenkinsfile), and deployment scripts.
-    *   **Testing:** Plan `write_file` actions to create unit tests, integration tests, and end-to-end test stubs.
-3.  **Code Generation Quality:** When using `write_file` for code, generate complete, functional, and professional-quality code. Adhere to best practices, include comments, and ensure proper structure for the language/framework. Leverage your large context window to generate substantial code blocks.
-4.  **File Modification Strategy (Read-Modify-Write):**
-    *   To modify an existing file: Use a `multi_action` sequence:
-        a. `read_file` with the `file_path`.
-        b. (Optional) `wait` or `start_visual_listener` if needed.
-        c. `write_file` for the *same* `file_path`. The `content` for this `write_file` MUST be the complete, new version of the file, incorporating changes based on the read content and user instructions. Ensure JSON escaping for the `content`.
-5.  **Iterative Approach for Very Large Tasks:** While the goal is a comprehensive upfront plan, for extremely large software, the plan might cover the initial major phases, with an understanding that further detailed planning might occur as these phases complete.
-
-**Output Format:**
-Provide ONLY the raw JSON object containing 'next_action' and 'reasoning'. Your entire response MUST be ONLY the valid JSON data, starting with `{{` and ending with `}}`.
-DO NOT include markdown fences like \`\`\`json or \`\`\`, and DO NOT add any introductory text or explanations.
-- The `next_action` must be a single action dictionary: `{{ "action_type": "...", "parameters": {{...}} }}`.
-  - If you need to perform a sequence of tightly coupled actions (like the "Open Notepad, go to Format menu..." example), use `{{ "action_type": "multi_action", "parameters": {{ "sequence": [{{...action1...}}, {{...action2...}} ] }} }}` as the `next_action`.
-- The `reasoning` should be a string explaining your thought process for choosing this next action.
-
-Example of the exact output format required (single action):
-User: open notepad
-{{
-  "next_action": {{ "action_type": "run_shell_command", "parameters": {{ "command": "notepad.exe" }} }},
-  "reasoning": "The user wants to open Notepad. The 'run_shell_command' action is suitable for launching applications."
-}}
-
-Example of the exact output format required (multi_action for a sequence):
-User: open notepad and type 'hello'
-{{
-  "next_action": {{
-    "action_type": "multi_action",
-    "parameters": {{
-      "sequence": [
-        {{ "action_type": "run_shell_command", "parameters": {{ "command": "notepad.exe" }} }},
-        {{ "action_type": "wait", "parameters": {{ "duration_seconds": 1.5 }} }},
-        {{ "action_type": "focus_window", "parameters": {{ "title_substring": "Notepad" }} }},
-        {{ "action_type": "type", "parameters": {{ "text_to_type": "hello" }} }}
-      ]
-    }}
-  }},
-  "reasoning": "The user wants to open Notepad and type 'hello'. This requires a sequence: launch Notepad, wait for it to open, focus the window, then type. A 'multi_action' is appropriate."
-}}
-
-Some hints:
-- If you having a conversation in an application use enter key to send messages.
-- You are in windows so do not use cmds of linux or macos
-- If you are not sure about the action type, use 'ask_user' to clarify.
-- with the tools you have you can literally do any task, you have only to make smart plans and use them wisely
-- Sometime you can use actions to do other purposes , for exemple you can use the click action to toggle the screenshot so you can see, so it s not nessesary use click only to see
-- Shortcuts can be used also in websites if you want to search for shortcuts list of a website you can rely on the tool navigate_web
-
-**CRITICAL RULE FOR SHELL COMMANDS:**
-- Do **NOT** use `run_shell_command` to open a terminal window (e.g., `cmd.exe`, `start cmd`, `start cmd.exe`).
-- Instead, always run the intended command directly. For example, to run `npm install` in a directory, use `cd /d C:\\path\\to\\dir && npm install` as the command.
-- Never propose a plan that only opens a terminal window; always include the full command to be executed.
-
-**CRITICAL RULE FOR ACTION REPETITION:**
-- Do NOT repeat a `run_shell_command` (or any action) that has already succeeded in the current task history, unless the user explicitly asks to repeat it or there is a clear reason to do so (e.g., the environment has changed).
-"""
-
-    content = [{"text": prompt}]
+    suffix = build_planner_suffix(
+        original_instruction, sub_task_info_for_prompt, history_str, executed_actions_summary_str,
+        shortcuts_str, reinforcements_str, overall_original_instruction, all_sub_tasks_count, current_sub_task_idx
+    )
+    content = [{"text": suffix}]
     if screenshot_base64:
         content.append({"inline_data": {"mime_type": "image/png", "data": screenshot_base64}})
 
@@ -1681,8 +1568,9 @@ Some hints:
              'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_MEDIUM_AND_ABOVE',
              'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_MEDIUM_AND_ABOVE',
         }
-        response = llm_model.generate_content(content, safety_settings=safety_settings)
-        token_usage = _get_token_usage(response)
+        response, token_usage, _ = context_prefix_cache.generate(
+            "planner", llm_model, "planner", PLANNER_PROMPT_VERSION, PLANNER_STATIC_PREFIX, content, safety_settings=safety_settings
+        )
 
         if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
             for part in response.candidates[0].content.parts:
@@ -5,6 +5,10 @@ import google.generativeai as genai
 import json
 from vision.vis import image_to_base64
 from tools.token_usage_tool import _get_token_usage
+from tools.llm_gateway import llm_gateway
+from tools.context_cache import context_prefix_cache
+from task_exec.planner_prompts import CRITIC_PROMPT_VERSION, CRITIC_STATIC_PREFIX, build_critic_suffix
+from task_exec.history_manager import legacy_history_str, LEGACY_HISTORY_TURNS
 import re,os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -123,8 +127,7 @@ Return your plan as a JSON object with this structure:
 """
 
         # Generate the plan using the model instance
-        response = llm_model.generate_content(prompt)
-        token_usage = _get_token_usage(response)
+        response, token_usage, _ = llm_gateway.generate("planner", prompt, model=llm_model)
         
         if not response.candidates or not response.candidates[0].content:
             return None, token_usage
@@ -170,7 +173,8 @@ def critique_action(
     history: List[str],
     action_to_critique: dict,
     llm_model: genai.GenerativeModel,
-    critique_screenshot_pil: Optional[Image.Image] = None
+    critique_screenshot_pil: Optional[Image.Image] = None,
+    history_str: Optional[str] = None # Prompt-ready history (TaskSession.history_segment); None = truncate `history` here
 ) -> Tuple[bool, str, Dict[str, int]]:
     action_type = action_to_critique.get('action_type', 'N/A')
     action_params = action_to_critique.get('parameters', {})
@@ -181,64 +185,12 @@ def critique_action(
         logging.error("LLM model is None in critique_action")
         return False, "Critique failed: LLM model not initialized", {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
 
-    max_history_turns_for_prompt = 6
-    string_history = [str(item) for item in history]
-    important_indices = [i for i, item in enumerate(string_history) if "System Observation:" in item or "User responded:" in item or "ask_user" in item or "Critique failed" in item or "User Goal:" in item]
-    if len(string_history) > max_history_turns_for_prompt * 2:
-        cutoff = len(string_history) - (max_history_turns_for_prompt * 2)
-        keep_indices = {0} if len(string_history) > 0 and "User Goal:" in string_history[0] else set()
-        keep_indices.update(range(cutoff, len(string_history)))
-        keep_indices.update(idx for idx in important_indices if idx >= cutoff)
-        keep_indices = {idx for idx in keep_indices if 0 <= idx < len(string_history)} # type: ignore
-        truncated_history = [string_history[i] for i in sorted(list(keep_indices))]
-    else:
-        truncated_history = string_history
-    history_str = "\n".join(truncated_history)
+    if history_str is None:
+        history_str = legacy_history_str([str(item) for item in history], LEGACY_HISTORY_TURNS["critic"])
 
     screenshot_base64 = image_to_base64(critique_screenshot_pil) if critique_screenshot_pil else None
 
-    prompt = f"""
-You are an Action Critic for a PC Automation Assistant. Your task is to evaluate a single proposed action for safety, sensibility, and appropriateness given the context.
-
---- CONTEXT ---
-**Initial User Goal (May be outdated):**
-"{original_instruction}"
-
-**Recent History (Actions, Outcomes, User Responses, Critiques):**
-{history_str}
-*   **CRITICAL: Identify the LATEST user instruction or clarification in the history.** This might override the initial goal. The proposed action MUST align with this LATEST request.
-
-**Proposed Action to Critique:**
-Action Type: {action_type}
-Parameters: {action_params}
-
-**Current Visual Context:** [See attached screenshot if available - CRUCIAL for visual actions like 'click', 'type']
-
---- YOUR TASK ---
-Analyze the **Proposed Action** based on the **LATEST User Instruction** (from history), **Recent History**, and **Current Visual Context** (if provided and relevant).
-
-1.  **Safety Check:** Is the action potentially harmful or destructive (e.g., deleting files unexpectedly, risky shell commands)?
-2.  **Sensibility Check:** Does this action logically follow the history and contribute towards the **LATEST user instruction/clarification**?
-    *   Is it redundant given the history?
-    *   **EXCEPTION:** If the LATEST user instruction was purely conversational (e.g., "hi", "hello", "thanks", "ok") AND the Proposed Action is `ask_user` with a simple greeting/acknowledgement (e.g., "Hello!", "Okay, what next?"), this is **NOT** redundant and should PASS the sensibility check.
-    *   Does it make sense given previous critiques (if any)? Avoid repeating failed patterns.
-    *   Is it targeting the correct application/context based on the screenshot or history?
-3.  **Parameter Check:** Are the parameters reasonable? (e.g., Is the `element_description` for `click` specific enough? Is the `command` for `run_shell_command` valid? Is the `wait` duration appropriate?)
-4.  **Visual Context Check (if screenshot provided):**
-    *   For `edit_image_with_file`:
-        *   If the LATEST user instruction is to **create or generate** an image (e.g., "create a picture of a cat"), then `image_path` being `null` or an empty string (`""`) is **CORRECT and EXPECTED**. The `prompt` parameter should describe the image to be generated.
-        *   If the LATEST user instruction is to **edit or modify** an existing image, then `image_path` **MUST** be a valid path to an image file.
-        *   Critique based on this dual capability. Do not fail a generation request solely because `image_path` is empty/null.
-4.  **Visual Context Check (if screenshot provided):**
-    *   For `click`/`type`/`click_and_type`: Does the target element described in `element_description` seem visible and appropriate in the screenshot for the **LATEST user goal**?
-    *   For `focus_window`: Does a window matching `title_substring` appear plausible based on the screenshot or history for the **LATEST user goal**?
-    *   For `run_shell_command`: Does the command make sense given the visible application state and the **LATEST user goal**?
-
-**Output Format:**
-Provide ONLY these two lines:
-CRITIQUE: [Your concise reasoning for PASS or FAIL, highlighting any concerns, specifically mentioning if it aligns with the LATEST user instruction]
-DECISION: [PASS or FAIL]
-"""
+    prompt = build_critic_suffix(original_instruction, history_str, action_type, action_params)
 
     content = [{"text": prompt}]
     if screenshot_base64:
@@ -248,11 +200,9 @@ DECISION: [PASS or FAIL]
 
     token_usage = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
     try:
-        response = llm_model.generate_content(
-            content,
-            safety_settings={}
+        response, token_usage, _ = context_prefix_cache.generate(
+            "critic", llm_model, "critic", CRITIC_PROMPT_VERSION, CRITIC_STATIC_PREFIX, content, safety_settings={}, cache=True
         )
-        token_usage = _get_token_usage(response)
         txt = ""
         if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
             txt = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text')).strip()
@@ -6,6 +6,7 @@ import re,sys,os
 import json
 from typing import Tuple
 from tools.token_usage_tool import _get_token_usage
+from tools.llm_gateway import llm_gateway
 from typing import List, Dict, Optional, Tuple
 import google.generativeai as genai
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -299,8 +300,7 @@ Example for a 'hard' task "Create a python script to fetch weather data and save
 }}
 """
     try:
-        response = llm_model.generate_content(prompt) # Assuming safety_settings are default or handled by model instance
-        token_usage = _get_token_usage(response)
+        response, token_usage, _ = llm_gateway.generate("task_analysis", prompt, model=llm_model, cache=True)
         # Ensure response_text is correctly accessed
         raw_response_text = ""
         if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
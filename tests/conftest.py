@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+# Tests import the application modules the same way the app does: from the repository root.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+# config.py keeps its caches and Chroma store under the home directory; point it at a
+# throwaway one so tests never read or write the user's data.
+_test_home = tempfile.mkdtemp(prefix="pc_agent_tests_")
+os.environ["HOME"] = os.environ["USERPROFILE"] = _test_home
+
+# Headless runs (CI, no DISPLAY): swap in the no-op pyautogui before any app module imports it.
+from task_exec.replay_harness import install_headless_stubs  # noqa: E402
+
+install_headless_stubs()
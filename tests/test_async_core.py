@@ -0,0 +1,42 @@
+import time
+
+import pytest
+
+from task_exec.async_core import AsyncExecutorCore
+
+
+def _fail():
+    raise ValueError("capture failed")
+
+
+@pytest.fixture(params=[True, False], ids=["concurrent", "sequential"])
+def core(request):
+    core = AsyncExecutorCore(enabled=request.param, io_workers=4)
+    yield core
+    core.shutdown()
+
+
+def test_settled_keeps_successful_phases(core):
+    results, errors = core.run_phases_settled({"app_context": lambda: "notepad", "frame": _fail, "reinforcements": lambda: ["tip"], "skipped": None})
+    assert results == {"app_context": "notepad", "reinforcements": ["tip"]}
+    assert list(errors) == ["frame"] and isinstance(errors["frame"], ValueError)
+    assert core.get_stats()["phases"]["frame"]["calls"] == 1
+
+
+def test_run_phases_reraises_after_all_phases_finish(core):
+    finished = []
+    with pytest.raises(ValueError):
+        core.run_phases({"frame": _fail, "slow": lambda: (time.sleep(0.05), finished.append("slow"))})
+    assert finished == ["slow"]
+
+
+def test_phases_overlap_when_enabled():
+    core = AsyncExecutorCore(enabled=True, io_workers=4)
+    try:
+        start = time.perf_counter()
+        results = core.run_phases({name: (lambda name=name: (time.sleep(0.2), name)[1]) for name in ("a", "b", "c")})
+        assert results == {"a": "a", "b": "b", "c": "c"}
+        assert time.perf_counter() - start < 0.5
+        assert core.get_stats()["overlap_saved_s"] > 0.2
+    finally:
+        core.shutdown()
@@ -0,0 +1,39 @@
+import os
+
+from chromaDB_management.blob_store import BlobStore, BLOB_REF_KEY
+
+
+def test_put_get_round_trip_and_deduplication(tmp_path):
+    store = BlobStore(str(tmp_path))
+    digest = store.put(b"payload")
+    assert store.put(b"payload") == digest
+    assert store.get(digest) == b"payload"
+    assert store.get_stats()["deduplicated"] == 1
+    assert os.path.exists(os.path.join(str(tmp_path), digest[:2], digest[2:]))
+
+
+def test_json_round_trip(tmp_path):
+    store = BlobStore(str(tmp_path))
+    value = {"steps": [1, 2, 3], "name": "é"}
+    assert store.get_json(store.put_json(value)) == value
+
+
+def test_externalize_resolve_round_trip(tmp_path):
+    store = BlobStore(str(tmp_path))
+    history = [
+        {"role": "user", "content": "short"},
+        {"role": "assistant", "content": "ok", "image_data": "x" * 64, "nested": {"log": "y" * 64}},
+    ]
+    externalized = store.externalize(history, min_chars=32)
+
+    assert externalized[0] == history[0]
+    assert set(externalized[1]["image_data"]) == {BLOB_REF_KEY}
+    assert set(externalized[1]["nested"]["log"]) == {BLOB_REF_KEY}
+    assert externalized[1]["content"] == "ok"
+    assert store.resolve(externalized) == history
+
+
+def test_resolve_missing_blob_is_empty_string(tmp_path):
+    store = BlobStore(str(tmp_path))
+    assert store.resolve([{"image_data": {BLOB_REF_KEY: "00" * 32}}]) == [{"image_data": ""}]
+    assert store.get_stats()["missing"] == 1
@@ -0,0 +1,101 @@
+import threading
+import time
+import types
+
+import pytest
+
+from tools import context_cache
+from tools.context_cache import ContextPrefixCache, CONTEXT_CACHE_MIN_CHARS, CONTEXT_CACHE_RENEW_SECONDS
+
+PREFIX = "p" * CONTEXT_CACHE_MIN_CHARS
+
+
+class FakeBackend:
+    pass
+
+
+class FakeCachedContent:
+    def __init__(self):
+        self.updates = 0
+
+    def update(self, ttl):
+        self.updates += 1
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(context_cache, "GeminiBackend", FakeBackend)
+    monkeypatch.setattr(context_cache.llm_gateway, "backend", FakeBackend())
+    monkeypatch.setattr(context_cache, "genai", types.SimpleNamespace(
+        GenerativeModel=types.SimpleNamespace(from_cached_content=lambda cached_content: ("model", cached_content))))
+    return ContextPrefixCache(enabled=True, ttl_seconds=3600)
+
+
+def _base_model():
+    return types.SimpleNamespace(model_name="models/test")
+
+
+def test_concurrent_callers_create_once_outside_the_lock(cache):
+    created = []
+
+    def slow_create(model_name, name, version, prefix):
+        assert not cache._lock.locked()
+        time.sleep(0.1)
+        created.append(name)
+        return FakeCachedContent()
+
+    cache._create = slow_create
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.model_for_prefix(_base_model(), "planner", "v1", PREFIX))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert created == ["planner"]
+    assert len(results) == 5 and len({id(r) for r in results}) == 1 and results[0][0] == "model"
+    assert cache.stats["planner"]["created"] == 1
+
+
+def test_other_prefixes_are_not_blocked_by_a_slow_create(cache):
+    release = threading.Event()
+
+    def create(model_name, name, version, prefix):
+        if name == "planner":
+            release.wait(5)
+        return FakeCachedContent()
+
+    cache._create = create
+    slow = threading.Thread(target=cache.model_for_prefix, args=(_base_model(), "planner", "v1", PREFIX))
+    slow.start()
+    time.sleep(0.05)
+    start = time.perf_counter()
+    assert cache.model_for_prefix(_base_model(), "critic", "v1", PREFIX) is not None
+    assert time.perf_counter() - start < 1.0
+    release.set()
+    slow.join(5)
+
+
+def test_refused_prefix_is_sent_inline_and_not_retried(cache):
+    calls = []
+
+    def refuse(*args):
+        calls.append(args)
+        raise RuntimeError("content too small")
+
+    cache._create = refuse
+    assert cache.model_for_prefix(_base_model(), "planner", "v1", PREFIX) is None
+    assert cache.model_for_prefix(_base_model(), "planner", "v1", PREFIX) is None
+    assert len(calls) == 1 and cache.stats["planner"]["refused"] == 1
+
+
+def test_entry_close_to_expiry_is_renewed(cache):
+    cached = FakeCachedContent()
+    cache._create = lambda *args: cached
+    model = cache.model_for_prefix(_base_model(), "planner", "v1", PREFIX)
+    key = next(iter(cache._entries))
+    cache._entries[key]["expires_at"] = time.time() + CONTEXT_CACHE_RENEW_SECONDS / 2
+
+    assert cache.model_for_prefix(_base_model(), "planner", "v1", PREFIX) is model
+    assert cached.updates == 1 and cache.stats["planner"]["renewed"] == 1
+    assert cache._entries[key]["expires_at"] > time.time() + CONTEXT_CACHE_RENEW_SECONDS
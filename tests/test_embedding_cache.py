@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+
+import chromadb
+import pytest
+from chromadb.utils import embedding_functions
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+from chromaDB_management import embedding_cache
+from chromaDB_management.embedding_cache import CachingEmbeddingFunction, share_with_chroma
+
+
+class FakeEmbeddingFunction:
+    """Deterministic 2-d vectors; records every batch it is asked to embed."""
+
+    def __init__(self, delay_event=None):
+        self.batches = []
+        self.delay_event = delay_event
+
+    def __call__(self, input):
+        if self.delay_event is not None:
+            self.delay_event.wait(2)
+        self.batches.append(list(input))
+        return [[float(len(text)), float(sum(map(ord, text)) % 97)] for text in input]
+
+
+def _vectors(embeddings):
+    # Chroma's EmbeddingFunction base class turns every result into numpy arrays.
+    return [[float(x) for x in embedding] for embedding in embeddings]
+
+
+def test_memory_hits_skip_the_wrapped_function():
+    inner = FakeEmbeddingFunction()
+    cache = CachingEmbeddingFunction(inner, "test-model", batch_window=0)
+    first = cache(["open notepad", "close window", "open notepad"])
+    assert inner.batches == [["open notepad", "close window"]]
+    assert _vectors(cache(["close window", "open notepad"])) == _vectors([first[1], first[0]])
+    assert len(inner.batches) == 1
+    stats = cache.get_stats()
+    assert stats["computed"] == 2 and stats["memory_hits"] == 2
+
+
+def test_disk_store_serves_a_new_instance(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    expected = CachingEmbeddingFunction(FakeEmbeddingFunction(), "test-model", disk_path=path, batch_window=0)(["save file"])
+
+    inner = FakeEmbeddingFunction()
+    cache = CachingEmbeddingFunction(inner, "test-model", disk_path=path, batch_window=0)
+    assert _vectors(cache(["save file"])) == _vectors(expected)
+    assert inner.batches == []
+    assert cache.get_stats()["disk_hits"] == 1
+
+    other_model = FakeEmbeddingFunction()
+    CachingEmbeddingFunction(other_model, "other-model", disk_path=path, batch_window=0)(["save file"])
+    assert other_model.batches == [["save file"]]
+
+
+def test_disk_store_evicts_least_recently_used_rows(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    cache = CachingEmbeddingFunction(FakeEmbeddingFunction(), "test-model", disk_path=path, batch_window=0, max_entries=1, disk_max_entries=10)
+    cache([f"text {i}" for i in range(10)])
+    cache(["text 0"])  # disk hit refreshes its last use (the memory LRU holds one entry)
+    cache(["text 10"])
+
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] == 9
+    assert cache.get_stats()["disk_evictions"] == 2
+    inner = FakeEmbeddingFunction()
+    fresh = CachingEmbeddingFunction(inner, "test-model", disk_path=path, batch_window=0)
+    fresh(["text 0", "text 10", "text 1"])
+    assert inner.batches == [["text 1"]]
+
+
+def test_concurrent_callers_share_one_batch():
+    release = threading.Event()
+    inner = FakeEmbeddingFunction(delay_event=release)
+    cache = CachingEmbeddingFunction(inner, "test-model", batch_window=0.2)
+    results = {}
+
+    def call(name, texts):
+        results[name] = cache(texts)
+
+    threads = [threading.Thread(target=call, args=(f"t{i}", [f"text {i}", "shared"])) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(inner.batches) == 1
+    assert sorted(inner.batches[0]) == sorted(["shared"] + [f"text {i}" for i in range(4)])
+    assert all(_vectors(result)[1] == _vectors(results["t0"])[1] for result in results.values())
+    assert cache.get_stats()["joined"] == 3
+
+
+def test_opens_a_collection_created_with_the_default_function(tmp_path, monkeypatch):
+    monkeypatch.setitem(embedding_functions.known_embedding_functions, "default", DefaultEmbeddingFunction)
+    monkeypatch.setattr(embedding_cache, "_shared_instance", None)
+    path = str(tmp_path / "chroma")
+    chromadb.PersistentClient(path=path).get_or_create_collection("tasks", embedding_function=DefaultEmbeddingFunction())
+
+    cache = CachingEmbeddingFunction(FakeEmbeddingFunction(), "test-model", batch_window=0)
+    share_with_chroma(cache)
+    collection = chromadb.PersistentClient(path=path).get_or_create_collection("tasks", embedding_function=cache)
+    collection.add(ids=["1"], documents=["open notepad"])
+    assert collection.query(query_texts=["open notepad"], n_results=1)["ids"] == [["1"]]
+    assert cache.get_stats()["computed"] == 1 and cache.get_stats()["memory_hits"] == 1
+
+
+def test_failed_batch_raises_and_is_not_cached():
+    class Failing:
+        calls = 0
+
+        def __call__(self, input):
+            Failing.calls += 1
+            raise RuntimeError("model unavailable")
+
+    cache = CachingEmbeddingFunction(Failing(), "test-model", batch_window=0)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            cache(["text"])
+    assert Failing.calls == 2
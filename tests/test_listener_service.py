@@ -0,0 +1,118 @@
+import time
+
+from PIL import Image
+
+from vision.listener_service import VisualListenerService
+
+
+class FakeWatcher:
+    """Stands in for VisualConditionWatcher: fires once it has seen `fire_after` frames."""
+
+    def __init__(self, fire_after=None):
+        self.fire_after = fire_after
+        self.frames_seen = 0
+        self.stats = {"polls": 0}
+        self.token_usage = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+        self.last_reasoning = ""
+
+    def check(self, screenshot):
+        self.frames_seen += 1
+        self.stats["polls"] += 1
+        return self.fire_after is not None and self.frames_seen >= self.fire_after
+
+    def next_poll_interval(self, base_interval, max_interval=None):
+        return base_interval
+
+    def format_stats(self):
+        return f"Polls: {self.stats['polls']}"
+
+
+class FakeCapture:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return Image.new("RGB", (4, 4))
+
+
+def _params(**overrides):
+    params = {
+        "description_of_change": "dialog appears",
+        "polling_interval_seconds": 0.25,
+        "timeout_seconds": 5,
+        "actions_on_detection": [{"action_type": "press_keys", "parameters": {"keys": ["enter"]}}],
+    }
+    params.update(overrides)
+    return params
+
+
+def _wait_until(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_fired_listener_queues_inject_plan_directive():
+    capture = FakeCapture()
+    service = VisualListenerService(capture_fn=capture)
+    started, _, listener_id = service.start_listener("task-1", _params(), None, watcher=FakeWatcher(fire_after=2))
+    assert started and service.has_active_listeners("task-1")
+
+    assert _wait_until(lambda: not service.has_active_listeners("task-1"))
+    directives = service.drain_directives("task-1")
+    assert [d["type"] for d in directives] == ["inject_plan"]
+    assert directives[0]["listener_id"] == listener_id
+    assert directives[0]["plan"] == _params()["actions_on_detection"]
+    assert capture.calls == 2
+    assert service.drain_directives("task-1") == []
+
+
+def test_due_listeners_share_one_capture(monkeypatch):
+    capture = FakeCapture()
+    service = VisualListenerService(capture_fn=capture)
+    monkeypatch.setattr(service, "_ensure_worker", lambda: None)  # Poll by hand so both listeners are due together
+    watchers = [FakeWatcher(fire_after=1), FakeWatcher(fire_after=1)]
+    for watcher in watchers:
+        service.start_listener("task-1", _params(), None, watcher=watcher)
+
+    service._poll_due_listeners(list(service._listeners.values()), time.time())
+    assert not service.has_active_listeners("task-1")
+    assert [w.frames_seen for w in watchers] == [1, 1]
+    assert capture.calls == 1
+    assert len(service.drain_directives("task-1")) == 2
+
+
+def test_timeout_queues_timeout_directive():
+    service = VisualListenerService(capture_fn=FakeCapture())
+    service.start_listener("task-1", _params(timeout_seconds=0.3), None, watcher=FakeWatcher())
+
+    assert _wait_until(lambda: not service.has_active_listeners("task-1"))
+    directives = service.drain_directives("task-1")
+    assert [d["type"] for d in directives] == ["listener_timeout_no_actions"]
+    assert service.get_status("task-1")[0]["status"] == "timed_out"
+
+
+def test_cancel_task_listeners_can_discard_pending_directives():
+    service = VisualListenerService(capture_fn=FakeCapture())
+    service.start_listener("task-1", _params(polling_interval_seconds=60), None, watcher=FakeWatcher())
+    service.start_listener("task-2", _params(polling_interval_seconds=60), None, watcher=FakeWatcher())
+
+    assert service.cancel_task_listeners("task-1", discard_pending=True) == 1
+    assert not service.has_active_listeners("task-1")
+    assert service.drain_directives("task-1") == []
+    assert service.has_active_listeners("task-2")
+
+    assert service.cancel_task_listeners("task-2") == 1
+    assert [d["type"] for d in service.drain_directives("task-2")] == ["listener_cancelled"]
+
+
+def test_invalid_params_are_rejected_without_starting():
+    service = VisualListenerService(capture_fn=FakeCapture())
+    started, message, listener_id = service.start_listener("task-1", _params(description_of_change=""), None, watcher=FakeWatcher())
+    assert not started and listener_id is None
+    assert "description_of_change" in message
+    assert not service.has_active_listeners("task-1")
@@ -0,0 +1,75 @@
+import json
+import os
+import threading
+
+import pytest
+from PIL import Image
+
+# Imported before any app module: it installs the no-op pyautogui on headless machines.
+from task_exec.replay_harness import replay_task
+
+ZERO_TOKENS = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+TOKENS = {"prompt_tokens": 100, "candidates_tokens": 20, "total_tokens": 120}
+
+
+class SpyCollection:
+    """Records any call made on it; the harness must not reach the real session collection."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls.append(name)
+            return {"ids": [], "metadatas": [], "documents": []}
+        return call
+
+
+@pytest.fixture
+def bundle(tmp_path):
+    os.makedirs(str(tmp_path / "frames"))
+    for i in range(2):
+        Image.new("RGB", (320, 200), (i * 100, 50, 50)).save(str(tmp_path / "frames" / f"{i:04d}.png"))
+    manifest = {
+        "version": 1,
+        "instruction": "create hello.txt",
+        "llm_calls": [
+            {"purpose": "task_analysis", "key": None, "token_usage": TOKENS, "latency_s": 0.8,
+             "text": json.dumps({"category": "simple", "sub_tasks": ["Create hello.txt"], "reasoning": "one step"})},
+            {"purpose": "planner", "key": None, "token_usage": TOKENS, "latency_s": 1.5,
+             "text": json.dumps({"next_action": {"action_type": "run_shell_command", "parameters": {"command": "echo hi > hello.txt"}}, "reasoning": "write it"})},
+            {"purpose": "critic", "key": None, "token_usage": TOKENS, "latency_s": 0.7, "text": "CRITIQUE: fine\nDECISION: PASS"},
+        ],
+        "seams": {
+            "get_active_window_name": ["Command Prompt"] * 5,
+            "execute_action": [[True, "Command ran.", None]],
+            "retrieve_similar_task_executions_from_db": [[]],
+            "retrieve_relevant_reinforcements_from_db": [[]],
+            "get_application_shortcuts": [["", ZERO_TOKENS]],
+        },
+        "frames": ["frames/0000.png", "frames/0001.png"],
+        "user_replies": [],
+        "summary": {},
+    }
+    with open(str(tmp_path / "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    return str(tmp_path)
+
+
+def test_replay_runs_without_touching_the_user_stores(bundle, monkeypatch):
+    import app_flask
+    import task_exec.task_executor as task_executor
+
+    spy_collection = SpyCollection()
+    monkeypatch.setattr(app_flask, "agent_task_sessions_collection", spy_collection)
+    session_log, shortcut_index = app_flask.session_log, task_executor.shortcut_index
+    records_before = session_log.get_stats()["records"]
+
+    report = replay_task(bundle)
+
+    assert report["status"] == "completed"
+    assert spy_collection.calls == []
+    assert session_log.get_stats()["records"] == records_before
+    assert app_flask.session_log is session_log and task_executor.shortcut_index is shortcut_index
+    assert app_flask.agent_task_sessions_collection is spy_collection
+    assert not any(thread.name == "session_record_migration" for thread in threading.enumerate())  # no import-time migration
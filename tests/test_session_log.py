@@ -0,0 +1,115 @@
+import os
+import sqlite3
+
+import pytest
+
+from chromaDB_management.blob_store import BlobStore
+from chromaDB_management.session_log import SessionEventLog
+
+
+@pytest.fixture
+def make_log(tmp_path):
+    logs = []
+
+    def make(**kwargs):
+        log = SessionEventLog(path=str(tmp_path / "sessions.sqlite3"), flush_seconds=0.01,
+                              blobs=BlobStore(str(tmp_path / "blobs")), **kwargs)
+        logs.append(log)
+        return log
+
+    yield make
+    for log in logs:
+        log.flush()
+        if log._conn is not None:
+            log._conn.close()
+
+
+def _state(**overrides):
+    state = {
+        "task_id": "task-1", "task_name": "write report", "status": "active", "iteration_count": 0,
+        "total_tokens": {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0},
+        "conversation_history": [{"role": "user", "content": "write a report"}],
+        "agent_thoughts": [], "youtube_references": [], "execution_log": "",
+    }
+    state.update(overrides)
+    return state
+
+
+def _event_count(log, task_id="task-1"):
+    log.flush()
+    with sqlite3.connect(log.path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM session_events WHERE task_id = ?", (task_id,)).fetchone()[0]
+
+
+def test_round_trip_of_appends_text_and_values(make_log):
+    log = make_log()
+    state = _state()
+    assert log.record("task-1", state) == 1  # first record is a snapshot
+    state["conversation_history"].append({"role": "assistant", "content": "on it"})
+    state["agent_thoughts"].append({"content": "planning", "type": "thinking"})
+    state["execution_log"] += "step 1 ok\n"
+    state["iteration_count"] = 1
+    state["status"] = "paused"
+    assert log.record("task-1", state) == 4  # two appends, one text append, one set
+    assert log.record("task-1", state) == 0  # nothing changed
+
+    assert log.load("task-1") == state
+    assert make_log().load("task-1") == state  # read back by a fresh instance
+    assert log.load("unknown-task") is None
+
+
+def test_replaced_or_truncated_list_is_logged_whole(make_log):
+    log = make_log()
+    state = _state()
+    log.record("task-1", state)
+    state["conversation_history"] = [{"role": "system", "content": "history cleared"}]
+    log.record("task-1", state)
+    assert log.load("task-1")["conversation_history"] == state["conversation_history"]
+
+
+def test_large_values_are_stored_as_blobs(make_log, tmp_path):
+    log = make_log()
+    image = "i" * (16 * 1024)
+    state = _state(conversation_history=[{"role": "assistant", "content": "screenshot", "image_data": image}])
+    log.record("task-1", state)
+    log.flush()
+    with sqlite3.connect(log.path) as conn:
+        payloads = [row[0] for row in conn.execute("SELECT payload FROM session_events")]
+    assert all(image not in payload for payload in payloads)
+    assert os.listdir(str(tmp_path / "blobs"))
+    assert log.load("task-1")["conversation_history"][0]["image_data"] == image
+
+
+def test_compaction_folds_events_into_a_snapshot(make_log):
+    log = make_log(snapshot_every=5)
+    state = _state()
+    log.record("task-1", state)
+    for i in range(12):
+        state["agent_thoughts"].append({"content": f"thought {i}", "type": "thinking"})
+        log.record("task-1", state)
+    log.flush()
+
+    assert log.get_stats()["snapshots"] >= 1
+    assert _event_count(log) < 13
+    assert log.load("task-1") == state
+
+
+def test_track_resumes_logging_from_a_loaded_state(make_log):
+    first = make_log()
+    first.record("task-1", _state())
+    first.flush()
+    log = make_log()
+    state = log.load("task-1")
+    log.track("task-1", state)
+    events_before = _event_count(log)
+    state["agent_thoughts"].append({"content": "resumed", "type": "thinking"})
+    assert log.record("task-1", state) == 1
+    assert _event_count(log) == events_before + 1
+    assert log.load("task-1")["agent_thoughts"] == [{"content": "resumed", "type": "thinking"}]
+
+
+def test_disabled_log_writes_nothing(make_log):
+    log = make_log(enabled=False)
+    assert log.record("task-1", _state()) == 0
+    assert log.load("task-1") is None
+    assert not os.path.exists(log.path)
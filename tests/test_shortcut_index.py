@@ -0,0 +1,61 @@
+from tools.shortcut_index import ShortcutIndex, parse_shortcut_text
+
+VSCODE_SHORTCUTS = """**Debugging:**
+- F5: Start debugging
+- Shift+F5: Stop debugging
+- F9: Toggle breakpoint
+
+- Ctrl+Z: Undo
+- Ctrl+C: Copy
+- Ctrl+V: Paste
+
+## Navigation
+- Ctrl+P: Quick open a file by name
+- Ctrl+G: Go to line
+- Ctrl+Shift+O: Go to symbol
+Other useful keys:
+- Ctrl+S: Save
+"""
+
+
+def _by_keys(records):
+    return {r["keys"]: r for r in records}
+
+
+def test_category_is_scoped_to_its_section():
+    records = _by_keys(parse_shortcut_text(VSCODE_SHORTCUTS, "vscode"))
+    assert records["F5"]["category"] == "Debugging"
+    assert records["F9"]["category"] == "Debugging"
+    assert records["Ctrl+Z"]["category"] == ""
+    assert records["Ctrl+C"]["category"] == ""
+    assert records["Ctrl+G"]["category"] == "Navigation"
+    assert records["Ctrl+S"]["category"] == "Other useful keys"
+
+
+def test_heading_followed_by_blank_line_keeps_its_category():
+    records = parse_shortcut_text("## Editing\n\n- Ctrl+X: Cut line\n- Ctrl+D: Select next match\n", "vscode")
+    assert [r["category"] for r in records] == ["Editing", "Editing"]
+
+
+def test_markdown_table_rows_are_parsed():
+    text = "| Shortcut | Action |\n|---|---|\n| `Ctrl+B` | Toggle sidebar |\n| F11 | Toggle full screen |\n"
+    assert [(r["keys"], r["action"]) for r in parse_shortcut_text(text, "vscode")] == [("Ctrl+B", "Toggle sidebar"), ("F11", "Toggle full screen")]
+
+
+def test_action_matches_rank_above_category_matches():
+    text = "**Debugging:**\n" + "\n".join(f"- {k}: {a}" for k, a in [
+        ("F5", "Start debugging"), ("Ctrl+Z", "Undo"), ("Ctrl+C", "Copy"), ("Ctrl+V", "Paste"),
+        ("Ctrl+X", "Cut"), ("Ctrl+A", "Select all"), ("Ctrl+F", "Find"), ("F9", "Toggle breakpoint"),
+    ])
+    index = ShortcutIndex(token_budget=6, persist=False)
+    selected, stats = index.select("vscode", text, "debugging the script")
+    assert selected.splitlines()[0] == "- F5: Start debugging"
+    assert stats["records_shown"] == 1 and stats["records_total"] == 8
+
+
+def test_short_lists_pass_through_unchanged():
+    index = ShortcutIndex(persist=False)
+    text = "- Ctrl+S: Save\n- Ctrl+O: Open"
+    selected, stats = index.select("notepad", text, "save the document")
+    assert selected == text
+    assert index.get_stats()["passthrough"] == 1
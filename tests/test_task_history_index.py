@@ -0,0 +1,60 @@
+from chromaDB_management.task_history_index import TaskHistoryIndex
+
+
+def _record(i, status="completed", name=None):
+    return {"task_id": f"task-{i}", "task_name": name or f"task {i}", "start_time": f"2026-01-01T00:{i:02d}:00+00:00",
+            "end_time": None, "status": status}
+
+
+def _ids(page):
+    return [item["task_id"] for item in page["items"]]
+
+
+def test_pages_newest_first():
+    index = TaskHistoryIndex(loader=lambda: [_record(i) for i in range(10)])
+    first = index.page(limit=4)
+    assert _ids(first) == ["task-9", "task-8", "task-7", "task-6"]
+    assert first["total"] == 10
+    assert _ids(index.page(offset=8, limit=4)) == ["task-1", "task-0"]
+    assert index.page(offset=20, limit=4)["items"] == []
+    assert len(index.page(limit=None)["items"]) == 10
+
+
+def test_filters_by_status_name_prefix_and_time_range():
+    records = [_record(i, status="paused" if i % 2 else "completed", name=("Write" if i < 5 else "open") + f" report {i}") for i in range(10)]
+    index = TaskHistoryIndex(loader=lambda: records)
+
+    paused = index.page(status="paused", limit=2)
+    assert _ids(paused) == ["task-9", "task-7"] and paused["total"] == 5
+    assert _ids(index.page(status=["paused", "completed"], name_prefix="write", limit=None)) == [f"task-{i}" for i in range(4, -1, -1)]
+    ranged = index.page(since="2026-01-01T00:03", until="2026-01-01T00:05", limit=None)
+    assert _ids(ranged) == ["task-5", "task-4", "task-3"] and ranged["total"] == 3
+
+
+def test_upsert_moves_and_updates_entries():
+    index = TaskHistoryIndex(loader=lambda: [_record(i) for i in range(3)])
+    index.upsert({**_record(0), "status": "paused", "start_time": "2026-01-02T00:00:00+00:00"})
+    assert _ids(index.page(limit=1)) == ["task-0"]
+    assert index.get("task-0")["status"] == "paused"
+    index.remove("task-0")
+    assert index.get("task-0") is None and len(index) == 2
+
+
+def test_failed_load_is_retried_and_keeps_earlier_upserts():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("collection unavailable")
+        return [_record(1), {**_record(2), "status": "completed"}]
+
+    index = TaskHistoryIndex(loader=loader)
+    index.upsert({**_record(2), "status": "paused"})
+    assert len(calls) == 1
+
+    assert _ids(index.page()) == ["task-2", "task-1"]
+    assert index.get("task-2")["status"] == "paused"
+    assert len(calls) == 2
+    index.page()
+    assert len(calls) == 2
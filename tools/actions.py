@@ -1,9 +1,10 @@
-from typing import List, Dict, Optional, Tuple, Union, Any
+from typing import List, Dict, Optional, Tuple, Union, Any, Callable
 import os
 import logging,re
 import google.generativeai as genai
 from PIL import  Image
 from tools.token_usage_tool import _get_token_usage
+from tools.llm_gateway import llm_gateway
 from vision.vis import image_to_base64,_hash_pil_image,capture_full_screen,locate_and_click_ui_element
 from agents.ai_agent import UIAgent
 from tools.web_search_tool import search_web_for_info
@@ -11,11 +12,12 @@ import time
 import sys
 import pyautogui
 import pyperclip
-from vision.vis import focus_window_by_title,get_screen_description_from_gemini
+from vision.vis import focus_window_by_title,get_screen_description_from_gemini,_execute_visual_listener
+from vision.listener_service import visual_listener_service
 from tools.web_search_tool import search_web_for_info,navigate_web
 import uuid # Added for unique sentinel in GUI execution
-from tools.youtube_tool import process_and_store_youtube_videos, search_youtube_transcripts # type: ignore
 from utils.file_util import _execute_read_file
+from utils.frame_diff import extract_click_point
 import subprocess
 from tools.image_generating import generate_or_edit_image
 import mimetypes
@@ -24,7 +26,6 @@ import httpx
 import tempfile
 import uuid # Added for unique sentinel
 from tools.files_upload import process_files_from_urls,process_local_files
-import pygetwindow as gw
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
@@ -128,6 +129,52 @@ def _execute_write_file(file_path: str, content: str, append: bool = False) -> T
         logging.error(f"Unexpected error {action_desc} file '{file_path}': {e}", exc_info=True)
         return False, f"Unexpected error {action_desc} file '{file_path}': {e}"
 
+def _stream_content_to_file(file_path: str, prompt: str, generation_model: genai.GenerativeModel) -> Tuple[bool, str, Dict[str, int], Dict[str, float]]:
+    """
+    Streams generated content into a temporary file next to `file_path` and renames it into
+    place when the stream completes, so the target is never left half-written. Leading and
+    trailing whitespace is dropped as the non-streaming path did, holding back only the
+    current whitespace run.
+
+    Returns:
+        A tuple (success: bool, message: str, token_usage, timing).
+    """
+    token_usage = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+    timing: Dict[str, float] = {}
+    directory = os.path.dirname(os.path.abspath(file_path))
+    tmp_path = None
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(file_path)}.", suffix=".part", dir=directory)
+        written = 0
+        pending_whitespace = ""
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            def _write_chunk(text: str) -> None:
+                nonlocal written, pending_whitespace
+                if not written and not pending_whitespace:
+                    text = text.lstrip()
+                data = pending_whitespace + text
+                stripped = data.rstrip()
+                pending_whitespace = data[len(stripped):]
+                if stripped:
+                    f.write(stripped)
+                    written += len(stripped)
+            token_usage, timing = llm_gateway.generate_stream("content_generation", prompt, _write_chunk, model=generation_model)
+        if not written:
+            os.remove(tmp_path)
+            return False, "External Gemini generation returned empty content.", token_usage, timing
+        os.replace(tmp_path, file_path)
+        logging.info(f"Streamed {written} characters to {file_path} (first chunk after {timing.get('ttfb_s', 0.0):.2f}s, total {timing.get('total_s', 0.0):.2f}s)")
+        return True, f"Successfully write to file: {file_path}", token_usage, timing
+    except Exception as e:
+        if tmp_path and os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        logging.error(f"Error streaming generated content to '{file_path}': {e}", exc_info=True)
+        return False, f"Error during large content generation: {e}", token_usage, timing
+
 def execute_cmd_via_run(cmd):
     """
     Execute a command through Windows Run dialog (Win+R) -> cmd -> command
@@ -347,6 +394,7 @@ def execute_action(action: dict, agent: 'UIAgent') -> Union[Tuple[bool, str], Tu
 
                     current_sub_action = sub_action_item.copy()
                     current_sub_action["_is_top_level_action_"] = False
+                    current_sub_action["_task_id_"] = action.get("_task_id_")
 
                     sub_result = execute_action(current_sub_action, agent)
 
@@ -408,8 +456,8 @@ def execute_action(action: dict, agent: 'UIAgent') -> Union[Tuple[bool, str], Tu
                     desc = parameters.get("element_description")
                     if not desc: return False, "Action 'click' failed: Missing 'element_description' or coordinates.", None
                     click_success, click_message = locate_and_click_ui_element(desc, agent)
-                    # Token usage for UIAgent.select_ui_element_for_click is handled within AgentState/TaskSession
-                    return click_success, click_message, {"type": "click_result", "token_usage": ZERO_TOKEN_USAGE} # Placeholder for action's direct tokens
+                    selection_stats = getattr(agent, "last_selection_stats", {})
+                    return click_success, click_message, {"type": "click_result", "token_usage": selection_stats.get("token_usage", ZERO_TOKEN_USAGE), "selection_stats": selection_stats}
 
             elif action_type == "type":
                 text = parameters.get("text_to_type")
@@ -558,6 +606,8 @@ def execute_action(action: dict, agent: 'UIAgent') -> Union[Tuple[bool, str], Tu
                     return False, "Action 'search_youtube' failed: Missing or invalid 'query' parameter.", None # No LLM call here directly
                 logging.info(f"Initiating YouTube search and transcript analysis for: '{query}'")
                 try:
+                    # Imported on first use: the module loads a SentenceTransformer model and opens its Qdrant store
+                    from tools.youtube_tool import process_and_store_youtube_videos, search_youtube_transcripts # type: ignore
                     store_success, store_message, videos_processed = process_and_store_youtube_videos(query, max_results=5)
                     if not store_success or not videos_processed:
                         logging.warning(f"Failed to process or find videos for query '{query}': {store_message}")
@@ -610,10 +660,12 @@ def execute_action(action: dict, agent: 'UIAgent') -> Union[Tuple[bool, str], Tu
                 logging.info(f"[click_and_type] Performing click on: '{desc}'")
 
                 click_success, click_message = locate_and_click_ui_element(desc, agent)
+                selection_stats = getattr(agent, "last_selection_stats", {})
+                action_token_usage = dict(selection_stats.get("token_usage", action_token_usage))
 
                 if not click_success:
                     logging.error(f"[click_and_type] Click part failed: {click_message}")
-                    return False, f"Action 'click_and_type' failed during click: {click_message}", {"type": "click_failed", "token_usage": action_token_usage}
+                    return False, f"Action 'click_and_type' failed during click: {click_message}", {"type": "click_failed", "token_usage": action_token_usage, "selection_stats": selection_stats}
                 logging.info(f"[click_and_type] Click successful, now typing.")
                 try:
                     interval_f = float(interval) # type: ignore
@@ -621,12 +673,14 @@ def execute_action(action: dict, agent: 'UIAgent') -> Union[Tuple[bool, str], Tu
                     time.sleep(0.3)
                     pyautogui.typewrite(text, interval=interval_f) # type: ignore
                     log_text = (text[:50] + '...') if len(text) > 53 else text # type: ignore
-                    message = f"Clicked '{desc}' and typed text: '{log_text}'"
+                    click_point = extract_click_point(click_message)
+                    click_at = f" at ({click_point[0]}, {click_point[1]})" if click_point else ""
+                    message = f"Clicked '{desc}'{click_at} and typed text: '{log_text}'"
                     if press_enter_after:
                         pyautogui.press('enter')
                         message += " and pressed Enter."
                         logging.info(f"[click_and_type] Pressed Enter after typing.")
-                    return True, message, {"type": "click_and_type_success", "token_usage": action_token_usage}
+                    return True, message, {"type": "click_and_type_success", "token_usage": action_token_usage, "selection_stats": selection_stats}
                 except ValueError:
                     return False, f"Action 'click_and_type' failed during type: Invalid 'interval_seconds': {interval}.", {"type": "type_failed", "token_usage": action_token_usage}
                 except Exception as e:
@@ -665,8 +719,21 @@ def execute_action(action: dict, agent: 'UIAgent') -> Union[Tuple[bool, str], Tu
                 return success, content_or_error, None
 
             elif action_type == "start_visual_listener":
-                # _execute_visual_listener returns tokens in its directive
-                return _execute_visual_listener(parameters, agent, agent.model) # type: ignore
+                if parameters.get("blocking"):
+                    # _execute_visual_listener returns tokens in its directive
+                    return _execute_visual_listener(parameters, agent, agent.model) # type: ignore
+                started, listener_message, listener_id = visual_listener_service.start_listener(
+                    action.get("_task_id_"), parameters, agent.model
+                )
+                return started, listener_message, {"type": "listener_started" if started else "error", "listener_id": listener_id, "token_usage": ZERO_TOKEN_USAGE}
+
+            elif action_type == "cancel_visual_listener":
+                listener_id = parameters.get("listener_id")
+                if listener_id:
+                    cancelled = visual_listener_service.cancel_listener(listener_id)
+                    return cancelled, f"Visual listener '{listener_id}' {'cancelled' if cancelled else 'was not running'}.", None
+                cancelled_count = visual_listener_service.cancel_task_listeners(action.get("_task_id_"))
+                return True, f"Cancelled {cancelled_count} running visual listener(s) for this task.", None
 
             elif action_type == "generate_large_content_with_gemini":
                 context_summary = parameters.get("context_summary")
@@ -677,23 +744,13 @@ def execute_action(action: dict, agent: 'UIAgent') -> Union[Tuple[bool, str], Tu
                     return False, "Action 'generate_large_content_with_gemini' failed: Missing one or more required parameters (context_summary, detailed_prompt_for_gemini, target_file_path).", {"type": "error", "token_usage": action_token_usage}
 
                 logging.info(f"Calling external Gemini for large content generation. Target: {target_file_path}")
-                gen_tokens = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
-                try:
-                    generation_model = model 
-                    response = generation_model.generate_content(detailed_prompt) 
-                    gen_tokens = _get_token_usage(response)
-                    generated_content = ""
-                    if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-                         generated_content = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text')).strip()
-
-                    if not generated_content:
-                        return False, "External Gemini generation returned empty content.", {"type": "generation_failed", "token_usage": gen_tokens}
-
-                    write_success, write_message = _execute_write_file(target_file_path, generated_content, append=False) # type: ignore
-                    return write_success, f"Generated content and {write_message}", {"type": "generation_complete", "file_path": target_file_path, "token_usage": gen_tokens}
-                except Exception as e_gen:
-                    logging.error(f"Error during 'generate_large_content_with_gemini': {e_gen}", exc_info=True)
-                    return False, f"Error during large content generation: {e_gen}", {"type": "generation_error", "token_usage": gen_tokens}
+                write_success, write_message, gen_tokens, gen_timing = _stream_content_to_file(target_file_path, detailed_prompt, model()) # type: ignore
+                timing_info = {"ttfb_ms": round(gen_timing.get("ttfb_s", 0.0) * 1000.0, 1), "total_ms": round(gen_timing.get("total_s", 0.0) * 1000.0, 1)}
+                if write_success:
+                    return True, f"Generated content and {write_message}", {"type": "generation_complete", "file_path": target_file_path, "token_usage": gen_tokens, **timing_info}
+                if write_message.startswith("External Gemini generation returned empty content"):
+                    return False, write_message, {"type": "generation_failed", "token_usage": gen_tokens, **timing_info}
+                return False, write_message, {"type": "generation_error", "token_usage": gen_tokens, **timing_info}
 
             elif action_type == "INFORM_USER":
                 msg = parameters.get("message", "")
@@ -752,8 +809,10 @@ def chat_with_user(
     conversation_history: List[str], 
     user_input: str, 
     execution_results: List[Tuple[dict, bool, str, Optional[Dict]]], 
-    plan_reasoning: str
+    plan_reasoning: str,
+    on_token: Optional[Callable[[str], None]] = None
 ) -> Tuple[str, Dict[str, int]]:
+    """With `on_token`, the reply is streamed and every text chunk is passed to it as it arrives."""
     logging.info("Generating conversational response.")
     summary = "\nExecution Summary:\n"
     task_result_info = "" 
@@ -885,14 +944,23 @@ Generate the response now:
     token_usage = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0} 
     try:
         safety_settings = { 'HARM_CATEGORY_HARASSMENT': 'BLOCK_MEDIUM_AND_ABOVE', 'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_MEDIUM_AND_ABOVE', 'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_MEDIUM_AND_ABOVE', 'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_MEDIUM_AND_ABOVE' }
-        response = model.generate_content(prompt, safety_settings=safety_settings) 
-        token_usage = _get_token_usage(response)
+        response = None
         reply = ""
-        if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-            reply = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text')).strip()
+        if on_token is not None:
+            chunks: List[str] = []
+            def _on_chunk(text: str) -> None:
+                chunks.append(text)
+                on_token(text)
+            token_usage, timing = llm_gateway.generate_stream("chat", prompt, _on_chunk, model=model(), safety_settings=safety_settings)
+            reply = "".join(chunks).strip()
+            logging.info(f"Chat reply streamed: first chunk after {timing['ttfb_s']:.2f}s, total {timing['total_s']:.2f}s.")
+        else:
+            response, token_usage, _ = llm_gateway.generate("chat", prompt, model=model(), safety_settings=safety_settings)
+            if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
+                reply = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text')).strip()
 
         if not reply:
-            if hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
+            if response is not None and hasattr(response, 'prompt_feedback') and response.prompt_feedback and response.prompt_feedback.block_reason:
                 reason = response.prompt_feedback.block_reason
                 logging.error(f"LLM chat response blocked: {reason}")
                 reply = f"My response was blocked ({reason}). Check logs for execution details."
@@ -1023,8 +1091,7 @@ def assess_action_outcome(
 
     try:
         safety_settings = {}
-        response = llm_model.generate_content(content, safety_settings=safety_settings)
-        token_usage = _get_token_usage(response)
+        response, token_usage, _ = llm_gateway.generate("assessment", content, model=llm_model, safety_settings=safety_settings)
         response_text = ""
         if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
             response_text = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text')).strip()
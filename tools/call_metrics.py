@@ -0,0 +1,144 @@
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Any, List
+
+# Registry of LLM and tool call metrics, tagged by call site (gateway purpose or action type),
+# model and the action being executed. Aggregated per process and per task; the per-task
+# aggregate is a plain dict owned by the TaskSession so it is saved and restored with it.
+LATENCY_BUCKETS_S = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+# Per-task token budget used when a task does not set its own (None = unlimited).
+DEFAULT_TASK_TOKEN_BUDGET: Optional[int] = None
+
+
+def _new_entry(kind: str, site: str, model: str, action_type: str) -> Dict[str, Any]:
+    return {
+        "kind": kind, "site": site, "model": model, "action_type": action_type,
+        "calls": 0, "errors": 0, "cache_hits": 0,
+        "latency_s": 0.0, "max_latency_s": 0.0, "latency_histogram": [0] * (len(LATENCY_BUCKETS_S) + 1),
+        "prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0, "image_bytes": 0,
+    }
+
+
+def image_payload_bytes(contents: Any) -> int:
+    """Bytes of image data attached to a prompt (inline_data dicts, SDK Part objects, PIL images)."""
+    if isinstance(contents, (list, tuple)):
+        return sum(image_payload_bytes(part) for part in contents)
+    if isinstance(contents, dict):
+        inline = contents.get("inline_data")
+        if isinstance(inline, dict):
+            data = inline.get("data", b"")
+            if isinstance(data, str):
+                return len(data) * 3 // 4  # base64 text
+            return len(data) if isinstance(data, (bytes, bytearray)) else 0
+        return sum(image_payload_bytes(value) for value in contents.values() if isinstance(value, (list, tuple, dict)))
+    inline = getattr(contents, "inline_data", None)
+    if inline is not None:
+        data = getattr(inline, "data", None)
+        return len(data) if isinstance(data, (bytes, bytearray)) else 0
+    size = getattr(contents, "size", None)
+    if getattr(contents, "mode", None) and isinstance(size, tuple) and len(size) == 2:
+        return int(size[0]) * int(size[1]) * len(contents.getbands())  # PIL image, uncompressed
+    return 0
+
+
+def _add(entry: Dict[str, Any], latency_s: float, token_usage: Optional[Dict[str, int]], image_bytes: int, cache_hit: bool, error: bool) -> None:
+    entry["calls"] += 1
+    entry["errors"] += 1 if error else 0
+    entry["cache_hits"] += 1 if cache_hit else 0
+    entry["latency_s"] = round(entry["latency_s"] + latency_s, 4)
+    entry["max_latency_s"] = round(max(entry["max_latency_s"], latency_s), 4)
+    entry["latency_histogram"][bisect.bisect_left(LATENCY_BUCKETS_S, latency_s)] += 1
+    for key in ("prompt_tokens", "candidates_tokens", "total_tokens"):
+        entry[key] += int((token_usage or {}).get(key, 0) or 0)
+    entry["image_bytes"] += image_bytes
+
+
+def summarize_by_site(metrics: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Roll the tagged entries up per call site, most tokens first."""
+    sites: Dict[str, Dict[str, Any]] = {}
+    for entry in (metrics.get("calls") or {}).values():
+        site = sites.setdefault(f"{entry['kind']}:{entry['site']}", {
+            "kind": entry["kind"], "site": entry["site"], "calls": 0, "errors": 0, "cache_hits": 0,
+            "latency_s": 0.0, "total_tokens": 0, "image_bytes": 0,
+        })
+        for key in ("calls", "errors", "cache_hits", "total_tokens", "image_bytes"):
+            site[key] += entry.get(key, 0)
+        site["latency_s"] = round(site["latency_s"] + entry.get("latency_s", 0.0), 4)
+    for site in sites.values():
+        site["mean_latency_s"] = round(site["latency_s"] / site["calls"], 3) if site["calls"] else 0.0
+    return sorted(sites.values(), key=lambda s: (s["total_tokens"], s["latency_s"]), reverse=True)
+
+
+class CallMetricsRegistry:
+    """
+    Thread-safe metrics registry. The agent runs one task at a time, so calls are attributed
+    to the task set with activate_task() (also from listener threads). The action being
+    executed is tracked per thread with action_scope().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._process: Dict[str, Any] = {"calls": {}}
+        self._task_id: Optional[str] = None
+        self._task_metrics: Optional[Dict[str, Any]] = None
+
+    def activate_task(self, task_id: Optional[str], task_metrics: Optional[Dict[str, Any]] = None) -> None:
+        """Attribute subsequent calls to `task_id`, aggregating into `task_metrics` (mutated in place)."""
+        with self._lock:
+            self._task_id = task_id
+            self._task_metrics = task_metrics
+            if task_metrics is not None:
+                task_metrics.setdefault("calls", {})
+
+    @property
+    def active_task_id(self) -> Optional[str]:
+        return self._task_id
+
+    @contextmanager
+    def action_scope(self, action_type: Optional[str]):
+        """Tag calls made by this thread with the action being executed."""
+        previous = getattr(self._local, "action_type", "")
+        self._local.action_type = action_type or ""
+        try:
+            yield
+        finally:
+            self._local.action_type = previous
+
+    def record(
+        self,
+        kind: str,
+        site: str,
+        model: str = "",
+        latency_s: float = 0.0,
+        token_usage: Optional[Dict[str, int]] = None,
+        image_bytes: int = 0,
+        cache_hit: bool = False,
+        error: bool = False
+    ) -> None:
+        action_type = getattr(self._local, "action_type", "")
+        key = f"{kind}|{site}|{model}|{action_type}"
+        with self._lock:
+            targets = [self._process]
+            if self._task_metrics is not None:
+                targets.append(self._task_metrics)
+            for metrics in targets:
+                entry = metrics["calls"].get(key)
+                if entry is None:
+                    entry = metrics["calls"][key] = _new_entry(kind, site, model, action_type)
+                _add(entry, latency_s, token_usage, image_bytes, cache_hit, error)
+
+    def get_process_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = {key: {**entry, "latency_histogram": list(entry["latency_histogram"])} for key, entry in self._process["calls"].items()}
+        return {"latency_buckets_s": list(LATENCY_BUCKETS_S), "calls": calls, "by_site": summarize_by_site({"calls": calls})}
+
+    def get_task_stats(self, task_metrics: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        with self._lock:
+            calls = {key: dict(entry) for key, entry in ((task_metrics or {}).get("calls") or {}).items()}
+        return {"latency_buckets_s": list(LATENCY_BUCKETS_S), "calls": calls, "by_site": summarize_by_site({"calls": calls})}
+
+
+call_metrics = CallMetricsRegistry()
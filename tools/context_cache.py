@@ -0,0 +1,159 @@
+import datetime
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Optional, Any, Tuple, List
+import google.generativeai as genai
+
+from tools.llm_gateway import llm_gateway, GeminiBackend
+
+# Gemini explicit context caching for static prompt prefixes (planner/critic instructions).
+# A prefix is cached once per (model, prefix name, version, text hash) as the system
+# instruction of a CachedContent; calls then send only their dynamic suffix. The TTL is
+# renewed when a call comes in less than CONTEXT_CACHE_RENEW_SECONDS before expiry.
+# Prefixes the API refuses (e.g. below the model's minimum cacheable size) are sent inline
+# and not retried for CONTEXT_CACHE_RETRY_SECONDS. Inline prefixes still come first, so
+# Gemini's implicit prefix caching can apply to them. The create/renew API calls run outside
+# the lock: one caller per prefix makes the call while concurrent callers wait on its
+# in-flight future (creation) or keep using the still-valid entry (renewal).
+CONTEXT_CACHE_ENABLED = True
+CONTEXT_CACHE_TTL_SECONDS = 30 * 60
+CONTEXT_CACHE_RENEW_SECONDS = 5 * 60
+CONTEXT_CACHE_RETRY_SECONDS = 30 * 60
+CONTEXT_CACHE_MIN_CHARS = 4096  # ~1k tokens, the smallest prefix worth a cache entry
+CHARS_PER_TOKEN = 4
+
+
+def prefix_hash(name: str, version: str, prefix: str) -> str:
+    return hashlib.blake2b(f"{name}\x00{version}\x00{prefix}".encode("utf-8"), digest_size=12).hexdigest()
+
+
+class ContextPrefixCache:
+    """Tracks the CachedContent per static prompt prefix and reports static vs dynamic prompt size."""
+
+    def __init__(self, enabled: bool = CONTEXT_CACHE_ENABLED, ttl_seconds: float = CONTEXT_CACHE_TTL_SECONDS):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], Dict[str, Any]] = {}  # (model name, prefix hash) -> entry
+        self._refused: Dict[Tuple[str, str], float] = {}  # -> time of refusal
+        self._inflight: Dict[Tuple[str, str], Future] = {}  # -> create/renew in progress, resolves to the model or None
+        self.stats: Dict[str, Dict[str, Any]] = {}
+
+    def _stat(self, name: str) -> Dict[str, Any]:
+        return self.stats.setdefault(name, {
+            "calls": 0, "cached_calls": 0, "created": 0, "renewed": 0, "refused": 0,
+            "prefix_chars": 0, "suffix_chars": 0, "version": "",
+        })
+
+    def _create(self, model_name: str, name: str, version: str, prefix: str) -> Any:
+        from google.generativeai import caching
+        return caching.CachedContent.create(
+            model=model_name,
+            display_name=f"{name}-{version}",
+            system_instruction=prefix,
+            ttl=datetime.timedelta(seconds=self.ttl_seconds),
+        )
+
+    def model_for_prefix(self, base_model: Any, name: str, version: str, prefix: str) -> Optional[genai.GenerativeModel]:
+        """A GenerativeModel bound to the cached prefix, or None when the prefix must be sent inline."""
+        model_name = getattr(base_model, "model_name", "") or ""
+        if not (self.enabled and model_name and isinstance(llm_gateway.backend, GeminiBackend)) or len(prefix) < CONTEXT_CACHE_MIN_CHARS:
+            return None
+        key = (model_name, prefix_hash(name, version, prefix))
+        now = time.time()
+        pending: Optional[Future] = None
+        with self._lock:
+            if now - self._refused.get(key, 0.0) < CONTEXT_CACHE_RETRY_SECONDS:
+                return None
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] > now and (entry["expires_at"] - now >= CONTEXT_CACHE_RENEW_SECONDS or key in self._inflight):
+                return entry["model"]  # fresh, or another caller is already renewing it
+            pending = self._inflight.get(key)
+            if pending is None:
+                future = self._inflight[key] = Future()
+        if pending is not None:
+            return pending.result()  # another caller is creating this prefix's entry
+        renewing = entry is not None and entry["expires_at"] > now
+        try:
+            if renewing:
+                entry["cached"].update(ttl=datetime.timedelta(seconds=self.ttl_seconds))
+                entry = {**entry, "expires_at": now + self.ttl_seconds}
+            else:
+                cached = self._create(model_name, name, version, prefix)
+                entry = {"cached": cached, "model": genai.GenerativeModel.from_cached_content(cached_content=cached), "expires_at": now + self.ttl_seconds}
+        except Exception as e:
+            with self._lock:
+                self._entries.pop(key, None)
+                self._refused[key] = now
+                self._stat(name)["refused"] += 1
+                self._inflight.pop(key, None)
+            logging.warning(f"Context cache: '{name}' prefix not cached, sending it inline ({e}).")
+            future.set_result(None)
+            return None
+        with self._lock:
+            self._entries[key] = entry
+            self._stat(name)["renewed" if renewing else "created"] += 1
+            self._inflight.pop(key, None)
+        if not renewing:
+            logging.info(f"Context cache: cached '{name}' prefix {version} ({len(prefix)} chars) for {model_name}.")
+        future.set_result(entry["model"])
+        return entry["model"]
+
+    def generate(
+        self,
+        purpose: str,
+        base_model: Any,
+        name: str,
+        version: str,
+        prefix: str,
+        suffix_parts: List[Dict[str, Any]],
+        **kwargs
+    ) -> Tuple[Any, Dict[str, int], float]:
+        """llm_gateway.generate() with the prefix served from the context cache, or prepended inline."""
+        suffix_chars = sum(len(part.get("text", "")) for part in suffix_parts)
+        cached_model = self.model_for_prefix(base_model, name, version, prefix)
+        with self._lock:
+            stat = self._stat(name)
+            stat["calls"] += 1
+            stat["version"] = version
+            stat["prefix_chars"] += len(prefix)
+            stat["suffix_chars"] += suffix_chars
+            stat["cached_calls"] += 1 if cached_model is not None else 0
+        namespace = prefix_hash(name, version, prefix)
+        if cached_model is not None:
+            return llm_gateway.generate(purpose, suffix_parts, model=cached_model, cache_namespace=namespace, **kwargs)
+        return llm_gateway.generate(purpose, [{"text": prefix}] + suffix_parts, model=base_model, cache_namespace=namespace, **kwargs)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per prefix: calls, how many used the cached prefix, and estimated prefix/suffix tokens per call."""
+        with self._lock:
+            report = {}
+            for name, stat in self.stats.items():
+                calls = max(1, stat["calls"])
+                report[name] = {
+                    **stat,
+                    "prefix_tokens_per_call": stat["prefix_chars"] // CHARS_PER_TOKEN // calls,
+                    "suffix_tokens_per_call": stat["suffix_chars"] // CHARS_PER_TOKEN // calls,
+                }
+            return report
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = {}
+
+    def clear(self) -> None:
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._refused.clear()
+        for entry in entries:
+            try:
+                entry["cached"].delete()
+            except Exception as e:
+                logging.debug(f"Context cache: could not delete cached content: {e}")
+
+
+context_prefix_cache = ContextPrefixCache()
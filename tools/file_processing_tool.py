@@ -6,6 +6,7 @@ import tempfile
 from typing import Dict, Tuple, List
 from tools.token_usage_tool import _get_token_usage
 from config import get_client
+from tools.llm_gateway import llm_gateway
 
 # Supported file types for Gemini API
 SUPPORTED_MIME_TYPES = [
@@ -60,12 +61,12 @@ def process_local_files(filepaths: List[str], prompt: str) -> Tuple[bool, str, D
             )
             file_refs.append(file_ref)
             
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=[*file_refs, prompt]
+        response, token_usage, _ = llm_gateway.generate(
+            "file_processing",
+            [*file_refs, prompt],
+            model_name="gemini-2.0-flash"
         )
         
-        token_usage = _get_token_usage(response)
         logging.info(f"Token usage for local file processing: {token_usage}")
         
         if not response.text:
@@ -127,12 +128,12 @@ def process_files_from_urls(urls: List[str], prompt: str) -> Tuple[bool, str, Di
             finally:
                 pathlib.Path(tmp_path).unlink(missing_ok=True)
                 
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=[*file_refs, prompt]
+        response, token_usage, _ = llm_gateway.generate(
+            "file_processing",
+            [*file_refs, prompt],
+            model_name="gemini-2.0-flash"
         )
         
-        token_usage = _get_token_usage(response)
         logging.info(f"Token usage for URL file processing: {token_usage}")
         
         if not response.text:
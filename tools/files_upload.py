@@ -3,6 +3,7 @@ import pathlib
 import httpx
 import tempfile
 from config import get_client
+from tools.llm_gateway import llm_gateway
 
 # Supported file types for Gemini API
 SUPPORTED_MIME_TYPES = [
@@ -49,9 +50,10 @@ def process_local_files(filepaths, prompt):
             )
             file_refs.append(file_ref)
             
-        response = get_client().models.generate_content(
-            model="gemini-2.0-flash",
-            contents=[*file_refs, prompt]
+        response, token_usage, _ = llm_gateway.generate(
+            "file_processing",
+            [*file_refs, prompt],
+            model_name="gemini-2.0-flash"
         )
         
         if not response.text:
@@ -93,9 +95,10 @@ def process_files_from_urls(urls, prompt):
             file_refs.append(file_ref)
             pathlib.Path(tmp_path).unlink(missing_ok=True)
             
-        response = get_client().models.generate_content(
-            model="gemini-2.0-flash",
-            contents=[*file_refs, prompt]
+        response, token_usage, _ = llm_gateway.generate(
+            "file_processing",
+            [*file_refs, prompt],
+            model_name="gemini-2.0-flash"
         )
         
         if not response.text:
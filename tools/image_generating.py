@@ -7,6 +7,7 @@ import base64
 import json
 import logging
 from config import get_client  
+from tools.llm_gateway import llm_gateway
 
 def generate_or_edit_image(prompt, image_path=None, output_path='output.png'):
     try:
@@ -44,9 +45,10 @@ def generate_or_edit_image(prompt, image_path=None, output_path='output.png'):
 
         # Make API call
         try:
-            response = client.models.generate_content(
-                model="gemini-2.0-flash-preview-image-generation",
-                contents=contents,
+            response, _, _ = llm_gateway.generate(
+                "image_generation",
+                contents,
+                model_name="gemini-2.0-flash-preview-image-generation",
                 config=types.GenerateContentConfig(
                     response_modalities=['TEXT', 'IMAGE']
                 )
@@ -0,0 +1,441 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Dict, Optional, Tuple, Any, List, Callable, Union, Iterator
+import google.generativeai as genai
+
+from tools.token_usage_tool import _get_token_usage
+from tools.llm_response_cache import llm_response_cache, make_cache_key, cached_response
+from tools.call_metrics import call_metrics, image_payload_bytes
+from config import get_client, get_model
+
+# All Gemini calls go through llm_gateway, for both SDKs:
+#   - genai.GenerativeModel.generate_content (pass `model=`)
+#   - client.models.generate_content (pass `model_name=`; uses the shared config.get_client())
+# Reusing the one configured GenerativeModel / Client keeps their HTTP/gRPC connections pooled.
+LLM_GLOBAL_CONCURRENCY = 4
+LLM_PURPOSE_CONCURRENCY = {
+    "planner": 2,
+    "task_analysis": 1,
+    "critic": 2,
+    "assessment": 2,
+    "ui_selection": 2,
+    "vision": 2,
+    "listener": 1,
+    "reinforcement": 1,
+    "shortcuts": 1,
+    "web_search": 2,
+    "file_processing": 2,
+    "image_generation": 1,
+    "content_generation": 1,
+    "chat": 2,
+}
+DEFAULT_PURPOSE_CONCURRENCY = 2
+
+# Per-call deadline in seconds, covering queueing, all attempts and backoff sleeps.
+LLM_PURPOSE_DEADLINES = {
+    "image_generation": 180.0,
+    "file_processing": 180.0,
+    "content_generation": 240.0,
+    "web_search": 90.0,
+}
+DEFAULT_LLM_DEADLINE_SECONDS = 90.0
+
+LLM_MAX_ATTEMPTS = 4
+LLM_BACKOFF_BASE_SECONDS = 1.0
+LLM_BACKOFF_MAX_SECONDS = 20.0
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+_RETRYABLE_MARKERS = ("429", "resource_exhausted", "resource exhausted", "rate limit", "quota",
+                      "500 internal", "503", "unavailable", "overloaded", "502", "504", "deadline exceeded")
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """The call did not complete (including retries) within its deadline."""
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    """HTTP-style status code from google.api_core / google.genai / httpx style exceptions."""
+    for attr in ("code", "status_code"):
+        value = getattr(exc, attr, None)
+        if callable(value):
+            try:
+                value = value()
+            except Exception:
+                value = None
+        value = getattr(value, "value", value)  # grpc.StatusCode enums carry (int, name)
+        if isinstance(value, tuple) and value:
+            value = value[0]
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """True for rate limiting (429) and transient server errors (5xx)."""
+    if isinstance(exc, LLMDeadlineExceeded):
+        return False
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    message = str(exc).lower()
+    return any(marker in message for marker in _RETRYABLE_MARKERS)
+
+
+def response_text(response: Any) -> str:
+    """Concatenated text parts of the first candidate (works for both SDKs), '' if none."""
+    try:
+        if response is not None and getattr(response, "candidates", None):
+            content = response.candidates[0].content
+            parts = getattr(content, "parts", None) or []
+            return "".join(part.text for part in parts if getattr(part, "text", None)).strip()
+    except (AttributeError, IndexError, TypeError, ValueError):
+        pass
+    return ""
+
+
+class GeminiBackend:
+    """Default backend: the real SDK objects."""
+
+    def generate_with_model(self, purpose: str, model: genai.GenerativeModel, contents: Any, **kwargs) -> Any:
+        return model.generate_content(contents, **kwargs)
+
+    def generate_with_client(self, purpose: str, model_name: str, contents: Any, config: Any = None) -> Any:
+        client = get_client()
+        if client is None:
+            raise RuntimeError("Gemini client is not configured.")
+        return client.models.generate_content(model=model_name, contents=contents, config=config)
+
+    def stream_with_model(self, purpose: str, model: genai.GenerativeModel, contents: Any, **kwargs) -> Iterator[Any]:
+        return iter(model.generate_content(contents, stream=True, **kwargs))
+
+    def stream_with_client(self, purpose: str, model_name: str, contents: Any, config: Any = None) -> Iterator[Any]:
+        client = get_client()
+        if client is None:
+            raise RuntimeError("Gemini client is not configured.")
+        return iter(client.models.generate_content_stream(model=model_name, contents=contents, config=config))
+
+
+class FakeLLMBackend:
+    """
+    Local backend for tests and benchmarks. `responder(purpose, contents)` returns the reply
+    text (default: a fixed string). `failures` is a list of exceptions raised by the first
+    calls, to exercise the retry policy. Token usage is estimated at 4 characters per token.
+    Streams split the reply into `stream_chunk_chars` pieces, `chunk_latency_seconds` apart.
+    """
+
+    def __init__(
+        self,
+        responder: Optional[Union[str, Callable[[str, Any], str]]] = None,
+        latency_seconds: float = 0.0,
+        failures: Optional[List[BaseException]] = None,
+        stream_chunk_chars: int = 64,
+        chunk_latency_seconds: float = 0.0
+    ):
+        self.responder = responder if responder is not None else "OK"
+        self.latency_seconds = latency_seconds
+        self.failures = list(failures or [])
+        self.stream_chunk_chars = max(1, stream_chunk_chars)
+        self.chunk_latency_seconds = chunk_latency_seconds
+        self.calls: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _response(text: str, prompt_tokens: int, candidates_tokens: int) -> Any:
+        part = SimpleNamespace(text=text, function_call=None)
+        return SimpleNamespace(
+            text=text,
+            candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]), finish_reason=1)],
+            usage_metadata=SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=candidates_tokens,
+                                           total_token_count=prompt_tokens + candidates_tokens),
+            prompt_feedback=None,
+        )
+
+    def _reply(self, purpose: str, contents: Any) -> str:
+        with self._lock:
+            self.calls.append({"purpose": purpose, "contents": contents})
+            failure = self.failures.pop(0) if self.failures else None
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        if failure is not None:
+            raise failure
+        return self.responder(purpose, contents) if callable(self.responder) else self.responder
+
+    def _respond(self, purpose: str, contents: Any) -> Any:
+        text = self._reply(purpose, contents)
+        return self._response(text, max(1, len(str(contents)) // 4), max(1, len(text) // 4))
+
+    def _stream(self, purpose: str, contents: Any) -> Iterator[Any]:
+        text = self._reply(purpose, contents)
+        prompt_tokens = max(1, len(str(contents)) // 4)
+        for start in range(0, len(text), self.stream_chunk_chars):
+            if start and self.chunk_latency_seconds:
+                time.sleep(self.chunk_latency_seconds)
+            chunk = text[start:start + self.stream_chunk_chars]
+            # Like the SDKs, usage metadata on every chunk is cumulative; the last one is final.
+            yield self._response(chunk, prompt_tokens, max(1, (start + len(chunk)) // 4))
+
+    def generate_with_model(self, purpose: str, model: Any, contents: Any, **kwargs) -> Any:
+        return self._respond(purpose, contents)
+
+    def generate_with_client(self, purpose: str, model_name: str, contents: Any, config: Any = None) -> Any:
+        return self._respond(purpose, contents)
+
+    def stream_with_model(self, purpose: str, model: Any, contents: Any, **kwargs) -> Iterator[Any]:
+        return self._stream(purpose, contents)
+
+    def stream_with_client(self, purpose: str, model_name: str, contents: Any, config: Any = None) -> Iterator[Any]:
+        return self._stream(purpose, contents)
+
+
+class LLMGateway:
+    """
+    Single entry point for Gemini calls: global and per-purpose concurrency limits, jittered
+    exponential backoff on 429/5xx, a deadline per call and uniform token/latency accounting.
+    """
+
+    def __init__(self, backend: Optional[Any] = None, global_concurrency: int = LLM_GLOBAL_CONCURRENCY):
+        self.backend = backend or GeminiBackend()
+        self._global_limit = threading.BoundedSemaphore(global_concurrency)
+        self._purpose_limits: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        # Attempts run on this pool so a deadline can abandon a hung request. A slot stays
+        # taken until the abandoned request really finishes.
+        self._pool = ThreadPoolExecutor(max_workers=global_concurrency * 2, thread_name_prefix="llm_gateway")
+        self.stats: Dict[str, Dict[str, Any]] = {}
+
+    def set_backend(self, backend: Optional[Any]) -> None:
+        self.backend = backend or GeminiBackend()
+
+    @contextmanager
+    def use_backend(self, backend: Any):
+        """Temporarily route all calls to another backend (e.g. FakeLLMBackend)."""
+        previous = self.backend
+        self.backend = backend
+        try:
+            yield backend
+        finally:
+            self.backend = previous
+
+    def _purpose_limit(self, purpose: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if purpose not in self._purpose_limits:
+                self._purpose_limits[purpose] = threading.BoundedSemaphore(LLM_PURPOSE_CONCURRENCY.get(purpose, DEFAULT_PURPOSE_CONCURRENCY))
+            return self._purpose_limits[purpose]
+
+    def _record(self, purpose: str, **increments) -> None:
+        with self._lock:
+            stats = self.stats.setdefault(purpose, {"calls": 0, "cache_hits": 0, "retries": 0, "errors": 0, "timeouts": 0, "latency_s": 0.0, "total_tokens": 0, "streams": 0, "ttfb_s": 0.0})
+            for key, value in increments.items():
+                stats[key] = stats.get(key, 0) + value
+
+    def _observe(self, purpose: str, model_label: str, latency: float, contents: Any, token_usage: Optional[Dict[str, int]] = None, cache_hit: bool = False, error: bool = False) -> None:
+        """Report one finished call to the call metrics registry."""
+        try:
+            call_metrics.record("llm", purpose, model_label, latency, token_usage, image_payload_bytes(contents), cache_hit, error)
+        except Exception as e:
+            logging.debug(f"LLM gateway: could not record call metrics for '{purpose}': {e}")
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {purpose: dict(stats) for purpose, stats in self.stats.items()}
+
+    def _attempt(self, purpose: str, call: Callable[[], Any], deadline: float) -> Any:
+        """One attempt under both concurrency limits, bounded by the remaining deadline."""
+        purpose_limit = self._purpose_limit(purpose)
+        if not purpose_limit.acquire(timeout=max(0.0, deadline - time.time())):
+            raise LLMDeadlineExceeded(f"Timed out waiting for a '{purpose}' LLM slot.")
+        if not self._global_limit.acquire(timeout=max(0.0, deadline - time.time())):
+            purpose_limit.release()
+            raise LLMDeadlineExceeded(f"Timed out waiting for a global LLM slot ({purpose}).")
+
+        def _release(_future) -> None:
+            self._global_limit.release()
+            purpose_limit.release()
+
+        try:
+            future = self._pool.submit(call)
+        except Exception:
+            _release(None)
+            raise
+        future.add_done_callback(_release)
+        try:
+            return future.result(timeout=max(0.0, deadline - time.time()))
+        except FutureTimeoutError:
+            raise LLMDeadlineExceeded(f"LLM call for '{purpose}' exceeded its deadline.")
+
+    def generate(
+        self,
+        purpose: str,
+        contents: Any,
+        model: Optional[genai.GenerativeModel] = None,
+        model_name: Optional[str] = None,
+        config: Any = None,
+        deadline_seconds: Optional[float] = None,
+        max_attempts: int = LLM_MAX_ATTEMPTS,
+        cache: bool = False,
+        cache_namespace: Optional[str] = None,
+        **model_kwargs
+    ) -> Tuple[Any, Dict[str, int], float]:
+        """
+        Call Gemini and return (raw response, token_usage, latency_seconds).
+        With `model_name` the shared google.genai Client is used (with `config`), otherwise
+        `model` (default: config.get_model()) with `model_kwargs` such as safety_settings.
+        `cache=True` opts the call into the persistent response cache: a hit returns a
+        text-only response with zero token usage and "cached_calls": 1. `cache_namespace` is
+        added to the cache key for prompt parts not in `contents` (e.g. a context-cached prefix).
+        Raises the last error once retries are exhausted, or LLMDeadlineExceeded.
+        """
+        start = time.time()
+        deadline = start + (deadline_seconds if deadline_seconds is not None else LLM_PURPOSE_DEADLINES.get(purpose, DEFAULT_LLM_DEADLINE_SECONDS))
+        backend = self.backend
+        if model_name:
+            call = lambda: backend.generate_with_client(purpose, model_name, contents, config)
+            cache_model, cache_config, system_instruction = model_name, config, None
+            model_label = model_name
+        else:
+            is_fake = isinstance(backend, FakeLLMBackend)
+            target_model = model if model is not None or is_fake else get_model()
+            if target_model is None and not is_fake:
+                raise RuntimeError("Gemini model is not configured.")
+            call = lambda: backend.generate_with_model(purpose, target_model, contents, **model_kwargs)
+            cache_model = getattr(target_model, "model_name", "") or ""
+            cache_config = {"generation_config": getattr(target_model, "_generation_config", None), **model_kwargs}
+            system_instruction = getattr(target_model, "_system_instruction", None)
+            model_label = cache_model
+
+        cache_key = None
+        if cache and llm_response_cache.enabled:
+            cache_key = make_cache_key(cache_model, contents, {"namespace": cache_namespace, "config": cache_config} if cache_namespace else cache_config, system_instruction)
+            entry = llm_response_cache.get(cache_key, purpose)
+            if entry is not None:
+                latency = time.time() - start
+                self._record(purpose, calls=1, cache_hits=1, latency_s=latency)
+                tokens_saved = (entry.get("token_usage") or {}).get("total_tokens", 0) or 0
+                token_usage = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0, "cached_calls": 1, "tokens_saved": tokens_saved}
+                self._observe(purpose, model_label, latency, contents, cache_hit=True)
+                return cached_response(entry["text"]), token_usage, latency
+
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = self._attempt(purpose, call, deadline)
+                latency = time.time() - start
+                token_usage = _get_token_usage(response)
+                self._record(purpose, calls=1, latency_s=latency, total_tokens=token_usage.get("total_tokens", 0) or 0)
+                self._observe(purpose, model_label, latency, contents, token_usage)
+                if cache_key is not None:
+                    llm_response_cache.put(cache_key, purpose, cache_model, response_text(response), token_usage)
+                return response, token_usage, latency
+            except LLMDeadlineExceeded:
+                self._record(purpose, calls=1, timeouts=1, latency_s=time.time() - start)
+                self._observe(purpose, model_label, time.time() - start, contents, error=True)
+                logging.error(f"LLM gateway: '{purpose}' call exceeded its deadline after {attempt} attempt(s).")
+                raise
+            except Exception as e:
+                retryable = is_retryable_error(e)
+                backoff = min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * (2 ** (attempt - 1)))
+                backoff = random.uniform(0, backoff)  # full jitter
+                if not retryable or attempt >= max_attempts or time.time() + backoff >= deadline:
+                    self._record(purpose, calls=1, errors=1, latency_s=time.time() - start)
+                    self._observe(purpose, model_label, time.time() - start, contents, error=True)
+                    raise
+                self._record(purpose, retries=1)
+                logging.warning(f"LLM gateway: '{purpose}' attempt {attempt} failed ({e}); retrying in {backoff:.1f}s.")
+                time.sleep(backoff)
+
+    def generate_stream(
+        self,
+        purpose: str,
+        contents: Any,
+        on_chunk: Callable[[str], None],
+        model: Optional[genai.GenerativeModel] = None,
+        model_name: Optional[str] = None,
+        config: Any = None,
+        deadline_seconds: Optional[float] = None,
+        max_attempts: int = LLM_MAX_ATTEMPTS,
+        **model_kwargs
+    ) -> Tuple[Dict[str, int], Dict[str, float]]:
+        """
+        Stream a reply, calling `on_chunk(text)` for every text chunk as it arrives (the text is
+        not accumulated here). Returns (token_usage, timing) with timing = {"ttfb_s", "total_s",
+        "chunks", "chars"}. Failures before the first chunk are retried like generate(); once
+        text has been handed to `on_chunk` errors are raised to the caller. The deadline is
+        checked between chunks.
+        """
+        start = time.time()
+        deadline = start + (deadline_seconds if deadline_seconds is not None else LLM_PURPOSE_DEADLINES.get(purpose, DEFAULT_LLM_DEADLINE_SECONDS))
+        backend = self.backend
+        if model_name:
+            open_stream = lambda: backend.stream_with_client(purpose, model_name, contents, config)
+            model_label = model_name
+        else:
+            is_fake = isinstance(backend, FakeLLMBackend)
+            target_model = model if model is not None or is_fake else get_model()
+            if target_model is None and not is_fake:
+                raise RuntimeError("Gemini model is not configured.")
+            open_stream = lambda: backend.stream_with_model(purpose, target_model, contents, **model_kwargs)
+            model_label = getattr(target_model, "model_name", "") or ""
+
+        purpose_limit = self._purpose_limit(purpose)
+        if not purpose_limit.acquire(timeout=max(0.0, deadline - time.time())):
+            raise LLMDeadlineExceeded(f"Timed out waiting for a '{purpose}' LLM slot.")
+        if not self._global_limit.acquire(timeout=max(0.0, deadline - time.time())):
+            purpose_limit.release()
+            raise LLMDeadlineExceeded(f"Timed out waiting for a global LLM slot ({purpose}).")
+        timing = {"ttfb_s": 0.0, "total_s": 0.0, "chunks": 0, "chars": 0}
+        token_usage = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+        try:
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    for chunk in open_stream():
+                        text = response_text(chunk)
+                        usage = _get_token_usage(chunk)
+                        if usage.get("total_tokens"):
+                            token_usage = usage
+                        if text:
+                            if not timing["chunks"]:
+                                timing["ttfb_s"] = time.time() - start
+                            timing["chunks"] += 1
+                            timing["chars"] += len(text)
+                            on_chunk(text)
+                        if time.time() > deadline:
+                            raise LLMDeadlineExceeded(f"LLM stream for '{purpose}' exceeded its deadline.")
+                    break
+                except LLMDeadlineExceeded:
+                    self._record(purpose, calls=1, streams=1, timeouts=1, latency_s=time.time() - start)
+                    self._observe(purpose, model_label, time.time() - start, contents, token_usage, error=True)
+                    raise
+                except Exception as e:
+                    backoff = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * (2 ** (attempt - 1))))
+                    if timing["chunks"] or not is_retryable_error(e) or attempt >= max_attempts or time.time() + backoff >= deadline:
+                        self._record(purpose, calls=1, streams=1, errors=1, latency_s=time.time() - start)
+                        self._observe(purpose, model_label, time.time() - start, contents, token_usage, error=True)
+                        raise
+                    self._record(purpose, retries=1)
+                    logging.warning(f"LLM gateway: '{purpose}' stream attempt {attempt} failed ({e}); retrying in {backoff:.1f}s.")
+                    time.sleep(backoff)
+        finally:
+            self._global_limit.release()
+            purpose_limit.release()
+        timing["total_s"] = time.time() - start
+        self._record(purpose, calls=1, streams=1, latency_s=timing["total_s"], ttfb_s=timing["ttfb_s"], total_tokens=token_usage.get("total_tokens", 0) or 0)
+        self._observe(purpose, model_label, timing["total_s"], contents, token_usage)
+        logging.info(f"LLM gateway: '{purpose}' stream finished: {timing['chunks']} chunks, {timing['chars']} chars, ttfb {timing['ttfb_s']:.2f}s, total {timing['total_s']:.2f}s.")
+        return token_usage, timing
+
+    def generate_text(self, purpose: str, contents: Any, **kwargs) -> Tuple[str, Dict[str, int], float]:
+        """Like generate() but returns (text, token_usage, latency_seconds)."""
+        response, token_usage, latency = self.generate(purpose, contents, **kwargs)
+        return response_text(response), token_usage, latency
+
+
+llm_gateway = LLMGateway()
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, Optional, Any, Tuple
+
+from config import CACHE_DIR
+
+# Disk cache of LLM text responses, used by llm_gateway.generate(..., cache=True).
+# Keyed by model name, prompt text, hashes of attached images/bytes and the generation
+# config; one JSON file per entry, evicted least-recently-used once the directory grows
+# past LLM_RESPONSE_CACHE_MAX_BYTES.
+LLM_RESPONSE_CACHE_ENABLED = True
+LLM_RESPONSE_CACHE_DIR = os.path.join(CACHE_DIR, "llm_responses")
+LLM_RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Time-to-live per gateway purpose, in seconds.
+LLM_RESPONSE_CACHE_TTLS = {
+    "shortcuts": 7 * 24 * 3600.0,
+    "task_analysis": 24 * 3600.0,
+    "web_search": 6 * 3600.0,
+    "critic": 3600.0,
+}
+DEFAULT_LLM_RESPONSE_CACHE_TTL = 3600.0
+
+
+class _Uncacheable(Exception):
+    """Contents contain something that cannot be hashed stably (e.g. an uploaded file ref)."""
+
+
+def _hash_bytes(data: Any) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8", "replace")
+    return hashlib.blake2b(bytes(data), digest_size=16).hexdigest()
+
+
+def _canonical_contents(contents: Any) -> Any:
+    """JSON-able form of the prompt with inline images replaced by their hash."""
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, (list, tuple)):
+        return [_canonical_contents(part) for part in contents]
+    if isinstance(contents, dict):
+        canonical = {}
+        for key, value in contents.items():
+            if key == "inline_data" and isinstance(value, dict):
+                canonical[key] = {"mime_type": value.get("mime_type"), "sha": _hash_bytes(value.get("data", b""))}
+            elif key == "data" and isinstance(value, (bytes, bytearray, str)):
+                canonical[key] = _hash_bytes(value)
+            else:
+                canonical[key] = _canonical_contents(value)
+        return canonical
+    if isinstance(contents, (int, float, bool)) or contents is None:
+        return contents
+    raise _Uncacheable(type(contents).__name__)
+
+
+def _canonical_config(config: Any) -> str:
+    if config is None:
+        return ""
+    dump = getattr(config, "model_dump_json", None)  # google.genai pydantic types
+    if callable(dump):
+        try:
+            return dump(exclude_none=True)
+        except Exception:
+            pass
+    return json.dumps(config, sort_keys=True, default=str)
+
+
+def make_cache_key(model_name: str, contents: Any, config: Any = None, system_instruction: Any = None) -> Optional[str]:
+    """Content address of one request, or None if the contents cannot be cached."""
+    try:
+        canonical = json.dumps(_canonical_contents(contents), sort_keys=True, ensure_ascii=False)
+    except _Uncacheable as e:
+        logging.debug(f"LLM response cache: request not cacheable ({e}).")
+        return None
+    hasher = hashlib.blake2b(digest_size=20)
+    for piece in (model_name or "", str(system_instruction or ""), _canonical_config(config), canonical):
+        hasher.update(piece.encode("utf-8", "replace"))
+        hasher.update(b"\x00")
+    return hasher.hexdigest()
+
+
+def cached_response(text: str) -> Any:
+    """Minimal response object with the attributes the call sites read (text, candidates, prompt_feedback)."""
+    part = SimpleNamespace(text=text, function_call=None)
+    return SimpleNamespace(
+        text=text,
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]), finish_reason="STOP")],
+        usage_metadata=None,
+        prompt_feedback=None,
+    )
+
+
+class LLMResponseCache:
+    """Size-bounded LRU on disk; file modification time is the recency stamp."""
+
+    def __init__(self, cache_dir: str = LLM_RESPONSE_CACHE_DIR, max_bytes: int = LLM_RESPONSE_CACHE_MAX_BYTES, enabled: bool = LLM_RESPONSE_CACHE_ENABLED):
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index: Optional[Dict[str, Tuple[int, float]]] = None  # key -> (size, last use)
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "writes": 0, "evictions": 0, "tokens_saved": 0}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_index(self) -> Dict[str, Tuple[int, float]]:
+        if self._index is None:
+            self._index = {}
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    try:
+                        st = os.stat(os.path.join(self.cache_dir, name))
+                        self._index[name[:-5]] = (st.st_size, st.st_mtime)
+                    except OSError:
+                        continue
+        return self._index
+
+    def _remove(self, key: str) -> None:
+        self._load_index().pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def get(self, key: Optional[str], purpose: str) -> Optional[Dict[str, Any]]:
+        """Cached entry {"text", "token_usage", ...} if present and younger than the purpose's TTL."""
+        if key is None:
+            return None
+        ttl = LLM_RESPONSE_CACHE_TTLS.get(purpose, DEFAULT_LLM_RESPONSE_CACHE_TTL)
+        with self._lock:
+            if key not in self._load_index():
+                self.stats["misses"] += 1
+                return None
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"LLM response cache: dropping unreadable entry {key}: {e}")
+                self._remove(key)
+                self.stats["misses"] += 1
+                return None
+            now = time.time()
+            if now - entry.get("created", 0) > ttl:
+                self._remove(key)
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            try:
+                os.utime(self._path(key), (now, now))
+            except OSError:
+                pass
+            self._index[key] = (self._index[key][0], now)
+            self.stats["hits"] += 1
+            self.stats["tokens_saved"] += (entry.get("token_usage") or {}).get("total_tokens", 0) or 0
+            return entry
+
+    def put(self, key: Optional[str], purpose: str, model_name: str, text: str, token_usage: Dict[str, int]) -> None:
+        if key is None or not text:
+            return
+        entry = {"purpose": purpose, "model": model_name, "created": time.time(), "text": text, "token_usage": token_usage}
+        with self._lock:
+            index = self._load_index()
+            path = self._path(key)
+            tmp_path = f"{path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+                index[key] = (os.path.getsize(path), time.time())
+                self.stats["writes"] += 1
+            except OSError as e:
+                logging.warning(f"LLM response cache: could not write entry for '{purpose}': {e}")
+                return
+            self._evict()
+
+    def _evict(self) -> None:
+        index = self._load_index()
+        total = sum(size for size, _ in index.values())
+        if total <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(index.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes * 0.9:
+                break
+            self._remove(key)
+            total -= size
+            self.stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._load_index()):
+                self._remove(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            index = self._load_index()
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": len(index),
+                "bytes": sum(size for size, _ in index.values()),
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+            }
+
+
+llm_response_cache = LLMResponseCache()
@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import re
+import threading
+from typing import Dict, Optional, Any, List, Tuple
+
+from tools.context_cache import CHARS_PER_TOKEN
+
+# Structured shortcut index. The free-text list get_application_shortcuts returns (and keeps
+# caching as text) is parsed into records {keys, action, category, app, source}, stored one
+# per row in the "shortcut_records" Chroma collection (embedded once, when an app's text
+# changes). At planning time only the records relevant to the current instruction are put
+# in the prompt: keyword overlap plus embedding similarity, filled best-first up to
+# SHORTCUT_PROMPT_TOKEN_BUDGET. Text that does not parse into at least
+# SHORTCUT_INDEX_MIN_RECORDS records is passed through whole, as before.
+SHORTCUT_PROMPT_TOKEN_BUDGET = 250
+SHORTCUT_INDEX_MIN_RECORDS = 8
+SHORTCUT_EMBEDDING_CANDIDATES = 40
+SHORTCUT_MIN_SIMILARITY = 0.3
+SHORTCUT_KEYWORD_WEIGHT = 1.0  # per instruction keyword found in the record's action
+SHORTCUT_CATEGORY_KEYWORD_WEIGHT = 0.25  # per keyword found only in its category heading
+
+_KEY_NAMES = {
+    "ctrl", "control", "alt", "shift", "win", "windows", "cmd", "fn", "tab", "esc", "escape", "enter", "return",
+    "space", "spacebar", "home", "end", "pgup", "pgdn", "pageup", "pagedown", "page up", "page down", "delete", "del",
+    "backspace", "insert", "ins", "up", "down", "left", "right", "prtsc", "printscreen", "menu",
+}
+_FUNCTION_KEY = re.compile(r"^f([1-9]|1[0-9]|2[0-4])$")
+_SEPARATORS = re.compile(r"\s*(?::|\s[-–—]\s|\t|\s{2,})\s*")
+_BULLET = re.compile(r"^\s*(?:[-*•·]\s+|\d+[.)]\s*)")
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "the", "and", "for", "with", "this", "that", "from", "into", "then", "your", "you", "open", "use", "using",
+    "current", "selected", "file", "window", "app", "application", "task", "step", "please", "want", "need",
+}
+
+
+def _stem(word: str) -> str:
+    """Crude stem: drop a common suffix and keep 6 letters (debugger/debugging -> debugg)."""
+    for suffix in ("ing", "ed", "es", "s"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            word = word[: -len(suffix)]
+            break
+    return word[:6]
+
+
+def _keywords(text: str) -> set:
+    return {_stem(w) for w in _WORD.findall(text.lower()) if len(w) >= 3 and w not in _STOPWORDS}
+
+
+def _unquote(text: str) -> str:
+    text = text.strip().strip("*").strip()
+    return text[1:-1].strip() if len(text) > 2 and text[0] == text[-1] == "`" else text
+
+
+def _looks_like_keys(text: str) -> bool:
+    """Ctrl+Shift+P, F5, Esc, Ctrl+K Ctrl+S, Alt+Tab / Alt+Shift+Tab, Ctrl+`, ..."""
+    text = _unquote(text)
+    if not text or len(text) > 40:
+        return False
+    for combo in re.split(r"\s*,\s*|\s+(?:/|or)\s+|\s+(?=(?:ctrl|alt|shift|win)\b)", text, flags=re.I):
+        if not combo:
+            continue
+        parts = [p.strip().lower() for p in combo.split("+")]
+        for part in parts:
+            if not part or not (part in _KEY_NAMES or _FUNCTION_KEY.match(part) or len(part) == 1 or part.isdigit()):
+                return False
+    return True
+
+
+def parse_shortcut_text(text: str, app: str, source: str = "llm") -> List[Dict[str, str]]:
+    """Shortcut records from the free-text list (bullets, "Keys: action", "Keys - action" and markdown tables)."""
+    records, category, seen = [], "", set()
+    section_records = 0  # records parsed under the current category heading
+    for raw_line in (text or "").splitlines():
+        line = raw_line.strip()
+        if not line:
+            # A blank line after a section's records closes it; later records are uncategorised until the next heading.
+            if section_records:
+                category, section_records = "", 0
+            continue
+        if set(line) <= set("|-: "):
+            continue
+        if line.startswith("|"):  # markdown table row
+            cells = [_unquote(c) for c in line.strip("|").split("|")]
+            keys, action = (cells[0], " ".join(cells[1:]).strip()) if len(cells) >= 2 else ("", "")
+        else:
+            heading = line.startswith("#") or (line.startswith("**") and line.rstrip(":").endswith("**"))
+            line = _BULLET.sub("", line).replace("**", "")
+            pieces = _SEPARATORS.split(line, maxsplit=1)
+            keys, action = (pieces[0], pieces[1]) if len(pieces) == 2 else ("", "")
+            if heading or (not action and line.endswith(":")):
+                category, section_records = line.strip("#*: ").strip(), 0
+                continue
+            keys, action = _unquote(keys), action.replace("`", "")
+        if not action or not _looks_like_keys(keys):
+            if section_records and not line.startswith("|"):  # prose after the section's records ends it too
+                category, section_records = "", 0
+            continue
+        section_records += 1
+        keys = " ".join(keys.split())
+        if (keys.lower(), action.lower()) in seen:
+            continue
+        seen.add((keys.lower(), action.lower()))
+        records.append({"keys": keys, "action": action.strip(), "category": category, "app": app, "source": source})
+    return records
+
+
+def format_records(records: List[Dict[str, str]]) -> str:
+    return "\n".join(f"- {r['keys']}: {r['action']}" for r in records)
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.blake2b((text or "").encode("utf-8"), digest_size=10).hexdigest()
+
+
+class ShortcutIndex:
+    """Parsed shortcut records per app, kept in memory and in the shortcut_records collection."""
+
+    def __init__(self, token_budget: int = SHORTCUT_PROMPT_TOKEN_BUDGET, persist: bool = True):
+        self.token_budget = token_budget
+        self.persist = persist  # False: records stay in memory and selection uses keywords only (replay harness)
+        self._lock = threading.Lock()
+        self._records: Dict[str, Tuple[str, List[Dict[str, str]]]] = {}  # app -> (text hash, records)
+        self.stats: Dict[str, Any] = {"selections": 0, "passthrough": 0, "full_tokens": 0, "prompt_tokens": 0, "records_total": 0, "records_shown": 0}
+
+    def _collection(self) -> Any:
+        if not self.persist:
+            return None
+        try:
+            from config import chroma_client, shortcut_records_collection
+            return shortcut_records_collection if chroma_client else None
+        except ImportError:
+            return None
+
+    def records_for(self, app: str, shortcuts_text: str) -> List[Dict[str, str]]:
+        """Parse (once per text) and index the app's shortcut text."""
+        text_hash = _text_hash(shortcuts_text)
+        with self._lock:
+            cached = self._records.get(app)
+            if cached and cached[0] == text_hash:
+                return cached[1]
+        records = parse_shortcut_text(shortcuts_text, app)
+        with self._lock:
+            self._records[app] = (text_hash, records)
+        collection = self._collection()
+        if collection is not None and len(records) >= SHORTCUT_INDEX_MIN_RECORDS:
+            try:
+                existing = collection.get(where={"app": app}, include=["metadatas"])
+                if not any((m or {}).get("text_hash") == text_hash for m in (existing.get("metadatas") or [])[:1]):
+                    if existing.get("ids"):
+                        collection.delete(ids=existing["ids"])
+                    collection.add(
+                        ids=[f"{app}:{text_hash}:{i}" for i in range(len(records))],
+                        documents=[f"{r['action']} ({r['category']})" if r["category"] else r["action"] for r in records],
+                        metadatas=[{**r, "text_hash": text_hash} for r in records],
+                    )
+                    logging.info(f"Indexed {len(records)} shortcut records for '{app}'.")
+            except Exception as e:
+                logging.warning(f"Could not index shortcut records for '{app}': {e}")
+        return records
+
+    def _similarities(self, app: str, instruction: str, count: int) -> Dict[int, float]:
+        """Record index -> cosine similarity to the instruction, for the nearest candidates."""
+        collection = self._collection()
+        if collection is None:
+            return {}
+        try:
+            results = collection.query(query_texts=[instruction], n_results=min(count, SHORTCUT_EMBEDDING_CANDIDATES), where={"app": app})
+            similarities = {}
+            for record_id, distance in zip(results["ids"][0], results["distances"][0]):
+                similarities[int(record_id.rsplit(":", 1)[1])] = 1.0 - float(distance)
+            return similarities
+        except Exception as e:
+            logging.warning(f"Shortcut embedding match failed for '{app}', using keywords only: {e}")
+            return {}
+
+    def select(self, app: str, shortcuts_text: str, instruction: str, token_budget: Optional[int] = None) -> Tuple[str, Dict[str, int]]:
+        """
+        The shortcut text to put in the planner prompt for `instruction`, and its stats
+        (full_tokens, prompt_tokens, records_total, records_shown).
+        """
+        full_tokens = len(shortcuts_text or "") // CHARS_PER_TOKEN
+        records = self.records_for(app, shortcuts_text) if shortcuts_text and shortcuts_text.strip() else []
+        if len(records) < SHORTCUT_INDEX_MIN_RECORDS:
+            stats = {"full_tokens": full_tokens, "prompt_tokens": full_tokens, "records_total": len(records), "records_shown": len(records)}
+            self._record(stats, passthrough=True)
+            return shortcuts_text, stats
+        budget_chars = (token_budget or self.token_budget) * CHARS_PER_TOKEN
+        wanted = _keywords(instruction)
+        similarities = self._similarities(app, instruction, len(records))
+        scored = []
+        for index, record in enumerate(records):
+            action_matches = wanted & _keywords(record["action"])
+            category_matches = (wanted & _keywords(record["category"])) - action_matches
+            similarity = similarities.get(index, 0.0)
+            if action_matches or category_matches or similarity >= SHORTCUT_MIN_SIMILARITY:
+                score = SHORTCUT_KEYWORD_WEIGHT * len(action_matches) + SHORTCUT_CATEGORY_KEYWORD_WEIGHT * len(category_matches) + similarity
+                scored.append((score, index))
+        chosen, used = [], 0
+        for _, index in sorted(scored, reverse=True):
+            line_chars = len(records[index]["keys"]) + len(records[index]["action"]) + 5
+            if used + line_chars > budget_chars:
+                break
+            chosen.append(index)
+            used += line_chars
+        shown = [records[i] for i in sorted(chosen)]
+        text = format_records(shown) if shown else "No shortcuts matched this step."
+        text += f"\n({len(shown)} of {len(records)} known '{app}' shortcuts shown, picked for this step.)"
+        stats = {"full_tokens": full_tokens, "prompt_tokens": len(text) // CHARS_PER_TOKEN, "records_total": len(records), "records_shown": len(shown)}
+        self._record(stats)
+        return text, stats
+
+    def _record(self, stats: Dict[str, int], passthrough: bool = False) -> None:
+        with self._lock:
+            self.stats["selections"] += 1
+            self.stats["passthrough"] += 1 if passthrough else 0
+            for key in ("full_tokens", "prompt_tokens", "records_total", "records_shown"):
+                self.stats[key] += stats[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["tokens_saved"] = stats["full_tokens"] - stats["prompt_tokens"]
+        return stats
+
+
+shortcut_index = ShortcutIndex()
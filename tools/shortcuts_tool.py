@@ -6,6 +6,7 @@ import time
 import hashlib
 from typing import Dict
 from tools.token_usage_tool import _get_token_usage
+from tools.llm_gateway import llm_gateway
 from utils.sanitize_util import sanitize_filename
 from typing import Tuple
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -102,16 +103,16 @@ def get_application_shortcuts(app_name_base: str, force_refresh: bool = False) -
         logging.info(f"Force refreshing shortcuts for {app_name_base} from LLM.")
 
     try:
-        client= get_client()  # type: ignore
-        response = client.models.generate_content( # type: ignore
-            model=MODEL_NAME, # type: ignore
-            contents=[{"text": prompt}], 
+        response, token_usage, _ = llm_gateway.generate( # type: ignore
+            "shortcuts",
+            [{"text": prompt}],
+            model_name=MODEL_NAME, # type: ignore
             config=GenerateContentConfig( # type: ignore
                 tools=[GOOGLE_SEARCH_TOOL], # type: ignore
                 response_modalities=["TEXT"], # type: ignore
-            )
+            ),
+            cache=not force_refresh
         )
-        token_usage = _get_token_usage(response)
 
         raw_response_text = ""
         if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
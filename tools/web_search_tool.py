@@ -7,6 +7,7 @@ from typing import Dict, Tuple
 from google.genai.types import GenerateContentConfig
 
 from tools.token_usage_tool import _get_token_usage
+from tools.llm_gateway import llm_gateway
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from config import GOOGLE_SEARCH_TOOL,get_client,MODEL_NAME
 
@@ -33,16 +34,16 @@ Provide a concise summary based on the search results.
 """
     token_usage = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
     try:
-        client= get_client() 
-        response = client.models.generate_content( # type: ignore
-            model=MODEL_NAME, # type: ignore
-            contents=[{"text": prompt}], 
+        response, token_usage, _ = llm_gateway.generate( # type: ignore
+            "web_search",
+            [{"text": prompt}],
+            model_name=MODEL_NAME, # type: ignore
             config=GenerateContentConfig( # type: ignore
                 tools=[GOOGLE_SEARCH_TOOL], # type: ignore
                 response_modalities=["TEXT"], # type: ignore
-            )
+            ),
+            cache=True
         )
-        token_usage = _get_token_usage(response)
         logging.info(f"Token usage reported by API for search_web_for_info (query: '{query[:30]}...'): {token_usage}")
 
         raw_response_text = ""
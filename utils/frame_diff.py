@@ -0,0 +1,227 @@
+import logging
+import re
+import time
+from typing import Optional, Union, Dict, List, Tuple, Any
+import numpy as np
+import cv2
+from PIL import Image
+
+# Tile edge in pixels. Changes are aggregated per tile before regions are built.
+DEFAULT_DIFF_TILE_SIZE = 16
+# Per-channel intensity delta below which a pixel is treated as unchanged (compression/AA noise).
+DEFAULT_DIFF_PIXEL_THRESHOLD = 24
+# Minimum fraction of changed pixels for a tile to count as changed (filters a blinking caret).
+DEFAULT_DIFF_MIN_TILE_FRACTION = 0.02
+MAX_DIFF_REGIONS = 20
+
+# Heuristics used by the assessor.
+CLICK_REGION_MARGIN_PX = 150
+NEW_WINDOW_MIN_AREA_FRACTION = 0.04
+NEW_WINDOW_MIN_FILL_RATIO = 0.6
+SIGNIFICANT_CHANGE_FRACTION = 0.01
+
+BENCHMARK_FRAME_SIZES = {
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+    "triple_1080p": (5760, 1080),
+}
+
+
+def _max_channel_delta(before: Union[Image.Image, np.ndarray], after: Union[Image.Image, np.ndarray]) -> Optional[np.ndarray]:
+    """
+    Per-pixel max absolute channel difference as an HxW uint8 array.
+    Alpha is ignored. Returns None if the frame sizes differ.
+    """
+    if isinstance(before, Image.Image) and isinstance(after, Image.Image) and before.mode != after.mode:
+        before = before.convert(after.mode)
+    before_arr = np.asarray(before)
+    after_arr = np.asarray(after)
+    if before_arr.shape != after_arr.shape:
+        return None
+    delta = cv2.absdiff(before_arr, after_arr)
+    if delta.ndim == 2:
+        return delta
+    channel_max = delta[:, :, 0]
+    for channel in range(1, min(delta.shape[2], 3)):
+        channel_max = np.maximum(channel_max, delta[:, :, channel])
+    return channel_max
+
+
+def compute_frame_diff(
+    before: Optional[Union[Image.Image, np.ndarray]],
+    after: Optional[Union[Image.Image, np.ndarray]],
+    tile_size: int = DEFAULT_DIFF_TILE_SIZE,
+    pixel_threshold: int = DEFAULT_DIFF_PIXEL_THRESHOLD,
+    min_tile_fraction: float = DEFAULT_DIFF_MIN_TILE_FRACTION,
+    max_regions: int = MAX_DIFF_REGIONS
+) -> Optional[Dict[str, Any]]:
+    """
+    Compare two frames tile by tile.
+
+    Returns a dict with `changed_fraction` (share of pixels whose max channel delta exceeds
+    `pixel_threshold`), `changed_tiles`/`total_tiles`, and `regions`: bounding boxes
+    (x1, y1, x2, y2) of connected changed tiles, largest first, each with its `area_fraction`
+    of the frame and `fill_ratio` (changed tiles / tiles in its bbox). None if frames are missing.
+    """
+    if before is None or after is None:
+        return None
+    start = time.perf_counter()
+    try:
+        delta = _max_channel_delta(before, after)
+        if delta is None:
+            width, height = after.size if isinstance(after, Image.Image) else (after.shape[1], after.shape[0])
+            logging.info(f"Frame size changed between captures; treating as full-frame change.")
+            return {
+                "changed_fraction": 1.0,
+                "changed_tiles": 0,
+                "total_tiles": 0,
+                "frame_size": (width, height),
+                "regions": [{"bbox": (0, 0, width, height), "area_fraction": 1.0, "fill_ratio": 1.0}],
+                "elapsed_ms": (time.perf_counter() - start) * 1000.0,
+            }
+
+        height, width = delta.shape[:2]
+        _, changed = cv2.threshold(delta, pixel_threshold, 255, cv2.THRESH_BINARY)
+        changed_pixels = int(cv2.countNonZero(changed))
+
+        tiles_y = -(-height // tile_size)
+        tiles_x = -(-width // tile_size)
+        if changed_pixels == 0:
+            return {
+                "changed_fraction": 0.0,
+                "changed_tiles": 0,
+                "total_tiles": tiles_x * tiles_y,
+                "frame_size": (width, height),
+                "regions": [],
+                "elapsed_ms": (time.perf_counter() - start) * 1000.0,
+            }
+
+        pad_y = tiles_y * tile_size - height
+        pad_x = tiles_x * tile_size - width
+        if pad_y or pad_x:
+            changed = cv2.copyMakeBorder(changed, 0, pad_y, 0, pad_x, cv2.BORDER_CONSTANT, value=0)
+        # Exact integer downscale: each output value is the mean of one tile (0..255).
+        tile_means = cv2.resize(changed, (tiles_x, tiles_y), interpolation=cv2.INTER_AREA)
+        tile_mask = tile_means >= max(1, int(round(min_tile_fraction * 255)))
+
+        regions: List[Dict[str, Any]] = []
+        if tile_mask.any():
+            num_labels, _, stats, _ = cv2.connectedComponentsWithStats(tile_mask.astype(np.uint8), connectivity=8)
+            frame_area = float(width * height)
+            for label_idx in range(1, num_labels):
+                tx, ty, tw, th, tile_area = stats[label_idx]
+                x1, y1 = int(tx * tile_size), int(ty * tile_size)
+                x2, y2 = min(width, int((tx + tw) * tile_size)), min(height, int((ty + th) * tile_size))
+                regions.append({
+                    "bbox": (x1, y1, x2, y2),
+                    "area_fraction": ((x2 - x1) * (y2 - y1)) / frame_area,
+                    "fill_ratio": float(tile_area) / float(tw * th),
+                })
+            regions.sort(key=lambda r: r["area_fraction"], reverse=True)
+
+        return {
+            "changed_fraction": changed_pixels / float(width * height),
+            "changed_tiles": int(np.count_nonzero(tile_mask)),
+            "total_tiles": tiles_x * tiles_y,
+            "frame_size": (width, height),
+            "regions": regions[:max_regions],
+            "elapsed_ms": (time.perf_counter() - start) * 1000.0,
+        }
+    except Exception as e:
+        logging.error(f"Error computing frame diff: {e}", exc_info=True)
+        return None
+
+
+def changed_near_point(diff: Optional[Dict[str, Any]], point: Tuple[int, int], margin: int = CLICK_REGION_MARGIN_PX) -> bool:
+    """True if any changed region lies within `margin` pixels of `point`."""
+    if not diff or not point:
+        return False
+    px, py = point
+    for region in diff.get("regions", []):
+        x1, y1, x2, y2 = region["bbox"]
+        if x1 - margin <= px <= x2 + margin and y1 - margin <= py <= y2 + margin:
+            return True
+    return False
+
+
+def find_new_window_region(
+    diff: Optional[Dict[str, Any]],
+    min_area_fraction: float = NEW_WINDOW_MIN_AREA_FRACTION,
+    min_fill_ratio: float = NEW_WINDOW_MIN_FILL_RATIO
+) -> Optional[Tuple[int, int, int, int]]:
+    """Return the bbox of a large, densely changed rectangle (a new window/dialog/menu), if any."""
+    if not diff:
+        return None
+    for region in diff.get("regions", []):
+        if region["area_fraction"] >= min_area_fraction and region["fill_ratio"] >= min_fill_ratio:
+            return region["bbox"]
+    return None
+
+
+def extract_click_point(message: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Parse the click coordinates from a click result message ("... at (x, y)")."""
+    if not isinstance(message, str):
+        return None
+    match = re.search(r'at (?:coordinates )?\((-?\d+),\s*(-?\d+)\)', message)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def summarize_frame_diff(diff: Optional[Dict[str, Any]], max_listed: int = 3) -> str:
+    """Short human/LLM readable description of a diff result."""
+    if not diff:
+        return "no diff available"
+    regions = diff.get("regions", [])
+    if not regions:
+        return f"no significant change ({diff.get('changed_fraction', 0.0):.2%} pixels changed)"
+    listed = ", ".join(str(r["bbox"]) for r in regions[:max_listed])
+    more = f" (+{len(regions) - max_listed} more)" if len(regions) > max_listed else ""
+    return f"{diff['changed_fraction']:.2%} pixels changed in {len(regions)} region(s): {listed}{more}"
+
+
+def benchmark_frame_diff(repeats: int = 10, sizes: Optional[Dict[str, Tuple[int, int]]] = None) -> List[Dict[str, Any]]:
+    """
+    Time compute_frame_diff on synthetic RGB frames with a dialog-sized change and a clock-sized change.
+    Returns one result dict per size with mean milliseconds per diff for PIL input (includes the
+    PIL -> array export) and for NumPy/cv2 input.
+    """
+    sizes = sizes or BENCHMARK_FRAME_SIZES
+    rng = np.random.default_rng(0)
+    results = []
+    for label, (width, height) in sizes.items():
+        base = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        changed = base.copy()
+        changed[height // 4: height // 2, width // 4: width // 2] ^= 0xFF
+        changed[height - 30: height - 10, width - 80: width - 20] ^= 0xFF
+        before_pil = Image.fromarray(base, "RGB")
+        after_pil = Image.fromarray(changed, "RGB")
+
+        diff = compute_frame_diff(before_pil, after_pil)
+
+        def _time(fn) -> float:
+            fn()
+            start = time.perf_counter()
+            for _ in range(repeats):
+                fn()
+            return (time.perf_counter() - start) * 1000.0 / repeats
+
+        results.append({
+            "size": label,
+            "width": width,
+            "height": height,
+            "diff_pil_ms": _time(lambda: compute_frame_diff(before_pil, after_pil)),
+            "diff_array_ms": _time(lambda: compute_frame_diff(base, changed)),
+            "regions": len(diff["regions"]) if diff else 0,
+            "changed_fraction": diff["changed_fraction"] if diff else 0.0,
+        })
+    return results
+
+
+if __name__ == "__main__":
+    for row in benchmark_frame_diff():
+        print(
+            f"{row['size']:>13} ({row['width']}x{row['height']}): pil {row['diff_pil_ms']:.1f}ms | "
+            f"array {row['diff_array_ms']:.1f}ms per diff, "
+            f"{row['regions']} regions, {row['changed_fraction']:.2%} changed"
+        )
@@ -0,0 +1,167 @@
+import logging
+import hashlib
+import time
+from typing import Optional, Union, Dict, List, Tuple
+import numpy as np
+import cv2
+from PIL import Image
+
+try:
+    import xxhash  # type: ignore
+except ImportError:
+    xxhash = None
+
+# Default downscale factor. 4 keeps single glyph changes visible after box averaging
+# while touching ~1/16 of the bytes md5 used to hash.
+DEFAULT_FRAME_HASH_STRIDE = 4
+FRAME_HASH_DIGEST_SIZE = 8
+# Grid size of perceptual_frame_hash (hash_size x hash_size bits).
+PERCEPTUAL_HASH_SIZE = 16
+
+# Screen sizes used by benchmark_frame_hashing (width, height).
+BENCHMARK_FRAME_SIZES = {
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+    "triple_1080p": (5760, 1080),
+}
+
+
+def _digest_bytes(data: bytes, header: bytes = b"") -> str:
+    """Hash bytes with xxh3 when available, otherwise blake2b with a small digest."""
+    if xxhash is not None:
+        hasher = xxhash.xxh3_64()
+    else:
+        hasher = hashlib.blake2b(digest_size=FRAME_HASH_DIGEST_SIZE)
+    hasher.update(header)
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def _downscale_pil(image: Image.Image, stride: int, sampling: str) -> Image.Image:
+    """Shrink a PIL frame by `stride` in C without converting its mode."""
+    if stride <= 1:
+        return image
+    if sampling == "stride":
+        width, height = image.size
+        return image.resize((max(1, width // stride), max(1, height // stride)), Image.NEAREST)
+    if image.mode in ("P", "1"):
+        # Box averaging palette indices is meaningless; decimate instead.
+        return _downscale_pil(image, stride, "stride")
+    return image.reduce(stride)
+
+
+def _downscale_array(array: np.ndarray, stride: int, sampling: str) -> np.ndarray:
+    """Shrink a cv2/NumPy frame (HxW or HxWxC) by `stride`."""
+    if stride <= 1:
+        return np.ascontiguousarray(array)
+    height, width = array.shape[:2]
+    if sampling == "stride" or height < stride or width < stride:
+        return np.ascontiguousarray(array[::stride, ::stride])
+    return cv2.resize(array, (width // stride, height // stride), interpolation=cv2.INTER_AREA)
+
+
+def fast_frame_hash(
+    image: Optional[Union[Image.Image, np.ndarray]],
+    stride: int = DEFAULT_FRAME_HASH_STRIDE,
+    sampling: str = "box"
+) -> Optional[str]:
+    """
+    Fast, non-cryptographic fingerprint of a screen frame for change detection.
+
+    Works directly on the capture buffer (PIL image in its native mode, or a cv2/NumPy array)
+    without an RGB conversion or full-frame copy. `sampling="box"` averages stride x stride
+    blocks so every pixel contributes; `sampling="stride"` only samples every Nth pixel.
+    Hashes of PIL images and arrays of the same pixels are not interchangeable.
+    """
+    if image is None:
+        return None
+    try:
+        stride = max(1, int(stride))
+        if isinstance(image, Image.Image):
+            small = _downscale_pil(image, stride, sampling)
+            header = f"pil:{image.mode}:{image.size[0]}x{image.size[1]}:{stride}:{sampling}".encode()
+            return _digest_bytes(small.tobytes(), header)
+        if isinstance(image, np.ndarray):
+            small_arr = _downscale_array(image, stride, sampling)
+            header = f"np:{image.dtype}:{'x'.join(map(str, image.shape))}:{stride}:{sampling}".encode()
+            return _digest_bytes(small_arr.tobytes(), header)
+        logging.error(f"fast_frame_hash: unsupported frame type {type(image).__name__}")
+        return None
+    except Exception as e:
+        logging.error(f"Error computing fast frame hash: {e}")
+        return None
+
+
+def perceptual_frame_hash(image: Optional[Union[Image.Image, np.ndarray]], hash_size: int = PERCEPTUAL_HASH_SIZE) -> Optional[str]:
+    """
+    Difference hash (dHash) of a frame: grayscale, box-downscaled to (hash_size + 1) x hash_size,
+    one bit per horizontal brightness gradient. Small local changes (a clock tick, a caret)
+    usually leave it unchanged, unlike fast_frame_hash. Not comparable across frame sizes.
+    """
+    if image is None:
+        return None
+    try:
+        if isinstance(image, Image.Image):
+            gray = np.asarray(image.convert("L"))
+        elif isinstance(image, np.ndarray):
+            gray = image if image.ndim == 2 else cv2.cvtColor(np.ascontiguousarray(image[:, :, :3]), cv2.COLOR_BGR2GRAY)
+        else:
+            logging.error(f"perceptual_frame_hash: unsupported frame type {type(image).__name__}")
+            return None
+        small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+        bits = np.packbits((small[:, 1:] > small[:, :-1]).flatten())
+        return f"{gray.shape[1]}x{gray.shape[0]}:" + bits.tobytes().hex()
+    except Exception as e:
+        logging.error(f"Error computing perceptual frame hash: {e}")
+        return None
+
+
+def _legacy_md5_hash(image: Image.Image) -> str:
+    """Previous full-frame hashing (RGB copy + md5), kept for benchmark comparison."""
+    return hashlib.md5(np.array(image.convert('RGB')).tobytes()).hexdigest()
+
+
+def benchmark_frame_hashing(repeats: int = 10, sizes: Optional[Dict[str, Tuple[int, int]]] = None) -> List[Dict[str, float]]:
+    """
+    Time legacy md5 hashing against fast_frame_hash on synthetic RGBA frames
+    (ImageGrab returns RGBA on multi-monitor Windows captures) and BGR arrays.
+    Returns one result dict per size with mean milliseconds per hash.
+    """
+    sizes = sizes or BENCHMARK_FRAME_SIZES
+    rng = np.random.default_rng(0)
+    results = []
+    for label, (width, height) in sizes.items():
+        pixels = rng.integers(0, 256, size=(height, width, 4), dtype=np.uint8)
+        pil_frame = Image.fromarray(pixels, "RGBA")
+        bgr_frame = np.ascontiguousarray(pixels[:, :, :3])
+
+        def _time(fn) -> float:
+            fn()
+            start = time.perf_counter()
+            for _ in range(repeats):
+                fn()
+            return (time.perf_counter() - start) * 1000.0 / repeats
+
+        result = {
+            "size": label,
+            "width": width,
+            "height": height,
+            "legacy_md5_ms": _time(lambda: _legacy_md5_hash(pil_frame)),
+            "fast_pil_box_ms": _time(lambda: fast_frame_hash(pil_frame)),
+            "fast_pil_stride_ms": _time(lambda: fast_frame_hash(pil_frame, sampling="stride")),
+            "fast_array_box_ms": _time(lambda: fast_frame_hash(bgr_frame)),
+            "fast_array_stride_ms": _time(lambda: fast_frame_hash(bgr_frame, sampling="stride")),
+        }
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    print(f"Hash backend: {'xxh3_64' if xxhash is not None else 'blake2b-' + str(FRAME_HASH_DIGEST_SIZE * 8)}")
+    for row in benchmark_frame_hashing():
+        print(
+            f"{row['size']:>13} ({row['width']}x{row['height']}): "
+            f"md5 {row['legacy_md5_ms']:.1f}ms | "
+            f"pil box {row['fast_pil_box_ms']:.1f}ms | pil stride {row['fast_pil_stride_ms']:.1f}ms | "
+            f"array box {row['fast_array_box_ms']:.1f}ms | array stride {row['fast_array_stride_ms']:.1f}ms"
+        )
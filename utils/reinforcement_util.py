@@ -6,10 +6,96 @@ import time
 from typing import List
 import google.generativeai as genai
 import re
-from typing import List,Tuple
+import threading
+from typing import List,Tuple,Dict,Optional,Any
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from config import  chroma_client, reinforcements_collection,BLUE, RESET, RED, GREEN
+from tools.llm_gateway import llm_gateway
+
+# Bumped whenever a reinforcement is added; per-task retrieval caches key on it.
+_reinforcements_version = 0
+_version_lock = threading.Lock()
+
+
+def reinforcements_version() -> int:
+    return _reinforcements_version
+
+
+def _bump_reinforcements_version() -> None:
+    global _reinforcements_version
+    with _version_lock:
+        _reinforcements_version += 1
+
+
+class ReinforcementRetrievalCache:
+    """
+    Per-task memo of reinforcement retrieval, keyed by query text, n_results and the
+    reinforcements version. Query embeddings are computed once per text and passed to Chroma
+    as query_embeddings, and the collection count is only re-read after a save.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results: Dict[Tuple[str, int, int], List[str]] = {}
+        self._embeddings: Dict[str, Any] = {}
+        self._count: Optional[Tuple[int, int]] = None  # (version, count)
+        self.stats: Dict[str, Any] = {
+            "lookups": 0, "hits": 0, "queries": 0, "query_ms": 0.0,
+            "embeddings": 0, "embeddings_reused": 0, "embed_ms": 0.0, "saved_ms_est": 0.0,
+        }
+
+    def get(self, query_text: str, n_results: int) -> Optional[List[str]]:
+        key = (query_text, n_results, reinforcements_version())
+        with self._lock:
+            self.stats["lookups"] += 1
+            if key not in self._results:
+                return None
+            self.stats["hits"] += 1
+            queries = max(1, self.stats["queries"])
+            self.stats["saved_ms_est"] = round(self.stats["saved_ms_est"] + self.stats["query_ms"] / queries, 2)
+            return list(self._results[key])
+
+    def put(self, query_text: str, n_results: int, docs: List[str], query_ms: float) -> None:
+        version = reinforcements_version()
+        with self._lock:
+            if any(key[2] != version for key in self._results):
+                self._results = {key: value for key, value in self._results.items() if key[2] == version}
+            self._results[(query_text, n_results, version)] = list(docs)
+            self.stats["queries"] += 1
+            self.stats["query_ms"] = round(self.stats["query_ms"] + query_ms, 2)
+
+    def count(self, collection: Any) -> int:
+        version = reinforcements_version()
+        with self._lock:
+            if self._count and self._count[0] == version:
+                return self._count[1]
+        count = collection.count()
+        with self._lock:
+            self._count = (version, count)
+        return count
+
+    def embedding(self, query_text: str) -> Optional[Any]:
+        """The query text's embedding, computed once per task (None if no embedding function)."""
+        with self._lock:
+            if query_text in self._embeddings:
+                self.stats["embeddings_reused"] += 1
+                self.stats["saved_ms_est"] = round(self.stats["saved_ms_est"] + self.stats["embed_ms"] / max(1, self.stats["embeddings"]), 2)
+                return self._embeddings[query_text]
+        start = time.perf_counter()
+        try:
+            from config import default_ef
+            embedding = default_ef([query_text])[0]
+        except Exception as e:
+            logging.warning(f"Could not embed reinforcement query, letting Chroma embed it: {e}")
+            return None
+        with self._lock:
+            self._embeddings[query_text] = embedding
+            self.stats["embeddings"] += 1
+            self.stats["embed_ms"] = round(self.stats["embed_ms"] + (time.perf_counter() - start) * 1000, 2)
+        return embedding
+
+
 def save_reinforcement_to_db(reinforcement_text: str, original_instruction: str, source_type: str = "llm_generated") -> bool:
     """Saves a single reinforcement/learning to ChromaDB, avoiding duplicates based on text."""
     if not chroma_client or not reinforcements_collection:
@@ -32,6 +118,7 @@ def save_reinforcement_to_db(reinforcement_text: str, original_instruction: str,
             }],
             ids=[reinforcement_id]
         )
+        _bump_reinforcements_version()
         logging.info(f"Saved reinforcement to ChromaDB (ID: {reinforcement_id}): '{reinforcement_text[:100]}...'")
         print(f"{BLUE}[ChromaDB] Successfully saved reinforcement: '{reinforcement_text[:50]}...'{RESET}")
         return True
@@ -40,23 +127,36 @@ def save_reinforcement_to_db(reinforcement_text: str, original_instruction: str,
         print(f"{BLUE}[ChromaDB] {RED}FAILED{BLUE} to save reinforcement: {e}{RESET}")
         return False
 
-def retrieve_relevant_reinforcements_from_db(query_text: str, n_results: int = 5) -> List[str]:
-    """Retrieves relevant reinforcements from ChromaDB using semantic search."""
+def retrieve_relevant_reinforcements_from_db(query_text: str, n_results: int = 5, cache: Optional[ReinforcementRetrievalCache] = None) -> List[str]:
+    """Retrieves relevant reinforcements from ChromaDB using semantic search (memoized in `cache` if given)."""
     if not chroma_client or not reinforcements_collection:
         logging.error("ChromaDB not available. Cannot retrieve reinforcements.")
         return []
     if not query_text: return []
+    if cache is not None:
+        cached_docs = cache.get(query_text, n_results)
+        if cached_docs is not None:
+            return cached_docs
     try:
+        start = time.perf_counter()
         # Ensure n_results is not greater than the number of items in the collection
-        count = reinforcements_collection.count()
-        if count == 0: return []
+        count = cache.count(reinforcements_collection) if cache is not None else reinforcements_collection.count()
+        if count == 0:
+            if cache is not None: cache.put(query_text, n_results, [], (time.perf_counter() - start) * 1000)
+            return []
         actual_n_results = min(n_results, count)
 
-        results = reinforcements_collection.query(
-            query_texts=[query_text],
-            n_results=actual_n_results
-        )
+        query_embedding = cache.embedding(query_text) if cache is not None else None
+        if query_embedding is not None:
+            results = reinforcements_collection.query(query_embeddings=[query_embedding], n_results=actual_n_results)
+        else:
+            results = reinforcements_collection.query(
+                query_texts=[query_text],
+                n_results=actual_n_results
+            )
         retrieved_docs = results['documents'][0] if results and results['documents'] else []
+        if cache is not None:
+            cache.put(query_text, n_results, retrieved_docs, (time.perf_counter() - start) * 1000)
         if retrieved_docs:
             print(f"{BLUE}[ChromaDB] Query: '{query_text[:70]}...' - Retrieved {GREEN}{len(retrieved_docs)}{BLUE} reinforcement(s). First: '{retrieved_docs[0][:70]}...'{RESET}")
         else:
@@ -133,7 +233,7 @@ CRITICAL: Respond ONLY with the raw JSON list, starting with `[` and ending with
 
     try:
         safety_settings = {}
-        response = llm_model.generate_content(prompt, safety_settings=safety_settings)
+        response, _, _ = llm_gateway.generate("reinforcement", prompt, model=llm_model, safety_settings=safety_settings)
         raw_response_text = getattr(response, 'text', '').strip()
 
         if not raw_response_text:
@@ -0,0 +1,207 @@
+import logging
+import os
+import time
+from typing import Dict, Optional, Tuple, Any, List
+import numpy as np
+import cv2
+import pytesseract
+from PIL import Image
+
+from utils.frame_hash import fast_frame_hash
+
+# Structured visual listener conditions evaluated locally (no LLM call).
+#   {"type": "ocr_text", "text": "Download complete", "mode": "appears"|"disappears", "region": [x1, y1, x2, y2]?}
+#   {"type": "template", "template_path": "path.png", "mode": "appears"|"disappears", "threshold": 0.85?, "region": [...]?}
+#   {"type": "region_stable", "stable_ms": 2000, "region": [...]?}
+#   {"type": "pixel_color", "x": 100, "y": 200, "color": [r, g, b] | "#rrggbb", "tolerance": 16?, "mode": "appears"|"disappears"}
+# "region" is in screenshot pixel coordinates; omitted means the full frame.
+LOCAL_CONDITION_TYPES = {"ocr_text", "template", "region_stable", "pixel_color"}
+CONDITION_MODES = {"appears", "disappears"}
+DEFAULT_TEMPLATE_THRESHOLD = 0.85
+DEFAULT_PIXEL_TOLERANCE = 16
+
+
+def _parse_color(color: Any) -> Optional[Tuple[int, int, int]]:
+    """Parse [r, g, b] or '#rrggbb' into an RGB tuple."""
+    try:
+        if isinstance(color, str):
+            hex_color = color.strip().lstrip('#')
+            if len(hex_color) != 6:
+                return None
+            return int(hex_color[0:2], 16), int(hex_color[2:4], 16), int(hex_color[4:6], 16)
+        if isinstance(color, (list, tuple)) and len(color) >= 3:
+            return int(color[0]), int(color[1]), int(color[2])
+    except (ValueError, TypeError):
+        return None
+    return None
+
+
+def _parse_region(region: Any) -> Optional[Tuple[int, int, int, int]]:
+    """Parse [x1, y1, x2, y2] into an int tuple, or None if absent/invalid."""
+    if not isinstance(region, (list, tuple)) or len(region) != 4:
+        return None
+    try:
+        x1, y1, x2, y2 = (int(v) for v in region)
+    except (ValueError, TypeError):
+        return None
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return x1, y1, x2, y2
+
+
+def validate_listener_condition(condition: Any) -> Optional[str]:
+    """Return an error message if a structured listener condition is invalid, else None."""
+    if not isinstance(condition, dict):
+        return "Visual listener failed: 'condition' must be an object."
+    condition_type = condition.get("type")
+    if condition_type == "llm":
+        return None
+    if condition_type not in LOCAL_CONDITION_TYPES:
+        return f"Visual listener failed: unknown condition type '{condition_type}'. Use one of: {', '.join(sorted(LOCAL_CONDITION_TYPES | {'llm'}))}."
+    if condition.get("mode", "appears") not in CONDITION_MODES:
+        return f"Visual listener failed: condition 'mode' must be one of {sorted(CONDITION_MODES)}."
+    if "region" in condition and condition["region"] is not None and _parse_region(condition["region"]) is None:
+        return "Visual listener failed: condition 'region' must be [x1, y1, x2, y2] with x2 > x1 and y2 > y1."
+    if condition_type == "ocr_text" and not condition.get("text"):
+        return "Visual listener failed: 'ocr_text' condition requires 'text'."
+    if condition_type == "template":
+        template_path = condition.get("template_path")
+        if not template_path or not os.path.exists(os.path.expandvars(template_path)):
+            return f"Visual listener failed: template image not found: {template_path}"
+    if condition_type == "region_stable":
+        try:
+            if float(condition.get("stable_ms", 0)) <= 0:
+                return "Visual listener failed: 'region_stable' condition requires a positive 'stable_ms'."
+        except (ValueError, TypeError):
+            return "Visual listener failed: 'stable_ms' must be a number."
+    if condition_type == "pixel_color":
+        if condition.get("x") is None or condition.get("y") is None or _parse_color(condition.get("color")) is None:
+            return "Visual listener failed: 'pixel_color' condition requires 'x', 'y' and 'color' ([r, g, b] or '#rrggbb')."
+    return None
+
+
+def describe_listener_condition(condition: Dict[str, Any]) -> str:
+    """Natural-language description of a structured condition (used for logs and LLM confirmation)."""
+    condition_type = condition.get("type")
+    mode = condition.get("mode", "appears")
+    region = _parse_region(condition.get("region"))
+    where = f" in region {region}" if region else " on screen"
+    if condition_type == "ocr_text":
+        return f"The text '{condition.get('text')}' {mode}{where}"
+    if condition_type == "template":
+        return f"The image '{os.path.basename(str(condition.get('template_path')))}' {mode}{where}"
+    if condition_type == "region_stable":
+        return f"The screen{where} stops changing for {condition.get('stable_ms')} ms"
+    if condition_type == "pixel_color":
+        verb = "becomes" if mode == "appears" else "is no longer"
+        return f"The pixel at ({condition.get('x')}, {condition.get('y')}) {verb} colour {condition.get('color')}"
+    return str(condition)
+
+
+class LocalConditionEvaluator:
+    """
+    Evaluates one structured condition against screen frames using OpenCV/Tesseract.
+    Expensive checks (OCR, template matching) are re-run only when the watched region changed.
+    """
+
+    def __init__(self, condition: Dict[str, Any]):
+        self.condition = condition
+        self.condition_type = condition.get("type")
+        self.mode = condition.get("mode", "appears")
+        self.region = _parse_region(condition.get("region"))
+        self.evaluations = 0
+        self.expensive_evaluations = 0
+        self._last_region_hash: Optional[str] = None
+        self._last_change_time: Optional[float] = None
+        self._last_present: Optional[bool] = None
+        self._seen_present = False
+        self._last_reasoning = ""
+        self._template_gray: Optional[np.ndarray] = None
+        self._target_color = _parse_color(condition.get("color"))
+
+    def _crop(self, screenshot_pil: Image.Image) -> Image.Image:
+        if not self.region:
+            return screenshot_pil
+        width, height = screenshot_pil.size
+        x1, y1, x2, y2 = self.region
+        return screenshot_pil.crop((max(0, x1), max(0, y1), min(width, x2), min(height, y2)))
+
+    def _load_template(self) -> Optional[np.ndarray]:
+        if self._template_gray is None:
+            template_path = os.path.expandvars(str(self.condition.get("template_path")))
+            self._template_gray = cv2.imread(template_path, cv2.IMREAD_GRAYSCALE)
+            if self._template_gray is None:
+                logging.error(f"Listener condition: could not read template image '{template_path}'.")
+        return self._template_gray
+
+    def _text_present(self, region_img: Image.Image) -> Tuple[bool, str]:
+        gray = cv2.cvtColor(np.asarray(region_img.convert('RGB')), cv2.COLOR_RGB2GRAY)
+        ocr_text = pytesseract.image_to_string(gray)
+        target = " ".join(str(self.condition.get("text", "")).lower().split())
+        normalized = " ".join(ocr_text.lower().split())
+        return target in normalized, f"OCR read {len(normalized)} chars; '{target}' {'found' if target in normalized else 'not found'}."
+
+    def _template_present(self, region_img: Image.Image) -> Tuple[bool, str]:
+        template = self._load_template()
+        if template is None:
+            return False, "Template image unavailable."
+        gray = cv2.cvtColor(np.asarray(region_img.convert('RGB')), cv2.COLOR_RGB2GRAY)
+        if gray.shape[0] < template.shape[0] or gray.shape[1] < template.shape[1]:
+            return False, "Watched region is smaller than the template."
+        scores = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
+        _, best_score, _, best_loc = cv2.minMaxLoc(scores)
+        threshold = float(self.condition.get("threshold", DEFAULT_TEMPLATE_THRESHOLD))
+        offset_x, offset_y = (self.region[0], self.region[1]) if self.region else (0, 0)
+        return best_score >= threshold, f"Best template match {best_score:.3f} (threshold {threshold}) at ({best_loc[0] + offset_x}, {best_loc[1] + offset_y})."
+
+    def _pixel_matches(self, screenshot_pil: Image.Image) -> Tuple[bool, str]:
+        x, y = int(self.condition.get("x")), int(self.condition.get("y")) # type: ignore
+        width, height = screenshot_pil.size
+        if not (0 <= x < width and 0 <= y < height):
+            return False, f"Pixel ({x}, {y}) is outside the {width}x{height} frame."
+        pixel = screenshot_pil.getpixel((x, y))
+        rgb = (pixel, pixel, pixel) if isinstance(pixel, int) else tuple(pixel[:3]) # type: ignore
+        tolerance = int(self.condition.get("tolerance", DEFAULT_PIXEL_TOLERANCE))
+        distance = max(abs(int(a) - int(b)) for a, b in zip(rgb, self._target_color)) # type: ignore
+        return distance <= tolerance, f"Pixel ({x}, {y}) is {rgb}, target {self._target_color} (max channel delta {distance}, tolerance {tolerance})."
+
+    def evaluate(self, screenshot_pil: Image.Image) -> Tuple[bool, str, bool]:
+        """Returns (condition_met, reasoning, region_changed_since_last_evaluation)."""
+        self.evaluations += 1
+        now = time.time()
+
+        if self.condition_type == "pixel_color":
+            present, reasoning = self._pixel_matches(screenshot_pil)
+            changed = present != self._last_present
+            self._last_present = present
+            return present if self.mode == "appears" else not present, reasoning, changed
+
+        region_img = self._crop(screenshot_pil)
+        region_hash = fast_frame_hash(region_img)
+        changed = region_hash is None or region_hash != self._last_region_hash
+        self._last_region_hash = region_hash
+        if changed or self._last_change_time is None:
+            self._last_change_time = now
+
+        if self.condition_type == "region_stable":
+            stable_for_ms = (now - self._last_change_time) * 1000.0
+            stable_ms = float(self.condition.get("stable_ms", 0))
+            return stable_for_ms >= stable_ms, f"Region unchanged for {stable_for_ms:.0f} ms (need {stable_ms:.0f} ms).", changed
+
+        if changed or self._last_present is None:
+            self.expensive_evaluations += 1
+            if self.condition_type == "ocr_text":
+                present, reasoning = self._text_present(region_img)
+            else:
+                present, reasoning = self._template_present(region_img)
+            self._last_present = present
+            self._last_reasoning = reasoning
+        else:
+            present = bool(self._last_present)
+            reasoning = f"Region unchanged; reusing last result. {self._last_reasoning}"
+        if present:
+            self._seen_present = True
+        if self.mode == "appears":
+            return present, reasoning, changed
+        # "disappears" requires the target to have been seen first.
+        return self._seen_present and not present, reasoning, changed
@@ -0,0 +1,175 @@
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, Optional, Tuple, Any, List
+import numpy as np
+import google.generativeai as genai
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vision.vis import VisualConditionWatcher
+
+# Offline cost model for the LLM-only listener when no real model is passed in:
+# one screenshot (~1290 image tokens) plus the condition prompt and a short JSON answer.
+SIMULATED_LLM_TOKENS_PER_CHECK = 1400
+SIMULATED_LLM_LATENCY_SECONDS = 0.3
+
+BENCHMARK_FRAME_SIZE = (1920, 1080)
+BANNER_BOX = (760, 480, 1160, 600)
+BANNER_COLOR = (40, 170, 70)
+PROGRESS_BOX = (660, 700, 1260, 730)
+CLOCK_BOX = (1800, 1050, 1900, 1075)
+
+
+class _SyntheticScreen:
+    """
+    Desktop-like frame source: a progress bar animates and a taskbar clock ticks until
+    `event_at` seconds, when the progress bar stops and a "Download complete" banner appears.
+    """
+
+    def __init__(self, event_at: float, size: Tuple[int, int] = BENCHMARK_FRAME_SIZE):
+        self.event_at = event_at
+        self.size = size
+        rng = np.random.default_rng(0)
+        background = np.full((size[1], size[0], 3), 235, dtype=np.uint8)
+        background[::40, :, :] = rng.integers(200, 230, size=(background[::40].shape[0], size[0], 3), dtype=np.uint8)
+        self._background = Image.fromarray(background, "RGB")
+        self._font = self._load_font(36)
+        self.started_at = time.time()
+
+    @staticmethod
+    def _load_font(size: int) -> Any:
+        try:
+            return ImageFont.load_default(size=size)
+        except TypeError:
+            return ImageFont.load_default()
+
+    def elapsed(self) -> float:
+        return time.time() - self.started_at
+
+    def banner_visible(self) -> bool:
+        return self.elapsed() >= self.event_at
+
+    def capture(self) -> Image.Image:
+        elapsed = self.elapsed()
+        frame = self._background.copy()
+        draw = ImageDraw.Draw(frame)
+        progress = min(1.0, elapsed / self.event_at) if self.event_at > 0 else 1.0
+        x1, y1, x2, y2 = PROGRESS_BOX
+        draw.rectangle(PROGRESS_BOX, outline=(90, 90, 90))
+        draw.rectangle((x1 + 2, y1 + 2, x1 + 2 + int((x2 - x1 - 4) * progress), y2 - 2), fill=(50, 110, 220))
+        draw.text((CLOCK_BOX[0], CLOCK_BOX[1]), f"{int(elapsed * 2) % 60:02d}", fill=(20, 20, 20))
+        if elapsed >= self.event_at:
+            draw.rectangle(BANNER_BOX, fill=BANNER_COLOR)
+            draw.text((BANNER_BOX[0] + 20, BANNER_BOX[1] + 40), "Download complete", fill=(255, 255, 255), font=self._font)
+        return frame
+
+    def banner_template(self) -> Image.Image:
+        """Crop of the banner as it will appear, used for the template condition."""
+        saved_start = self.started_at
+        self.started_at = time.time() - self.event_at - 1.0
+        frame = self.capture()
+        self.started_at = saved_start
+        return frame.crop(BANNER_BOX)
+
+
+def _simulated_llm_check(screen: _SyntheticScreen, latency_seconds: float):
+    """Stand-in for _check_visual_condition_with_llm with a fixed latency and token cost."""
+    def _check(screenshot_pil: Image.Image, description: str, llm_model: Any) -> Tuple[bool, str, Dict[str, int]]:
+        time.sleep(latency_seconds)
+        pixel = screenshot_pil.getpixel(((BANNER_BOX[0] + BANNER_BOX[2]) // 2, BANNER_BOX[1] + 5))
+        met = max(abs(int(a) - int(b)) for a, b in zip(pixel[:3], BANNER_COLOR)) <= 16 # type: ignore
+        tokens = {"prompt_tokens": SIMULATED_LLM_TOKENS_PER_CHECK - 40, "candidates_tokens": 40, "total_tokens": SIMULATED_LLM_TOKENS_PER_CHECK}
+        return met, "simulated LLM check", tokens
+    return _check
+
+
+def _benchmark_conditions(template_path: str, include_ocr: bool) -> Dict[str, Dict[str, Any]]:
+    banner_probe = {"type": "pixel_color", "x": (BANNER_BOX[0] + BANNER_BOX[2]) // 2, "y": BANNER_BOX[1] + 5, "color": list(BANNER_COLOR)}
+    conditions: Dict[str, Dict[str, Any]] = {
+        "llm_only": {"description_of_change": "A green 'Download complete' banner appears in the middle of the screen"},
+        "pixel_color": {"condition": banner_probe},
+        "pixel_color+llm_confirm": {
+            "condition": banner_probe,
+            "confirm_with_llm": True,
+            "description_of_change": "A green 'Download complete' banner appears in the middle of the screen",
+        },
+        "template": {"condition": {"type": "template", "template_path": template_path, "region": [600, 400, 1320, 680]}},
+        "region_stable": {"condition": {"type": "region_stable", "stable_ms": 500, "region": list(PROGRESS_BOX)}},
+    }
+    if include_ocr:
+        conditions["ocr_text"] = {"condition": {"type": "ocr_text", "text": "Download complete", "region": list(BANNER_BOX)}}
+    return conditions
+
+
+def benchmark_listener_conditions(
+    llm_model: Optional[genai.GenerativeModel] = None,
+    event_at: float = 2.0,
+    polling_interval: float = 0.1,
+    timeout_seconds: float = 8.0,
+    include_ocr: bool = False,
+    llm_latency_seconds: float = SIMULATED_LLM_LATENCY_SECONDS
+) -> List[Dict[str, Any]]:
+    """
+    Run each listener condition type against the same synthetic screen and report detection
+    latency after the event, LLM calls, tokens and local compute per poll. Without `llm_model`
+    the LLM check is simulated (fixed latency, SIMULATED_LLM_TOKENS_PER_CHECK tokens per call).
+    `include_ocr` needs the Tesseract binary.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        template_path = os.path.join(temp_dir, "banner.png")
+        _SyntheticScreen(event_at).banner_template().save(template_path)
+
+        for label, params in _benchmark_conditions(template_path, include_ocr).items():
+            screen = _SyntheticScreen(event_at)
+            watcher = VisualConditionWatcher(
+                params.get("description_of_change", ""),
+                llm_model, # type: ignore
+                condition=params.get("condition"),
+                confirm_with_llm=bool(params.get("confirm_with_llm", False)),
+                llm_check_fn=None if llm_model is not None else _simulated_llm_check(screen, llm_latency_seconds)
+            )
+            if not watcher.description and watcher.local_evaluator is not None:
+                watcher.description = str(watcher.local_evaluator.condition)
+
+            detected_at: Optional[float] = None
+            false_positive = False
+            check_seconds = 0.0
+            while screen.elapsed() < timeout_seconds:
+                frame = screen.capture()
+                check_start = time.perf_counter()
+                condition_met = watcher.check(frame)
+                check_seconds += time.perf_counter() - check_start
+                if condition_met:
+                    if not screen.banner_visible():
+                        false_positive = True
+                    detected_at = screen.elapsed()
+                    break
+                time.sleep(watcher.next_poll_interval(polling_interval))
+
+            llm_calls = watcher.stats["llm_polls"]
+            llm_seconds = llm_calls * llm_latency_seconds if llm_model is None else 0.0
+            results.append({
+                "condition": label,
+                "detected": detected_at is not None,
+                "false_positive": false_positive,
+                "detection_latency_s": (detected_at - event_at) if detected_at is not None else None,
+                "polls": watcher.stats["polls"],
+                "llm_calls": llm_calls,
+                "total_tokens": watcher.token_usage["total_tokens"],
+                "local_ms_per_poll": max(0.0, check_seconds - llm_seconds) * 1000.0 / max(1, watcher.stats["polls"]),
+            })
+    return results
+
+
+if __name__ == "__main__":
+    print(f"Simulated LLM: {SIMULATED_LLM_TOKENS_PER_CHECK} tokens, {SIMULATED_LLM_LATENCY_SECONDS}s per check")
+    for row in benchmark_listener_conditions(include_ocr="--ocr" in sys.argv):
+        latency = f"{row['detection_latency_s']:.2f}s" if row["detection_latency_s"] is not None else "missed"
+        print(
+            f"{row['condition']:>24}: latency {latency}{' (FALSE POSITIVE)' if row['false_positive'] else ''} | "
+            f"{row['polls']} polls, {row['llm_calls']} LLM calls, {row['total_tokens']} tokens | "
+            f"{row['local_ms_per_poll']:.1f}ms local/poll"
+        )
@@ -0,0 +1,225 @@
+import logging
+import threading
+import time
+import uuid
+from typing import Dict, Optional, Tuple, Any, List, Callable
+import google.generativeai as genai
+from PIL import Image
+
+from vision.vis import (
+    capture_full_screen, VisualConditionWatcher,
+    _validate_listener_params, _build_listener_watcher, _build_listener_directive, _listener_description
+)
+
+# Upper bound for how long the worker sleeps when no listener is due, so cancellations
+# and newly registered listeners are picked up promptly even without a wake-up signal.
+LISTENER_WORKER_IDLE_SECONDS = 1.0
+MIN_LISTENER_POLL_INTERVAL_SECONDS = 0.25
+
+
+class _BackgroundListener:
+    """State of a single listener registered with the VisualListenerService."""
+
+    def __init__(self, listener_id: str, task_id: Optional[str], params: Dict[str, Any], watcher: VisualConditionWatcher):
+        self.listener_id = listener_id
+        self.task_id = task_id
+        self.params = params
+        self.watcher = watcher
+        self.description = _listener_description(params)
+        self.polling_interval = max(MIN_LISTENER_POLL_INTERVAL_SECONDS, float(params.get("polling_interval_seconds", 5.0)))
+        max_polling_interval = params.get("max_polling_interval_seconds")
+        self.max_polling_interval = float(max_polling_interval) if max_polling_interval else None
+        self.timeout_seconds = float(params.get("timeout_seconds", 300.0))
+        self.started_at = time.time()
+        self.next_poll_at = self.started_at
+        self.finished_at: Optional[float] = None
+        self.status = "running"  # running | fired | timed_out | cancelled | error
+        self.result_message = ""
+
+    def to_status_dict(self) -> Dict[str, Any]:
+        now = self.finished_at or time.time()
+        return {
+            "listener_id": self.listener_id,
+            "task_id": self.task_id,
+            "description": self.description,
+            "status": self.status,
+            "elapsed_seconds": round(now - self.started_at, 1),
+            "timeout_seconds": self.timeout_seconds,
+            "polling_interval_seconds": self.polling_interval,
+            "condition_type": (self.params.get("condition") or {}).get("type", "llm"),
+            "stats": dict(self.watcher.stats),
+            "token_usage": dict(self.watcher.token_usage),
+            "last_reasoning": self.watcher.last_reasoning,
+            "result_message": self.result_message,
+        }
+
+
+class VisualListenerService:
+    """
+    Runs visual listeners on one background worker. All listeners that are due in the same
+    tick share a single screen capture. When a listener fires or times out, its directive is
+    queued for its task and drained by the executor between iterations.
+    """
+
+    def __init__(self, capture_fn: Optional[Callable[[], Optional[Image.Image]]] = None, finished_retention: int = 20):
+        self._capture_fn = capture_fn or capture_full_screen
+        self._finished_retention = finished_retention
+        self._listeners: Dict[str, _BackgroundListener] = {}
+        self._pending_directives: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self.captures_taken = 0
+
+    def start_listener(
+        self,
+        task_id: Optional[str],
+        params: Dict[str, Any],
+        llm_model: genai.GenerativeModel,
+        watcher: Optional[VisualConditionWatcher] = None
+    ) -> Tuple[bool, str, Optional[str]]:
+        """Register a listener and return immediately. Returns (success, message, listener_id)."""
+        validation_error = _validate_listener_params(params)
+        if validation_error:
+            return False, validation_error, None
+        listener_id = f"listener_{uuid.uuid4().hex[:8]}"
+        listener = _BackgroundListener(listener_id, task_id, params, watcher or _build_listener_watcher(params, llm_model))
+        with self._lock:
+            self._listeners[listener_id] = listener
+        self._ensure_worker()
+        self._wake_event.set()
+        logging.info(f"Visual listener {listener_id} started in background for task {task_id}: '{listener.description}' "
+                     f"(timeout {listener.timeout_seconds}s, polling every {listener.polling_interval}s).")
+        return True, f"Background visual listener '{listener_id}' started for '{listener.description}'. Its actions will be injected when it fires.", listener_id
+
+    def cancel_listener(self, listener_id: str) -> bool:
+        """Cancel a running listener. Returns False if it is unknown or already finished."""
+        with self._lock:
+            listener = self._listeners.get(listener_id)
+            if not listener or listener.status != "running":
+                return False
+            self._finish(listener, "cancelled", f"Listener for '{listener.description}' cancelled.")
+        logging.info(f"Visual listener {listener_id} cancelled.")
+        self._wake_event.set()
+        return True
+
+    def cancel_task_listeners(self, task_id: Optional[str], discard_pending: bool = False) -> int:
+        """Cancel every running listener of a task. Optionally drop its undelivered directives."""
+        cancelled = 0
+        with self._lock:
+            for listener in self._listeners.values():
+                if listener.task_id == task_id and listener.status == "running":
+                    self._finish(listener, "cancelled", f"Listener for '{listener.description}' cancelled with its task.")
+                    cancelled += 1
+            if discard_pending:
+                self._pending_directives.pop(task_id, None)
+        if cancelled:
+            logging.info(f"Cancelled {cancelled} visual listener(s) for task {task_id}.")
+            self._wake_event.set()
+        return cancelled
+
+    def has_active_listeners(self, task_id: Optional[str]) -> bool:
+        with self._lock:
+            return any(l.task_id == task_id and l.status == "running" for l in self._listeners.values())
+
+    def drain_directives(self, task_id: Optional[str]) -> List[Dict[str, Any]]:
+        """Remove and return all queued listener directives for a task, oldest first."""
+        with self._lock:
+            return self._pending_directives.pop(task_id, [])
+
+    def get_status(self, task_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Per-listener status dicts, running listeners first, optionally filtered by task."""
+        with self._lock:
+            listeners = [l for l in self._listeners.values() if task_id is None or l.task_id == task_id]
+            statuses = [l.to_status_dict() for l in listeners]
+        statuses.sort(key=lambda s: (s["status"] != "running", -s["elapsed_seconds"]))
+        return statuses
+
+    def _finish(self, listener: _BackgroundListener, status: str, message: str, directive: Optional[Dict[str, Any]] = None) -> None:
+        """Mark a listener finished and queue its directive (caller holds the lock)."""
+        listener.status = status
+        listener.result_message = message
+        listener.finished_at = time.time()
+        if directive is None:
+            directive = {"type": f"listener_{status}", "token_usage": listener.watcher.token_usage, "listener_stats": listener.watcher.stats}
+        directive = dict(directive)
+        directive.update({"listener_id": listener.listener_id, "message": message})
+        self._pending_directives.setdefault(listener.task_id, []).append(directive)
+        self._prune_finished()
+
+    def _prune_finished(self) -> None:
+        """Keep only the most recent finished listeners for status reporting (caller holds the lock)."""
+        finished = sorted((l for l in self._listeners.values() if l.status != "running"), key=lambda l: l.finished_at or 0)
+        excess = len(finished) - self._finished_retention
+        for listener in finished[:max(0, excess)]:
+            self._listeners.pop(listener.listener_id, None)
+
+    def _ensure_worker(self) -> None:
+        with self._lock:
+            if self._worker and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name="VisualListenerService", daemon=True)
+            self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                running = [l for l in self._listeners.values() if l.status == "running"]
+            if not running:
+                # Exit when idle; start_listener restarts the worker.
+                with self._lock:
+                    if not any(l.status == "running" for l in self._listeners.values()):
+                        self._worker = None
+                        return
+                continue
+
+            now = time.time()
+            next_due = min(l.next_poll_at for l in running)
+            if next_due > now:
+                self._wake_event.wait(min(next_due - now, LISTENER_WORKER_IDLE_SECONDS))
+                self._wake_event.clear()
+                continue
+            try:
+                self._poll_due_listeners(running, now)
+            except Exception as e:
+                logging.error(f"Visual listener service poll failed: {e}", exc_info=True)
+
+    def _poll_due_listeners(self, running: List[_BackgroundListener], now: float) -> None:
+        """Capture one frame and evaluate every due listener against it."""
+        due = [l for l in running if l.next_poll_at <= now]
+        for listener in due:
+            if now - listener.started_at >= listener.timeout_seconds:
+                success, message, directive = _build_listener_directive(listener.params, listener.watcher, False)
+                with self._lock:
+                    if listener.status == "running":
+                        self._finish(listener, "timed_out", message, directive)
+                logging.warning(f"Visual listener {listener.listener_id} TIMEOUT for '{listener.description}'. Stats: {listener.watcher.stats}")
+        due = [l for l in due if l.status == "running"]
+        if not due:
+            return
+
+        screenshot_pil = self._capture_fn()
+        self.captures_taken += 1
+        for listener in due:
+            if screenshot_pil is None:
+                listener.next_poll_at = time.time() + listener.polling_interval
+                logging.warning(f"Listener {listener.listener_id}: Failed to capture screen during poll.")
+                continue
+            try:
+                condition_met = listener.watcher.check(screenshot_pil)
+            except Exception as e:
+                logging.error(f"Visual listener {listener.listener_id} check failed: {e}", exc_info=True)
+                with self._lock:
+                    if listener.status == "running":
+                        self._finish(listener, "error", f"Listener for '{listener.description}' failed: {e}")
+                continue
+            listener.next_poll_at = time.time() + listener.watcher.next_poll_interval(listener.polling_interval, listener.max_polling_interval)
+            if condition_met:
+                success, message, directive = _build_listener_directive(listener.params, listener.watcher, True)
+                with self._lock:
+                    if listener.status == "running":
+                        self._finish(listener, "fired", message, directive)
+                logging.info(f"Visual listener {listener.listener_id} FIRED for '{listener.description}'. Stats: {listener.watcher.stats}")
+
+
+visual_listener_service = VisualListenerService()
@@ -7,6 +7,7 @@ from PIL import Image, ImageGrab
 from typing import Dict, Optional, Tuple, Any
 import google.generativeai as genai
 from tools.token_usage_tool import _get_token_usage 
+from tools.llm_gateway import llm_gateway
 import hashlib
 from utils.file_util import save_debug_data
 from vision.xga import  visualize_ui_elements, UIElementCollection
@@ -16,6 +17,9 @@ import re,time,sys
 from agents.ai_agent import UIAgent
 from chromaDB_management.cache import UICache,get_active_window_name
 from utils.image_utils import image_to_base64 , pil_to_cv2# type: ignore
+from utils.frame_hash import fast_frame_hash
+from utils.frame_diff import compute_frame_diff
+from vision.conditions import LocalConditionEvaluator, LOCAL_CONDITION_TYPES, validate_listener_condition, describe_listener_condition
 
 ui_cache = UICache()
 
@@ -32,6 +36,7 @@ def locate_and_click_ui_element(element_desc: str, agent: UIAgent) -> Tuple[bool
     """
     logging.info(f"Attempting to locate and click UI element: '{element_desc}'")
     error_prefix = "Click failed: "
+    agent.last_selection_stats = {}
 
 
     pil_screenshot = capture_full_screen()
@@ -74,6 +79,7 @@ def locate_and_click_ui_element(element_desc: str, agent: UIAgent) -> Tuple[bool
 
 
     logging.info(f"UI Element Selection Reasoning:\n{agent.last_reasoning}\n")
+    selection_stats = getattr(agent, "last_selection_stats", {})
 
     if matching_idx is None:
         msg = f"No matching element found by LLM for '{element_desc}'"
@@ -82,7 +88,7 @@ def locate_and_click_ui_element(element_desc: str, agent: UIAgent) -> Tuple[bool
             failed_search_path = os.path.join(debug_session_dir, "search_failed.txt")
             try:
                 with open(failed_search_path, "w", encoding="utf-8") as f:
-                    f.write(f"Search term: {element_desc}\nResult: No match\nReasoning:\n{agent.last_reasoning}")
+                    f.write(f"Search term: {element_desc}\nResult: No match\nSelection stats: {selection_stats}\nReasoning:\n{agent.last_reasoning}")
             except Exception as e:
                 logging.error(f"Could not write failed search info: {e}")
         return False, error_prefix + msg
@@ -119,6 +125,7 @@ def locate_and_click_ui_element(element_desc: str, agent: UIAgent) -> Tuple[bool
             with open(match_info_path, "w", encoding="utf-8") as f:
                 f.write(f"Search term: {element_desc}\n")
                 f.write(f"Matched index: {matching_idx}\n")
+                f.write(f"Selection stats: {selection_stats}\n")
                 f.write(f"Element: {vars(matching_element)}\n")
                 f.write(f"Reasoning:\n{agent.last_reasoning}\n")
 
@@ -256,8 +263,7 @@ CONDITION_MET: [YES or NO]
             'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_MEDIUM_AND_ABOVE',
             'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_MEDIUM_AND_ABOVE',
         }
-        response = llm_model.generate_content(content, safety_settings=safety_settings)
-        token_usage = _get_token_usage(response)
+        response, token_usage, _ = llm_gateway.generate("listener", content, model=llm_model, safety_settings=safety_settings)
         response_text = ""
         if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
             response_text = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text')).strip()
@@ -289,19 +295,211 @@ CONDITION_MET: [YES or NO]
 
 
 def _hash_pil_image(image: Optional[Image.Image]) -> Optional[str]:
-    """Generate a hash for a PIL image."""
+    """Generate a fast change-detection hash for a PIL image (see utils.frame_hash)."""
     if image is None:
         return None
-    try:
+    return fast_frame_hash(image)
 
-        np_image = np.array(image.convert('RGB'))
 
 
-        return hashlib.md5(np_image.tobytes()).hexdigest()
-    except Exception as e:
-        logging.error(f"Error hashing PIL image: {e}")
-        return None
+# Listener change gate defaults: re-ask the LLM only if at least this share of pixels changed
+# since the last LLM-checked frame, or if that check is older than the staleness limit.
+LISTENER_CHANGE_THRESHOLD = 0.0002
+LISTENER_MAX_STALENESS_SECONDS = 60.0
+# Adaptive polling: the interval grows by this factor on every poll without change, up to
+# max_polling_interval_seconds (default: base interval x LISTENER_MAX_BACKOFF_MULTIPLIER).
+LISTENER_BACKOFF_FACTOR = 1.5
+LISTENER_MAX_BACKOFF_MULTIPLIER = 4.0
+
+
+def _listener_frame_changed(
+    last_checked_frame: Optional[Image.Image],
+    last_checked_hash: Optional[str],
+    screenshot_pil: Image.Image,
+    change_threshold: float
+) -> Tuple[bool, Optional[str]]:
+    """Cheap local check whether a listener frame differs from the last LLM-checked frame."""
+    current_hash = _hash_pil_image(screenshot_pil)
+    if last_checked_frame is None:
+        return True, current_hash
+    if current_hash and current_hash == last_checked_hash:
+        return False, current_hash
+    frame_diff = compute_frame_diff(last_checked_frame, screenshot_pil)
+    if frame_diff is None:
+        return True, current_hash
+    return bool(frame_diff["regions"]) and frame_diff["changed_fraction"] >= change_threshold, current_hash
+
+
+class VisualConditionWatcher:
+    """
+    Visual condition check shared by the blocking listener and the background listener service.
+
+    With a structured `condition` (see vision.conditions) the check runs locally and the LLM is
+    only asked to confirm a local trigger when `confirm_with_llm` is set. Without one, every poll
+    is an LLM vision call, gated on the frame having changed since the last LLM-checked frame.
+    Tracks token usage, poll statistics and an adaptive polling interval.
+    """
+
+    def __init__(
+        self,
+        description: str,
+        llm_model: genai.GenerativeModel,
+        change_threshold: float = LISTENER_CHANGE_THRESHOLD,
+        max_staleness_seconds: float = LISTENER_MAX_STALENESS_SECONDS,
+        condition: Optional[Dict[str, Any]] = None,
+        confirm_with_llm: bool = False,
+        backoff_factor: float = LISTENER_BACKOFF_FACTOR,
+        llm_check_fn: Optional[Any] = None
+    ):
+        self.description = description
+        self.llm_model = llm_model
+        self.change_threshold = change_threshold
+        self.max_staleness_seconds = max_staleness_seconds
+        self.local_evaluator = LocalConditionEvaluator(condition) if condition and condition.get("type") in LOCAL_CONDITION_TYPES else None
+        self.confirm_with_llm = confirm_with_llm
+        self.backoff_factor = max(1.0, backoff_factor)
+        self._llm_check_fn = llm_check_fn or _check_visual_condition_with_llm
+        self.token_usage = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+        self.stats = {"polls": 0, "llm_polls": 0, "skipped_polls": 0, "local_checks": 0, "llm_rejections": 0, "estimated_tokens_saved": 0}
+        self.last_reasoning = ""
+        self._last_checked_frame: Optional[Image.Image] = None
+        self._last_checked_hash: Optional[str] = None
+        self._last_check_time = 0.0
+        self._last_poll_changed = True
+        self._current_interval: Optional[float] = None
+
+    def _llm_check(self, screenshot_pil: Image.Image, current_hash: Optional[str]) -> bool:
+        condition_met, reasoning, check_tokens = self._llm_check_fn(
+            screenshot_pil, self.description, self.llm_model
+        )
+        for k in self.token_usage: self.token_usage[k] += check_tokens.get(k, 0) # type: ignore
+        self.stats["llm_polls"] += 1
+        self.last_reasoning = reasoning
+        self._last_checked_frame, self._last_checked_hash, self._last_check_time = screenshot_pil, current_hash, time.time()
+        logging.info(f"Listener poll: Condition '{self.description}' met? {'YES' if condition_met else 'NO'}. Reasoning: {reasoning}")
+        return condition_met
+
+    def _gated_llm_check(self, screenshot_pil: Image.Image) -> Optional[bool]:
+        is_stale = time.time() - self._last_check_time >= self.max_staleness_seconds
+        frame_changed, current_hash = _listener_frame_changed(
+            self._last_checked_frame, self._last_checked_hash, screenshot_pil, self.change_threshold
+        )
+        self._last_poll_changed = frame_changed
+        if not frame_changed and not is_stale:
+            self.stats["skipped_polls"] += 1
+            if self.stats["llm_polls"]:
+                self.stats["estimated_tokens_saved"] = int(
+                    self.stats["skipped_polls"] * self.token_usage["total_tokens"] / self.stats["llm_polls"]
+                )
+            logging.debug(f"Listener poll skipped: screen unchanged since last LLM check ({self.stats['skipped_polls']} skipped).")
+            return None
+        return self._llm_check(screenshot_pil, current_hash)
+
+    def check(self, screenshot_pil: Image.Image) -> Optional[bool]:
+        """Evaluate the condition on a frame. Returns None when the poll was skipped as unchanged."""
+        self.stats["polls"] += 1
+        if self.local_evaluator is None:
+            return self._gated_llm_check(screenshot_pil)
+
+        locally_met, reasoning, region_changed = self.local_evaluator.evaluate(screenshot_pil)
+        self.stats["local_checks"] += 1
+        self._last_poll_changed = region_changed
+        self.last_reasoning = reasoning
+        logging.debug(f"Listener local check '{self.description}': met={locally_met}. {reasoning}")
+        if not locally_met or not self.confirm_with_llm:
+            return locally_met
+
+        # Local trigger fired; confirm with the LLM, without re-asking for an unchanged frame.
+        confirmed = self._gated_llm_check(screenshot_pil)
+        if confirmed is False:
+            self.stats["llm_rejections"] += 1
+        return bool(confirmed)
+
+    def next_poll_interval(self, base_interval: float, max_interval: Optional[float] = None) -> float:
+        """Adaptive polling interval: reset to the base after a change, back off while nothing changes."""
+        max_interval = max(base_interval, max_interval if max_interval is not None else base_interval * LISTENER_MAX_BACKOFF_MULTIPLIER)
+        if self.local_evaluator is not None and self.local_evaluator.condition_type == "region_stable":
+            # Keep enough resolution to notice the region settling.
+            stable_seconds = float(self.local_evaluator.condition.get("stable_ms", 0)) / 1000.0
+            max_interval = max(base_interval, min(max_interval, stable_seconds / 2.0))
+        if self._last_poll_changed or self._current_interval is None:
+            self._current_interval = base_interval
+        else:
+            self._current_interval = min(max_interval, self._current_interval * self.backoff_factor)
+        return self._current_interval
+
+    def format_stats(self) -> str:
+        """One-line summary of listener gating for result messages."""
+        if self.local_evaluator is not None:
+            return (f"(local checks: {self.stats['local_checks']}/{self.stats['polls']} polls, "
+                    f"LLM confirmations: {self.stats['llm_polls']}, rejected: {self.stats['llm_rejections']})")
+        return (f"(LLM checks: {self.stats['llm_polls']}/{self.stats['polls']} polls, "
+                f"skipped unchanged: {self.stats['skipped_polls']}, "
+                f"~{self.stats['estimated_tokens_saved']} tokens saved)")
+
+
+def _listener_description(params: Dict[str, Any]) -> str:
+    """Description used for logs/LLM checks: explicit description, else derived from the condition."""
+    description = params.get("description_of_change")
+    if description:
+        return description
+    condition = params.get("condition")
+    return describe_listener_condition(condition) if isinstance(condition, dict) else ""
+
+
+def _validate_listener_params(params: Dict[str, Any]) -> Optional[str]:
+    """Return an error message if visual listener parameters are invalid, else None."""
+    condition = params.get("condition")
+    if condition is not None:
+        condition_error = validate_listener_condition(condition)
+        if condition_error:
+            return condition_error
+    needs_description = condition is None or condition.get("type") == "llm"
+    if needs_description and not params.get("description_of_change"):
+        return "Visual listener failed: 'description_of_change' is missing."
+    if not isinstance(params.get("actions_on_detection", []), list):
+        return "Visual listener failed: 'actions_on_detection' must be a list (plan)."
+    if not isinstance(params.get("actions_on_timeout", []), list):
+        return "Visual listener failed: 'actions_on_timeout' must be a list (plan)."
+    return None
+
+
+def _build_listener_watcher(params: Dict[str, Any], llm_model: genai.GenerativeModel) -> VisualConditionWatcher:
+    """Create the condition watcher described by visual listener parameters."""
+    return VisualConditionWatcher(
+        _listener_description(params),
+        llm_model,
+        change_threshold=float(params.get("change_threshold", LISTENER_CHANGE_THRESHOLD)),
+        max_staleness_seconds=float(params.get("max_staleness_seconds", LISTENER_MAX_STALENESS_SECONDS)),
+        condition=params.get("condition"),
+        confirm_with_llm=bool(params.get("confirm_with_llm", False)),
+        backoff_factor=float(params.get("backoff_factor", LISTENER_BACKOFF_FACTOR))
+    )
+
 
+def _build_listener_directive(params: Dict[str, Any], watcher: VisualConditionWatcher, condition_met: bool) -> Tuple[bool, str, Dict[str, Any]]:
+    """Build the (success, message, directive) result for a listener that fired or timed out."""
+    description = _listener_description(params)
+    if condition_met:
+        directive = {
+            "type": "inject_plan",
+            "plan": params.get("actions_on_detection", []),
+            "reason": f"visual_listener_condition_met: {description}",
+            "token_usage": watcher.token_usage, # Include accumulated tokens
+            "listener_stats": watcher.stats
+        }
+        return True, f"Condition '{description}' met. Triggering detection actions. {watcher.format_stats()}", directive
+    actions_on_timeout = params.get("actions_on_timeout", [])
+    if actions_on_timeout:
+        directive = {
+            "type": "inject_plan",
+            "plan": actions_on_timeout,
+            "reason": f"visual_listener_timeout: {description}",
+            "token_usage": watcher.token_usage, # Include accumulated tokens
+            "listener_stats": watcher.stats
+        }
+        return True, f"Listener for '{description}' timed out. Triggering timeout actions. {watcher.format_stats()}", directive
+    return False, f"Listener for '{description}' timed out. No timeout actions defined. {watcher.format_stats()}", {"type": "listener_timeout_no_actions", "token_usage": watcher.token_usage, "listener_stats": watcher.stats}
 
 
 def _execute_visual_listener(
@@ -309,21 +507,18 @@ def _execute_visual_listener(
     agent_object: 'UIAgent', 
     llm_model: genai.GenerativeModel
 ) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
-    description = params.get("description_of_change")
-    polling_interval = params.get("polling_interval_seconds", 5.0)
+    """Blocking listener: polls in the calling thread until the condition is met or it times out."""
+    description = _listener_description(params)
+    polling_interval = float(params.get("polling_interval_seconds", 5.0))
+    max_polling_interval = params.get("max_polling_interval_seconds")
     timeout_seconds = float(params.get("timeout_seconds", 300.0)) # Ensure float
-    actions_on_detection = params.get("actions_on_detection", []) 
-    actions_on_timeout = params.get("actions_on_timeout", [])     
     # area_to_monitor = params.get("area_to_monitor")
 
-    if not description:
-        return False, "Visual listener failed: 'description_of_change' is missing.", None
-    if not isinstance(actions_on_detection, list):
-        return False, "Visual listener failed: 'actions_on_detection' must be a list (plan).", None
-    if not isinstance(actions_on_timeout, list):
-        return False, "Visual listener failed: 'actions_on_timeout' must be a list (plan).", None
+    validation_error = _validate_listener_params(params)
+    if validation_error:
+        return False, validation_error, None
 
-    accumulated_listener_tokens = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
+    watcher = _build_listener_watcher(params, llm_model)
 
     start_time = time.time()
     logging.info(f"Starting visual listener: Looking for '{description}' for up to {timeout_seconds}s (polling every {polling_interval}s).")
@@ -335,37 +530,14 @@ def _execute_visual_listener(
             time.sleep(polling_interval) # type: ignore
             continue
 
-        condition_met, reasoning, check_tokens = _check_visual_condition_with_llm(
-            screenshot_pil, description, llm_model
-        )
-        for k in accumulated_listener_tokens: accumulated_listener_tokens[k] += check_tokens[k] # type: ignore
-
-        logging.info(f"Listener poll: Condition '{description}' met? {'YES' if condition_met else 'NO'}. Reasoning: {reasoning}")
-
-        if condition_met:
-            logging.info(f"Visual condition '{description}' MET.")
-            directive = {
-                "type": "inject_plan",
-                "plan": actions_on_detection,
-                "reason": f"visual_listener_condition_met: {description}",
-                "token_usage": accumulated_listener_tokens # Include accumulated tokens
-            }
-            return True, f"Condition '{description}' met. Triggering detection actions.", directive
+        if watcher.check(screenshot_pil):
+            logging.info(f"Visual condition '{description}' MET. Listener stats: {watcher.stats}")
+            return _build_listener_directive(params, watcher, True)
 
-        time.sleep(polling_interval) # type: ignore
+        time.sleep(watcher.next_poll_interval(polling_interval, float(max_polling_interval) if max_polling_interval else None))
 
-    logging.warning(f"Visual listener TIMEOUT for condition: '{description}'.")
-    directive = None
-    if actions_on_timeout:
-        directive = {
-            "type": "inject_plan",
-            "plan": actions_on_timeout,
-            "reason": f"visual_listener_timeout: {description}",
-            "token_usage": accumulated_listener_tokens # Include accumulated tokens
-        }
-        return True, f"Listener for '{description}' timed out. Triggering timeout actions.", directive
-    else:
-        return False, f"Listener for '{description}' timed out. No timeout actions defined.", {"type": "listener_timeout_no_actions", "token_usage": accumulated_listener_tokens}
+    logging.warning(f"Visual listener TIMEOUT for condition: '{description}'. Listener stats: {watcher.stats}")
+    return _build_listener_directive(params, watcher, False)
 
 
 
@@ -386,8 +558,7 @@ def get_screen_description_from_gemini(screenshot_pil: Image.Image, llm_model: g
     token_usage = {"prompt_tokens": 0, "candidates_tokens": 0, "total_tokens": 0}
     try:
         safety_settings = {}
-        response = llm_model.generate_content(content, safety_settings=safety_settings)
-        token_usage = _get_token_usage(response)
+        response, token_usage, _ = llm_gateway.generate("vision", content, model=llm_model, safety_settings=safety_settings)
         description = ""
         if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
             description = "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text')).strip()